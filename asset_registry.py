@@ -0,0 +1,145 @@
+# asset_registry.py
+# === [ASSETS] Реестр фонов и шрифтов для карусели и single-art ===
+# create_carousel_images / create_single_art_image на каждый вызов заново делали glob
+# по захардкоженному D:/Project/Auto Telegramm и на каждый слайд декодировали
+# полноразмерный JPEG с Pexels (4000x6000) через Image.open(...).convert("RGBA").
+# Здесь: каталог задаётся ENV (по умолчанию рядом с main.py), фоны декодируются один
+# раз сразу в рабочее разрешение 1080 по ширине и хранятся в памяти с лимитом по байтам
+# (LRU); слайд начинается с дешёвого copy() готового изображения.
+
+import logging
+import random
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from PIL import Image
+
+from text_layout import get_font
+
+log = logging.getLogger("auto_telegramm")
+
+BACKGROUND_EXTS = {".jpg", ".jpeg", ".png"}
+
+
+class AssetRegistry:
+    def __init__(self, base_dir: str | Path, *, target_width: int = 1080, max_bytes: int = 128 * 1024 * 1024):
+        self.base_dir = Path(base_dir)
+        self.backgrounds_dir = self.base_dir / "backgrounds"
+        self.fonts_dir = self.base_dir / "fonts"
+        self.target_width = target_width
+        self.max_bytes = max_bytes
+        self.background_paths: list[Path] = []
+        self.font_paths: list[Path] = []
+        self._images: OrderedDict[Path, Image.Image] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.RLock()
+        self._loaded = False
+        self.hits = 0
+        self.misses = 0
+        self.decode_seconds = 0.0
+
+    # --- загрузка ---
+    def load(self) -> dict:
+        """Сканирует каталоги и декодирует фоны, пока хватает лимита памяти. Повторный вызов — пересканирование."""
+        started = time.perf_counter()
+        backgrounds = sorted(p for p in self.backgrounds_dir.glob("*") if p.suffix.lower() in BACKGROUND_EXTS)
+        fonts = sorted(self.fonts_dir.glob("*.ttf"))
+        with self._lock:
+            self.background_paths = backgrounds
+            self.font_paths = fonts
+            self._images.clear()
+            self._bytes = 0
+            self._loaded = True
+        for path in backgrounds:
+            if self._bytes >= self.max_bytes:
+                break
+            try:
+                self._decode(path)
+            except Exception as e:
+                log.warning(f"[ASSETS] failed to decode {path.name}: {e}")
+        stats = self.stats()
+        log.info(
+            f"[ASSETS] loaded from {self.base_dir}: backgrounds={len(backgrounds)} decoded={stats['decoded']} "
+            f"fonts={len(fonts)} memory={stats['memory_mb']}MB in {time.perf_counter() - started:.1f}s"
+        )
+        return stats
+
+    def ensure_loaded(self) -> None:
+        if not self._loaded:
+            self.load()
+
+    def _decode(self, path: Path) -> Image.Image:
+        t0 = time.perf_counter()
+        with Image.open(path) as src:
+            if src.width > self.target_width:
+                # draft: JPEG декодируется сразу в уменьшенном масштабе (1/2, 1/4, 1/8)
+                src.draft("RGB", (self.target_width, int(src.height * self.target_width / src.width)))
+            img = src.convert("RGB")
+        if img.width != self.target_width:
+            height = max(1, round(img.height * self.target_width / img.width))
+            img = img.resize((self.target_width, height), Image.LANCZOS)
+        img = img.convert("RGBA")
+        size = img.width * img.height * 4
+        with self._lock:
+            self.decode_seconds += time.perf_counter() - t0
+            old = self._images.pop(path, None)
+            if old is not None:
+                self._bytes -= old.width * old.height * 4
+            self._images[path] = img
+            self._bytes += size
+            # LRU: выкидываем давно не использованные, но последний декодированный оставляем
+            while self._bytes > self.max_bytes and len(self._images) > 1:
+                _, evicted = self._images.popitem(last=False)
+                self._bytes -= evicted.width * evicted.height * 4
+        return img
+
+    # --- выдача ---
+    def background(self, path: Path | None = None) -> Image.Image | None:
+        """Копия фона (RGBA, 1080 по ширине): случайного или заданного. None, если фонов нет."""
+        self.ensure_loaded()
+        with self._lock:
+            if path is None:
+                if not self.background_paths:
+                    return None
+                path = random.choice(self.background_paths)
+            cached = self._images.get(path)
+            if cached is not None:
+                self._images.move_to_end(path)
+                self.hits += 1
+                return cached.copy()
+            self.misses += 1
+        return self._decode(path).copy()
+
+    def has_assets(self) -> bool:
+        self.ensure_loaded()
+        return bool(self.background_paths) and bool(self.font_paths)
+
+    def random_font_path(self) -> Path | None:
+        self.ensure_loaded()
+        return random.choice(self.font_paths) if self.font_paths else None
+
+    def bold_font_path(self) -> Path | None:
+        """Bold-шрифт, если есть, иначе первый по алфавиту."""
+        self.ensure_loaded()
+        bold = [p for p in self.font_paths if "bold" in p.name.lower()]
+        if bold:
+            return bold[0]
+        return self.font_paths[0] if self.font_paths else None
+
+    def font(self, path: str | Path, size: int):
+        return get_font(path, size)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "backgrounds": len(self.background_paths),
+                "decoded": len(self._images),
+                "fonts": len(self.font_paths),
+                "memory_mb": round(self._bytes / (1024 * 1024), 1),
+                "max_mb": round(self.max_bytes / (1024 * 1024), 1),
+                "hits": self.hits,
+                "misses": self.misses,
+                "decode_s": round(self.decode_seconds, 2),
+            }
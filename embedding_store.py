@@ -0,0 +1,219 @@
+# embedding_store.py
+# === [EMBED_STORE] Эмбеддинги опубликованных текстов для смыслового антидубля ===
+# MinHash (text_dedup.py) ловит копии и близкие переводы, но не пересказ «та же тема
+# другими словами» — ради него check_similar_content и держал генеративный вызов LLM
+# на каждый пост. Здесь: эмбеддинг каждого опубликованного текста считается один раз
+# и хранится в memory-mapped матрице float32 (строки нормированы), кандидат — это
+# один вызов эмбеддинга и одно матрично-векторное произведение по всей истории.
+# Провайдер подключаемый: OpenAI embeddings или локальный hashing-векторизатор
+# (детерминированный, без сети — для офлайн-проверок). У каждого провайдера/размерности
+# своя матрица: векторы разных моделей несравнимы.
+
+import hashlib
+import logging
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+log = logging.getLogger("auto_telegramm")
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS embedding_rows (
+    row        INTEGER PRIMARY KEY,
+    text_hash  TEXT NOT NULL UNIQUE,
+    text       TEXT NOT NULL,
+    created_at INTEGER NOT NULL
+);
+"""
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32)
+
+
+class HashingEmbedder:
+    """
+    Локальный провайдер: слова и пары слов -> знаковый хэш в dim корзин, вес 1+log(tf).
+    Ловит пересказ с общей лексикой, но не синонимы — для прода лучше OpenAI.
+    """
+
+    name = "hashing"
+
+    def __init__(self, dim: int = 512):
+        self.dim = dim
+
+    def _vector(self, text: str) -> np.ndarray:
+        words = _TOKEN_RE.findall((text or "").lower())
+        counts: dict[str, int] = {}
+        for token in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+            counts[token] = counts.get(token, 0) + 1
+        vec = np.zeros(self.dim, dtype=np.float32)
+        for token, tf in counts.items():
+            h = int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "little")
+            vec[h % self.dim] += (1.0 if (h >> 63) & 1 else -1.0) * (1.0 + math.log(tf))
+        return vec
+
+    def embed_sync(self, texts: list[str]) -> np.ndarray:
+        return _normalize_rows(np.stack([self._vector(t) for t in texts])) if texts else np.zeros((0, self.dim), np.float32)
+
+    async def embed(self, texts: list[str]) -> np.ndarray:
+        return self.embed_sync(texts)
+
+
+class OpenAIEmbedder:
+    """Провайдер OpenAI embeddings через OpenAIScheduler (общие лимиты RPM/TPM)."""
+
+    def __init__(self, scheduler, *, model: str = "text-embedding-3-small", dim: int = 512, timeout: float | None = None):
+        self.scheduler = scheduler
+        self.model = model
+        self.dim = dim
+        self.timeout = timeout
+        self.name = f"openai-{model}"
+
+    async def embed(self, texts: list[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, self.dim), np.float32)
+        resp = await self.scheduler.embeddings(
+            tag="EMBED", timeout=self.timeout, model=self.model, input=list(texts), dimensions=self.dim
+        )
+        data = sorted(resp.data, key=lambda d: d.index)
+        return _normalize_rows(np.asarray([d.embedding for d in data], dtype=np.float32))
+
+
+class EmbeddingStore:
+    """
+    <base_dir>/<provider>_<dim>/vectors.f32 — матрица capacity x dim (memmap, растёт удвоением),
+    rows.db — какая строка какому тексту принадлежит. Число строк берётся из rows.db:
+    вектор пишется и сбрасывается на диск до вставки строки, так что обрыв записи безвреден.
+    """
+
+    def __init__(self, base_dir: str | Path, *, provider_name: str, dim: int, initial_capacity: int = 1024):
+        slug = re.sub(r"[^A-Za-z0-9_.-]+", "_", provider_name)
+        self.dir = Path(base_dir) / f"{slug}_{dim}"
+        self.dim = dim
+        self.initial_capacity = initial_capacity
+        self._lock = threading.Lock()
+        self._conn: sqlite3.Connection | None = None
+        self._matrix: np.memmap | None = None
+        self._count = 0
+        self._hashes: set[str] = set()
+        self._loaded = False
+        self.searches = 0
+        self.search_seconds = 0.0
+
+    @property
+    def vectors_path(self) -> Path:
+        return self.dir / "vectors.f32"
+
+    @staticmethod
+    def text_hash(text: str) -> str:
+        return hashlib.sha1(" ".join((text or "").split()).encode("utf-8")).hexdigest()
+
+    def _ensure_loaded(self) -> None:
+        if self._loaded:
+            return
+        self.dir.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(str(self.dir / "rows.db"), check_same_thread=False, isolation_level=None, timeout=10)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SCHEMA)
+        self._conn = conn
+        rows = conn.execute("SELECT row, text_hash FROM embedding_rows").fetchall()
+        self._count = max((r for r, _ in rows), default=-1) + 1
+        self._hashes = {h for _, h in rows}
+        capacity = self.initial_capacity
+        while capacity < self._count:
+            capacity *= 2
+        self._open_matrix(capacity)
+        self._loaded = True
+        log.info(f"[EMBED_STORE] {self.dir.name}: {self._count} vectors, capacity {capacity}")
+
+    def _open_matrix(self, capacity: int) -> None:
+        needed = capacity * self.dim * 4
+        if self._matrix is not None:
+            self._matrix.flush()
+            self._matrix = None
+        with open(self.vectors_path, "ab") as f:
+            if f.tell() < needed:
+                f.truncate(needed)
+        size = os.path.getsize(self.vectors_path) // (self.dim * 4)
+        self._matrix = np.memmap(self.vectors_path, dtype=np.float32, mode="r+", shape=(size, self.dim))
+
+    def count(self) -> int:
+        with self._lock:
+            self._ensure_loaded()
+            return self._count
+
+    def contains(self, text: str) -> bool:
+        with self._lock:
+            self._ensure_loaded()
+            return self.text_hash(text) in self._hashes
+
+    def add(self, text: str, vector: np.ndarray) -> bool:
+        """Сохраняет нормированный вектор текста. False — текст уже есть."""
+        vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+        if vector.shape[0] != self.dim:
+            raise ValueError(f"vector dim {vector.shape[0]} != store dim {self.dim}")
+        text_hash = self.text_hash(text)
+        with self._lock:
+            self._ensure_loaded()
+            if text_hash in self._hashes:
+                return False
+            if self._count >= self._matrix.shape[0]:
+                self._open_matrix(self._matrix.shape[0] * 2)
+            row = self._count
+            self._matrix[row] = vector
+            self._matrix.flush()
+            self._conn.execute(
+                "INSERT INTO embedding_rows(row, text_hash, text, created_at) VALUES(?, ?, ?, ?)",
+                (row, text_hash, text, int(time.time())),
+            )
+            self._count += 1
+            self._hashes.add(text_hash)
+            return True
+
+    def search(self, vector: np.ndarray, k: int = 5) -> list[tuple[float, int]]:
+        """Top-k [(косинус, row)] по всей истории — одно матрично-векторное произведение."""
+        query = np.asarray(vector, dtype=np.float32).reshape(-1)
+        t0 = time.perf_counter()
+        with self._lock:
+            self._ensure_loaded()
+            count = self._count
+            if not count:
+                return []
+            scores = self._matrix[:count] @ query
+        k = min(k, count)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        with self._lock:
+            self.searches += 1
+            self.search_seconds += time.perf_counter() - t0
+        return [(round(float(scores[i]), 4), int(i)) for i in top]
+
+    def texts(self, rows: list[int]) -> list[str]:
+        if not rows:
+            return []
+        with self._lock:
+            self._ensure_loaded()
+            placeholders = ",".join("?" * len(rows))
+            found = dict(self._conn.execute(f"SELECT row, text FROM embedding_rows WHERE row IN ({placeholders})", rows).fetchall())
+        return [found[r] for r in rows if r in found]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "store": self.dir.name,
+                "vectors": self._count,
+                "size_mb": round(self._count * self.dim * 4 / (1024 * 1024), 2),
+                "searches": self.searches,
+                "avg_search_ms": round(self.search_seconds / self.searches * 1000, 3) if self.searches else 0.0,
+            }
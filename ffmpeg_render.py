@@ -0,0 +1,290 @@
+# ffmpeg_render.py
+# === [FFMPEG_ENGINE] Рендер Reels одной командой ffmpeg (filter_complex) ===
+# MoviePy гоняет каждый кадр через Python/NumPy (crop/resize/speedx/colorx/mask/Composite),
+# поэтому рендер идёт медленнее реального времени. Здесь тот же шаблон
+# (канвас 1080x1920, скруглённые углы, TOPTEXT PNG, отступы по layout_kind,
+# speed/brightness, smart slicer, micro-stitches) собирается в один filter_complex.
+# Включается через RENDER_ENGINE=ffmpeg (см. process_video в main.py).
+
+import logging
+import os
+import subprocess
+from pathlib import Path
+
+from PIL import Image, ImageDraw
+
+from media_probe import MediaProbeError, run_ffprobe
+
+log = logging.getLogger("auto_telegramm")
+
+# --- Зеркало констант шаблона process_video (менять синхронно!) ---
+CANVAS_W, CANVAS_H = 1080, 1920
+VIDEO_BOTTOM_CROP_PCT = 0.02
+GOLDEN_MARGIN = 0.10
+VERT_VIDEO_SCALE = 0.9
+VERT_SCALE_UP = 1.025
+VERT_VIDEO_Y_SHIFT = 96
+SAFE_TOP_PX = 120
+VIDEO_SHIFT_DOWN_PX = 60
+VERT_TEXT_GAP_PX = 24
+TOPTEXT_GAP_PX = 6
+TOPTEXT_PNG_H = 240
+TOP_SAFE_PX = 18
+SLICER_ZOOM = 1.03
+MASK_RADIUS = 45
+OUT_FPS = 30
+
+
+class FfmpegRenderError(Exception):
+    """ffmpeg/ffprobe завершился с ошибкой."""
+
+
+def probe_media(path: str | Path) -> dict:
+    """Один вызов ffprobe без кэша (в боте — через MEDIA_PROBE): размеры, длительность, аудио."""
+    try:
+        return run_ffprobe(path)
+    except MediaProbeError as e:
+        raise FfmpegRenderError(str(e)) from e
+
+
+def _even(v: float) -> int:
+    """libx264/yuv420p любят чётные размеры."""
+    v = int(v)
+    return v - (v % 2)
+
+
+def compute_layout(src_w: int, src_h: int, *, random_crop_px: int = 0, brightness_crop_px: int = 0) -> dict:
+    """
+    Повторяет геометрию process_video:
+    2% кроп снизу -> random crop (с ресайзом обратно) -> кроп Плана Б ->
+    Golden Template 10% -> extra_scale по layout_kind -> вертикальные масштабы ->
+    позиция на канвасе и якорь TOPTEXT.
+    """
+    w, h = src_w, int(src_h * (1.0 - VIDEO_BOTTOM_CROP_PCT))
+    crops = [(w, h, 0, 0)]
+    if random_crop_px:
+        crops.append((w - 2 * random_crop_px, h - 2 * random_crop_px, random_crop_px, random_crop_px))
+        # MoviePy растягивает обратно до (w, h) — размер не меняется
+    if brightness_crop_px:
+        crops.append((w - 2 * brightness_crop_px, h - 2 * brightness_crop_px, brightness_crop_px, brightness_crop_px))
+        w, h = w - 2 * brightness_crop_px, h - 2 * brightness_crop_px
+
+    src_ar = w / max(1, h)
+    if src_ar >= 1.05:
+        layout_kind, extra_scale, y_offset = "landscape", 1.00, 0
+    elif src_ar >= 0.90:
+        layout_kind, extra_scale, y_offset = "square", 0.96, 185
+    else:
+        layout_kind, extra_scale, y_offset = "vertical", 0.94, 125
+
+    scale = min(int(CANVAS_W * (1 - GOLDEN_MARGIN)) / w, int(CANVAS_H * (1 - GOLDEN_MARGIN)) / h)
+    new_w, new_h = int(w * scale), int(h * scale)
+    if extra_scale != 1.00:
+        new_w, new_h = int(new_w * extra_scale), int(new_h * extra_scale)
+    if layout_kind == "vertical":
+        new_w, new_h = int(new_w * VERT_VIDEO_SCALE), int(new_h * VERT_VIDEO_SCALE)
+        new_w, new_h = int(new_w * VERT_SCALE_UP), int(new_h * VERT_SCALE_UP)
+    new_w, new_h = _even(new_w), _even(new_h)
+
+    if layout_kind == "vertical":
+        top_y = max(SAFE_TOP_PX, int(CANVAS_H * 0.18) + VERT_VIDEO_Y_SHIFT)
+        final_h = _even(new_h - int(new_h * 0.02))  # VERT: кроп 2% снизу после маски
+        text_y = max(TOP_SAFE_PX, top_y - VERT_TEXT_GAP_PX - TOPTEXT_PNG_H + 10)
+    else:
+        base_top = (CANVAS_H - new_h) / 2
+        y_shift = min(y_offset + VIDEO_SHIFT_DOWN_PX, max(0, base_top - 20))
+        top_y = int(base_top + y_shift)
+        final_h = new_h
+        text_y = max(TOP_SAFE_PX, top_y - TOPTEXT_GAP_PX - TOPTEXT_PNG_H)
+
+    return {
+        "layout_kind": layout_kind,
+        "crops": crops,
+        "random_crop_px": random_crop_px,
+        "src_w": src_w,
+        "base_h": int(src_h * (1.0 - VIDEO_BOTTOM_CROP_PCT)),
+        "new_w": new_w,
+        "new_h": new_h,
+        "final_h": final_h,
+        "top_y": int(top_y),
+        "text_y": int(text_y),
+    }
+
+
+def make_mask_png(width: int, height: int, out_dir: Path, radius: int = MASK_RADIUS) -> Path:
+    """Маска скруглённых углов (как _rounded_mask), кэшируется по размеру."""
+    out_dir.mkdir(parents=True, exist_ok=True)
+    mask_path = out_dir / f"mask_{width}x{height}_r{radius}.png"
+    if not mask_path.exists():
+        img = Image.new("L", (width, height), 0)
+        ImageDraw.Draw(img).rounded_rectangle([(0, 0), (width, height)], radius=radius, fill=255)
+        img.save(mask_path)
+    return mask_path
+
+
+def stitch_boundaries(duration: float) -> list[tuple[float, float]]:
+    """MICRO-STITCHES: те же точки разреза, что и в process_video (>=6s: 1 разрез, >=9s: 2)."""
+    if duration <= 3.0:
+        return []
+    cuts = []
+    if duration >= 9.0:
+        cuts = [duration / 3, 2 * duration / 3]
+    elif duration >= 6.0:
+        cuts = [duration / 2]
+    bounds = [0.0] + cuts + [duration]
+    return [(a, b) for a, b in zip(bounds, bounds[1:]) if b - a >= 0.5]
+
+
+def build_reel_command(
+    src_path: str | Path,
+    out_path: str | Path,
+    *,
+    probe: dict,
+    layout: dict,
+    mask_png: Path,
+    toptext_png: str | Path | None = None,
+    bg_color: tuple = (0, 0, 0),
+    speed_multiplier: float = 1.01,
+    brightness_adjust: float = 0.0,
+    smart_slicer: bool = False,
+    voiceover_path: str | Path | None = None,
+    voiceover_duration: float = 0.0,
+    pitch_factor: float = 1.0,
+    tempo_change: float = 1.0,
+    encode_args: list[str] | None = None,
+    null_output: bool = False,
+) -> tuple[list[str], dict]:
+    """
+    Собирает argv для ffmpeg и сводку таймлайна (длительности для логов/проверок).
+    null_output=True — проход 1 двухпроходного кодирования: только статистика,
+    вывод в null-муксер вместо out_path.
+    """
+    duration = float(probe["duration"])
+    sped = duration / speed_multiplier
+    # Картинки (маска, TOPTEXT) зациклены — ограничиваем их длиной с запасом
+    loop_t = f"{max(duration, voiceover_duration) + 1:.3f}"
+    inputs: list[str] = ["-i", str(src_path)]
+    mask_idx = 1
+    inputs += ["-loop", "1", "-t", loop_t, "-i", str(mask_png)]
+    text_idx = None
+    if toptext_png:
+        text_idx = 2
+        inputs += ["-loop", "1", "-t", loop_t, "-i", str(toptext_png)]
+    vo_idx = None
+    if voiceover_path:
+        vo_idx = 3 if text_idx else 2
+        inputs += ["-i", str(voiceover_path)]
+
+    # Итоговая длительность по правилам SAFE_DURATION / SYNC из process_video
+    video_slow = 1.0
+    final_dur = max(sped, duration)
+    if vo_idx is not None and voiceover_duration > sped:
+        video_slow = voiceover_duration / sped
+        final_dur = voiceover_duration
+    pad = max(0.0, final_dur - sped * video_slow)
+
+    new_w, new_h, final_h = layout["new_w"], layout["new_h"], layout["final_h"]
+    chain = []
+    for idx, (cw, ch, cx, cy) in enumerate(layout["crops"]):
+        chain.append(f"crop={cw}:{ch}:{cx}:{cy}")
+        if idx == 1 and layout.get("random_crop_px"):
+            chain.append(f"scale={layout['src_w']}:{layout['base_h']}")
+    chain.append(f"scale={new_w}:{new_h}:flags=bicubic")
+    chain.append(f"setpts=PTS/{speed_multiplier:.6f}")
+    if brightness_adjust != 0.0:
+        k = 1.0 + brightness_adjust
+        chain.append(f"colorchannelmixer=rr={k:.4f}:gg={k:.4f}:bb={k:.4f}")
+    if smart_slicer:
+        # SMART SLICER: все сегменты получают одинаковый зум 1.03 без переходов —
+        # эквивалентно зуму всего ролика в пределах той же рамки
+        chain.append(f"scale={_even(new_w * SLICER_ZOOM)}:{_even(new_h * SLICER_ZOOM)},crop={new_w}:{new_h}")
+    chain.append(f"fps={OUT_FPS}")
+    graph = [f"[0:v]{','.join(chain)}[vbase]"]
+
+    segs = stitch_boundaries(sped)
+    if len(segs) > 1:
+        labels = [f"[st{i}]" for i in range(len(segs))]
+        graph.append(f"[vbase]split={len(segs)}{''.join(labels)}")
+        outs = []
+        for i, (a, b) in enumerate(segs):
+            graph.append(f"{labels[i]}trim=start={a:.3f}:end={b:.3f},setpts=PTS-STARTPTS[sg{i}]")
+            outs.append(f"[sg{i}]")
+        graph.append(f"{''.join(outs)}concat=n={len(segs)}:v=1:a=0[vstitched]")
+        vlabel = "[vstitched]"
+    else:
+        vlabel = "[vbase]"
+
+    graph.append(f"[{mask_idx}:v]format=gray[mask]")
+    graph.append(f"{vlabel}format=rgba[vrgba]")
+    graph.append("[vrgba][mask]alphamerge[vmasked]")
+    post = []
+    if final_h != new_h:
+        post.append(f"crop={new_w}:{final_h}:0:0")
+    if video_slow != 1.0:
+        post.append(f"setpts=PTS*{video_slow:.6f}")
+    if pad > 0.05:
+        post.append(f"tpad=stop_mode=clone:stop_duration={pad:.3f}")
+    graph.append(f"[vmasked]{','.join(post) if post else 'null'}[vfinal]")
+
+    r, g, b = (int(c) for c in bg_color)
+    graph.append(f"color=c=0x{r:02x}{g:02x}{b:02x}:s={CANVAS_W}x{CANVAS_H}:r={OUT_FPS}:d={final_dur:.3f}[bg]")
+    cur = "[bg]"
+    if text_idx is not None:
+        graph.append(f"{cur}[{text_idx}:v]overlay=x=(W-w)/2:y={layout['text_y']}:shortest=1[bgtext]")
+        cur = "[bgtext]"
+    graph.append(f"{cur}[vfinal]overlay=x=(W-w)/2:y={layout['top_y']}:eof_action=repeat,format=yuv420p[vout]")
+
+    amap = []
+    if vo_idx is not None:
+        if voiceover_duration < sped and probe.get("has_audio"):
+            rest = sped - voiceover_duration
+            graph.append(f"[0:a]atempo={speed_multiplier:.6f},atrim=end={rest:.3f},asetpts=PTS-STARTPTS[orest]")
+            graph.append(f"[{vo_idx}:a][orest]concat=n=2:v=0:a=1[aout]")
+        else:
+            graph.append(f"[{vo_idx}:a]anull[aout]")
+        amap = ["-map", "[aout]"]
+    elif probe.get("has_audio"):
+        sr = int(probe.get("sample_rate") or 44100)
+        afilters = [f"atempo={speed_multiplier:.6f}"]
+        if pitch_factor != 1.0:
+            # PROFESSIONAL_AUDIO: pitch через смену частоты дискретизации (как with_fps в MoviePy)
+            afilters.append(f"asetrate={int(sr * pitch_factor)},aresample={sr}")
+        if abs(tempo_change - 1.0) > 0.001:
+            afilters.append(f"atempo={tempo_change:.4f}")
+        afilters.append(f"atrim=end={final_dur:.3f}")
+        graph.append(f"[0:a]{','.join(afilters)}[aout]")
+        amap = ["-map", "[aout]"]
+
+    if encode_args is None:
+        # IRONCLAD: те же параметры, что и write_videofile в process_video
+        encode_args = ["-c:v", "libx264", "-preset", "slow", "-b:v", "6000k", "-crf", "18", "-pix_fmt", "yuv420p"]
+    cmd = [
+        "ffmpeg", "-y", "-hide_banner", "-loglevel", "error",
+        *inputs,
+        "-filter_complex", ";".join(graph),
+        "-map", "[vout]", *amap,
+        "-r", str(OUT_FPS),
+        *encode_args,
+        *(["-c:a", "aac"] if amap else []),
+        "-t", f"{final_dur:.3f}",
+        *(["-f", "null", os.devnull] if null_output else ["-movflags", "+faststart", str(out_path)]),
+    ]
+    timeline = {
+        "src_duration": duration,
+        "sped_duration": sped,
+        "final_duration": final_dur,
+        "pad": pad,
+        "stitches": len(segs),
+        "video_slow": video_slow,
+    }
+    return cmd, timeline
+
+
+def run_ffmpeg(cmd: list[str], timeout: int = 1800) -> None:
+    try:
+        proc = subprocess.run(cmd, capture_output=True, timeout=timeout)
+    except subprocess.TimeoutExpired as e:
+        raise FfmpegRenderError(f"ffmpeg timeout after {timeout}s") from e
+    if proc.returncode != 0:
+        tail = (proc.stderr or b"").decode("utf-8", "ignore")[-800:]
+        raise FfmpegRenderError(f"ffmpeg exit={proc.returncode}: {tail}")
@@ -0,0 +1,159 @@
+# file_identity.py
+# === [FILE_ID] Дешёвый идентификатор медиафайла + кэш по stat() ===
+# _hash_file_fast читал до 10 МБ исходника одним bytes-объектом и гнал через SHA-256
+# на каждый файл, ничего не запоминая между перезапусками. Здесь: хэш считается по
+# трём отрезкам файла (начало, середина, конец) через mmap + размер — читается и
+# держится в памяти ~200 КБ вместо 10 МБ; результат кэшируется по
+# (st_dev, st_ino, size, mtime_ns): неизменённый файл повторно не читается вовсе.
+# Старый ключ (SHA-256 первых 10 МБ + размер) считается потоково, по 256 КБ, —
+# только пока в MEDIA_STATE остаются записи со старыми ключами.
+
+import hashlib
+import logging
+import mmap
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from state_store import ProcessConnection
+
+log = logging.getLogger("auto_telegramm")
+
+# Префикс ключа: по нему новые ключи MEDIA_STATE отличаются от старых SHA-256
+SAMPLED_PREFIX = "s1:"
+SAMPLE_BYTES = 64 * 1024
+LEGACY_MAX_BYTES = 10 * 1024 * 1024
+LEGACY_CHUNK = 256 * 1024
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS file_hash (
+    dev        INTEGER NOT NULL,
+    ino        INTEGER NOT NULL,
+    size       INTEGER NOT NULL,
+    mtime_ns   INTEGER NOT NULL,
+    kind       TEXT NOT NULL,
+    value      TEXT NOT NULL,
+    created_at INTEGER NOT NULL,
+    PRIMARY KEY (dev, ino, size, mtime_ns, kind)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_file_hash_created ON file_hash(created_at);
+"""
+
+
+def sampled_hash(path: str | Path, sample_bytes: int = SAMPLE_BYTES) -> str:
+    """blake2b-128 по размеру и трём отрезкам файла; маленький файл хэшируется целиком."""
+    size = os.path.getsize(path)
+    h = hashlib.blake2b(digest_size=16)
+    h.update(size.to_bytes(8, "little"))
+    if size:
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            with memoryview(mm) as view:
+                if size <= 3 * sample_bytes:
+                    h.update(view)
+                else:
+                    middle = size // 2 - sample_bytes // 2
+                    for offset in (0, middle, size - sample_bytes):
+                        h.update(view[offset : offset + sample_bytes])
+    return SAMPLED_PREFIX + h.hexdigest()
+
+
+def legacy_hash(path: str | Path, max_bytes: int = LEGACY_MAX_BYTES) -> str:
+    """Тот же ключ, что у старого _hash_file_fast, но чтение потоковое, по LEGACY_CHUNK."""
+    size = os.path.getsize(path)
+    h = hashlib.sha256()
+    remaining = max_bytes
+    with open(path, "rb") as f:
+        while remaining > 0:
+            chunk = f.read(min(LEGACY_CHUNK, remaining))
+            if not chunk:
+                break
+            h.update(chunk)
+            remaining -= len(chunk)
+    h.update(str(size).encode("utf-8"))
+    return h.hexdigest()
+
+
+class FileHashCache:
+    """Кэш хэшей по stat(): память (LRU) + SQLite в state/."""
+
+    def __init__(self, db_path: str | Path, *, memory_entries: int = 1024, max_entries: int = 50000):
+        self.db_path = Path(db_path)
+        self.memory_entries = memory_entries
+        self.max_entries = max_entries
+        self._memory: OrderedDict[tuple, str] = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = ProcessConnection(self.db_path, _SCHEMA)
+        self.hits = 0
+        self.misses = 0
+        self.hash_seconds = 0.0
+
+    def _get(self, path: str | Path, kind: str, compute) -> str:
+        st = os.stat(path)
+        key = (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns, kind)
+        with self._lock:
+            value = self._memory.get(key)
+            if value is None:
+                try:
+                    row = self._db().execute(
+                        "SELECT value FROM file_hash WHERE dev = ? AND ino = ? AND size = ? AND mtime_ns = ? AND kind = ?",
+                        key,
+                    ).fetchone()
+                except sqlite3.Error as e:
+                    log.warning(f"[FILE_ID] cache read failed: {e}")
+                    row = None
+                value = row[0] if row else None
+            if value is not None:
+                self.hits += 1
+                self._remember(key, value)
+                return value
+            self.misses += 1
+        t0 = time.perf_counter()
+        value = compute(path)
+        elapsed = time.perf_counter() - t0
+        with self._lock:
+            self.hash_seconds += elapsed
+            self._remember(key, value)
+            try:
+                db = self._db()
+                db.execute(
+                    "INSERT OR REPLACE INTO file_hash(dev, ino, size, mtime_ns, kind, value, created_at) VALUES(?, ?, ?, ?, ?, ?, ?)",
+                    (*key, value, int(time.time())),
+                )
+                count = db.execute("SELECT COUNT(*) FROM file_hash").fetchone()[0]
+                if count > self.max_entries:
+                    # Самые старые записи (секундная точность: может уйти чуть больше лишнего)
+                    cutoff = db.execute(
+                        "SELECT created_at FROM file_hash ORDER BY created_at ASC LIMIT 1 OFFSET ?",
+                        (count - self.max_entries - 1,),
+                    ).fetchone()
+                    if cutoff:
+                        db.execute("DELETE FROM file_hash WHERE created_at <= ?", cutoff)
+            except sqlite3.Error as e:
+                log.warning(f"[FILE_ID] cache write failed: {e}")
+        log.info(f"[FILE_ID] {kind} {Path(path).name}: {value[:14]} ({elapsed * 1000:.1f}ms)")
+        return value
+
+    def _remember(self, key: tuple, value: str) -> None:
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def sampled(self, path: str | Path) -> str:
+        return self._get(path, "sampled", sampled_hash)
+
+    def legacy(self, path: str | Path) -> str:
+        return self._get(path, "legacy", legacy_hash)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "avg_hash_ms": round(self.hash_seconds / self.misses * 1000, 2) if self.misses else 0.0,
+            }
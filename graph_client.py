@@ -0,0 +1,163 @@
+# graph_client.py
+# === [GRAPH_CLIENT] Асинхронный клиент Meta Graph API (Instagram + Facebook) ===
+# Раньше ig_post/ig_get/fb_post делали requests.post/get с таймаутом до 300с прямо
+# внутри async-функций: весь бот стоял, а asyncio.gather(TG, IG, FB) в post_worker
+# фактически выполнялся по очереди. Здесь — один httpx.AsyncClient с keep-alive
+# пулом, таймауты по типу запроса и повторы с jitter-паузой на 5xx / rate limit.
+
+import asyncio
+import logging
+import random
+
+import httpx
+
+log = logging.getLogger("auto_telegramm")
+
+GRAPH_BASE_URL = "https://graph.facebook.com"
+
+# Коды Graph API, которые имеет смысл повторять (временные ошибки и лимиты)
+# 1/2 — unknown/service, 4/17/32/613 — rate limit, 341 — application limit
+RETRYABLE_GRAPH_CODES = {1, 2, 4, 17, 32, 341, 613}
+RETRYABLE_HTTP_STATUSES = {429, 500, 502, 503, 504}
+# Публикующие запросы (media_publish, FB /videos, /photos, /feed) повторяем только на явный
+# отказ по лимиту: запрос точно не выполнен. Таймаут и 5xx могут прийти уже после публикации.
+RATE_LIMIT_GRAPH_CODES = {4, 17, 32, 613}
+
+
+class GraphClient:
+    """
+    Общий пул соединений к graph.facebook.com.
+    request() никогда не бросает исключения наружу: как и старые ig_post/fb_post,
+    при окончательной ошибке возвращает {} (вызывающий код уже это обрабатывает).
+    """
+
+    def __init__(
+        self,
+        base_url: str = GRAPH_BASE_URL,
+        *,
+        max_connections: int = 10,
+        max_retries: int = 3,
+        backoff_base: float = 2.0,
+        backoff_max: float = 30.0,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.max_connections = max_connections
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._client: httpx.AsyncClient | None = None
+        self.requests_total = 0
+        self.retries_total = 0
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                    keepalive_expiry=60.0,
+                ),
+                timeout=httpx.Timeout(60.0, connect=15.0),
+            )
+        return self._client
+
+    def _backoff(self, attempt: int, retry_after: str | None = None) -> float:
+        if retry_after:
+            try:
+                return min(self.backoff_max, float(retry_after))
+            except ValueError:
+                pass
+        delay = min(self.backoff_max, self.backoff_base * (2 ** (attempt - 1)))
+        # full jitter: не долбим Graph синхронно из нескольких задач
+        return random.uniform(delay / 2, delay)
+
+    @staticmethod
+    def _is_retryable(status: int, body: dict, publishing: bool = False) -> bool:
+        err = body.get("error") if isinstance(body, dict) else None
+        if publishing:
+            if status == 429:
+                return True
+            try:
+                return isinstance(err, dict) and int(err.get("code") or 0) in RATE_LIMIT_GRAPH_CODES
+            except (TypeError, ValueError):
+                return False
+        if status in RETRYABLE_HTTP_STATUSES:
+            return True
+        if isinstance(err, dict):
+            if err.get("is_transient"):
+                return True
+            try:
+                return int(err.get("code") or 0) in RETRYABLE_GRAPH_CODES
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    async def request(
+        self,
+        method: str,
+        path: str,
+        *,
+        data: dict | None = None,
+        params: dict | None = None,
+        timeout: float = 60.0,
+        tag: str = "GRAPH",
+        retries: int | None = None,
+        retry_on_timeout: bool = True,
+        publishing: bool = False,
+    ) -> dict:
+        """
+        retry_on_timeout=False — без повторов при обрыве соединения.
+        publishing=True — запрос публикует пост (IG media_publish, FB /videos, /photos, /feed):
+        ни таймаут, ни 5xx не повторяются (публикация могла пройти, повтор = дубль),
+        только явный rate limit (429, коды 4/17/32/613). Неясный исход проверяет вызывающий.
+        """
+        url = "/" + path.lstrip("/")
+        max_retries = self.max_retries if retries is None else retries
+        attempt = 0
+        while True:
+            attempt += 1
+            self.requests_total += 1
+            try:
+                resp = await self._get_client().request(
+                    method, url, data=data, params=params, timeout=timeout
+                )
+                text = (resp.text or "")[:500]
+                log.info(f"{tag} url={self.base_url}{url} status={resp.status_code} attempt={attempt} resp={text}")
+                try:
+                    body = resp.json()
+                except ValueError:
+                    body = {}
+                if resp.status_code < 400:
+                    return body if isinstance(body, dict) else {}
+                if attempt <= max_retries and self._is_retryable(resp.status_code, body, publishing):
+                    delay = self._backoff(attempt, resp.headers.get("retry-after"))
+                    self.retries_total += 1
+                    log.warning(f"{tag}_RETRY url={url} status={resp.status_code} in {delay:.1f}s ({attempt}/{max_retries})")
+                    await asyncio.sleep(delay)
+                    continue
+                log.error(f"{tag}_FAIL url={self.base_url}{url} status={resp.status_code}")
+                return {}
+            except (httpx.TimeoutException, httpx.TransportError) as e:
+                if attempt <= max_retries and retry_on_timeout and not publishing:
+                    delay = self._backoff(attempt)
+                    self.retries_total += 1
+                    log.warning(f"{tag}_RETRY url={url} error={type(e).__name__} in {delay:.1f}s ({attempt}/{max_retries})")
+                    await asyncio.sleep(delay)
+                    continue
+                log.error(f"{tag}_FAIL url={self.base_url}{url} error={e}")
+                return {}
+            except Exception as e:
+                log.error(f"{tag}_FAIL url={self.base_url}{url} error={e}")
+                return {}
+
+    async def post(self, path: str, data: dict, *, timeout: float = 60.0, tag: str = "GRAPH_POST", retries: int | None = None, retry_on_timeout: bool = True, publishing: bool = False) -> dict:
+        return await self.request("POST", path, data=data, timeout=timeout, tag=tag, retries=retries, retry_on_timeout=retry_on_timeout, publishing=publishing)
+
+    async def get(self, path: str, params: dict, *, timeout: float = 30.0, tag: str = "GRAPH_GET", retries: int | None = None) -> dict:
+        return await self.request("GET", path, params=params, timeout=timeout, tag=tag, retries=retries)
+
+    async def aclose(self) -> None:
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+        self._client = None
@@ -288,15 +288,13 @@ import time as pytime
 import hashlib
 import random
 import uuid
-import mimetypes
 import textwrap
 import re
 import shutil
 import subprocess
 import requests
-from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional
-from collections import deque
 from pathlib import Path
 from datetime import datetime, timedelta, time as dt_time
 import numpy as np
@@ -310,12 +308,23 @@ from moviepy.editor import (
     concatenate_videoclips,
 )
 from moviepy.video.fx import all as vfx_all
+from render_pool import RenderPool
+import ffmpeg_render
+from graph_client import GraphClient
+from supabase_upload import SupabaseUploader, default_tus_threshold
+from state_store import StateStore, DEDUP_SEEN_HASH, DEDUP_SEEN_FILE_ID, DEDUP_PUBLISHED
+from media_state import MediaState
+from ready_index import ReadyIndex
+from post_queue import ArrivalOrder, PostQueue
+import translation_cache
+import overlay_cache
 logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
 log = logging.getLogger("auto_telegramm")
 log.info("[ASR] DISABLED by config")
 
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
+from openai_scheduler import OpenAIScheduler
 load_dotenv()
 
 # --- STARTUP SELF-CHECK (не трогать логику проекта) ---
@@ -350,6 +359,16 @@ def is_telethon_configured() -> bool:
 
 # Импорт для работы с изображениями
 from PIL import Image, ImageDraw, ImageFont
+from asset_registry import AssetRegistry
+from rate_control import plan_encode
+from stage_timing import StageLog, StageTimer
+from media_probe import MediaProbe, MediaProbeError, usable_video_problem
+from plan_b_variants import VariantStore, variant_params
+from text_dedup import NearDuplicateIndex
+from embedding_store import EmbeddingStore, HashingEmbedder, OpenAIEmbedder
+from video_fingerprint import VideoFingerprintIndex
+from file_identity import FileHashCache, SAMPLED_PREFIX
+from text_layout import get_font, fit_font_size, greedy_wrap, measure_text as _measure, wrap_to_lines as _wrap_to_lines
 
 # Импорт для Supabase
 from supabase import create_client, Client
@@ -385,6 +404,12 @@ FB_PAGE_ID = os.getenv("FB_PAGE_ID", "").strip()
 FB_PAGE_TOKEN = os.getenv("FB_PAGE_TOKEN", "").strip()
 FB_GRAPH_VERSION = os.getenv("FB_GRAPH_VERSION", "v21.0").strip()
 FB_TIMEOUT_SECONDS = int(os.getenv("FB_TIMEOUT_SECONDS", "300"))
+# === [GRAPH_CLIENT] Таймауты по типу запроса и повторы ===
+IG_CREATE_TIMEOUT_SECONDS = int(os.getenv("IG_CREATE_TIMEOUT_SECONDS", "120"))
+IG_STATUS_TIMEOUT_SECONDS = int(os.getenv("IG_STATUS_TIMEOUT_SECONDS", "30"))
+IG_PUBLISH_PAUSE_SECONDS = int(os.getenv("IG_PUBLISH_PAUSE_SECONDS", "10"))
+GRAPH_MAX_RETRIES = int(os.getenv("GRAPH_MAX_RETRIES", "3"))
+GRAPH_MAX_CONNECTIONS = int(os.getenv("GRAPH_MAX_CONNECTIONS", "10"))
 
 POST_DELAY_SECONDS_RAW = int(os.getenv("POST_DELAY_SECONDS", "1800"))  # 30 минут по умолчанию
 # Минимальный интервал: 1 час (3600 сек) для соблюдения правил публикации
@@ -489,6 +514,30 @@ openai_client = None
 if os.getenv("OPENAI_API_KEY"):
     openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
+# === [OPENAI_SCHED] Async-клиент для перевода / similarity / категорий ===
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "4"))
+OPENAI_RPM = float(os.getenv("OPENAI_RPM", "60"))
+OPENAI_TPM = float(os.getenv("OPENAI_TPM", "150000"))
+OPENAI_TIMEOUT_SECONDS = float(os.getenv("OPENAI_TIMEOUT_SECONDS", "60"))
+OPENAI_SHORT_TIMEOUT_SECONDS = float(os.getenv("OPENAI_SHORT_TIMEOUT_SECONDS", "20"))
+OPENAI_SCHEDULER: Optional[OpenAIScheduler] = None
+# Апдейты PTB обрабатываются параллельно: пачка постов из канала переводится одновременно,
+# в пределах OPENAI_MAX_CONCURRENCY. 1 — прежняя последовательная обработка.
+# В POST_QUEUE посты всё равно встают в порядке прихода (CHANNEL_POST_ORDER).
+TG_CONCURRENT_UPDATES = int(os.getenv("TG_CONCURRENT_UPDATES", "8"))
+# Сколько пост ждёт постановки более ранних, прежде чем встать в очередь без них
+CHANNEL_POST_ORDER_TIMEOUT = float(os.getenv("CHANNEL_POST_ORDER_TIMEOUT", "900"))
+if os.getenv("OPENAI_API_KEY"):
+    OPENAI_SCHEDULER = OpenAIScheduler(
+        AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=2),
+        max_concurrency=OPENAI_MAX_CONCURRENCY,
+        requests_per_minute=OPENAI_RPM,
+        tokens_per_minute=OPENAI_TPM,
+        timeout=OPENAI_TIMEOUT_SECONDS,
+        # log_tokens объявлена ниже — берём её в момент вызова
+        on_usage=lambda prompt, completion, total: log_tokens(prompt, completion, total),
+    )
+
 supabase_client: Optional[Client] = None
 
 # message_id -> {emoji: count}
@@ -497,7 +546,8 @@ REACTIONS = {}
 USER_REACTIONS = {}
 
 
-POST_QUEUE = deque()
+POST_QUEUE = PostQueue()  # [POST_QUEUE] индексы по file_id/dedup_key и полосы по типу
+CHANNEL_POST_ORDER = ArrivalOrder()  # [POST_QUEUE] порядок постановки = порядок прихода постов
 VIDEO_PROCESSING_QUEUE = asyncio.Queue()  # FIX B: Очередь для фоновой обработки видео
 IS_POSTING = False
 # Первое включение после рестарта — не публикуем автоматически; требуется /postnow
@@ -532,8 +582,28 @@ def get_ready_failed_dir() -> Path:
 
 # СИСТЕМА КОНВЕЙЕР: Папка готовых постов
 READY_TO_PUBLISH_DIR = get_ready_dir()
+# [READY_INDEX] Склад в памяти: куча по mtime, сканирование диска — только при старте/сверке
+READY_INDEX = ReadyIndex(READY_TO_PUBLISH_DIR)
+READY_INDEX_RECONCILE_SECONDS = float(os.getenv("READY_INDEX_RECONCILE_SECONDS", "300"))
 TARGET_READY_POSTS = 10  # Поддерживаем 10 готовых постов (5 дней автономной работы)
-IS_PREPARING = False  # Флаг для контроля одновременной подготовки
+IS_PREPARING = False  # Флаг для контроля одновременной подготовки (True, пока есть хотя бы один рендер)
+# === [RENDER_POOL] Рендер process_video в отдельных процессах ===
+# RENDER_WORKERS=N — сколько роликов конвейер рендерит параллельно (0 = один фоновый поток)
+# RENDER_MAX_TASKS_PER_CHILD — после скольких рендеров пересоздавать процесс (утечки MoviePy)
+RENDER_POOL = RenderPool(max_tasks_per_child=int(os.getenv("RENDER_MAX_TASKS_PER_CHILD", "4")) or None)
+CONVEYOR_TASKS: set = set()  # asyncio.Task подготовок, которые сейчас в работе
+# === [PLAN_B_VARIANTS] Запасные версии роликов для повторов публикации ===
+# PLAN_B_VARIANTS_IG / PLAN_B_VARIANTS_FB — сколько вариантов (= повторов после первой попытки) на платформу
+# PLAN_B_PRERENDER=1 — рендерить варианты заранее, пока конвейер простаивает; 0 — только лениво при сбое
+PLAN_B_BUDGET = {
+    "ig": max(0, int(os.getenv("PLAN_B_VARIANTS_IG", "2"))),
+    "fb": max(0, int(os.getenv("PLAN_B_VARIANTS_FB", "0"))),
+}
+PLAN_B_PRERENDER = os.getenv("PLAN_B_PRERENDER", "1") == "1"
+PLAN_B_PRERENDER_INTERVAL = float(os.getenv("PLAN_B_PRERENDER_INTERVAL", "60"))
+PLAN_B_VARIANTS = VariantStore(READY_TO_PUBLISH_DIR)
+# === [FFMPEG_ENGINE] Движок рендера: moviepy (по умолчанию) или ffmpeg (один filter_complex) ===
+RENDER_ENGINE = os.getenv("RENDER_ENGINE", "moviepy").strip().lower() or "moviepy"
 PUBLISHED_DIR = Path("published")
 PUBLISHED_DIR.mkdir(exist_ok=True)
 PUBLISH_LOCK = asyncio.Lock()
@@ -545,6 +615,48 @@ STATE_DIR = Path("state")
 STATE_DIR.mkdir(exist_ok=True)
 MEDIA_STATE_PATH = STATE_DIR / "media_state.json"
 MEDIA_STATE_LOCK = STATE_DIR / "media_state.lock"
+# === [STATE_DB] Очередь, dedup-ключи, состояние медиа и статистика — в одной SQLite (WAL) ===
+STATE_DB_PATH = Path(os.getenv("STATE_DB_PATH", str(STATE_DIR / "state.db")))
+STATE_DB = StateStore(STATE_DB_PATH)
+# [MEDIA_STATE] read-modify-write записей медиа под flock(MEDIA_STATE_LOCK) + транзакция
+MEDIA_STATE = MediaState(STATE_DB, MEDIA_STATE_LOCK)
+# Кэши, которые раньше лежали каждый в своём state/*.db, — таблицы в STATE_DB_PATH
+for _legacy_db, _tables in (
+    ("media_probe.db", ("media_probe",)),
+    ("file_hash.db", ("file_hash",)),
+    ("video_fp.db", ("video_fp",)),
+    ("text_dedup.db", ("text_minhash",)),
+):
+    STATE_DB.migrate_sqlite(STATE_DIR / _legacy_db, _tables)
+# [MEDIA_PROBE] ffprobe-метаданные по (путь, размер, mtime): память + таблица media_probe рядом с media_state
+MEDIA_PROBE = MediaProbe(
+    STATE_DB_PATH,
+    memory_entries=int(os.getenv("MEDIA_PROBE_MEMORY", "512")),
+)
+# [FILE_ID] Хэши исходников по (st_dev, st_ino, size, mtime_ns): таблица file_hash в STATE_DB_PATH
+FILE_HASHES = FileHashCache(STATE_DB_PATH)
+# === [VIDEO_FP] Перцептивные отпечатки исходников: пережатый/обрезанный дубль отсекается до рендера ===
+# VIDEO_FP_RADIUS — расстояние Хэмминга между кадрами (из 64 бит); VIDEO_FP_MIN_MATCH — доля совпавших кадров
+VIDEO_FP_ENABLED = os.getenv("VIDEO_FP", "1") == "1"
+VIDEO_FP = VideoFingerprintIndex(
+    STATE_DB_PATH,
+    radius=int(os.getenv("VIDEO_FP_RADIUS", "10")),
+    min_match=float(os.getenv("VIDEO_FP_MIN_MATCH", "0.5")),
+)
+# === [TRANSLATE_CACHE] Кэш переводов: память (LRU) + SQLite, TTL в днях ===
+# TRANSLATE_CACHE_VERSION — поднять вручную, если поменялась логика постобработки перевода
+TRANSLATE_CACHE_VERSION = "1"
+TRANSLATE_CACHE = translation_cache.TranslationCache(
+    STATE_DIR / "translation_cache.db",
+    memory_entries=int(os.getenv("TRANSLATE_CACHE_MEMORY", "2000")),
+    disk_entries=int(os.getenv("TRANSLATE_CACHE_MAX", "50000")),
+    ttl_seconds=float(os.getenv("TRANSLATE_CACHE_TTL_DAYS", "30")) * 86400,
+)
+# === [TOPTEXT_CACHE] Готовые PNG-плашки TOPTEXT (общий для процессов RENDER_POOL) ===
+TOPTEXT_CACHE = overlay_cache.OverlayCache(
+    Path(os.getenv("TOPTEXT_CACHE_DIR", str(Path("tmp_media") / "toptext_cache"))),
+    max_bytes=int(float(os.getenv("TOPTEXT_CACHE_MAX_MB", "64")) * 1024 * 1024),
+)
 
 TOP_FONT_PATH = r"fonts\Poppins All\Poppins-Regular.ttf"
 CHANNEL_URL = "https://t.me/+19xSNtVpjx1hZGQy"
@@ -937,7 +1049,7 @@ def caption_cleaner_base(text: str) -> tuple[str, dict]:
 
 async def detect_category_openai(src_text: str) -> str:
     """Определяет категорию текста через OpenAI (1 слово из CATEGORIES)."""
-    if not openai_client or not src_text:
+    if not OPENAI_SCHEDULER or not src_text:
         return "SHOCK"
     
     try:
@@ -947,7 +1059,9 @@ async def detect_category_openai(src_text: str) -> str:
             f"Текст:\n{src_text[:500]}"
         )
         
-        resp = openai_client.chat.completions.create(
+        resp = await OPENAI_SCHEDULER.chat(
+            tag="DETECT_CAT",
+            timeout=OPENAI_SHORT_TIMEOUT_SECONDS,
             model=os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
             max_tokens=10,
             messages=[
@@ -1031,6 +1145,31 @@ def _record_failed_conveyor_item(item: dict, reason: str, detail: str = "") -> P
 # --- START: MAX_50MB_GUARD ---
 MAX_UPLOAD_MB = 50
 MAX_UPLOAD_BYTES = MAX_UPLOAD_MB * 1024 * 1024
+# [RATE_CONTROL] Лимит, под который планируется битрейт рендера (по умолчанию = лимит загрузки)
+RENDER_MAX_BYTES = int(float(os.getenv("RENDER_MAX_MB", str(MAX_UPLOAD_MB))) * 1024 * 1024)
+
+# [TIMING] Замеры этапов рендера/конвейера: JSONL, общий для процессов RENDER_POOL
+STAGE_TIMINGS_PATH = os.getenv("STAGE_TIMINGS_PATH", "reports/stage_timings.jsonl")
+STAGE_LOG = StageLog(
+    STAGE_TIMINGS_PATH,
+    max_bytes=int(float(os.getenv("STAGE_TIMINGS_MAX_MB", "20")) * 1024 * 1024),
+    enabled=os.getenv("STAGE_TIMINGS", "1") == "1",
+)
+
+
+def _stage_timer(scope: str, post_data: dict | None, **extra) -> StageTimer:
+    post_id = (post_data.get("post_id") or post_data.get("id")) if isinstance(post_data, dict) else None
+    return StageTimer(STAGE_LOG, scope, post_id, **extra)
+
+
+def stage_timing_lines(since: float | None = None, limit: int = 6) -> list[str]:
+    """[TIMING] Самые долгие этапы (по p95) строками для /status и отчёта. Читает файл — звать из потока."""
+    summary = STAGE_LOG.summarize(since=since)
+    lines = []
+    for key, row in list(summary.items())[:limit]:
+        peak = f", пик {row['max_peak_rss_mb']:.0f} MB" if row.get("max_peak_rss_mb") else ""
+        lines.append(f"{key}: p50 {row['p50_s']:.1f}с, p95 {row['p95_s']:.1f}с (n={row['count']}{peak})")
+    return lines
 
 
 def _file_size_bytes(p: str) -> int:
@@ -1041,18 +1180,17 @@ def _file_size_bytes(p: str) -> int:
 
 
 def _ffprobe_duration_sec(p: str) -> float:
-    # returns duration in seconds, fallback 0
-    try:
-        cmd = [
-            "ffprobe", "-v", "error",
-            "-show_entries", "format=duration",
-            "-of", "default=noprint_wrappers=1:nokey=1",
-            p
-        ]
-        out = subprocess.check_output(cmd, stderr=subprocess.STDOUT).decode("utf-8", "ignore").strip()
-        return float(out) if out else 0.0
-    except Exception:
-        return 0.0
+    # returns duration in seconds, fallback 0 ([MEDIA_PROBE]: ffprobe один раз на версию файла)
+    return MEDIA_PROBE.duration(p)
+
+
+def _bump_encode_count(item: dict, where: str) -> int:
+    """[RATE_CONTROL] MAX50 всё-таки пережал ролик — учитываем лишнее кодирование."""
+    meta = item.get("ready_metadata") if isinstance(item.get("ready_metadata"), dict) else {}
+    count = int(item.get("encode_count") or meta.get("encode_count") or 1) + 1
+    item["encode_count"] = count
+    log.warning(f"[ENCODE] {where}: MAX50 re-encode, encode_count={count} plan={item.get('encode_plan') or meta.get('encode_plan')}")
+    return count
 
 
 def ensure_max_50mb(video_path: str) -> str:
@@ -1160,74 +1298,30 @@ def _pick_description_from_meta(meta: dict | None) -> str:
 
 
 def _sorted_ready_files(desc: bool = False) -> list[Path]:
-    ready_dir = get_ready_dir()
-    
-    # FIX READY PATH: Детальное сканирование с логированием каждого файла
-    ready_files = list(ready_dir.glob("*.mp4"))
-    log.info(f"[READY_SCAN] Found {len(ready_files)} mp4 files in {ready_dir}")
-    
-    for f in ready_files:
-        try:
-            size = f.stat().st_size / (1024 * 1024)  # Convert to MB
-            log.info(f"[READY_SCAN] File: {f.name} (size: {size:.2f} MB)")
-        except OSError as e:
-            log.warning(f"[READY_SCAN] Cannot stat {f.name}: {e}")
-    
-    mp4_candidates: list[tuple[float, Path]] = []
-    for mp4 in ready_files:
-        try:
-            mp4_candidates.append((mp4.stat().st_mtime, mp4))
-        except OSError as exc:
-            log.warning(f"[READY] stat failed for {mp4.name}: {exc}")
-    mp4_candidates.sort(key=lambda pair: pair[0], reverse=desc)
-    ordered = [p for _, p in mp4_candidates]
-    preview = [p.name for p in ordered[:5]]
-    log.info(f"[READY_SCAN] mp4_count={len(ordered)} names={preview}")
-
-    def has_json(mp4p: Path) -> bool:
-        return mp4p.with_suffix(".json").exists()
-
-    filtered = [p for p in ordered if has_json(p)]
-    log.info(f"[READY_SCAN] with_json_count={len(filtered)}")
-    return filtered
+    """Готовые mp4 с sidecar, отсортированные по mtime (из READY_INDEX, без сканирования диска)."""
+    entries = [e for e in READY_INDEX.entries() if e.has_meta]
+    entries.sort(key=lambda e: e.mtime, reverse=desc)
+    ordered = [e.mp4 for e in entries]
+    log.info(f"[READY_SCAN] with_json_count={len(ordered)} names={[p.name for p in ordered[:5]]}")
+    return ordered
 
 
 def _pick_ready_latest() -> tuple[Path | None, Path | None]:
-    mp4_files = list(READY_TO_PUBLISH_DIR.glob("*.mp4"))
-    items = []
-    for mp4 in mp4_files:
-        js = mp4.with_suffix(".json")
-        if js.exists():
-            items.append((mp4, js))
-        else:
-            log.warning(f"[READY_SCAN] missing json for mp4={mp4.name}")
-    
-    # READY_SCAN: Один понятный лог со статистикой
-    log.info(f"[READY_SCAN] dir={READY_TO_PUBLISH_DIR} exists={READY_TO_PUBLISH_DIR.exists()} mp4={len(mp4_files)} pairs={len(items)}")
-    
-    # Сортируем по времени (новые первыми) и берём первую пару
-    for mp4 in _sorted_ready_files(desc=True):
-        return mp4, _resolve_ready_json(mp4)
-    return None, None
+    # [READY_INDEX] Вершина кучи «новые первыми»
+    entry = READY_INDEX.newest()
+    log.info(f"[READY_SCAN] index mp4={READY_INDEX.count()} pairs={READY_INDEX.count(with_meta=True)} pick={entry.mp4.name if entry else None}")
+    if not entry:
+        return None, None
+    return entry.mp4, entry.meta_path
 
 
 def _pick_ready_fifo() -> tuple[Path | None, Path | None]:
-    mp4_files = list(READY_TO_PUBLISH_DIR.glob("*.mp4"))
-    items = []
-    for mp4 in mp4_files:
-        js = mp4.with_suffix(".json")
-        if js.exists():
-            items.append((mp4, js))
-        else:
-            log.warning(f"[READY_SCAN] missing json for mp4={mp4.name}")
-    
-    # READY_SCAN: Один понятный лог со статистикой
-    log.info(f"[READY_SCAN] dir={READY_TO_PUBLISH_DIR} exists={READY_TO_PUBLISH_DIR.exists()} mp4={len(mp4_files)} pairs={len(items)}")
-    
-    # Сортируем по времени (старые первыми) и берём первую пару
-    for mp4 in _sorted_ready_files(desc=False):
-        return mp4, _resolve_ready_json(mp4)
-    return None, None
+    # [READY_INDEX] Вершина кучи «старые первыми»
+    entry = READY_INDEX.oldest()
+    log.info(f"[READY_SCAN] index mp4={READY_INDEX.count()} pairs={READY_INDEX.count(with_meta=True)} pick={entry.mp4.name if entry else None}")
+    if not entry:
+        return None, None
+    return entry.mp4, entry.meta_path
 
 
 def _build_ready_item(mp4_path: Path, meta_data: dict) -> tuple[dict, str, str, str]:
@@ -1248,6 +1342,10 @@ def _build_ready_item(mp4_path: Path, meta_data: dict) -> tuple[dict, str, str,
         "local_path": str(mp4_path),
         "upload_path": str(mp4_path),
     }
+    # [PREUPLOAD] Ролик уже в Supabase — публикация начнётся сразу с URL
+    if _preupload_is_fresh(meta_data, for_publish=True):
+        item["supabase_url"] = meta_data["supabase_url"]
+        item["supabase_uploaded_at"] = meta_data.get("supabase_uploaded_at")
     return item, caption, caption_tg, caption_meta
 
 
@@ -1261,6 +1359,8 @@ def _archive_ready_artifacts(mp4_path: Path) -> None:
             dest_mp4 = PUBLISHED_DIR / f"{mp4_path.stem}_{int(pytime.time())}{mp4_path.suffix}"
         dest_mp4.parent.mkdir(exist_ok=True)
         shutil.move(str(mp4_path), str(dest_mp4))
+        READY_INDEX.discard(mp4_path)
+        PLAN_B_VARIANTS.discard(mp4_path)
         log.info(f"[READY_ARCHIVE] mp4 moved: {mp4_path.name} -> published/{dest_mp4.name}")
         
         # [ARCHIVE_JSON_FIX] Переносим json вместе с mp4
@@ -1323,11 +1423,19 @@ async def safe_unlink(path: Path | str, retries: int = 10, delay: float = 0.4):
     Does not raise; only logs on failure.
     """
     p = Path(path)
+    from_ready = p.suffix.lower() == ".mp4" and p.parent.resolve() == READY_TO_PUBLISH_DIR.resolve()
+    if from_ready:
+        # [READY_INDEX] Ролик со склада удаляется — убираем из индекса (и его варианты Плана Б)
+        READY_INDEX.discard(p)
+        PLAN_B_VARIANTS.discard(p)
     if not p.exists():
         return True
     for i in range(retries):
         try:
             p.unlink()
+            if from_ready:
+                # Сверка READY_INDEX.scan() могла вернуть ролик в индекс, пока ждали повтора
+                READY_INDEX.discard(p)
             return True
         except PermissionError:
             await asyncio.sleep(delay)
@@ -1400,59 +1508,61 @@ def _clamp_t(t: float, duration: float, eps: float = 0.25) -> float:
     return max(0.0, min(float(t), max(0.0, float(duration) - eps)))
 
 
-@contextmanager
-def _media_state_lock_guard(timeout: float = 5.0, poll: float = 0.05):
-    start = pytime.time()
-    lock_acquired = False
-    while not lock_acquired:
-        try:
-            fd = os.open(MEDIA_STATE_LOCK, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
-            os.close(fd)
-            lock_acquired = True
-        except FileExistsError:
-            if (pytime.time() - start) > timeout:
-                log.warning("[STATE] media_state.lock busy >%ss, proceeding without lock", timeout)
-                break
-            pytime.sleep(poll)
-    try:
-        yield
-    finally:
-        if lock_acquired:
-            try:
-                MEDIA_STATE_LOCK.unlink(missing_ok=True)
-            except AttributeError:
-                if MEDIA_STATE_LOCK.exists():
-                    MEDIA_STATE_LOCK.unlink()
-
-
-def _load_media_state() -> dict:
-    if MEDIA_STATE_PATH.exists():
-        try:
-            return json.loads(MEDIA_STATE_PATH.read_text(encoding="utf-8"))
-        except Exception as exc:
-            log.warning(f"[STATE] failed to read media_state.json: {exc}")
-    return {}
+def _media_state_get(media_hash: str) -> dict:
+    """[STATE_DB] Запись состояния медиа по хешу исходника (пустой dict, если нет)."""
+    return MEDIA_STATE.get(media_hash)
 
 
-def _save_media_state(state: dict) -> None:
-    with _media_state_lock_guard():
-        MEDIA_STATE_PATH.write_text(json.dumps(state, ensure_ascii=False, indent=2), encoding="utf-8")
-
-
-def _hash_file_fast(path: str, max_bytes: int = 10 * 1024 * 1024) -> str:
+def _hash_file_fast(path: str) -> str:
+    """[FILE_ID] Ключ исходника в MEDIA_STATE: отрезки файла через mmap + размер, кэш по stat()."""
     try:
-        size = os.path.getsize(path)
-        h = hashlib.sha256()
-        with open(path, "rb") as f:
-            chunk = f.read(max_bytes)
-        h.update(chunk)
-        h.update(str(size).encode("utf-8"))
-        return h.hexdigest()
+        return _resolve_media_hash(path)
     except Exception as exc:
         log.warning(f"[STATE] hash failed for {path}: {exc}")
         return ""
 
 
+# [FILE_ID] Старые ключи MEDIA_STATE (SHA-256 первых 10 МБ), которые ещё на что-то влияют:
+# готовый файл на складе (REUSE) или ожидание повтора. Пока такие есть, для нового
+# исходника считается и старый ключ — запись переносится на новый.
+_LEGACY_MEDIA_KEYS: set[str] | None = None
+_LEGACY_MEDIA_KEYS_AT = 0.0
+
+
+def _legacy_media_keys() -> set[str]:
+    global _LEGACY_MEDIA_KEYS, _LEGACY_MEDIA_KEYS_AT
+    if _LEGACY_MEDIA_KEYS is None or pytime.time() - _LEGACY_MEDIA_KEYS_AT > 3600:
+        keys = set()
+        for key, entry in STATE_DB.media_all().items():
+            if key.startswith(SAMPLED_PREFIX):
+                continue
+            ready_path = entry.get("ready_path")
+            if entry.get("status") == "done" and ready_path and Path(ready_path).exists():
+                keys.add(key)
+            elif int(entry.get("next_retry_at") or 0) > _now():
+                keys.add(key)
+        if keys or _LEGACY_MEDIA_KEYS:
+            log.info(f"[FILE_ID] legacy media_state keys still in use: {len(keys)}")
+        _LEGACY_MEDIA_KEYS, _LEGACY_MEDIA_KEYS_AT = keys, pytime.time()
+    return _LEGACY_MEDIA_KEYS
+
+
+def _resolve_media_hash(path: str) -> str:
+    key = FILE_HASHES.sampled(path)
+    legacy_keys = _legacy_media_keys()
+    if legacy_keys and not MEDIA_STATE.get(key):
+        legacy_key = FILE_HASHES.legacy(path)
+        if legacy_key in legacy_keys:
+            entry = MEDIA_STATE.get(legacy_key)
+            if entry:
+                MEDIA_STATE.update(key, lambda current: current or entry)
+                MEDIA_STATE.delete(legacy_key)
+                VIDEO_FP.rename_media_hash(legacy_key, key)
+                log.info(f"[FILE_ID] media_state migrated {legacy_key[:10]} -> {key[:13]} status={entry.get('status')}")
+            legacy_keys.discard(legacy_key)
+    return key
+
+
 def _now() -> int:
     return int(pytime.time())
 
@@ -1480,11 +1590,10 @@ def ensure_post_id(item: dict, fallback: str | None = None) -> str:
     return safe
 
 
-def _media_wait_status(media_hash: str, state: dict | None = None) -> tuple[bool, dict]:
+def _media_wait_status(media_hash: str, entry: dict | None = None) -> tuple[bool, dict]:
     if not media_hash:
         return False, {}
-    state = state or _load_media_state()
-    entry = state.get(media_hash)
+    entry = entry if entry is not None else _media_state_get(media_hash)
     if not entry:
         return False, {}
     nra = int(entry.get("next_retry_at") or 0)
@@ -1794,10 +1903,33 @@ def get_supabase_client() -> Optional[Client]:
     return supabase_client
 
 
+# === [SUPABASE_UPLOAD] Общий загрузчик: пул соединений + TUS-докачка для больших файлов ===
+SUPABASE_UPLOADER = SupabaseUploader(
+    SUPABASE_STORAGE_ENDPOINT,
+    SUPABASE_SERVICE_ROLE_KEY,
+    SUPABASE_BUCKET,
+    timeout=SUPABASE_TIMEOUT_SECONDS,
+    tus_threshold_bytes=default_tus_threshold(),
+    max_retries=int(os.getenv("SUPABASE_UPLOAD_RETRIES", "4")),
+)
+# [PREUPLOAD] Конвейер заливает готовый ролик в Supabase сразу после рендера,
+# публикация стартует с уже готового публичного URL. Неопубликованные объекты
+# старше TTL удаляет cleanup_supabase_orphans.
+SUPABASE_PREUPLOAD = os.getenv("SUPABASE_PREUPLOAD", "1").strip()
+SUPABASE_PREUPLOAD_TTL_HOURS = float(os.getenv("SUPABASE_PREUPLOAD_TTL_HOURS", "48"))
+# Для публикации URL берём только с таким запасом до порога удаления (TTL - 1 ч):
+# объект, отданный в IG/FB, не должен стать сиротой, пока публикация идёт
+SUPABASE_PREUPLOAD_REUSE_MARGIN_HOURS = float(os.getenv("SUPABASE_PREUPLOAD_REUSE_MARGIN_HOURS", "6"))
+SUPABASE_CLEANUP_INTERVAL_HOURS = float(os.getenv("SUPABASE_CLEANUP_INTERVAL_HOURS", "6"))
+# Объекты моложе этого возраста не считаем сиротами: их могут прямо сейчас дописывать
+SUPABASE_ORPHAN_GRACE_SECONDS = 3600
+
+
 def upload_to_supabase(local_file_path: str, content_type: str) -> Optional[str]:
     """
     Загружает файл в Supabase Storage и возвращает публичный URL.
-    Не меняет существующую логику бота.
+    Файл читается с диска кусками через общий SUPABASE_UPLOADER;
+    файлы больше SUPABASE_TUS_THRESHOLD_MB идут по resumable (TUS) протоколу.
     """
     client = get_supabase_client()
     if not client:
@@ -1819,23 +1951,17 @@ def upload_to_supabase(local_file_path: str, content_type: str) -> Optional[str]
     log.info(f"[DEBUG] File size: {size_mb:.2f} MB")
 
     unique_name = f"{int(datetime.now().timestamp() * 1000)}_{uuid.uuid4().hex}{path_obj.suffix}"
-    upload_url = f"{SUPABASE_STORAGE_ENDPOINT}object/{SUPABASE_BUCKET}/{unique_name}"
-    headers = {
-        "Authorization": f"Bearer {SUPABASE_SERVICE_ROLE_KEY}",
-        "apikey": SUPABASE_SERVICE_ROLE_KEY,
-        "Content-Type": content_type or "application/octet-stream",
-        "x-upsert": "false",
-    }
-    
+    last_logged = [0]
+
+    def _on_progress(sent: int, total: int) -> None:
+        # Логируем примерно каждые 25%, чтобы не засорять лог
+        pct = int(sent * 100 / total) if total else 100
+        if pct >= last_logged[0] + 25 or sent >= total:
+            last_logged[0] = pct
+            log.info(f"[SUPABASE_UPLOAD] {unique_name}: {pct}% ({sent / (1024 * 1024):.1f}/{total / (1024 * 1024):.1f} MB)")
+
     try:
-        with path_obj.open("rb") as f:
-            resp = requests.post(
-                upload_url,
-                data=f,
-                headers=headers,
-                timeout=SUPABASE_TIMEOUT_SECONDS,
-            )
-        resp.raise_for_status()
+        SUPABASE_UPLOADER.upload(path_obj, unique_name, content_type or "application/octet-stream", on_progress=_on_progress)
         public_url = client.storage.from_(SUPABASE_BUCKET).get_public_url(unique_name)
         log.info(f"[Supabase] File uploaded: {public_url}")
         return public_url
@@ -1844,6 +1970,11 @@ def upload_to_supabase(local_file_path: str, content_type: str) -> Optional[str]
         return None
 
 
+async def upload_to_supabase_async(local_file_path: str, content_type: str) -> Optional[str]:
+    """upload_to_supabase в отдельном потоке — загрузка не блокирует event loop."""
+    return await asyncio.to_thread(upload_to_supabase, local_file_path, content_type)
+
+
 def delete_supabase_file(public_url: str):
     """Удаляет файл из Supabase по публичному URL."""
     client = get_supabase_client()
@@ -1927,6 +2058,18 @@ async def cleanup_supabase_orphans(dry_run: bool = True) -> list[str]:
         if k:
             keep_keys.add(k)
 
+    # [PREUPLOAD] Заранее залитые ролики из ready_to_publish держим, пока не истёк TTL
+    expired_meta: list[Path] = []
+    for meta_path, meta in _iter_ready_preuploads():
+        k = supabase_key_from_url(meta.get("supabase_url"))
+        if not k:
+            continue
+        if _preupload_is_fresh(meta):
+            keep_keys.add(k)
+        else:
+            expired_meta.append(meta_path)
+    now_ms = int(pytime.time() * 1000)
+
     orphans: list[str] = []
     offset = 0
     page_size = 1000
@@ -1944,13 +2087,17 @@ async def cleanup_supabase_orphans(dry_run: bool = True) -> list[str]:
         for f in files:
             name = f.get("name")
             if name and name not in keep_keys:
+                # Имя upload_to_supabase начинается с timestamp в мс — свежие не трогаем
+                ts_part = name.split("_", 1)[0]
+                if ts_part.isdigit() and now_ms - int(ts_part) < SUPABASE_ORPHAN_GRACE_SECONDS * 1000:
+                    continue
                 orphans.append(name)
         if len(files) < page_size:
             break
         offset += page_size
 
     if dry_run:
-        log.info(f"[Supabase] cleanup dry-run: orphans={orphans}")
+        log.info(f"[Supabase] cleanup dry-run: orphans={orphans} expired_preuploads={len(expired_meta)}")
         return orphans
 
     for name in orphans:
@@ -1959,35 +2106,157 @@ async def cleanup_supabase_orphans(dry_run: bool = True) -> list[str]:
             log.info(f"INFO | [CLEANUP] Supabase storage cleared for file: {name}")
         except Exception as e:
             log.warning(f"[Supabase] cleanup remove failed for {name}: {e}")
+
+    # Просроченный pre-upload: объект уже удалён как сирота — убираем URL из sidecar,
+    # при публикации post_worker зальёт ролик заново
+    for meta_path in expired_meta:
+        _update_ready_meta(meta_path, {"supabase_url": None, "supabase_uploaded_at": None})
+        log.info(f"[PREUPLOAD] TTL expired, url dropped from {meta_path.name}")
     return orphans
 
 
-def ig_post(path: str, data: dict) -> dict:
-    """POST к Instagram Graph API с логированием."""
-    url = f"https://graph.facebook.com/{IG_GRAPH_VERSION}/{path.lstrip('/')}"
+def _preupload_is_fresh(meta: dict, for_publish: bool = False) -> bool:
+    """
+    URL из sidecar ещё живой: загружен не раньше TTL назад (с запасом в 1 час — порог,
+    после которого cleanup_supabase_orphans удаляет объект). for_publish=True — окно
+    строже на SUPABASE_PREUPLOAD_REUSE_MARGIN_HOURS: публикация успеет до удаления.
+    """
+    uploaded_at = meta.get("supabase_uploaded_at")
+    if not meta.get("supabase_url") or not uploaded_at:
+        return False
     try:
-        resp = requests.post(url, data=data, timeout=IG_TIMEOUT_SECONDS)
-        text = (resp.text or "")[:500]
-        log.info(f"IG_POST url={url} status={resp.status_code} resp={text}")
-        resp.raise_for_status()
-        return resp.json()
-    except Exception as e:
-        log.error(f"IG_POST_FAIL url={url} error={e}")
-        return {}
+        age = pytime.time() - float(uploaded_at)
+    except (TypeError, ValueError):
+        return False
+    margin = 3600 + (SUPABASE_PREUPLOAD_REUSE_MARGIN_HOURS * 3600 if for_publish else 0)
+    return age < SUPABASE_PREUPLOAD_TTL_HOURS * 3600 - margin
 
 
-def ig_get(path: str, params: dict) -> dict:
-    """GET к Instagram Graph API с логированием."""
-    url = f"https://graph.facebook.com/{IG_GRAPH_VERSION}/{path.lstrip('/')}"
+def _iter_ready_preuploads():
+    """(meta_path, meta) для всех sidecar в ready_to_publish, где записан supabase_url."""
+    for entry in READY_INDEX.entries():
+        if entry.meta_path and isinstance(entry.meta, dict) and entry.meta.get("supabase_url"):
+            yield entry.meta_path, entry.meta
+
+
+def _update_ready_meta(meta_path: Path, updates: dict) -> bool:
+    """Дописывает поля в sidecar .json (None — удалить поле). Запись через временный файл."""
     try:
-        resp = requests.get(url, params=params, timeout=IG_TIMEOUT_SECONDS)
-        text = (resp.text or "")[:500]
-        log.info(f"IG_GET url={resp.url} status={resp.status_code} resp={text}")
-        resp.raise_for_status()
-        return resp.json()
+        meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        for key, value in updates.items():
+            if value is None:
+                meta.pop(key, None)
+            else:
+                meta[key] = value
+        tmp_path = meta_path.with_suffix(meta_path.suffix + ".tmp")
+        tmp_path.write_text(json.dumps(meta, ensure_ascii=False, indent=2), encoding="utf-8")
+        os.replace(tmp_path, meta_path)
+        READY_INDEX.refresh_meta(meta_path)
+        return True
     except Exception as e:
-        log.error(f"IG_GET_FAIL url={url} error={e}")
-        return {}
+        log.warning(f"[PREUPLOAD] failed to update {meta_path.name}: {e}")
+        return False
+
+
+async def preupload_ready_video(ready_path: Path, meta_path: Path, item: dict) -> Optional[str]:
+    """
+    [PREUPLOAD] Сразу после рендера: MAX50-проверка и загрузка в Supabase,
+    supabase_url + supabase_uploaded_at пишутся в sidecar и в item.
+    Ошибка не критична — post_worker зальёт файл в момент публикации.
+    """
+    if SUPABASE_PREUPLOAD != "1" or not (SUPABASE_URL and SUPABASE_BUCKET):
+        return None
+    try:
+        guarded = Path(await asyncio.to_thread(ensure_max_50mb, str(ready_path)))
+        if guarded != ready_path:
+            os.replace(str(guarded), str(ready_path))
+            log.info(f"[PREUPLOAD] MAX50 re-encoded {ready_path.name}")
+            _update_ready_meta(meta_path, {"encode_count": _bump_encode_count(item, "preupload")})
+    except Exception as guard_err:
+        log.warning(f"[PREUPLOAD] MAX50 check failed for {ready_path.name}: {guard_err}")
+        return None
+
+    public_url = await upload_to_supabase_async(str(ready_path), "video/mp4")
+    if not public_url:
+        log.warning(f"[PREUPLOAD] upload failed, will retry at publish time: {ready_path.name}")
+        return None
+    uploaded_at = int(pytime.time())
+    if not _update_ready_meta(meta_path, {"supabase_url": public_url, "supabase_uploaded_at": uploaded_at}):
+        # Без записи в sidecar ссылку никто не найдёт — не оставляем мусор в бакете
+        await asyncio.to_thread(delete_supabase_file, public_url)
+        return None
+    item["supabase_url"] = public_url
+    item["supabase_uploaded_at"] = uploaded_at
+    log.info(f"[PREUPLOAD] OK {ready_path.name} -> {public_url}")
+    return public_url
+
+
+async def supabase_cleanup_scheduler():
+    """Периодическая очистка бакета: сироты и просроченные pre-upload ролики."""
+    while True:
+        await asyncio.sleep(max(600, SUPABASE_CLEANUP_INTERVAL_HOURS * 3600))
+        try:
+            orphans = await cleanup_supabase_orphans(dry_run=False)
+            log.info(f"[Supabase] periodic cleanup done: removed={len(orphans)}")
+        except Exception as e:
+            log.error(f"[Supabase] periodic cleanup failed: {e}")
+
+
+GRAPH_CLIENT = GraphClient(max_connections=GRAPH_MAX_CONNECTIONS, max_retries=GRAPH_MAX_RETRIES)
+
+
+async def ig_post(path: str, data: dict, timeout: float | None = None, publishing: bool = False) -> dict:
+    """POST к Instagram Graph API с логированием (общий пул соединений, повторы на 5xx/лимиты).
+    publishing=True — media_publish: повтор только на явный rate limit."""
+    return await GRAPH_CLIENT.post(
+        f"{IG_GRAPH_VERSION}/{path.lstrip('/')}",
+        data,
+        timeout=timeout or IG_TIMEOUT_SECONDS,
+        tag="IG_POST",
+        publishing=publishing,
+    )
+
+
+IG_PUBLISH_ATTEMPTS = 2
+
+
+async def ig_media_publish(creation_id: str) -> str | None:
+    """
+    media_publish без дублей: запрос не повторяется на таймаут/5xx. После неясного исхода
+    статус контейнера (status_code=PUBLISHED) показывает, вышел ли пост; повторный
+    media_publish — только если контейнер всё ещё не опубликован.
+    Возвращает id медиа (или creation_id, если публикация подтверждена по статусу).
+    """
+    for attempt in range(1, IG_PUBLISH_ATTEMPTS + 1):
+        publish_res = await ig_post(
+            f"{IG_USER_ID}/media_publish",
+            {"creation_id": creation_id, "access_token": IG_ACCESS_TOKEN},
+            publishing=True,
+        )
+        log.info(f"IG_PUBLISH_RESP: {publish_res}")
+        if publish_res.get("id"):
+            return publish_res["id"]
+        status_res = await ig_get(creation_id, {"fields": "status_code", "access_token": IG_ACCESS_TOKEN})
+        status_code = status_res.get("status_code")
+        log.warning(f"IG_PUBLISH_UNCLEAR creation_id={creation_id} status_code={status_code} attempt={attempt}/{IG_PUBLISH_ATTEMPTS}")
+        if status_code == "PUBLISHED":
+            log.info(f"IG_PUBLISH_CONFIRMED_BY_STATUS creation_id={creation_id}")
+            return creation_id
+        if status_code != "FINISHED":
+            # Контейнер не готов к публикации (ERROR/EXPIRED) или статус неизвестен — повтор не поможет
+            return None
+        await asyncio.sleep(IG_PUBLISH_PAUSE_SECONDS)
+    return None
+
+
+async def ig_get(path: str, params: dict, timeout: float | None = None) -> dict:
+    """GET к Instagram Graph API с логированием."""
+    return await GRAPH_CLIENT.get(
+        f"{IG_GRAPH_VERSION}/{path.lstrip('/')}",
+        params,
+        timeout=timeout or IG_STATUS_TIMEOUT_SECONDS,
+        tag="IG_GET",
+    )
 
 
 def clean_caption(text: str) -> str:
@@ -2082,7 +2351,7 @@ async def publish_to_instagram(item: dict, force: bool = False):
             "access_token": IG_ACCESS_TOKEN,
         }
     
-    res = ig_post(f"{IG_USER_ID}/media", payload)
+    res = await ig_post(f"{IG_USER_ID}/media", payload, timeout=IG_CREATE_TIMEOUT_SECONDS)
     log.info(f"IG_CREATE_RESP: {res}")
     creation_id = res.get("id")
     if not creation_id:
@@ -2094,7 +2363,7 @@ async def publish_to_instagram(item: dict, force: bool = False):
     if media_type == "video":
         tries = IG_POLL_MAX_TRIES
         while tries > 0:
-            status_res = ig_get(creation_id, {"fields": "status_code", "access_token": IG_ACCESS_TOKEN})
+            status_res = await ig_get(creation_id, {"fields": "status_code", "access_token": IG_ACCESS_TOKEN})
             status_code = status_res.get("status_code")
             log.info(f"IG_STATUS creation_id={creation_id} status_code={status_code} resp={status_res}")
             if status_code == "FINISHED":
@@ -2102,7 +2371,7 @@ async def publish_to_instagram(item: dict, force: bool = False):
             if status_code in ("ERROR", "FAILED", "EXPIRED"):
                 # Одна повторная попытка после 30 секунд
                 await asyncio.sleep(30)
-                status_res_retry = ig_get(creation_id, {"fields": "status_code", "access_token": IG_ACCESS_TOKEN})
+                status_res_retry = await ig_get(creation_id, {"fields": "status_code", "access_token": IG_ACCESS_TOKEN})
                 status_code_retry = status_res_retry.get("status_code")
                 log.info(f"IG_STATUS_RETRY creation_id={creation_id} status_code={status_code_retry} resp={status_res_retry}")
                 if status_code_retry == "FINISHED":
@@ -2114,13 +2383,11 @@ async def publish_to_instagram(item: dict, force: bool = False):
         if tries == 0:
             log.warning(f"IG_STATUS_TIMEOUT creation_id={creation_id} after 5 minutes - trying media_publish anyway (Smart Skip improved)")
     
-    # Пауза перед публикацией, чтобы Meta успела подготовить контейнер
-    pytime.sleep(10)
+    # Пауза перед публикацией, чтобы Meta успела подготовить контейнер (не блокирует event loop)
+    await asyncio.sleep(IG_PUBLISH_PAUSE_SECONDS)
 
     # Публикуем
-    publish_res = ig_post(f"{IG_USER_ID}/media_publish", {"creation_id": creation_id, "access_token": IG_ACCESS_TOKEN})
-    log.info(f"IG_PUBLISH_RESP: {publish_res}")
-    media_id = publish_res.get("id")
+    media_id = await ig_media_publish(creation_id)
     if media_id:
         log.info(f"IG_PUBLISH_OK media_id={media_id}")
         item["ig_published"] = True
@@ -2131,8 +2398,8 @@ async def publish_to_instagram(item: dict, force: bool = False):
         return False
 
 
-async def publish_to_instagram_carousel(item: dict, image_urls: list[str]):
-    """Публикация карусели (альбом) в Instagram."""
+async def publish_to_instagram_carousel(item: dict, image_urls: list[str], cleanup: bool = True):
+    """Публикация карусели (альбом) в Instagram. cleanup=False — файлы в Supabase удалит вызывающий."""
     if ENABLE_INSTAGRAM != "1":
         return
     if not IG_USER_ID or not IG_ACCESS_TOKEN:
@@ -2147,27 +2414,31 @@ async def publish_to_instagram_carousel(item: dict, image_urls: list[str]):
     log.info(f"CAPTION_TO_IG: {caption[:300]}")
     safe_caption = clean_social_text(caption)
 
-    child_ids = []
-    for url in image_urls:
-        res = ig_post(
-            f"{IG_USER_ID}/media",
-            {
-                "image_url": url,
-                "is_carousel_item": "true",
-                "access_token": IG_ACCESS_TOKEN,
-            },
-        )
+    # [CAROUSEL_PARALLEL] Дочерние контейнеры создаются одновременно, порядок слайдов сохраняется
+    sem = asyncio.Semaphore(CAROUSEL_PARALLEL)
+
+    async def _create_child(url: str) -> Optional[str]:
+        async with sem:
+            res = await ig_post(
+                f"{IG_USER_ID}/media",
+                {
+                    "image_url": url,
+                    "is_carousel_item": "true",
+                    "access_token": IG_ACCESS_TOKEN,
+                },
+            )
         media_id = res.get("id")
-        if media_id:
-            child_ids.append(media_id)
-        else:
+        if not media_id:
             log.error("IG_CAROUSEL_CHILD_FAIL")
+        return media_id
+
+    child_ids = [cid for cid in await asyncio.gather(*(_create_child(u) for u in image_urls)) if cid]
 
     if not child_ids:
         log.error("IG_CAROUSEL_CHILDREN_EMPTY")
         return
 
-    parent_res = ig_post(
+    parent_res = await ig_post(
         f"{IG_USER_ID}/media",
         {
             "media_type": "CAROUSEL",
@@ -2181,57 +2452,57 @@ async def publish_to_instagram_carousel(item: dict, image_urls: list[str]):
         log.error("IG_CAROUSEL_PARENT_FAIL")
         return
 
-    publish_res = ig_post(
-        f"{IG_USER_ID}/media_publish",
-        {"creation_id": creation_id, "access_token": IG_ACCESS_TOKEN},
-    )
-    media_id = publish_res.get("id")
+    media_id = await ig_media_publish(creation_id)
     if media_id:
         log.info(f"IG_PUBLISH_CAROUSEL_OK media_id={media_id}")
         item["ig_published"] = True
         ig_mark_published("carousel")
-        if ENABLE_FB != "1":
+        if cleanup and ENABLE_FB != "1":
             delete_supabase_files(image_urls)
     else:
         log.error("IG_PUBLISH_CAROUSEL_FAIL")
 
 
-def fb_post(path: str, data: dict) -> dict:
-    """POST к Facebook Graph API (Page) с логированием."""
-    url = f"https://graph.facebook.com/{FB_GRAPH_VERSION}/{path.lstrip('/')}"
-    try:
-        resp = requests.post(url, data=data, timeout=FB_TIMEOUT_SECONDS)
-        text = (resp.text or "")[:500]
-        log.info(f"FB_POST url={url} status={resp.status_code} resp={text}")
-        resp.raise_for_status()
-        return resp.json()
-    except Exception as e:
-        log.error(f"FB_POST_FAIL url={url} error={e}")
-        return {}
+async def fb_post(path: str, data: dict, timeout: float | None = None) -> dict:
+    """POST к Facebook Graph API (Page) с логированием.
+    Публикация не идемпотентна — на таймаут и 5xx не повторяем (иначе дубль поста),
+    только на явный rate limit."""
+    return await GRAPH_CLIENT.post(
+        f"{FB_GRAPH_VERSION}/{path.lstrip('/')}",
+        data,
+        timeout=timeout or FB_TIMEOUT_SECONDS,
+        tag="FB_POST",
+        publishing=True,
+    )
+
 
+# Исход publish_to_facebook: «пропущен» — не успех и не ошибка (Plan B не тратится, архив не блокируется)
+FB_PUBLISHED, FB_SKIPPED, FB_FAILED = "published", "skipped", "failed"
 
-async def publish_to_facebook(item: dict, force: bool = False):
+
+async def publish_to_facebook(item: dict, force: bool = False) -> str:
     """Публикация медиа в Facebook Page по публичному URL из Supabase.
-    force=True используется /postnow для игнорирования schedule guard."""
+    force=True используется /postnow для игнорирования schedule guard.
+    Возвращает FB_PUBLISHED / FB_SKIPPED (FB выключен, нет настроек, нечего публиковать) / FB_FAILED."""
     if ENABLE_FB != "1":
-        return
+        return FB_SKIPPED
     if not FB_PAGE_ID or not FB_PAGE_TOKEN:
         log.warning("Facebook disabled: missing FB_PAGE_ID or FB_PAGE_TOKEN")
-        return
+        return FB_SKIPPED
 
     media_type = item.get("type")
     if media_type == "text":
         log.info("Facebook skip: text post")
-        return
+        return FB_SKIPPED
     
     if media_type not in ("photo", "video"):
         log.info(f"Facebook skip: unsupported type {media_type}")
-        return
+        return FB_SKIPPED
     
     supabase_url = item.get("supabase_url")
     if not supabase_url:
         log.warning("Facebook skip: no supabase_url")
-        return
+        return FB_SKIPPED
     
     caption = item.get("caption") or item.get("text") or ""
     caption = (caption or "").replace("**", "")
@@ -2257,7 +2528,7 @@ async def publish_to_facebook(item: dict, force: bool = False):
 
     try:
         if media_type == "photo":
-            res = fb_post(f"{FB_PAGE_ID}/photos", {
+            res = await fb_post(f"{FB_PAGE_ID}/photos", {
                 "url": supabase_url,
                 "caption": safe_caption,
                 "access_token": FB_PAGE_TOKEN,
@@ -2265,10 +2536,11 @@ async def publish_to_facebook(item: dict, force: bool = False):
             media_id = res.get("id")
             if media_id:
                 log.info(f"FB_PUBLISH_PHOTO_OK id={media_id}")
-            else:
-                log.error("FB_PUBLISH_PHOTO_FAIL")
+                item["fb_published"] = True
+                return FB_PUBLISHED
+            log.error("FB_PUBLISH_PHOTO_FAIL")
         else:
-            res = fb_post(f"{FB_PAGE_ID}/videos", {
+            res = await fb_post(f"{FB_PAGE_ID}/videos", {
                 "file_url": supabase_url,
                 "description": safe_caption,
                 "access_token": FB_PAGE_TOKEN,
@@ -2277,14 +2549,19 @@ async def publish_to_facebook(item: dict, force: bool = False):
             if media_id:
                 log.info(f"FB_PUBLISH_VIDEO_OK id={media_id}")
                 item["fb_published"] = True
-            else:
-                log.error("FB_PUBLISH_VIDEO_FAIL")
+                return FB_PUBLISHED
+            log.error("FB_PUBLISH_VIDEO_FAIL")
     except Exception as e:
         log.error(f"Facebook publish error: {e}")
+    return FB_FAILED
 
 
-async def publish_to_facebook_carousel(item: dict, image_urls: list[str]):
-    """Публикация набора фото как альбом/серия в Facebook Page."""
+async def publish_to_facebook_carousel(item: dict, image_urls: list[str], cleanup: bool = True):
+    """
+    Публикация набора фото одним постом в Facebook Page:
+    фото загружаются параллельно как неопубликованные, затем один пост в ленту с attached_media.
+    cleanup=False — файлы в Supabase удалит вызывающий.
+    """
     if ENABLE_FB != "1":
         return
     if not FB_PAGE_ID or not FB_PAGE_TOKEN:
@@ -2297,26 +2574,41 @@ async def publish_to_facebook_carousel(item: dict, image_urls: list[str]):
     caption = item.get("caption") or item.get("text") or ""
     safe_caption = clean_social_text(caption)
 
-    success = False
-    for idx, url in enumerate(image_urls):
-        res = fb_post(
-            f"{FB_PAGE_ID}/photos",
-            {
-                "url": url,
-                "caption": safe_caption if idx == 0 else "",
-                "access_token": FB_PAGE_TOKEN,
-            },
-        )
+    sem = asyncio.Semaphore(CAROUSEL_PARALLEL)
+
+    async def _upload_photo(idx: int, url: str) -> Optional[str]:
+        async with sem:
+            res = await fb_post(
+                f"{FB_PAGE_ID}/photos",
+                {
+                    "url": url,
+                    "published": "false",
+                    "access_token": FB_PAGE_TOKEN,
+                },
+            )
         media_id = res.get("id")
         if media_id:
-            success = True
-            log.info(f"FB_PUBLISH_CAROUSEL_PHOTO_OK id={media_id} idx={idx}")
+            log.info(f"FB_CAROUSEL_PHOTO_OK id={media_id} idx={idx}")
         else:
             log.error(f"FB_PUBLISH_CAROUSEL_PHOTO_FAIL idx={idx}")
+        return media_id
 
-    if success:
+    photo_ids = [pid for pid in await asyncio.gather(*(_upload_photo(i, u) for i, u in enumerate(image_urls))) if pid]
+    if not photo_ids:
+        log.error("FB_CAROUSEL_PHOTOS_EMPTY")
+        return
+
+    data = {"message": safe_caption, "access_token": FB_PAGE_TOKEN}
+    for idx, photo_id in enumerate(photo_ids):
+        data[f"attached_media[{idx}]"] = json.dumps({"media_fbid": photo_id})
+    res = await fb_post(f"{FB_PAGE_ID}/feed", data)
+    if res.get("id"):
+        log.info(f"FB_PUBLISH_CAROUSEL_OK post_id={res.get('id')} photos={len(photo_ids)}")
         item["fb_published"] = True
-        delete_supabase_files(image_urls)
+        if cleanup:
+            delete_supabase_files(image_urls)
+    else:
+        log.error("FB_PUBLISH_CAROUSEL_FAIL")
 
 # Статистика для отчётов
 STATS_FILE = Path("daily_stats.json")
@@ -2337,73 +2629,82 @@ DAILY_STATS = {
 }
 
 
+# Полная сверка очереди с STATE_DB: при первом сохранении и после сбоя записи
+_QUEUE_FULL_SYNC = True
+
+
 def save_queue():
+    # [STATE_DB] Пишется только журнал изменений POST_QUEUE с прошлого сохранения
+    global _QUEUE_FULL_SYNC
     try:
-        with QUEUE_FILE.open("w", encoding="utf-8") as f:
-            json.dump(list(POST_QUEUE), f, ensure_ascii=False)
+        if _QUEUE_FULL_SYNC:
+            POST_QUEUE.drain_changes()
+            STATE_DB.queue_sync(POST_QUEUE)
+            _QUEUE_FULL_SYNC = False
+        else:
+            added, removed, cleared = POST_QUEUE.drain_changes()
+            STATE_DB.queue_apply(added, removed, cleared=cleared)
     except Exception as e:
+        # Журнал уже вычитан — следующее сохранение сверит очередь целиком
+        _QUEUE_FULL_SYNC = True
         print("Failed to save queue", e)
 
 
 def load_queue():
-    if not QUEUE_FILE.exists():
-        return
     try:
-        with QUEUE_FILE.open("r", encoding="utf-8") as f:
-            items = json.load(f)
-            for it in items:
-                POST_QUEUE.append(it)
+        for it in STATE_DB.queue_load():
+            POST_QUEUE.append(it)
     except Exception as e:
         print("Failed to load queue", e)
 
 
+def migrate_json_state():
+    """[STATE_DB] Одноразовый перенос старых JSON-файлов состояния в SQLite."""
+    try:
+        STATE_DB.migrate_from_json({
+            "queue": QUEUE_FILE,
+            "seen": SEEN_FILE,
+            "published_keys": PUBLISHED_KEYS_FILE,
+            "published_texts": PUBLISHED_TEXTS_FILE,
+            "media_state": MEDIA_STATE_PATH,
+            "last_post_time": LAST_POST_TIME_FILE,
+            "daily_stats": STATS_FILE,
+        })
+    except Exception as e:
+        log.error(f"[STATE_DB] JSON migration failed: {e}")
+
+
 def load_seen():
-    if SEEN_FILE.exists():
-        try:
-            data = json.loads(SEEN_FILE.read_text(encoding="utf-8"))
-            if isinstance(data, dict):
-                # Новая структура: {"hashes": [...], "buffer_message_ids": [...], "file_ids": [...]}
-                SEEN_HASHES.update(data.get("hashes", []))
-                SEEN_FILE_IDS.update(data.get("file_ids", []))
-                # Загружаем обработанные message_id (если есть)
-                if "buffer_message_ids" in data:
-                    # Сохраняем для совместимости, но не используем активно
-                    pass
-            else:
-                # Старая структура: просто список хешей
-                SEEN_HASHES.update(data)
-        except Exception:
-            pass
+    try:
+        SEEN_HASHES.update(STATE_DB.dedup_load(DEDUP_SEEN_HASH))
+        SEEN_FILE_IDS.update(STATE_DB.dedup_load(DEDUP_SEEN_FILE_ID))
+    except Exception as e:
+        log.warning(f"[STATE_DB] Failed to load seen keys: {e}")
 
 
 def save_seen():
-    # Сохраняем в новом формате с поддержкой обратной совместимости
-    data = {
-        "hashes": list(SEEN_HASHES),
-        "file_ids": list(SEEN_FILE_IDS),
-        "buffer_message_ids": []  # Будет заполняться при публикации
-    }
-    SEEN_FILE.write_text(json.dumps(data), encoding="utf-8")
+    # INSERT OR IGNORE: уже сохранённые ключи не переписываются
+    try:
+        STATE_DB.dedup_add_many(DEDUP_SEEN_HASH, SEEN_HASHES)
+        STATE_DB.dedup_add_many(DEDUP_SEEN_FILE_ID, SEEN_FILE_IDS)
+    except Exception as e:
+        log.warning(f"[STATE_DB] Failed to save seen keys: {e}")
 
 
 def load_last_post_time():
     global LAST_POST_TIME
-    if LAST_POST_TIME_FILE.exists():
-        try:
-            data = json.loads(LAST_POST_TIME_FILE.read_text(encoding="utf-8"))
-            if isinstance(data, dict) and data.get("last_post_time"):
-                LAST_POST_TIME = datetime.fromisoformat(data["last_post_time"])
-        except Exception:
-            pass
+    try:
+        raw = STATE_DB.kv_get("last_post_time")
+        if raw:
+            LAST_POST_TIME = datetime.fromisoformat(raw)
+    except Exception:
+        pass
 
 
 def save_last_post_time():
     if LAST_POST_TIME:
         try:
-            LAST_POST_TIME_FILE.write_text(
-                json.dumps({"last_post_time": LAST_POST_TIME.isoformat()}),
-                encoding="utf-8"
-            )
+            STATE_DB.kv_set("last_post_time", LAST_POST_TIME.isoformat())
         except Exception as e:
             log.warning(f"Failed to save last_post_time: {e}")
 
@@ -2414,34 +2715,23 @@ def mark_file_id_seen(file_id: str):
     if file_id in SEEN_FILE_IDS:
         return
     SEEN_FILE_IDS.add(file_id)
-    save_seen()
+    try:
+        STATE_DB.dedup_add(DEDUP_SEEN_FILE_ID, file_id)
+    except Exception as e:
+        log.warning(f"[STATE_DB] Failed to store seen file_id: {e}")
 
 
 def load_published_keys():
     """Loads dedup keys that already reached publication."""
-    global PUBLISHED_KEYS
-    if not PUBLISHED_KEYS_FILE.exists():
-        return
     try:
-        raw = json.loads(PUBLISHED_KEYS_FILE.read_text(encoding="utf-8"))
-        keys: list = []
-        if isinstance(raw, dict):
-            keys = raw.get("keys") or raw.get("hashes") or raw.get("values") or []
-        elif isinstance(raw, list):
-            keys = raw
-        for key in keys:
-            if key:
-                PUBLISHED_KEYS.add(str(key))
+        PUBLISHED_KEYS.update(STATE_DB.dedup_load(DEDUP_PUBLISHED))
     except Exception as e:
         log.warning(f"[DEDUP] Failed to load published keys: {e}")
 
 
 def save_published_keys():
     try:
-        PUBLISHED_KEYS_FILE.write_text(
-            json.dumps(sorted(PUBLISHED_KEYS)),
-            encoding="utf-8"
-        )
+        STATE_DB.dedup_add_many(DEDUP_PUBLISHED, PUBLISHED_KEYS)
     except Exception as e:
         log.warning(f"[DEDUP] Failed to save published keys: {e}")
 
@@ -2456,7 +2746,10 @@ def mark_as_published(key: str | None):
     if not key or key in PUBLISHED_KEYS:
         return
     PUBLISHED_KEYS.add(key)
-    save_published_keys()
+    try:
+        STATE_DB.dedup_add(DEDUP_PUBLISHED, key)
+    except Exception as e:
+        log.warning(f"[DEDUP] Failed to store published key: {e}")
 
 
 def reset_ig_schedule_if_needed():
@@ -2550,99 +2843,154 @@ def ig_mark_published(media_kind: str):
 def load_published_texts():
     """Загружает список опубликованных текстов"""
     global PUBLISHED_TEXTS
-    if PUBLISHED_TEXTS_FILE.exists():
-        try:
-            with PUBLISHED_TEXTS_FILE.open("r", encoding="utf-8") as f:
-                PUBLISHED_TEXTS = json.load(f)
-                # Оставляем только последние MAX_PUBLISHED_TEXTS
-                if len(PUBLISHED_TEXTS) > MAX_PUBLISHED_TEXTS:
-                    PUBLISHED_TEXTS = PUBLISHED_TEXTS[-MAX_PUBLISHED_TEXTS:]
-        except Exception as e:
-            log.warning(f"Failed to load published texts: {e}")
-            PUBLISHED_TEXTS = []
+    try:
+        # Только последние MAX_PUBLISHED_TEXTS
+        PUBLISHED_TEXTS = STATE_DB.texts_load(MAX_PUBLISHED_TEXTS)
+    except Exception as e:
+        log.warning(f"Failed to load published texts: {e}")
+        PUBLISHED_TEXTS = []
 
 
 def save_published_texts():
     """Сохраняет список опубликованных текстов"""
     try:
-        with PUBLISHED_TEXTS_FILE.open("w", encoding="utf-8") as f:
-            json.dump(PUBLISHED_TEXTS, f, ensure_ascii=False)
+        STATE_DB.texts_replace(PUBLISHED_TEXTS[-MAX_PUBLISHED_TEXTS:])
     except Exception as e:
         log.warning(f"Failed to save published texts: {e}")
 
 
+def remember_published_text(text: str):
+    """Добавляет текст в окно последних публикаций: одна строка в БД вместо перезаписи списка."""
+    PUBLISHED_TEXTS.append(text)
+    if len(PUBLISHED_TEXTS) > MAX_PUBLISHED_TEXTS:
+        PUBLISHED_TEXTS.pop(0)
+    try:
+        STATE_DB.text_append(text, keep=MAX_PUBLISHED_TEXTS)
+    except Exception as e:
+        log.warning(f"Failed to save published text: {e}")
+    # [TEXT_DEDUP] В индекс почти-дубликатов — вся история, без окна в MAX_PUBLISHED_TEXTS
+    try:
+        TEXT_DEDUP.add(text)
+    except Exception as e:
+        log.warning(f"[TEXT_DEDUP] Failed to index published text: {e}")
+    # [EMBED_STORE] Эмбеддинг — сетевой вызов, поэтому фоном (публикация его не ждёт)
+    try:
+        _spawn_embed_task(index_published_embeddings([text]))
+    except RuntimeError:
+        pass  # вне event loop: текст доберёт бэкфилл при следующем старте
+
+
+_POST_FOOTER_RE = re.compile(r"(🧠\s*)?Haqiqat(\s*🧠)?|Kanalga obuna bo['ʻʼ`]?ling|\|", re.IGNORECASE)
+
+
+def _strip_post_template(text: str) -> str:
+    """
+    Тело поста без общего для всех публикаций хвоста: футер канала, хэштеги, ссылки.
+    Для антидублей (MinHash и эмбеддинги): шаблон один у всех постов и сам по себе
+    даёт несвязанным текстам высокое сходство.
+    """
+    body = _POST_FOOTER_RE.sub(" ", strip_batafsil_links_hashtags(text or ""))
+    body = " ".join(re.sub(r"\(\s*\)?\s*$|\(\s*\)", " ", body).split())
+    return body or (text or "")
+
+
+def _text_dedup_normalize(text: str) -> str:
+    """
+    norm_cmp оставляет только латиницу (узбекский текст); у русского текста после него
+    почти ничего не остаётся — тогда та же нормализация, но с кириллицей.
+    Шаблон канала отрезается до шинглов (_strip_post_template).
+    """
+    text = _strip_post_template(text)
+    norm = norm_cmp(text)
+    letters = len(re.sub(r"[\W_]", "", text or ""))
+    if letters and len(norm.replace(" ", "")) >= letters // 2:
+        return norm
+    t = re.sub(r"[^\w\sʻʼ'-]", "", sanitize_uz_jivoy_text(text).lower())
+    return re.sub(r"\s+", " ", t).strip()
+
+
+# === [TEXT_DEDUP] MinHash/LSH по всей истории публикаций (таблица text_minhash в STATE_DB_PATH) ===
+# TEXT_DEDUP_DUPLICATE — оценка Jaccard, с которой текст считается дубликатом без обращения к модели
+TEXT_DEDUP = NearDuplicateIndex(STATE_DB_PATH, normalize=_text_dedup_normalize)
+TEXT_DEDUP_DUPLICATE = float(os.getenv("TEXT_DEDUP_DUPLICATE", "0.8"))
+
+# === [EMBED_STORE] Смысловой антидубль: эмбеддинги всей истории (state/embeddings/) ===
+# EMBED_PROVIDER=openai (по умолчанию при OPENAI_API_KEY) | hashing (локально, без сети)
+# EMBED_DUPLICATE — косинус, с которого текст считается пересказом опубликованного
+EMBED_PROVIDER = os.getenv("EMBED_PROVIDER", "openai" if OPENAI_SCHEDULER else "hashing").strip().lower()
+EMBED_DIM = int(os.getenv("EMBED_DIM", "512"))
+if EMBED_PROVIDER == "openai" and OPENAI_SCHEDULER:
+    EMBEDDER = OpenAIEmbedder(
+        OPENAI_SCHEDULER,
+        model=os.getenv("EMBED_MODEL", "text-embedding-3-small"),
+        dim=EMBED_DIM,
+        timeout=OPENAI_SHORT_TIMEOUT_SECONDS,
+    )
+else:
+    EMBEDDER = HashingEmbedder(EMBED_DIM)
+EMBED_STORE = EmbeddingStore(STATE_DIR / "embeddings", provider_name=EMBEDDER.name, dim=EMBEDDER.dim)
+EMBED_DUPLICATE = float(os.getenv("EMBED_DUPLICATE", "0.85" if isinstance(EMBEDDER, OpenAIEmbedder) else "0.8"))
+# Ссылки на фоновые задачи индексации: иначе loop держит их слабо и GC может снять задачу на лету
+_EMBED_TASKS: set[asyncio.Task] = set()
+
+
+def _spawn_embed_task(coro) -> asyncio.Task:
+    task = asyncio.get_running_loop().create_task(coro)
+    _EMBED_TASKS.add(task)
+    task.add_done_callback(_EMBED_TASKS.discard)
+    return task
+
+
+def _embedding_text(text: str) -> str:
+    """Текст для эмбеддинга: без общего шаблона канала (иначе косинус ~0.6 у несвязанных постов)."""
+    return _strip_post_template(text)
+
+
+async def index_published_embeddings(texts: list[str]) -> int:
+    """[EMBED_STORE] Один батч-вызов провайдера на все ещё не сохранённые тексты."""
+    pending = [t for t in dict.fromkeys(texts) if t and not EMBED_STORE.contains(t)]
+    if not pending:
+        return 0
+    try:
+        vectors = await EMBEDDER.embed([_embedding_text(t) for t in pending])
+    except Exception as e:
+        log.warning(f"[EMBED_STORE] embedding failed for {len(pending)} text(s): {e}")
+        return 0
+    added = sum(1 for text, vec in zip(pending, vectors) if EMBED_STORE.add(text, vec))
+    log.info(f"[EMBED_STORE] indexed {added} published text(s), total={EMBED_STORE.count()}")
+    return added
+
+
 async def check_similar_content(text: str) -> tuple[bool, float]:
-    """Проверяет semantic similarity с опубликованными постами. Возвращает (is_similar, similarity_score)"""
-    if not openai_client or not text or not PUBLISHED_TEXTS:
-        return (False, 0.0)
-    
-    # Берем последние 20 постов для проверки (увеличено для более строгой проверки)
-    recent_texts = PUBLISHED_TEXTS[-20:] if len(PUBLISHED_TEXTS) > 20 else PUBLISHED_TEXTS
-    
-    if not recent_texts:
+    """
+    Проверяет similarity с опубликованными постами. Возвращает (is_similar, similarity_score).
+    [TEXT_DEDUP] Копии и близкие переводы — локальным MinHash без сети.
+    [EMBED_STORE] Пересказ «та же тема другими словами» — один вызов эмбеддинга
+    и косинус по всей истории вместо генеративного запроса на каждый пост.
+    """
+    if not text:
         return (False, 0.0)
-    
+    matches = TEXT_DEDUP.query(text, threshold=TEXT_DEDUP_DUPLICATE, limit=1)
+    if matches:
+        TEXT_DEDUP.record(duplicate=True)
+        log.warning(f"SKIP: near duplicate (jaccard={matches[0][0]:.2f}, local index)")
+        return (True, matches[0][0])
     try:
-        # Проверяем через OpenAI semantic similarity
-        resp = openai_client.chat.completions.create(
-            model=os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
-            messages=[
-                {
-                    "role": "system",
-                    "content": (
-                        "Ты — строгий эксперт по обнаружению дубликатов контента в Telegram-канале.\n\n"
-                        "Твоя задача: определить, является ли новый текст ДУБЛИКАТОМ уже опубликованного поста.\n\n"
-                        "Верни ТОЛЬКО валидный JSON в формате:\n"
-                        '{"is_similar": true/false, "similarity_score": 0.0-1.0, "reason": "краткое объяснение"}\n\n'
-                        "КРИТИЧЕСКИ ВАЖНО: is_similar = true, если:\n"
-                        "1. ОДИНАКОВАЯ ТЕМА/ИДЕЯ (даже если слова разные):\n"
-                        "   - 'избегай таких людей' = 'держись подальше от таких людей' = 'не общайся с такими'\n"
-                        "   - 'советы по успеху' = 'как добиться успеха' = 'правила успеха'\n"
-                        "   - 'признаки токсичных людей' = 'как распознать плохих людей' = 'избегай этих людей'\n\n"
-                        "2. ОДИНАКОВЫЕ КЛЮЧЕВЫЕ ФАКТЫ/ПРИМЕРЫ:\n"
-                        "   - одинаковые списки признаков/характеристик\n"
-                        "   - одинаковые примеры/ситуации\n"
-                        "   - одинаковые выводы/советы\n\n"
-                        "3. ПОХОЖИЙ ПЕРЕВОД ОДНОГО И ТОГО ЖЕ ИСТОЧНИКА:\n"
-                        "   - если оба текста перевод одного и того же русского поста\n"
-                        "   - даже если формулировки немного отличаются\n\n"
-                        "4. similarity_score >= 0.65 (снижен порог для более строгой проверки)\n\n"
-                        "is_similar = false ТОЛЬКО если:\n"
-                        "- РАЗНЫЕ темы (например, 'про успех' vs 'про отношения')\n"
-                        "- РАЗНЫЕ факты/примеры\n"
-                        "- РАЗНАЯ основная идея\n"
-                        "- similarity_score < 0.65\n\n"
-                        "ПРИМЕРЫ ДУБЛИКАТОВ (is_similar = true):\n"
-                        "- 'Избегай таких людей: они не держат секреты' vs 'Держись подальше от людей, которые не умеют хранить тайны'\n"
-                        "- '5 признаков токсичных людей' vs 'Как распознать токсичного человека: 5 признаков'\n"
-                        "- 'Советы по успеху: работай усердно' vs 'Как добиться успеха: усердная работа'\n\n"
-                        "ПРИМЕРЫ НЕ ДУБЛИКАТОВ (is_similar = false):\n"
-                        "- 'Как заработать деньги' vs 'Как найти работу'\n"
-                        "- 'Признаки токсичных людей' vs 'Как улучшить отношения'\n"
-                        "- 'Советы по карьере' vs 'Советы по здоровью'\n\n"
-                        "БУДЬ СТРОГИМ: если есть хоть малейшее сомнение, что это один и тот же пост/тема — верни is_similar = true."
-                    ),
-                },
-                {
-                    "role": "user",
-                    "content": f"Новый текст:\n{text}\n\nОпубликованные тексты (последние 10):\n" + "\n---\n".join(recent_texts[:10])
-                },
-            ],
-            response_format={"type": "json_object"},
-        )
-        
-        result = json.loads(resp.choices[0].message.content or "{}")
-        similarity_score = float(result.get("similarity_score", 0.0))
-        is_similar = result.get("is_similar", False) or similarity_score >= 0.65  # Снижен порог с 0.75 до 0.65
-        
-        if is_similar:
-            log.warning(f"SKIP: semantic duplicate (similarity={similarity_score:.2f}): {result.get('reason', '')}")
-        
-        return (is_similar, similarity_score)
-        
+        vector = (await EMBEDDER.embed([_embedding_text(text)]))[0]
     except Exception as e:
         log.warning(f"Failed to check similar content: {e}")
         return (False, 0.0)
+    top = EMBED_STORE.search(vector, k=3)
+    if not top:
+        return (False, 0.0)
+    similarity_score, row = top[0]
+    is_similar = similarity_score >= EMBED_DUPLICATE
+    if is_similar:
+        similar_text = (EMBED_STORE.texts([row]) or [""])[0]
+        log.warning(f"SKIP: semantic duplicate (cosine={similarity_score:.2f}): {similar_text[:80]!r}")
+    else:
+        log.info(f"[EMBED_STORE] top cosine={similarity_score:.2f} (threshold {EMBED_DUPLICATE:.2f}) over {EMBED_STORE.count()} texts")
+    return (is_similar, similarity_score)
 
 
 def remove_comment_phrases(text: str) -> str:
@@ -2761,25 +3109,9 @@ def split_text_for_carousel(text: str, max_chars: int = 700) -> list[str]:
 
 
 def wrap_lines_to_width(draw: ImageDraw.ImageDraw, text: str, font: ImageFont.FreeTypeFont, max_width: int) -> list[str]:
-    """Перенос строк с учётом реальной ширины."""
+    """Перенос строк с учётом реальной ширины (text_layout.greedy_wrap)."""
     words = text.split()
-    lines = []
-    line = ""
-    for word in words:
-        candidate = (line + " " + word).strip()
-        if not candidate:
-            continue
-        bbox = draw.textbbox((0, 0), candidate, font=font)
-        width = bbox[2] - bbox[0]
-        if width <= max_width:
-            line = candidate
-        else:
-            if line:
-                lines.append(line)
-            line = word
-    if line:
-        lines.append(line)
-    return lines
+    return [" ".join(words[a:b]) for a, b in greedy_wrap(draw, words, font, max_width)]
 
 
 def parse_accent_tokens(text: str) -> list[tuple[str, bool]]:
@@ -2800,120 +3132,155 @@ def parse_accent_tokens(text: str) -> list[tuple[str, bool]]:
 
 
 def wrap_tokens_to_width(draw: ImageDraw.ImageDraw, tokens: list[tuple[str, bool]], font: ImageFont.FreeTypeFont, max_width: int) -> list[list[tuple[str, bool]]]:
-    """Перенос строк с учётом ширины для токенов с подсветкой."""
-    lines: list[list[tuple[str, bool]]] = []
-    line: list[tuple[str, bool]] = []
-
-    def measure(line_tokens: list[tuple[str, bool]]) -> float:
-        if not line_tokens:
-            return 0
-        joined = " ".join(t[0] for t in line_tokens)
-        bbox = draw.textbbox((0, 0), joined, font=font)
-        return bbox[2] - bbox[0]
-
-    for tok in tokens:
-        if not line:
-            line.append(tok)
-            if measure(line) > max_width and len(tok[0]) > 0:
-                lines.append(line)
-                line = []
+    """Перенос строк с учётом ширины для токенов с подсветкой (text_layout.greedy_wrap)."""
+    spans = greedy_wrap(draw, [t[0] for t in tokens], font, max_width)
+    return [tokens[a:b] for a, b in spans]
+
+
+# === [ASSETS] Фоны и шрифты карусели / single-art: один раз при старте, рядом с main.py ===
+ASSETS_DIR = Path(os.getenv("ASSETS_DIR", str(Path(__file__).resolve().parent)))
+ASSETS_MAX_MB = float(os.getenv("ASSETS_MAX_MB", "128"))
+ASSET_REGISTRY = AssetRegistry(ASSETS_DIR, target_width=1080, max_bytes=int(ASSETS_MAX_MB * 1024 * 1024))
+
+
+# === [CAROUSEL_PARALLEL] Слайды рендерятся пулом потоков, загрузка и дочерние контейнеры — параллельно ===
+CAROUSEL_RENDER_WORKERS = max(1, int(os.getenv("CAROUSEL_RENDER_WORKERS", "4")))
+CAROUSEL_PARALLEL = max(1, int(os.getenv("CAROUSEL_PARALLEL", "4")))
+
+
+def _render_carousel_slide(idx: int, chunk: str, tmp_dir: Path) -> str:
+    """Один слайд карусели -> путь к PNG. Вызывается из потоков create_carousel_images."""
+    font_path = ASSET_REGISTRY.random_font_path()
+    img = ASSET_REGISTRY.background()
+    draw = ImageDraw.Draw(img)
+
+    max_text_width = int(img.width * 0.55)  # компактный блок текста
+    max_text_height = int(img.height * 0.8)
+
+    # подбираем размер шрифта (крупный, не ниже 50)
+    font_size = 72
+    min_font = 50
+    chosen_lines = []
+    chosen_font = get_font(font_path, font_size)
+
+    while font_size >= min_font:
+        font = get_font(font_path, font_size)
+        lines = wrap_lines_to_width(draw, chunk, font, max_text_width)
+        if len(lines) > 18:
+            # заведомо не влезает — не раскладываем блок целиком
+            font_size -= 2
             continue
-        candidate = line + [tok]
-        if measure(candidate) <= max_width:
-            line.append(tok)
-        else:
-            lines.append(line)
-            line = [tok]
-    if line:
-        lines.append(line)
-    return lines
+        text_block = "\n".join(lines)
+        bbox = draw.multiline_textbbox((0, 0), text_block, font=font, align="center")
+        text_w = bbox[2] - bbox[0]
+        text_h = bbox[3] - bbox[1]
+
+        if text_w <= max_text_width and text_h <= max_text_height and len(lines) <= 18:
+            chosen_lines = lines
+            chosen_font = font
+            break
+        font_size -= 2
+
+    # если не уложились, жёстко режем строки по 18
+    if not chosen_lines:
+        lines = wrap_lines_to_width(draw, chunk, chosen_font, max_text_width)
+        chosen_lines = lines[:18]
+
+    final_text = "\n".join(chosen_lines)
+    bbox = draw.multiline_textbbox((0, 0), final_text, font=chosen_font, align="center")
+    text_w = bbox[2] - bbox[0]
+    text_h = bbox[3] - bbox[1]
+    x = (img.width - text_w) / 2
+    y = (img.height - text_h) / 2
+
+    # тень
+    shadow_offset = 2
+    draw.multiline_text(
+        (x + shadow_offset, y + shadow_offset),
+        final_text,
+        font=chosen_font,
+        fill="black",
+        align="center",
+    )
+    # основной текст
+    draw.multiline_text(
+        (x, y),
+        final_text,
+        font=chosen_font,
+        fill="white",
+        align="center",
+    )
+
+    out_path = tmp_dir / f"carousel_{uuid.uuid4().hex}.png"
+    img.save(out_path, format="PNG")
+    log.info(f"[PILLOW] Слайд №{idx} успешно создан и сохранен")
+    return str(out_path)
+
 
 
 def create_carousel_images(text: str) -> list[str]:
     """
     Создаёт изображения с текстом для карусели.
-    Возвращает список путей к временным PNG-файлам.
+    Возвращает список путей к временным PNG-файлам (в порядке слайдов).
     """
-    base_dir = Path("D:/Project/Auto Telegramm")
-    backgrounds_dir = base_dir / "backgrounds"
-    fonts_dir = base_dir / "fonts"
     tmp_dir = Path("tmp_media") / "carousel"
     tmp_dir.mkdir(parents=True, exist_ok=True)
 
-    bg_files = [p for p in backgrounds_dir.glob("*") if p.suffix.lower() in {".jpg", ".jpeg", ".png"}]
-    font_files = [p for p in fonts_dir.glob("*.ttf")]
-    if not bg_files or not font_files:
+    if not ASSET_REGISTRY.has_assets():
         log.error("Carousel assets missing: backgrounds or fonts not found")
         return []
 
-    slides = []
     chunks = split_text_for_carousel(text)
+    t0 = pytime.perf_counter()
+    # Pillow отпускает GIL на resize/compose/PNG-сжатии — слайды рендерятся параллельно
+    with ThreadPoolExecutor(max_workers=min(CAROUSEL_RENDER_WORKERS, len(chunks)), thread_name_prefix="carousel") as pool:
+        slides = list(pool.map(_render_carousel_slide, range(1, len(chunks) + 1), chunks, [tmp_dir] * len(chunks)))
+    log.info(f"[CAROUSEL_PARALLEL] rendered {len(slides)} slides in {pytime.perf_counter() - t0:.2f}s workers={min(CAROUSEL_RENDER_WORKERS, len(chunks))}")
+    return slides
 
-    for idx, chunk in enumerate(chunks, start=1):
-        bg_path = random.choice(bg_files)
-        font_path = random.choice(font_files)
-        img = Image.open(bg_path).convert("RGBA")
-        draw = ImageDraw.Draw(img)
 
-        max_text_width = int(img.width * 0.55)  # компактный блок текста
-        max_text_height = int(img.height * 0.8)
-
-        # подбираем размер шрифта (крупный, не ниже 50)
-        font_size = 72
-        min_font = 50
-        chosen_lines = []
-        chosen_font = ImageFont.truetype(str(font_path), font_size)
-
-        while font_size >= min_font:
-            font = ImageFont.truetype(str(font_path), font_size)
-            lines = wrap_lines_to_width(draw, chunk, font, max_text_width)
-            text_block = "\n".join(lines)
-            bbox = draw.multiline_textbbox((0, 0), text_block, font=font, align="center")
-            text_w = bbox[2] - bbox[0]
-            text_h = bbox[3] - bbox[1]
-
-            if text_w <= max_text_width and text_h <= max_text_height and len(lines) <= 18:
-                chosen_lines = lines
-                chosen_font = font
-                break
-            font_size -= 2
+async def upload_carousel_slides(paths: list[str]) -> list[str]:
+    """Параллельная загрузка слайдов в Supabase (не больше CAROUSEL_PARALLEL одновременно). Порядок сохраняется."""
+    sem = asyncio.Semaphore(CAROUSEL_PARALLEL)
 
-        # если не уложились, жёстко режем строки по 18
-        if not chosen_lines:
-            lines = wrap_lines_to_width(draw, chunk, chosen_font, max_text_width)
-            chosen_lines = lines[:18]
+    async def _upload(path: str) -> Optional[str]:
+        async with sem:
+            return await upload_to_supabase_async(path, "image/png")
 
-        final_text = "\n".join(chosen_lines)
-        bbox = draw.multiline_textbbox((0, 0), final_text, font=chosen_font, align="center")
-        text_w = bbox[2] - bbox[0]
-        text_h = bbox[3] - bbox[1]
-        x = (img.width - text_w) / 2
-        y = (img.height - text_h) / 2
-
-        # тень
-        shadow_offset = 2
-        draw.multiline_text(
-            (x + shadow_offset, y + shadow_offset),
-            final_text,
-            font=chosen_font,
-            fill="black",
-            align="center",
-        )
-        # основной текст
-        draw.multiline_text(
-            (x, y),
-            final_text,
-            font=chosen_font,
-            fill="white",
-            align="center",
-        )
+    t0 = pytime.perf_counter()
+    results = await asyncio.gather(*(_upload(p) for p in paths))
+    urls = [u for u in results if u]
+    if len(urls) != len(paths):
+        log.warning(f"[CAROUSEL_PARALLEL] uploaded {len(urls)}/{len(paths)} slides")
+    log.info(f"[CAROUSEL_PARALLEL] upload {len(urls)} slides in {pytime.perf_counter() - t0:.2f}s")
+    return urls
 
-        out_path = tmp_dir / f"carousel_{uuid.uuid4().hex}.png"
-        img.save(out_path, format="PNG")
-        log.info(f"[PILLOW] Слайд №{idx} успешно создан и сохранен")
-        slides.append(str(out_path))
 
-    return slides
+async def publish_carousel(item: dict) -> bool:
+    """
+    Карусель целиком: рендер слайдов -> загрузка в Supabase -> IG и FB одновременно.
+    Файлы в Supabase удаляются после обеих публикаций (IG забирает image_url при создании контейнера).
+    """
+    text = item.get("final_translated_text") or item.get("text") or ""
+    t0 = pytime.perf_counter()
+    slides = await asyncio.to_thread(create_carousel_images, text)
+    if not slides:
+        return False
+    urls = await upload_carousel_slides(slides)
+    try:
+        if urls:
+            await asyncio.gather(
+                publish_to_instagram_carousel(item, urls, cleanup=False),
+                publish_to_facebook_carousel(item, urls, cleanup=False),
+            )
+    finally:
+        if urls:
+            await asyncio.to_thread(delete_supabase_files, urls)
+        for path in slides:
+            await safe_unlink(path)
+    ok = bool(item.get("ig_published") or item.get("fb_published"))
+    log.info(f"[CAROUSEL_PARALLEL] done slides={len(slides)} ok={ok} total={pytime.perf_counter() - t0:.2f}s")
+    return ok
 
 
 def summarize_for_image(text: str) -> str:
@@ -2988,24 +3355,17 @@ def create_single_art_image(text: str) -> str:
     Создает одно изображение с цитатой.
     Возвращает путь к PNG файлу.
     """
-    base_dir = Path("D:/Project/Auto Telegramm")
-    backgrounds_dir = base_dir / "backgrounds"
-    fonts_dir = base_dir / "fonts"
     tmp_dir = Path("tmp_media") / "single_art"
     tmp_dir.mkdir(parents=True, exist_ok=True)
 
-    bg_files = [p for p in backgrounds_dir.glob("*") if p.suffix.lower() in {".jpg", ".jpeg", ".png"}]
-    font_files = [p for p in fonts_dir.glob("*.ttf")]
-    if not bg_files or not font_files:
+    if not ASSET_REGISTRY.has_assets():
         log.error("Single art assets missing: backgrounds or fonts not found")
         return ""
 
-    bg_path = random.choice(bg_files)
     # Пытаемся найти Bold-шрифт
-    bold_fonts = [p for p in font_files if "bold" in p.name.lower()]
-    font_path = bold_fonts[0] if bold_fonts else font_files[0]
+    font_path = ASSET_REGISTRY.bold_font_path()
 
-    img = Image.open(bg_path).convert("RGBA")
+    img = ASSET_REGISTRY.background()
     draw = ImageDraw.Draw(img)
 
     # Очистка HTML и укороченный текст для изображения
@@ -3018,7 +3378,7 @@ def create_single_art_image(text: str) -> str:
     font_size = 140
     min_font = 100
     chosen_lines = []
-    chosen_font = ImageFont.truetype(str(font_path), font_size)
+    chosen_font = get_font(font_path, font_size)
     tokens = parse_accent_tokens(summary)
 
     def measure_lines(lines_tokens: list[list[tuple[str, bool]]], font: ImageFont.FreeTypeFont) -> tuple[float, float, list[float], list[float]]:
@@ -3035,8 +3395,11 @@ def create_single_art_image(text: str) -> str:
         return max_w_inner, total_h_inner, line_widths_inner, line_heights_inner
 
     while font_size >= min_font:
-        font = ImageFont.truetype(str(font_path), font_size)
+        font = get_font(font_path, font_size)
         lines_tokens = wrap_tokens_to_width(draw, tokens, font, max_text_width)
+        if len(lines_tokens) > 12:
+            font_size -= 2
+            continue
         max_w, total_h, line_widths, line_heights = measure_lines(lines_tokens, font)
 
         if max_w <= max_text_width and total_h <= max_text_height and len(lines_tokens) <= 12:
@@ -3058,7 +3421,7 @@ def create_single_art_image(text: str) -> str:
     reduce_steps = 0
     while (max_w > max_text_width or total_h > max_text_height) and chosen_font.size > min_font:
         new_size = max(min_font, int(chosen_font.size * 0.9))
-        chosen_font = ImageFont.truetype(str(font_path), new_size)
+        chosen_font = get_font(font_path, new_size)
         chosen_lines = wrap_tokens_to_width(draw, tokens, chosen_font, max_text_width)[:12]
         max_w, total_h, chosen_line_widths, chosen_line_heights = measure_lines(chosen_lines, chosen_font)
         reduce_steps += 1
@@ -3517,8 +3880,19 @@ def pick_toptext_source(post: dict | None) -> tuple[str, str]:
     return "", "none"
 
 
+_TOPTEXT_FONT_RESOLVED: Optional[Path] = None
+
+
 def resolve_toptext_font() -> Path:
-    """Ищем Poppins Regular (приоритет), затем fallback-пути."""
+    """Ищем Poppins Regular (приоритет), затем fallback-пути. Найденный путь запоминаем на процесс."""
+    global _TOPTEXT_FONT_RESOLVED
+    if _TOPTEXT_FONT_RESOLVED is not None and _TOPTEXT_FONT_RESOLVED.exists():
+        return _TOPTEXT_FONT_RESOLVED
+    _TOPTEXT_FONT_RESOLVED = _resolve_toptext_font_uncached()
+    return _TOPTEXT_FONT_RESOLVED
+
+
+def _resolve_toptext_font_uncached() -> Path:
     preferred_files = [
         Path("fonts") / "Poppins" / "Poppins-Regular.ttf",
         Path("fonts") / "Poppins All" / "Poppins-Regular.ttf",
@@ -3612,40 +3986,6 @@ def _has_cyrillic(s: str) -> bool:
     return False
 
 
-def _measure(draw, text, font):
-    """Измеряет ширину текста в пиксельных единицах."""
-    if not text:
-        return 0
-    bbox = draw.textbbox((0, 0), text, font=font)
-    if not bbox:
-        return 0
-    return int(max(0, bbox[2] - bbox[0]))
-
-
-def _wrap_to_lines(draw, words, font, max_w, max_lines=2):
-    """Переносит текст на max_lines строк без изменения шрифта, ориентируясь на пиксельную ширину."""
-    lines = []
-    cur = []
-    for w in words:
-        test = (" ".join(cur + [w])).strip()
-        if not test:
-            continue
-        if _measure(draw, test, font) <= max_w or not cur:
-            cur.append(w)
-        else:
-            lines.append(" ".join(cur))
-            cur = [w]
-            if len(lines) >= max_lines:
-                break
-    if cur and len(lines) < max_lines:
-        lines.append(" ".join(cur))
-    # Если слов больше, чем влезло — добавляем многоточие к последней строке
-    if len(lines) == max_lines and len(words) > sum(len(l.split()) for l in lines):
-        if not lines[-1].endswith("…"):
-            lines[-1] = (lines[-1] + " …").strip()
-    return lines
-
-
 def clean_toptext(text: str) -> str:
     """Очищает TOPTEXT от лишних символов (* ❌ • | и двойные пробелы).
     
@@ -3702,9 +4042,9 @@ def make_top_text_png(text: str, width: int, height: int, font_path: str, font_s
     
     Алгоритм:
     1. Переносим текст на TOPTEXT_MAX_LINES максимум (ориентируясь на пиксельную ширину, не символы)
-    2. Если даже при переносе слишком широко — уменьшаем шрифт на 4px шаг, но не ниже TOPTEXT_FONT_MIN
+    2. Если даже при переносе слишком широко — бинарным поиском берём наибольший подходящий размер, но не ниже TOPTEXT_FONT_MIN
     3. 2-е слово каждой строки подсвечиваем неон-cyan
-    4. Используем MD5-хэш для кеша и избегания стаб-файлов
+    4. Готовая плашка берётся из TOPTEXT_CACHE (ключ: шрифт + текст + параметры раскладки)
     5. Для вертикальных (align_bottom=True) - рисуем текст ближе к нижнему краю PNG
     """
     text = (text or "").strip()
@@ -3726,34 +4066,41 @@ def make_top_text_png(text: str, width: int, height: int, font_path: str, font_s
     log.info(f"[TOPTEXT] text={text[:80]!r}")
 
     font_size = int(font_size)
-    img = Image.new("RGBA", (width, height), (0, 0, 0, 0))
-    draw = ImageDraw.Draw(img)
-
     font_file = Path(font_path or TOP_FONT_PATH)
     if not font_file.exists():
         raise RuntimeError(f"TOPTEXT font missing: {font_file}")
 
-    def _load_font(size: int) -> ImageFont.FreeTypeFont:
-        return ImageFont.truetype(str(font_file), int(size))
+    # [TOPTEXT_CACHE] Та же плашка уже рисовалась (Plan B, повторный рендер) — Pillow не нужен
+    cache_key = overlay_cache.make_key(
+        text, font_path=font_file, width=width, height=height, font_size=font_size,
+        font_min=font_min, max_lines=max_lines, align_bottom=bool(align_bottom),
+    )
+    try:
+        cached_png = TOPTEXT_CACHE.get(cache_key)
+    except Exception as e:
+        log.warning(f"[TOPTEXT_CACHE] lookup failed: {e}")
+        cached_png = None
+    if cached_png is not None:
+        log.info(f"[TOPTEXT_CACHE] HIT {cached_png.name}")
+        return str(cached_png)
 
-    base_font = _load_font(font_size)
+    img = Image.new("RGBA", (width, height), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(img)
 
     pad_x = 70
     pad_y = 35
     max_w = int(width * 0.92)  # 92% ширины с полями
     words = text.split()
 
-    # 1) Переносим на max_lines без уменьшения
-    lines = _wrap_to_lines(draw, words, base_font, max_w, max_lines=max_lines)
+    # 1) Переносим на max_lines; 2) если слишком широко — наибольший размер в [font_min, font_size]
+    def _layout(size: int):
+        fnt = get_font(font_file, size)
+        wrapped = _wrap_to_lines(draw, words, fnt, max_w, max_lines=max_lines)
+        return not any(_measure(draw, ln, fnt) > max_w for ln in wrapped), (fnt, wrapped)
 
-    # 2) Если всё ещё слишком широко — слегка уменьшаем, но не ниже MIN
-    while font_size > font_min:
-        too_wide = any(_measure(draw, ln, base_font) > max_w for ln in lines)
-        if not too_wide:
-            break
-        font_size -= 4
-        base_font = _load_font(font_size)
-        lines = _wrap_to_lines(draw, words, base_font, max_w, max_lines=max_lines)
+    font_size, (base_font, lines), probes = fit_font_size(_layout, font_min, font_size)
+    if probes > 1:
+        log.info(f"[TOPTEXT] font fit: size={font_size} probes={probes}")
 
     def _font_label(fnt) -> str:
         path = getattr(fnt, "path", None)
@@ -3799,22 +4146,217 @@ def make_top_text_png(text: str, width: int, height: int, font_path: str, font_s
             y += font_size + line_gap
         draw_words_line(pad_x, y, line_text)
 
-    # === CACHE BUSTING: Включаем шрифт и хеш текста в имя файла ===
-    key = f"{text}|{width}|{height}|{font_size}"
-    h = hashlib.md5(key.encode("utf-8")).hexdigest()[:10]
-    
-    out = Path("tmp_media") / f"toptext_{h}_{font_size}.png"
-    out.parent.mkdir(parents=True, exist_ok=True)
-    
-    # Удаляем старый файл, чтобы обеспечить свежий рендер
-    if out.exists():
-        out.unlink()
-    
-    img.save(out)
+    out = TOPTEXT_CACHE.put(cache_key, img)
     log.info(f"[TOPTEXT] saved: {out.name}")
     return str(out)
 
 
+def _auto_compress_output(out_path: Path) -> int:
+    """
+    AUTO-COMPRESS: пережимает готовый рендер, если он больше 50 МБ (общий для обоих движков).
+    С [RATE_CONTROL] срабатывать не должен — остаётся страховкой. Возвращает число пережатий.
+    """
+    reencodes = 0
+    # 🔄 AUTO-COMPRESS: Проверка размера и автоматическое пережатие (SIZE GUARD)
+    try:
+        file_size_mb = out_path.stat().st_size / (1024 * 1024)
+        max_size_mb = 50  # Лимит для Telegram и Instagram
+        
+        if file_size_mb > max_size_mb:
+            log.warning(f"[AUTO-COMPRESS] File too large: {file_size_mb:.2f} MB > {max_size_mb} MB")
+            log.info("[AUTO-COMPRESS] Re-encoding with CRF 22 to reduce size...")
+            
+            # Создаем временный файл для пережатой версии
+            compressed_path = out_path.parent / f"compressed_{out_path.name}"
+            
+            # ПЕРВАЯ ПОПЫТКА: CRF 22, bitrate 4000k через ffmpeg (file-based)
+            cmd_crf22 = [
+                "ffmpeg", "-y",
+                "-i", str(out_path),
+                "-c:v", "libx264",
+                "-preset", "medium",
+                "-b:v", "4000k",
+                "-crf", "22",
+                "-pix_fmt", "yuv420p",
+                "-c:a", "aac",
+                "-b:a", "128k",
+                str(compressed_path)
+            ]
+            
+            try:
+                subprocess.run(cmd_crf22, check=True, capture_output=True, timeout=600)
+                reencodes += 1
+                compressed_size_mb = compressed_path.stat().st_size / (1024 * 1024)
+                log.info(f"[AUTO-COMPRESS] New size with CRF 22: {compressed_size_mb:.2f} MB (was {file_size_mb:.2f} MB)")
+                
+                if compressed_size_mb <= max_size_mb:
+                    # Успех! Заменяем оригинал
+                    out_path.unlink()
+                    compressed_path.rename(out_path)
+                    log.info(f"✅ [AUTO-COMPRESS] Success! File compressed to {compressed_size_mb:.2f} MB")
+                else:
+                    # ВТОРАЯ ПОПЫТКА: CRF 24, bitrate 3000k через ffmpeg
+                    log.warning(f"[AUTO-COMPRESS] Still too large ({compressed_size_mb:.2f} MB), trying CRF 24...")
+                    compressed_path.unlink()  # Удаляем первую попытку
+                    
+                    cmd_crf24 = [
+                        "ffmpeg", "-y",
+                        "-i", str(out_path),
+                        "-c:v", "libx264",
+                        "-preset", "medium",
+                        "-b:v", "3000k",
+                        "-crf", "24",
+                        "-pix_fmt", "yuv420p",
+                        "-c:a", "aac",
+                        "-b:a", "128k",
+                        str(compressed_path)
+                    ]
+                    
+                    subprocess.run(cmd_crf24, check=True, capture_output=True, timeout=600)
+                    reencodes += 1
+                    final_size_mb = compressed_path.stat().st_size / (1024 * 1024)
+                    log.info(f"[AUTO-COMPRESS] Final size with CRF 24: {final_size_mb:.2f} MB")
+                    
+                    out_path.unlink()
+                    compressed_path.rename(out_path)
+                    log.info(f"✅ [AUTO-COMPRESS] Compressed with CRF 24 to {final_size_mb:.2f} MB")
+            
+            except subprocess.TimeoutExpired:
+                log.error("[AUTO-COMPRESS] Compression timeout (600s), keeping original file")
+            except subprocess.CalledProcessError as ffmpeg_err:
+                log.error(f"[AUTO-COMPRESS] ffmpeg compression failed: {ffmpeg_err}, keeping original file")
+                if compressed_path.exists():
+                    compressed_path.unlink()
+        else:
+            log.info(f"✅ [SIZE CHECK] File size OK: {file_size_mb:.2f} MB <= {max_size_mb} MB (HD quality preserved)")
+    except Exception as compress_err:
+        log.error(f"[AUTO-COMPRESS] Failed: {compress_err}")
+    return reencodes
+
+
+def _record_encode(post_data: dict | None, plan, out_path: Path, reencodes: int) -> None:
+    """[RATE_CONTROL] План и число кодирований — в post_data (дальше в sidecar .json)."""
+    try:
+        size_mb = out_path.stat().st_size / (1024 * 1024)
+    except OSError:
+        size_mb = 0.0
+    encode_count = 1 + reencodes
+    log.info(
+        f"[ENCODE] {out_path.name}: mode={plan.mode} video={plan.video_kbps}k dur={plan.duration:.1f}s "
+        f"size={size_mb:.1f}MB (limit {plan.max_bytes / (1024 * 1024):.0f}MB) encodes={encode_count}"
+    )
+    if reencodes:
+        log.warning(f"[ENCODE] plan missed the limit, AUTO-COMPRESS re-encoded {reencodes}x: {plan.summary()}")
+    if isinstance(post_data, dict):
+        post_data["encode_plan"] = plan.summary()
+        post_data["encode_count"] = encode_count
+
+
+def _resolve_overlay_text(local_path, caption: str | None, source_description: str | None, post_data: dict | None) -> str:
+    """
+    TOPTEXT: выбирает и чистит текст overlay (общая часть для MoviePy и ffmpeg движков).
+    Дописывает в post_data overlay_text_clean / overlay_src / caption_text_clean (HARD_BIND).
+    """
+    # --- TOPTEXT source pipeline (OVERLAY_SOURCE_CLEAN_v2) ---
+    # КЛЮЧЕВАЯ СМЕНА: Берем final_translated_text вместо caption_unified
+    # Это гарантирует что overlay содержит ТОЛЬКО перевод без брендинга/ссылок/хэштегов
+    post_payload = post_data if isinstance(post_data, dict) else None
+    
+    # === ЗАЩИТА ОТ РАССИНХРОНА: Проверка binding_key ===
+    post_id = post_payload.get("id", "unknown") if post_payload else "unknown"
+    binding_key = post_payload.get("binding_key", "") if post_payload else ""
+    expected_local_path = post_payload.get("local_path", "") if post_payload else ""
+    
+    # Сравниваем ожидаемый путь с фактическим - НО не блокируем, если пусто (fallback mode)
+    actual_local_path_str = str(local_path) if local_path else ""
+    if expected_local_path and expected_local_path != actual_local_path_str:
+        log.warning(f"[BIND_MISMATCH] Path mismatch (continuing with actual)")
+        log.warning(f"[BIND_MISMATCH] post_id={post_id} expected={expected_local_path} actual={actual_local_path_str}")
+        # [FIX_BIND_MISMATCH] No longer blocking - use actual_local_path for processing
+    elif expected_local_path:
+        log.debug(f"[VERIFY_BIND] Local path match: post_id={post_id} path={actual_local_path_str}")
+    
+    # Приоритет: final_translated_text (чистый перевод) > description > caption
+    base_text_for_overlay = ""
+    overlay_src = "none"
+    if post_payload:
+        base_text_for_overlay = post_payload.get("final_translated_text", "") or ""
+        overlay_src = "final_translated_text"
+    if not base_text_for_overlay and source_description:
+        base_text_for_overlay = source_description
+        overlay_src = "source_description"
+    if not base_text_for_overlay and caption:
+        base_text_for_overlay = caption
+        overlay_src = "caption"
+    
+    # === КОНТРОЛЬНЫЙ ЛОГ: Что пошло в overlay и откуда ===
+    log.info(f"[OVERLAY_CHECK] post_id={post_id} src={overlay_src} preview={repr(base_text_for_overlay[:120])}")
+    
+    # === ЛОГИРОВАНИЕ СВЯЗКИ В process_video ===
+    log.info(f"[OVERLAY_BIND] post_id={post_id} path={os.path.basename(expected_local_path) if expected_local_path else 'no_path'} key={binding_key} src={overlay_src}")
+    
+    # Применяем жесткую очистку для overlay (максимум 2 строки)
+    raw_overlay_text = base_text_for_overlay
+    top_text, overlay_meta = clean_overlay_text(base_text_for_overlay, max_lines=2)
+    
+    log.info(f"[OVERLAY_TEXT] raw_len={overlay_meta['raw_len']} clean_len={overlay_meta['clean_len']} lines={overlay_meta['lines']} contains_html={overlay_meta['had_html']} contains_url={overlay_meta['had_url']}")
+    log.info(f"[OVERLAY_TEXT] raw={raw_overlay_text[:100]!r}...")
+    log.info(f"[OVERLAY_TEXT] clean={top_text[:100]!r}...")
+    
+    # === HARD_BIND: Сохраняем очищенный overlay в post_data ===
+    if post_payload:
+        post_payload["overlay_text_clean"] = top_text
+        post_payload["overlay_src"] = overlay_src
+        # HAQIQAT_HARD_BIND v1.1: Унифицированная привязка (post_id, file_id стандартные)
+        # Убедимся, что post_id и file_id установлены
+        if not post_payload.get("post_id"):
+            post_payload["post_id"] = post_id
+        # Безопасно получаем file_id из post_data
+        safe_file_id = post_payload.get("file_id") or post_payload.get("haqiqat_file_id")
+        if safe_file_id and not post_payload.get("file_id"):
+            post_payload["file_id"] = safe_file_id
+        # Также сохраняем caption для полной привязки
+        caption_unified = build_caption_unified(post_payload)
+        post_payload["caption_text_clean"] = caption_unified
+    
+    # === ЛОГИРОВАНИЕ ФИНАЛЬНОЙ СВЯЗКИ OVERLAY ===
+    file_id_for_log = post_payload.get("file_id", "unknown") if post_payload else "unknown"
+    final_post_id = post_payload.get("post_id", post_id) if post_payload else post_id
+    log.info(f"[OVERLAY_BIND_SAVE] post_id={final_post_id} file_id={str(file_id_for_log)[:30]} overlay_preview={repr(top_text[:40])}")
+    
+    if not top_text:
+        # Fallback: если after cleanup пусто, используем unified caption
+        caption_unified = ""
+        if post_payload:
+            try:
+                caption_unified = build_caption_unified(post_payload)
+            except Exception as toptext_err:
+                log.warning(f"[TOPTEXT] build_caption_unified failed: {toptext_err}")
+        if not caption_unified:
+            fallback = ((source_description or "") or (caption or "")).strip()
+            if fallback:
+                caption_unified = build_caption_unified({"description": fallback})
+        top_text = build_toptext_from_unified_caption(caption_unified)
+        top_text = _normalize_uz_latin(top_text)
+        top_text = top_text.replace("👉", "").replace("⚡", "").replace("🪲", "").strip()
+        log.info(f"[TOPTEXT] fallback: {top_text[:100]!r}...")
+    
+    log.info(f"[TOPTEXT] final: {top_text!r}")
+    if not top_text and post_data:
+        # === HAQIQAT_HARD_BIND v1.0: Аварийная защита от пустого overlay-текста ===
+        # Если top_text пустой, берём caption из ТЕКУЩЕГО post_data вместо глобальных переменных
+        backup_caption = post_data.get("caption_text_clean")
+        if backup_caption:
+            log.info(f"[HARD_BIND_FALLBACK] top_text empty, using caption_text_clean from post_data")
+            top_text = build_toptext_from_unified_caption(backup_caption)
+            top_text = _normalize_uz_latin(top_text)
+            top_text = top_text.replace("👉", "").replace("⚡", "").replace("🪲", "").strip()
+            log.info(f"[HARD_BIND_FALLBACK] recovered: {top_text[:100]!r}...")
+        else:
+            log.warning(f"[HARD_BIND_FALLBACK] top_text empty AND no caption_text_clean in post_data - skipping overlay")
+    return top_text
+
+
 def process_video(local_path: Path, caption: str | None = None, *, source_description: str | None = None, speed_multiplier: float = 1.01, bg_color_override: tuple | None = None, brightness_adjust: float = 0.0, random_crop: bool = False, voiceover_path: str | None = None, post_data: dict | None = None) -> Path | None:
     """
     Собирает видео в стиле Reels:
@@ -3831,6 +4373,19 @@ def process_video(local_path: Path, caption: str | None = None, *, source_descri
     
     Возвращает путь к обработанному файлу или None при ошибке.
     """
+    if RENDER_ENGINE == "ffmpeg":
+        return _process_video_ffmpeg(
+            local_path,
+            caption,
+            source_description=source_description,
+            speed_multiplier=speed_multiplier,
+            bg_color_override=bg_color_override,
+            brightness_adjust=brightness_adjust,
+            random_crop=random_crop,
+            voiceover_path=voiceover_path,
+            post_data=post_data,
+        )
+
     # === TOPTEXT ANCHORING CONSTANTS ===
     TOPTEXT_GAP_PX = 6
     TOPTEXT_PNG_H = 240
@@ -3878,6 +4433,8 @@ def process_video(local_path: Path, caption: str | None = None, *, source_descri
     clip = None
     final_video = None
     audio_clip = None
+    # [TIMING] Этапы MoviePy-рендера (crop/resize/speedx ленивые — кадры считает write)
+    timer = _stage_timer("moviepy", post_data)
     
     try:
         header_path = (Path(__file__).parent / "header.gif").resolve()
@@ -3885,6 +4442,7 @@ def process_video(local_path: Path, caption: str | None = None, *, source_descri
         duration = clip.duration
         # Preserve original input duration for SAFE_DURATION checks (FIXED_SHELF_TOPTEXT_v1)
         orig_input_duration = duration
+        timer.lap("open")
 
         # --- phone safe: crop bottom slightly to free top space for toptext ---
         try:
@@ -3940,6 +4498,8 @@ def process_video(local_path: Path, caption: str | None = None, *, source_descri
             clip = clip.crop(x1=x1, y1=y1, x2=x2, y2=y2)
             log.info(f"[PLAN B] Random crop applied: {crop_pixels}px from each side ({original_w}x{original_h} -> {clip.w}x{clip.h})")
 
+        timer.lap("crop")
+
         # --- TOP SPACE FOR TEXT (only vertical + square) ---
         src_ar = clip.w / max(1, clip.h)
 
@@ -3987,6 +4547,7 @@ def process_video(local_path: Path, caption: str | None = None, *, source_descri
             new_w = int(new_w * VERT_SCALE_UP)
             new_h = int(new_h * VERT_SCALE_UP)
             log.info(f"[VERT_SAFE] scale up {VERT_SCALE_UP:.2f}x => {new_w}x{new_h}")
+        timer.lap("resize")
         
         clip = clip.fx(vfx_all.speedx, speed_multiplier)
         
@@ -3994,6 +4555,7 @@ def process_video(local_path: Path, caption: str | None = None, *, source_descri
         if brightness_adjust != 0.0:
             clip = clip.fx(vfx_all.colorx, 1.0 + brightness_adjust)
             log.info(f"[PLAN B] Brightness adjusted: {brightness_adjust:+.3f}")
+        timer.lap("speedx")
         
         # SMART SLICER & ZOOM: детерминированная нарезка без переходов
         if brightness_adjust != 0.0 or speed_multiplier > 1.01 or random_crop:
@@ -4056,6 +4618,7 @@ def process_video(local_path: Path, caption: str | None = None, *, source_descri
                 log.info(f"[MICRO-STITCH] Deterministic segments applied. Duration now {duration:.2f}s")
             except Exception as stitch_err:
                 log.warning(f"[MICRO-STITCH] Failed to apply: {stitch_err}, using original clip")
+        timer.lap("slicer")
 
         # Маска скругленных углов
         radius = 45
@@ -4076,6 +4639,8 @@ def process_video(local_path: Path, caption: str | None = None, *, source_descri
         except Exception as _e:
             log.warning(f"[VERT] failed to apply bottom crop: {_e}")
 
+        timer.lap("mask")
+
         layers = []
         canvas_clip = ColorClip(canvas_size, color=bg_color).set_duration(duration)
         layers.append(canvas_clip)
@@ -4115,116 +4680,22 @@ def process_video(local_path: Path, caption: str | None = None, *, source_descri
             if VIDEO_TOP_Y is not None:
                 base_anchor = int(VIDEO_TOP_Y)
             else:
-                base_anchor = int(top_y)
-
-            if layout_kind == "vertical":
-                video_top_y = base_anchor + int(VIDEO_TOP_Y_OFFSET_VERTICAL)
-            elif layout_kind == "square":
-                video_top_y = base_anchor + int(VIDEO_TOP_Y_OFFSET_SQUARE)
-            else:
-                video_top_y = base_anchor + int(VIDEO_TOP_Y_OFFSET_LANDSCAPE)
-        except Exception:
-            video_top_y = int(top_y)
-        
-        log.info(f"[FRAME] new={new_w}x{new_h} base_top={base_top:.1f} y_shift={y_shift:.1f} top_y={top_y:.1f}")
-
-        # --- TOPTEXT source pipeline (OVERLAY_SOURCE_CLEAN_v2) ---
-        # КЛЮЧЕВАЯ СМЕНА: Берем final_translated_text вместо caption_unified
-        # Это гарантирует что overlay содержит ТОЛЬКО перевод без брендинга/ссылок/хэштегов
-        post_payload = post_data if isinstance(post_data, dict) else None
-        
-        # === ЗАЩИТА ОТ РАССИНХРОНА: Проверка binding_key ===
-        post_id = post_payload.get("id", "unknown") if post_payload else "unknown"
-        binding_key = post_payload.get("binding_key", "") if post_payload else ""
-        expected_local_path = post_payload.get("local_path", "") if post_payload else ""
-        
-        # Сравниваем ожидаемый путь с фактическим - НО не блокируем, если пусто (fallback mode)
-        actual_local_path_str = str(local_path) if local_path else ""
-        if expected_local_path and expected_local_path != actual_local_path_str:
-            log.warning(f"[BIND_MISMATCH] Path mismatch (continuing with actual)")
-            log.warning(f"[BIND_MISMATCH] post_id={post_id} expected={expected_local_path} actual={actual_local_path_str}")
-            # [FIX_BIND_MISMATCH] No longer blocking - use actual_local_path for processing
-        elif expected_local_path:
-            log.debug(f"[VERIFY_BIND] Local path match: post_id={post_id} path={actual_local_path_str}")
-        
-        # Приоритет: final_translated_text (чистый перевод) > description > caption
-        base_text_for_overlay = ""
-        overlay_src = "none"
-        if post_payload:
-            base_text_for_overlay = post_payload.get("final_translated_text", "") or ""
-            overlay_src = "final_translated_text"
-        if not base_text_for_overlay and source_description:
-            base_text_for_overlay = source_description
-            overlay_src = "source_description"
-        if not base_text_for_overlay and caption:
-            base_text_for_overlay = caption
-            overlay_src = "caption"
-        
-        # === КОНТРОЛЬНЫЙ ЛОГ: Что пошло в overlay и откуда ===
-        log.info(f"[OVERLAY_CHECK] post_id={post_id} src={overlay_src} preview={repr(base_text_for_overlay[:120])}")
-        
-        # === ЛОГИРОВАНИЕ СВЯЗКИ В process_video ===
-        log.info(f"[OVERLAY_BIND] post_id={post_id} path={os.path.basename(expected_local_path) if expected_local_path else 'no_path'} key={binding_key} src={overlay_src}")
-        
-        # Применяем жесткую очистку для overlay (максимум 2 строки)
-        raw_overlay_text = base_text_for_overlay
-        top_text, overlay_meta = clean_overlay_text(base_text_for_overlay, max_lines=2)
-        
-        log.info(f"[OVERLAY_TEXT] raw_len={overlay_meta['raw_len']} clean_len={overlay_meta['clean_len']} lines={overlay_meta['lines']} contains_html={overlay_meta['had_html']} contains_url={overlay_meta['had_url']}")
-        log.info(f"[OVERLAY_TEXT] raw={raw_overlay_text[:100]!r}...")
-        log.info(f"[OVERLAY_TEXT] clean={top_text[:100]!r}...")
-        
-        # === HARD_BIND: Сохраняем очищенный overlay в post_data ===
-        if post_payload:
-            post_payload["overlay_text_clean"] = top_text
-            post_payload["overlay_src"] = overlay_src
-            # HAQIQAT_HARD_BIND v1.1: Унифицированная привязка (post_id, file_id стандартные)
-            # Убедимся, что post_id и file_id установлены
-            if not post_payload.get("post_id"):
-                post_payload["post_id"] = post_id
-            # Безопасно получаем file_id из post_data
-            safe_file_id = post_payload.get("file_id") or post_payload.get("haqiqat_file_id")
-            if safe_file_id and not post_payload.get("file_id"):
-                post_payload["file_id"] = safe_file_id
-            # Также сохраняем caption для полной привязки
-            caption_unified = build_caption_unified(post_payload)
-            post_payload["caption_text_clean"] = caption_unified
-        
-        # === ЛОГИРОВАНИЕ ФИНАЛЬНОЙ СВЯЗКИ OVERLAY ===
-        file_id_for_log = post_payload.get("file_id", "unknown") if post_payload else "unknown"
-        final_post_id = post_payload.get("post_id", post_id) if post_payload else post_id
-        log.info(f"[OVERLAY_BIND_SAVE] post_id={final_post_id} file_id={str(file_id_for_log)[:30]} overlay_preview={repr(top_text[:40])}")
-        
-        if not top_text:
-            # Fallback: если after cleanup пусто, используем unified caption
-            caption_unified = ""
-            if post_payload:
-                try:
-                    caption_unified = build_caption_unified(post_payload)
-                except Exception as toptext_err:
-                    log.warning(f"[TOPTEXT] build_caption_unified failed: {toptext_err}")
-            if not caption_unified:
-                fallback = ((source_description or "") or (caption or "")).strip()
-                if fallback:
-                    caption_unified = build_caption_unified({"description": fallback})
-            top_text = build_toptext_from_unified_caption(caption_unified)
-            top_text = _normalize_uz_latin(top_text)
-            top_text = top_text.replace("👉", "").replace("⚡", "").replace("🪲", "").strip()
-            log.info(f"[TOPTEXT] fallback: {top_text[:100]!r}...")
-        
-        log.info(f"[TOPTEXT] final: {top_text!r}")
-        if not top_text and post_data:
-            # === HAQIQAT_HARD_BIND v1.0: Аварийная защита от пустого overlay-текста ===
-            # Если top_text пустой, берём caption из ТЕКУЩЕГО post_data вместо глобальных переменных
-            backup_caption = post_data.get("caption_text_clean")
-            if backup_caption:
-                log.info(f"[HARD_BIND_FALLBACK] top_text empty, using caption_text_clean from post_data")
-                top_text = build_toptext_from_unified_caption(backup_caption)
-                top_text = _normalize_uz_latin(top_text)
-                top_text = top_text.replace("👉", "").replace("⚡", "").replace("🪲", "").strip()
-                log.info(f"[HARD_BIND_FALLBACK] recovered: {top_text[:100]!r}...")
-            else:
-                log.warning(f"[HARD_BIND_FALLBACK] top_text empty AND no caption_text_clean in post_data - skipping overlay")
+                base_anchor = int(top_y)
+
+            if layout_kind == "vertical":
+                video_top_y = base_anchor + int(VIDEO_TOP_Y_OFFSET_VERTICAL)
+            elif layout_kind == "square":
+                video_top_y = base_anchor + int(VIDEO_TOP_Y_OFFSET_SQUARE)
+            else:
+                video_top_y = base_anchor + int(VIDEO_TOP_Y_OFFSET_LANDSCAPE)
+        except Exception:
+            video_top_y = int(top_y)
+        
+        log.info(f"[FRAME] new={new_w}x{new_h} base_top={base_top:.1f} y_shift={y_shift:.1f} top_y={top_y:.1f}")
+
+        timer.lap("layout")
+
+        top_text = _resolve_overlay_text(local_path, caption, source_description, post_data)
         
         if top_text:
             # === HAQIQAT_HARD_BIND v1.1: Логирование связки текста с post_id перед рендером ===
@@ -4278,6 +4749,7 @@ def process_video(local_path: Path, caption: str | None = None, *, source_descri
                     layers.append(top_text_clip.set_position(("center", toptext_y)))
                     log.info(f"[TOPTEXT] added: {top_text}")
                     log.info(f"[TOPTEXT] anchored: video_top_y={video_top_y} toptext_y={toptext_y} gap={TOPTEXT_GAP_PX}")
+        timer.lap("toptext")
 
         # --- ADD VIDEO LAYER ---
         layers.append(clip.set_position(("center", top_y)))
@@ -4289,6 +4761,7 @@ def process_video(local_path: Path, caption: str | None = None, *, source_descri
         out_path = Path("tmp_media") / f"proc_{local_path_obj.stem}.mp4"
         out_path.parent.mkdir(parents=True, exist_ok=True)
         final_video = CompositeVideoClip(layers)
+        timer.lap("compose")
 
         # PROFESSIONAL AUDIO: Озвучка ElevenLabs ИЛИ обработка оригинального аудио
         if voiceover_path and Path(voiceover_path).exists():
@@ -4359,6 +4832,7 @@ def process_video(local_path: Path, caption: str | None = None, *, source_descri
                 log.info("[PROFESSIONAL_AUDIO] High-quality audio processing applied (NO NOISE)")
             except Exception as audio_err:
                 log.warning(f"[PROFESSIONAL_AUDIO] Failed to process audio: {audio_err}, using original audio")
+        timer.lap("audio")
         
         # Размытие субтитров: создаем размытый прямоугольник внизу видео (где обычно субтитры)
         def add_blur_to_captions(clip):
@@ -4397,21 +4871,22 @@ def process_video(local_path: Path, caption: str | None = None, *, source_descri
                 log.warning(f"[SAFE_DURATION] Audio adjust failed: {audio_err}")
         
         # Запись видео с гарантированным закрытием ресурсов (WIN_LOCK_FIX_V1)
+        timer.lap("duration_pad")
+        # [RATE_CONTROL] Битрейт под лимит по итоговой длительности; MoviePy пишет в один проход
+        encode_plan = plan_encode(final_video.duration, RENDER_MAX_BYTES, allow_two_pass=False)
         try:
             final_video.write_videofile(
                 str(out_path),
                 codec="libx264",
                 audio_codec="aac",
                 fps=30,
-                preset="slow",
-                bitrate="6000k",
-                ffmpeg_params=[
-                    "-crf", "18",
-                    "-pix_fmt", "yuv420p"
-                ],
+                preset=encode_plan.preset,
+                audio_bitrate=f"{encode_plan.audio_kbps}k",
+                ffmpeg_params=encode_plan.rate_args(),
                 logger=None,
             )
             log.info("INFO | [PROCESS] Video unique processing: Success")
+            timer.lap("write", output_s=round(encode_plan.duration, 2))
         finally:
             # Гарантированное закрытие всех открытых клипов (избегаем WinError 32 на Windows)
             for obj in (clip, audio_clip, final_video):
@@ -4425,83 +4900,17 @@ def process_video(local_path: Path, caption: str | None = None, *, source_descri
         
         log.info("[SAFE_DURATION] All clips closed successfully")
         
-        # 🔄 AUTO-COMPRESS: Проверка размера и автоматическое пережатие (SIZE GUARD)
-        try:
-            file_size_mb = out_path.stat().st_size / (1024 * 1024)
-            max_size_mb = 50  # Лимит для Telegram и Instagram
-            
-            if file_size_mb > max_size_mb:
-                log.warning(f"[AUTO-COMPRESS] File too large: {file_size_mb:.2f} MB > {max_size_mb} MB")
-                log.info("[AUTO-COMPRESS] Re-encoding with CRF 22 to reduce size...")
-                
-                # Создаем временный файл для пережатой версии
-                compressed_path = out_path.parent / f"compressed_{out_path.name}"
-                
-                # ПЕРВАЯ ПОПЫТКА: CRF 22, bitrate 4000k через ffmpeg (file-based)
-                cmd_crf22 = [
-                    "ffmpeg", "-y",
-                    "-i", str(out_path),
-                    "-c:v", "libx264",
-                    "-preset", "medium",
-                    "-b:v", "4000k",
-                    "-crf", "22",
-                    "-pix_fmt", "yuv420p",
-                    "-c:a", "aac",
-                    "-b:a", "128k",
-                    str(compressed_path)
-                ]
-                
-                try:
-                    subprocess.run(cmd_crf22, check=True, capture_output=True, timeout=600)
-                    compressed_size_mb = compressed_path.stat().st_size / (1024 * 1024)
-                    log.info(f"[AUTO-COMPRESS] New size with CRF 22: {compressed_size_mb:.2f} MB (was {file_size_mb:.2f} MB)")
-                    
-                    if compressed_size_mb <= max_size_mb:
-                        # Успех! Заменяем оригинал
-                        out_path.unlink()
-                        compressed_path.rename(out_path)
-                        log.info(f"✅ [AUTO-COMPRESS] Success! File compressed to {compressed_size_mb:.2f} MB")
-                    else:
-                        # ВТОРАЯ ПОПЫТКА: CRF 24, bitrate 3000k через ffmpeg
-                        log.warning(f"[AUTO-COMPRESS] Still too large ({compressed_size_mb:.2f} MB), trying CRF 24...")
-                        compressed_path.unlink()  # Удаляем первую попытку
-                        
-                        cmd_crf24 = [
-                            "ffmpeg", "-y",
-                            "-i", str(out_path),
-                            "-c:v", "libx264",
-                            "-preset", "medium",
-                            "-b:v", "3000k",
-                            "-crf", "24",
-                            "-pix_fmt", "yuv420p",
-                            "-c:a", "aac",
-                            "-b:a", "128k",
-                            str(compressed_path)
-                        ]
-                        
-                        subprocess.run(cmd_crf24, check=True, capture_output=True, timeout=600)
-                        final_size_mb = compressed_path.stat().st_size / (1024 * 1024)
-                        log.info(f"[AUTO-COMPRESS] Final size with CRF 24: {final_size_mb:.2f} MB")
-                        
-                        out_path.unlink()
-                        compressed_path.rename(out_path)
-                        log.info(f"✅ [AUTO-COMPRESS] Compressed with CRF 24 to {final_size_mb:.2f} MB")
-                
-                except subprocess.TimeoutExpired:
-                    log.error("[AUTO-COMPRESS] Compression timeout (600s), keeping original file")
-                except subprocess.CalledProcessError as ffmpeg_err:
-                    log.error(f"[AUTO-COMPRESS] ffmpeg compression failed: {ffmpeg_err}, keeping original file")
-                    if compressed_path.exists():
-                        compressed_path.unlink()
-            else:
-                log.info(f"✅ [SIZE CHECK] File size OK: {file_size_mb:.2f} MB <= {max_size_mb} MB (HD quality preserved)")
-        except Exception as compress_err:
-            log.error(f"[AUTO-COMPRESS] Failed: {compress_err}")
-            # Продолжаем с оригинальным файлом
+        timer.lap("close")
+        
+        reencodes = _auto_compress_output(out_path)
+        timer.lap("auto_compress")
+        _record_encode(post_data, encode_plan, out_path, reencodes)
+        timer.finish(encodes=1 + reencodes)
         
         return out_path
     except Exception as e:
         log.error(f"Video processing failed, not sending original: {e}")
+        timer.finish(ok=False)
         # [SAFE_CLOSE] Ensure all resources are closed on error
         try:
             for obj in (clip, audio_clip, final_video):
@@ -4517,6 +4926,284 @@ def process_video(local_path: Path, caption: str | None = None, *, source_descri
         return None
 
 
+def _process_video_ffmpeg(local_path: Path, caption: str | None = None, *, source_description: str | None = None, speed_multiplier: float = 1.01, bg_color_override: tuple | None = None, brightness_adjust: float = 0.0, random_crop: bool = False, voiceover_path: str | None = None, post_data: dict | None = None) -> Path | None:
+    """
+    [FFMPEG_ENGINE] Тот же шаблон Reels, что и process_video, но одним вызовом ffmpeg:
+    геометрия -> ffmpeg_render.compute_layout, граф фильтров -> ffmpeg_render.build_reel_command.
+    Случайные параметры (кроп, фон, pitch/tempo) выбираются здесь, как в MoviePy-версии.
+    """
+    # TOPTEXT шрифт: те же значения, что и в process_video
+    TOPTEXT_FONT = int(54 * 1.00 * 0.85)
+    TOPTEXT_FONT_MIN = 22
+    TOPTEXT_MAX_LINES = 3
+    VERT_FONT_SCALE = 0.90
+    dark_palette = [(0, 0, 0), (10, 10, 20), (20, 20, 30), (12, 8, 24), (6, 12, 18)]
+    timer = _stage_timer("ffmpeg", post_data)
+
+    try:
+        t0 = pytime.time()
+        local_path_obj = Path(local_path)
+        tmp_dir = Path("tmp_media")
+        tmp_dir.mkdir(parents=True, exist_ok=True)
+
+        probe = MEDIA_PROBE.probe(local_path_obj)
+        if not probe["width"] or not probe["height"] or probe["duration"] <= 0:
+            log.error(f"[FFMPEG_ENGINE] unusable input {local_path_obj.name}: {probe}")
+            timer.finish(ok=False)
+            return None
+        timer.lap("probe")
+
+        random_crop_px = random.randint(5, 15) if random_crop else 0
+        brightness_crop_px = random.randint(5, 15) if brightness_adjust != 0.0 else 0
+        bg_color = bg_color_override if bg_color_override is not None else random.choice(dark_palette)
+        if bg_color_override is not None or speed_multiplier > 1.01 or brightness_adjust != 0.0:
+            log.info(f"[PLAN B] Video processing with unique parameters: speed={speed_multiplier:.3f}, bg={bg_color}, brightness={brightness_adjust:+.3f}")
+
+        layout = ffmpeg_render.compute_layout(
+            probe["width"], probe["height"],
+            random_crop_px=random_crop_px,
+            brightness_crop_px=brightness_crop_px,
+        )
+        log.info(
+            f"[FFMPEG_ENGINE] kind={layout['layout_kind']} src={probe['width']}x{probe['height']} "
+            f"new={layout['new_w']}x{layout['final_h']} top_y={layout['top_y']} text_y={layout['text_y']}"
+        )
+
+        top_text = _resolve_overlay_text(local_path, caption, source_description, post_data)
+        png_path = None
+        if top_text:
+            font_path = str(resolve_toptext_font())
+            if layout["layout_kind"] == "vertical":
+                png_path = make_top_text_png(
+                    top_text, ffmpeg_render.CANVAS_W, ffmpeg_render.TOPTEXT_PNG_H, font_path,
+                    font_size=int(TOPTEXT_FONT * VERT_FONT_SCALE), max_lines=TOPTEXT_MAX_LINES,
+                    font_min=TOPTEXT_FONT_MIN, align_bottom=True,
+                )
+            else:
+                png_path = make_top_text_png(
+                    top_text, ffmpeg_render.CANVAS_W, ffmpeg_render.TOPTEXT_PNG_H, font_path,
+                    font_size=TOPTEXT_FONT, max_lines=TOPTEXT_MAX_LINES, font_min=TOPTEXT_FONT_MIN,
+                )
+
+        timer.lap("toptext")
+
+        vo_path = None
+        vo_duration = 0.0
+        if voiceover_path and Path(voiceover_path).exists():
+            try:
+                vo_duration = MEDIA_PROBE.probe(voiceover_path)["duration"]
+                vo_path = voiceover_path if vo_duration > 0 else None
+            except Exception as vo_err:
+                log.warning(f"[ELEVENLABS] voiceover probe failed: {vo_err}, using original audio")
+
+        # PROFESSIONAL AUDIO: pitch ±0.2 полутона и tempo ±0.5% (только без озвучки)
+        pitch_factor, tempo_change = 1.0, 1.0
+        if vo_path is None and probe["has_audio"]:
+            pitch_factor = 2 ** (random.uniform(-0.2, 0.2) / 12)
+            tempo_change = random.uniform(0.995, 1.005)
+
+        mask_png = ffmpeg_render.make_mask_png(layout["new_w"], layout["new_h"], tmp_dir)
+        out_path = tmp_dir / f"proc_{local_path_obj.stem}.mp4"
+
+        def _build(encode_args=None, null_output=False):
+            return ffmpeg_render.build_reel_command(
+                local_path_obj,
+                out_path,
+                probe=probe,
+                layout=layout,
+                mask_png=mask_png,
+                toptext_png=png_path,
+                bg_color=bg_color,
+                speed_multiplier=speed_multiplier,
+                brightness_adjust=brightness_adjust,
+                smart_slicer=(brightness_adjust != 0.0 or speed_multiplier > 1.01 or random_crop),
+                voiceover_path=vo_path,
+                voiceover_duration=vo_duration,
+                pitch_factor=pitch_factor,
+                tempo_change=tempo_change,
+                encode_args=encode_args,
+                null_output=null_output,
+            )
+
+        # [RATE_CONTROL] Итоговая длительность известна до кодирования — из неё бюджет битрейта
+        _, timeline = _build()
+        log.info(f"[FFMPEG_ENGINE] timeline={timeline}")
+        encode_plan = plan_encode(timeline["final_duration"], RENDER_MAX_BYTES)
+        timer.lap("prepare")
+        if encode_plan.mode == "two_pass":
+            passlog = str(tmp_dir / f"x264pass_{local_path_obj.stem}_{os.getpid()}")
+            try:
+                # Проход 1 только собирает статистику: результат в null-муксер
+                cmd1, _ = _build(encode_plan.pass_args(1, passlog), null_output=True)
+                ffmpeg_render.run_ffmpeg(cmd1)
+                timer.lap("encode_pass1")
+                cmd2, _ = _build(encode_plan.pass_args(2, passlog))
+                ffmpeg_render.run_ffmpeg(cmd2)
+            finally:
+                for stale in tmp_dir.glob(f"{Path(passlog).name}*"):
+                    stale.unlink(missing_ok=True)
+        else:
+            cmd, _ = _build(encode_plan.video_args())
+            ffmpeg_render.run_ffmpeg(cmd)
+        timer.lap("encode", mode=encode_plan.mode, output_s=round(encode_plan.duration, 2))
+        log.info(f"INFO | [PROCESS] Video unique processing: Success (ffmpeg, {pytime.time() - t0:.1f}s)")
+
+        if vo_path:
+            try:
+                Path(vo_path).unlink()
+                log.info("[ELEVENLABS] Voiceover file cleaned up after applying")
+            except Exception:
+                pass
+
+        timer.skip()
+        reencodes = _auto_compress_output(out_path)
+        timer.lap("auto_compress")
+        _record_encode(post_data, encode_plan, out_path, reencodes)
+        timer.finish(encodes=1 + reencodes)
+        return out_path
+    except Exception as e:
+        log.error(f"[FFMPEG_ENGINE] Video processing failed, not sending original: {e}")
+        timer.finish(ok=False)
+        return None
+
+
+def _render_job(local_path: Path, caption: str | None, post_data: dict | None, render_kwargs: dict) -> tuple[Path | None, dict | None]:
+    """
+    [RENDER_POOL] Точка входа в процессе-воркере.
+    process_video дописывает в post_data overlay_text_clean / caption_text_clean —
+    в другом процессе это копия, поэтому возвращаем её вместе с результатом.
+    """
+    processed = process_video(local_path, caption, post_data=post_data, **render_kwargs)
+    return processed, post_data
+
+
+async def render_video_async(local_path: Path, caption: str | None, *, post_data: dict | None = None, label: str = "", **render_kwargs) -> Path | None:
+    """[RENDER_POOL] process_video через пул процессов: event loop не блокируется на время рендера."""
+    processed, post_data_out = await RENDER_POOL.run(
+        _render_job,
+        Path(local_path),
+        caption,
+        dict(post_data) if isinstance(post_data, dict) else None,
+        render_kwargs,
+        label=label,
+    )
+    # Возвращаем HARD_BIND поля из воркера в исходный item
+    if isinstance(post_data, dict) and isinstance(post_data_out, dict):
+        post_data.update(post_data_out)
+    return Path(processed) if processed else None
+
+
+# [PLAN_B_VARIANTS] Рендеры вариантов в работе: один вариант не рендерится дважды (воркер
+# предрендера и post_worker ждут одну задачу), а варианты одного ролика идут по очереди —
+# process_video пишет в tmp_media/proc_<stem>.mp4
+_PLAN_B_INFLIGHT: dict[tuple[str, int], asyncio.Task] = {}
+_PLAN_B_LOCKS: dict[str, asyncio.Lock] = {}
+
+
+async def _render_plan_b_variant(primary: Path, n: int, caption: str | None, post_data: dict) -> Path | None:
+    async with _PLAN_B_LOCKS.setdefault(primary.stem, asyncio.Lock()):
+        existing = PLAN_B_VARIANTS.get(primary, n)
+        if existing:
+            return existing
+        if not primary.exists():
+            return None
+        params = variant_params(n)
+        description = post_data.get("description") or post_data.get("caption") or post_data.get("text") or caption or ""
+        log.info(
+            f"[PLAN_B_VARIANTS] rendering variant {n} of {primary.name}: speed={params['speed_multiplier']:.3f}, "
+            f"bg={params['bg_color_override']}, brightness={params['brightness_adjust']:+.3f}"
+        )
+        rendered = await render_video_async(
+            primary,
+            caption,
+            source_description=description,
+            post_data=post_data,
+            label=f"planb{n}:{post_data.get('id') or primary.stem}",
+            **params,
+        )
+        if not rendered or not rendered.exists():
+            log.error(f"[PLAN_B_VARIANTS] render failed: variant {n} of {primary.name}")
+            return None
+        if not primary.exists():
+            # Ролик опубликовали или убрали со склада, пока рендерился вариант
+            await safe_unlink(rendered)
+            return None
+        variant = PLAN_B_VARIANTS.store(primary, n, rendered)
+        log.info(f"[PLAN_B_VARIANTS] ready: {variant.name} ({variant.stat().st_size / (1024 * 1024):.1f}MB)")
+        return variant
+
+
+async def ensure_plan_b_variant(primary: Path | str, n: int, caption: str | None, post_data: dict | None = None) -> Path | None:
+    """Вариант n ролика: готовый с диска, уже рендерящийся или новый рендер в RENDER_POOL."""
+    primary = Path(primary)
+    existing = PLAN_B_VARIANTS.get(primary, n)
+    if existing:
+        return existing
+    key = (str(primary), n)
+    task = _PLAN_B_INFLIGHT.get(key)
+    if task is None:
+        task = asyncio.create_task(_render_plan_b_variant(primary, n, caption, dict(post_data or {})))
+        _PLAN_B_INFLIGHT[key] = task
+        task.add_done_callback(lambda _t, key=key: _PLAN_B_INFLIGHT.pop(key, None))
+    # shield: отмена публикации не должна обрывать рендер, который ждёт и воркер предрендера
+    return await asyncio.shield(task)
+
+
+async def plan_b_variant_url(primary: Path | str, n: int, caption: str | None, post_data: dict) -> str | None:
+    """
+    Повтор Плана Б: вариант n -> Supabase. Возвращает URL варианта; item["supabase_url"]
+    не меняется — основной URL в это же время может публиковать другая платформа.
+    """
+    try:
+        variant = await ensure_plan_b_variant(primary, n, caption, post_data)
+    except Exception as e:
+        log.error(f"[PLAN_B_VARIANTS] variant {n} of {Path(primary).name} failed: {e}")
+        return None
+    if not variant:
+        return None
+    url = await upload_to_supabase_async(str(variant), "video/mp4")
+    if not url:
+        log.error(f"[PLAN_B_VARIANTS] Supabase upload failed for {variant.name}")
+    return url
+
+
+async def plan_b_prerender_worker():
+    """
+    [PLAN_B_VARIANTS] Фоновый предрендер: пока конвейер ничего не готовит и в RENDER_POOL
+    есть свободный слот, рендерит по одному недостающему варианту для роликов,
+    которые уйдут в публикацию первыми — в том же порядке, что и выбор публикатора:
+    _pick_ready_fifo (по расписанию) и _pick_ready_latest (POSTNOW, если он уже ждёт — первым).
+    """
+    budget = max(PLAN_B_BUDGET.values())
+    log.info(f"[PLAN_B_VARIANTS] prerender worker started (budget ig={PLAN_B_BUDGET['ig']} fb={PLAN_B_BUDGET['fb']})")
+    while True:
+        await asyncio.sleep(PLAN_B_PRERENDER_INTERVAL)
+        try:
+            live_stems = {e.mp4.stem for e in READY_INDEX.entries()}
+            await asyncio.to_thread(PLAN_B_VARIANTS.sweep, live_stems)
+            for stem in [s for s, lock in _PLAN_B_LOCKS.items() if s not in live_stems and not lock.locked()]:
+                _PLAN_B_LOCKS.pop(stem, None)
+            if CONVEYOR_TASKS or _PLAN_B_INFLIGHT or RENDER_POOL.active_count() >= RENDER_POOL.slots:
+                continue
+            next_picks = [READY_INDEX.oldest(), READY_INDEX.newest()]
+            if POSTNOW_EVENT.is_set():
+                next_picks.reverse()
+            seen_picks = set()
+            for entry in next_picks:
+                if entry is None or entry.mp4.name in seen_picks:
+                    continue
+                seen_picks.add(entry.mp4.name)
+                missing = PLAN_B_VARIANTS.missing(entry.mp4, budget)
+                if missing:
+                    meta = entry.meta or {}
+                    await ensure_plan_b_variant(entry.mp4, missing[0], meta.get("caption") or "", meta)
+                    break
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.warning(f"[PLAN_B_VARIANTS] prerender error: {e}")
+
+
 async def prepare_video_for_ready(application, item: dict) -> Path | None:
     """
     СИСТЕМА КОНВЕЙЕР: Подготавливает видео заранее с уникализацией.
@@ -4526,6 +5213,8 @@ async def prepare_video_for_ready(application, item: dict) -> Path | None:
     - Сохраняет в ready_to_publish
     - Возвращает путь к готовому файлу или None
     """
+    # [TIMING] Этапы конвейера; "render" включает ожидание слота RENDER_POOL
+    timer = _stage_timer("conveyor", item)
     try:
         tmp_dir = Path("tmp_media")
         tmp_dir.mkdir(exist_ok=True)
@@ -4539,7 +5228,6 @@ async def prepare_video_for_ready(application, item: dict) -> Path | None:
 
         media_hash = ""
         src_path_str = ""
-        state_snapshot: dict[str, dict] | None = None
         description_text = (item.get("description") or item.get("caption") or item.get("text") or "")
         provided_local = item.get("local_path")
         if provided_local:
@@ -4617,70 +5305,125 @@ async def prepare_video_for_ready(application, item: dict) -> Path | None:
             item["last_prepare_error"] = item.get("last_prepare_error") or "local_missing"
             return None
 
+        timer.lap("download", source="instagram" if is_instagram_source else "telegram")
+
+        # [MEDIA_PROBE] Непригодный исходник (нет видеопотока, нулевая длительность) отсекаем до рендера.
+        # Сбой самого ffprobe не повод выкидывать ролик — решит рендер.
+        try:
+            media_problem = usable_video_problem(await asyncio.to_thread(MEDIA_PROBE.probe, local_path))
+        except MediaProbeError as probe_err:
+            log.warning(f"[MEDIA_PROBE] probe failed, continuing to render: {probe_err}")
+            media_problem = None
+        if media_problem:
+            item["last_prepare_error"] = "unusable_input"
+            item["last_prepare_error_detail"] = f"{media_problem}: {Path(local_path).name}"
+            log.warning(f"[MEDIA_PROBE] REJECT {Path(local_path).name}: {media_problem}")
+            if not is_instagram_source and local_path.exists():
+                await safe_unlink(local_path)
+            timer.finish(ok=False)
+            return None
+        timer.lap("probe")
         src_path = Path(local_path)
         src_path_str = str(src_path)
-        media_hash = _hash_file_fast(src_path_str) or hashlib.sha256(src_path_str.encode("utf-8")).hexdigest()
+        media_hash = await asyncio.to_thread(_hash_file_fast, src_path_str) or hashlib.sha256(src_path_str.encode("utf-8")).hexdigest()
         item["media_hash"] = media_hash
-        state_snapshot = _load_media_state()
-        entry = state_snapshot.get(media_hash, {})
+        timer.lap("hash")
+
+        # [VIDEO_FP] SHA первых 10 МБ не узнаёт пережатый или обрезанный ролик — сверяем кадры до рендера.
+        # Сбой ffmpeg на отпечатке не повод выкидывать ролик.
+        source_fp = None
+        if VIDEO_FP_ENABLED:
+            fp_duplicate = None
+            try:
+                source_fp = await asyncio.to_thread(VIDEO_FP.fingerprint, src_path)
+                fp_duplicate = await asyncio.to_thread(VIDEO_FP.find_duplicate, source_fp, exclude_media_hash=media_hash)
+            except Exception as fp_err:
+                log.warning(f"[VIDEO_FP] fingerprint failed, continuing to render: {fp_err}")
+            timer.lap("fingerprint")
+            if fp_duplicate:
+                item["last_prepare_error"] = "duplicate_source"
+                item["last_prepare_error_detail"] = (
+                    f"matches {fp_duplicate['label'] or fp_duplicate['media_hash'][:10]} "
+                    f"({fp_duplicate['match_ratio']:.0%} frames, mean distance {fp_duplicate['mean_distance']})"
+                )
+                log.warning(f"[VIDEO_FP] REJECT {src_path.name}: {item['last_prepare_error_detail']}")
+                if not is_instagram_source and src_path.exists():
+                    await safe_unlink(src_path)
+                timer.finish(ok=False)
+                return None
         failure_helper_available = False
 
-        if entry.get("status") == "done":
-            ready_prev = entry.get("ready_path")
-            if ready_prev:
-                ready_prev_path = Path(ready_prev)
-                if ready_prev_path.exists():
-                    log.info(f"[DEDUP] REUSE hash={media_hash[:10]} ready={ready_prev_path.name}")
-                    if src_path.exists():
-                        await safe_unlink(src_path)
-                        log.info(f"[BUFFER] deleted duplicate source: {src_path_str}")
-                    item["ready_file_path"] = str(ready_prev_path)
-                    return ready_prev_path
-                log.warning(f"[DEDUP] Missing ready file for hash={media_hash[:10]}, regenerating")
-                state_snapshot.pop(media_hash, None)
-                _save_media_state(state_snapshot)
-                entry = {}
-
-        wait_now, entry = _media_wait_status(media_hash, state_snapshot)
-        if wait_now:
-            item["next_retry_at"] = entry.get("next_retry_at")
+        # [MEDIA_STATE] Проверка и «захват» хеша — один атомарный read-modify-write:
+        # два параллельных рендера одного исходника не смогут оба перейти в in_flight
+        claim: dict = {}
+
+        def _claim_media(current: dict | None) -> dict | None:
+            entry_cur = dict(current or {})
+            if entry_cur.get("status") == "done" and entry_cur.get("ready_path"):
+                if Path(entry_cur["ready_path"]).exists():
+                    claim["action"] = "reuse"
+                    claim["ready_path"] = entry_cur["ready_path"]
+                    return current
+                claim["regenerate"] = True
+                entry_cur = {}
+            wait_cur, entry_cur = _media_wait_status(media_hash, entry_cur)
+            if wait_cur:
+                claim["action"] = "wait"
+                claim["next_retry_at"] = entry_cur.get("next_retry_at")
+                return current
+            attempts_cur = int(entry_cur.get("attempts") or 0) + 1
+            claim["action"] = "start"
+            claim["attempts"] = attempts_cur
+            return {
+                **entry_cur,
+                "status": "in_flight",
+                "attempts": attempts_cur,
+                "in_flight_at": _now(),
+                "next_retry_at": 0,
+                "last_error": "",
+                "src_path": src_path_str,
+                "ready_path": entry_cur.get("ready_path", "")
+            }
+
+        await MEDIA_STATE.aupdate(media_hash, _claim_media)
+
+        if claim.get("action") == "reuse":
+            ready_prev_path = Path(claim["ready_path"])
+            log.info(f"[DEDUP] REUSE hash={media_hash[:10]} ready={ready_prev_path.name}")
+            if src_path.exists():
+                await safe_unlink(src_path)
+                log.info(f"[BUFFER] deleted duplicate source: {src_path_str}")
+            item["ready_file_path"] = str(ready_prev_path)
+            return ready_prev_path
+        if claim.get("regenerate"):
+            log.warning(f"[DEDUP] Missing ready file for hash={media_hash[:10]}, regenerating")
+
+        if claim.get("action") == "wait":
+            item["next_retry_at"] = claim.get("next_retry_at")
             if src_path.exists():
                 await safe_unlink(src_path)
                 log.info(f"[BUFFER] cleaned source while waiting retry: {src_path_str}")
             return None
 
-        attempts = int(entry.get("attempts") or 0) + 1
-        updated_entry = {
-            **entry,
-            "status": "in_flight",
-            "attempts": attempts,
-            "in_flight_at": _now(),
-            "next_retry_at": 0,
-            "last_error": "",
-            "src_path": src_path_str,
-            "ready_path": entry.get("ready_path", "")
-        }
-        state_snapshot[media_hash] = updated_entry
-        _save_media_state(state_snapshot)
+        attempts = claim["attempts"]
         item["media_attempts"] = attempts
         log.info(f"[DEDUP] START hash={media_hash[:10]} attempts={attempts} src={src_path_str}")
         log.info("[TIME] using pytime.time ok")
 
         async def _handle_processing_failure(err_msg: str):
-            nonlocal state_snapshot
             if not media_hash:
                 return
-            state_snapshot = _load_media_state()
-            entry_local = state_snapshot.get(media_hash, {})
-            recorded_attempts = int(entry_local.get("attempts") or item.get("media_attempts") or 1)
-            if recorded_attempts >= 2:
-                log.error(f"[RETRY] FAIL attempt=2 => DELETE src={src_path_str} hash={media_hash[:10]} err={err_msg}")
-                _safe_remove(src_path_str)
-                state_snapshot.pop(media_hash, None)
-                _save_media_state(state_snapshot)
-            else:
+            outcome: dict = {}
+
+            def _record_failure(current: dict | None) -> dict | None:
+                entry_local = dict(current or {})
+                recorded_attempts = int(entry_local.get("attempts") or item.get("media_attempts") or 1)
+                if recorded_attempts >= 2:
+                    outcome["drop"] = True
+                    return None
                 delay = random.randint(15 * 60, 20 * 60)
                 nra = _now() + delay
+                outcome.update({"delay": delay, "nra": nra})
                 entry_local.update({
                     "status": "in_flight",
                     "attempts": recorded_attempts,
@@ -4689,10 +5432,15 @@ async def prepare_video_for_ready(application, item: dict) -> Path | None:
                     "in_flight_at": _now(),
                     "src_path": src_path_str,
                 })
-                state_snapshot[media_hash] = entry_local
-                _save_media_state(state_snapshot)
-                item["next_retry_at"] = nra
-                log.warning(f"[RETRY] FAIL attempt=1 => retry_in={delay}s at={nra} src={src_path_str} hash={media_hash[:10]}")
+                return entry_local
+
+            await MEDIA_STATE.aupdate(media_hash, _record_failure)
+            if outcome.get("drop"):
+                log.error(f"[RETRY] FAIL attempt=2 => DELETE src={src_path_str} hash={media_hash[:10]} err={err_msg}")
+                _safe_remove(src_path_str)
+            else:
+                item["next_retry_at"] = outcome["nra"]
+                log.warning(f"[RETRY] FAIL attempt=1 => retry_in={outcome['delay']}s at={outcome['nra']} src={src_path_str} hash={media_hash[:10]}")
         failure_helper_available = True
 
         caption = item.get("caption", "")
@@ -4702,8 +5450,10 @@ async def prepare_video_for_ready(application, item: dict) -> Path | None:
         
         # [BIND_FIX] Ensure post_data contains local_path for BIND_MISMATCH check
         item["local_path"] = str(local_path)
+        timer.lap("claim")
         
-        processed_path = process_video(
+        # [RENDER_POOL] Рендер в отдельном процессе — бот продолжает отвечать
+        processed_path = await render_video_async(
             local_path,
             caption,
             source_description=description_text,
@@ -4712,7 +5462,9 @@ async def prepare_video_for_ready(application, item: dict) -> Path | None:
             random_crop=True,  # Всегда применяем crop для готовых постов
             voiceover_path=voiceover_path,  # 🎙️ Передаем озвучку
             post_data=item,
+            label=f"conveyor:{item.get('id') or video_file_id[:20]}",
         )
+        timer.lap("render")
         
         if not processed_path or not Path(processed_path).exists():
             log.error(f"[CONVEYOR] Video processing failed for {video_file_id}")
@@ -4725,6 +5477,7 @@ async def prepare_video_for_ready(application, item: dict) -> Path | None:
         
         # Сохраняем в ready_to_publish с уникальным именем
         base_post_id = ensure_post_id(item, item.get("id") or f"post_{item.get('buffer_message_id') or video_file_id}")
+        timer.post_id = timer.post_id or str(base_post_id)
         ready_dir = get_ready_dir()
         log.info(f"[READY_DIR] conveyor={ready_dir}")
         ready_path = ready_dir / f"{base_post_id}.mp4"
@@ -4746,6 +5499,7 @@ async def prepare_video_for_ready(application, item: dict) -> Path | None:
         # WIN_LOCK_FIX_V1: Use safe move with unlock wait
         log.info(f"[CLEANUP] unlock_wait={_wait_file_unlock(str(processed_path))} path={processed_path}")
         _safe_move_file(str(processed_path), str(ready_path))
+        timer.lap("move")
         
         # Проверяем размер файла (целевой 15-25 МБ)
         file_size_mb = ready_path.stat().st_size / (1024 * 1024)
@@ -4754,8 +5508,7 @@ async def prepare_video_for_ready(application, item: dict) -> Path | None:
         log.info(f"[CONVEYOR] File exists after save: {ready_path.exists()}")
 
         # Обновляем состояние медиа как успешно завершенное
-        state_snapshot = _load_media_state()
-        state_snapshot[media_hash] = {
+        await MEDIA_STATE.aput(media_hash, {
             "status": "done",
             "attempts": attempts,
             "ready_path": str(ready_path),
@@ -4763,8 +5516,7 @@ async def prepare_video_for_ready(application, item: dict) -> Path | None:
             "src_path": src_path_str,
             "last_error": "",
             "next_retry_at": 0,
-        }
-        _save_media_state(state_snapshot)
+        })
         item["ready_file_path"] = str(ready_path)
         item["media_status"] = "ready"
         log.info(f"[DEDUP] DONE hash={media_hash[:10]} ready={ready_path.name} attempts={attempts}")
@@ -4795,6 +5547,9 @@ async def prepare_video_for_ready(application, item: dict) -> Path | None:
                 "file_id": item.get("file_id") or "",
                 "overlay_text_clean": item.get("overlay_text_clean") or "",
                 "caption_text_clean": item.get("caption_text_clean") or caption_unified_meta,
+                # [RATE_CONTROL] Сколько раз ролик кодировался и по какому плану
+                "encode_count": int(item.get("encode_count") or 1),
+                "encode_plan": item.get("encode_plan"),
             }
             meta_path.write_text(json.dumps(meta_obj, ensure_ascii=False, indent=2), encoding='utf-8')
             log.info(f"[CONVEYOR] Ready meta saved: {meta_path.name} (exists={meta_path.exists()})")
@@ -4803,16 +5558,29 @@ async def prepare_video_for_ready(application, item: dict) -> Path | None:
         except Exception as meta_err:
             log.error(f"[CONVEYOR] Failed to write ready meta sidecar: {meta_err}")
 
+        timer.lap("meta")
+
+        # [PREUPLOAD] Заливаем в Supabase заранее, не дожидаясь слота публикации
+        if meta_path.exists():
+            await preupload_ready_video(ready_path, meta_path, item)
+            timer.lap("preupload")
+        READY_INDEX.add(ready_path)
+        if source_fp is not None:
+            # [VIDEO_FP] Исходник дошёл до склада — его повторы дальше отсекаются до рендера
+            await asyncio.to_thread(VIDEO_FP.add, media_hash, source_fp, ready_path.name)
+
         # Удаляем временные файлы (безопасно)
         if local_path.exists():
             await safe_unlink(local_path)
             if is_instagram_source:
                 log.info("[CONVEYOR] Instagram source video cleaned up after processing")
+        timer.finish()
         
         return ready_path
         
     except Exception as e:
         error_msg = str(e)
+        timer.finish(ok=False)
         
         # 🚨 CRITICAL: Проверка на Invalid file_id (НО НЕ для Instagram!)
         if ("Invalid file_id" in error_msg or "file_id" in error_msg.lower()) and item.get('file_id') != "instagram_source":
@@ -4854,28 +5622,23 @@ def process_photo(local_path: Path) -> Path | None:
 def load_stats():
     """Загружает статистику из файла"""
     global DAILY_STATS
-    if STATS_FILE.exists():
-        try:
-            with STATS_FILE.open("r", encoding="utf-8") as f:
-                data = json.load(f)
-                today = datetime.now().strftime("%Y-%m-%d")
-                if data.get("date") == today:
-                    DAILY_STATS.update(data)
-                else:
-                    # Новый день - сбрасываем статистику
-                    reset_stats()
-        except Exception as e:
-            log.warning(f"Failed to load stats: {e}")
+    try:
+        data = STATE_DB.kv_get("daily_stats")
+        today = datetime.now().strftime("%Y-%m-%d")
+        if isinstance(data, dict) and data.get("date") == today:
+            DAILY_STATS.update(data)
+        else:
+            # Новый день (или пусто) - сбрасываем статистику
             reset_stats()
-    else:
+    except Exception as e:
+        log.warning(f"Failed to load stats: {e}")
         reset_stats()
 
 
 def save_stats():
     """Сохраняет статистику в файл"""
     try:
-        with STATS_FILE.open("w", encoding="utf-8") as f:
-            json.dump(DAILY_STATS, f, ensure_ascii=False, indent=2)
+        STATE_DB.kv_set("daily_stats", DAILY_STATS)
     except Exception as e:
         log.warning(f"Failed to save stats: {e}")
 
@@ -4897,7 +5660,8 @@ def reset_stats():
             "completion_tokens": 0,
             "total_tokens": 0
         },
-        "cost_usd": 0.0
+        "cost_usd": 0.0,
+        "translation_cache": {"hits": 0, "misses": 0}
     }
     save_stats()
 
@@ -4964,6 +5728,16 @@ async def send_daily_report(application):
     stats = DAILY_STATS
     tokens = stats.get("tokens", {})
     cost = stats.get("cost_usd", 0.0)
+    tc_day = stats.get("translation_cache") or {}
+    tc_hits = tc_day.get("hits", 0)
+    tc_lookups = tc_hits + tc_day.get("misses", 0)
+    tc_total = TRANSLATE_CACHE.stats()
+    day_start = datetime.combine(datetime.now().date(), dt_time()).timestamp()
+    try:
+        timing_lines = await asyncio.to_thread(stage_timing_lines, day_start, 8)
+    except Exception as timing_err:
+        log.warning(f"[TIMING] daily summary failed: {timing_err}")
+        timing_lines = []
     
     report = (
         f"📊 Отчёт Haqiqat ({today})\n\n"
@@ -4977,8 +5751,13 @@ async def send_daily_report(application):
         f"  Prompt: {tokens.get('prompt_tokens', 0):,}\n"
         f"  Completion: {tokens.get('completion_tokens', 0):,}\n"
         f"  Всего: {tokens.get('total_tokens', 0):,}\n\n"
-        f"Стоимость: ${cost:.4f}"
+        f"Стоимость: ${cost:.4f}\n\n"
+        f"Кэш переводов: {tc_hits}/{tc_lookups} попаданий"
+        f" ({(tc_hits / tc_lookups * 100) if tc_lookups else 0:.0f}%), промахов {tc_day.get('misses', 0)}\n"
+        f"  В кэше: {tc_total['disk_entries']} записей"
     )
+    if timing_lines:
+        report += "\n\nЭтапы рендера (p50/p95 за день):\n" + "\n".join(f"  {line}" for line in timing_lines)
     
     try:
         # Отправляем отчёт админу, если указан, иначе в лог
@@ -5090,26 +5869,18 @@ def bootstrap_from_disk() -> dict:
     
     # === ШАГ 2: Сканирование ready_to_publish ===
     try:
-        ready_files = list(READY_TO_PUBLISH_DIR.glob("*.mp4"))
-        json_files = list(READY_TO_PUBLISH_DIR.glob("*.json"))
-        log.info(f"[BOOTSTRAP] ready_to_publish: mp4={len(ready_files)} json={len(json_files)}")
-        result["loaded_ready"] = len(ready_files)
+        result["loaded_ready"] = READY_INDEX.scan()
+        log.info(f"[BOOTSTRAP] ready_to_publish: mp4={result['loaded_ready']} json={READY_INDEX.count(with_meta=True)}")
     except Exception as e:
         log.error(f"[BOOTSTRAP] ready scan error: {e}")
     
-    # === ШАГ 3: Сканирование buffer (POST_QUEUE file) ===
+    # === ШАГ 3: Сканирование buffer (POST_QUEUE из STATE_DB) ===
     try:
-        if QUEUE_FILE.exists():
-            data = json.loads(QUEUE_FILE.read_text(encoding="utf-8"))
-            if isinstance(data, list):
-                for item in data:
-                    POST_QUEUE.append(item)
-                result["loaded_buffer"] = len(data)
-                log.info(f"[BUFFER_SCAN] found={len(data)}")
-            else:
-                log.warning("[BUFFER_SCAN] queue file has invalid format")
-        else:
-            log.info("[BUFFER_SCAN] found=0 (no queue file)")
+        data = STATE_DB.queue_load()
+        for item in data:
+            POST_QUEUE.append(item)
+        result["loaded_buffer"] = len(data)
+        log.info(f"[BUFFER_SCAN] found={len(data)}")
     except Exception as e:
         log.error(f"[BOOTSTRAP] buffer load error: {e}")
     
@@ -5190,6 +5961,9 @@ def load_ready_files_to_queue():
                 "ready_metadata": meta_data,
                 "from_ready_folder": True  # Флаг, что это готовый файл
             }
+            if _preupload_is_fresh(meta_data, for_publish=True):
+                item["supabase_url"] = meta_data["supabase_url"]
+                item["supabase_uploaded_at"] = meta_data.get("supabase_uploaded_at")
             
             # === HAQIQAT_HARD_BIND v1.1: Восстанавливаем hard-bind поля из JSON ===
             post_id_restored = meta_data.get("post_id") or meta_data.get("haqiqat_post_id")  # fallback для совместимости
@@ -5218,13 +5992,10 @@ def load_ready_files_to_queue():
 
             # === ДЕДУПЛИКАЦИЯ при загрузке готовых файлов ===
             if file_id != "unknown":
-                for idx, existing_item in enumerate(POST_QUEUE):
-                    if existing_item.get("file_id") == file_id:
-                        log.info(f"[DEDUP_READY] Found duplicate file_id={file_id} at queue[{idx}]")
-                        log.info(f"[DEDUP_READY] Removing old: {existing_item.get('ready_file_path', 'unknown')}")
-                        POST_QUEUE.pop(idx)
-                        log.info(f"[DEDUP_READY] Removed old, will add new: {ready_file.name}")
-                        break
+                existing_item = POST_QUEUE.pop_duplicate(file_id=file_id)
+                if existing_item is not None:
+                    log.info(f"[DEDUP_READY] Found duplicate file_id={file_id} in queue")
+                    log.info(f"[DEDUP_READY] Removed old: {existing_item.get('ready_file_path', 'unknown')}, will add new: {ready_file.name}")
 
             POST_QUEUE.append(item)
             loaded_count += 1
@@ -5241,115 +6012,135 @@ def load_ready_files_to_queue():
     return loaded_count
 
 
+async def _conveyor_prepare_item(application, video_item: dict) -> None:
+    """
+    СИСТЕМА КОНВЕЙЕР: Подготовка одного ролика (запускается отдельной задачей).
+    Успех -> удаление из буфера; ошибка -> повтор в очереди или failed.
+    """
+    ensure_post_id(video_item, video_item.get("id"))
+    video_item_failures = int(video_item.get("failures") or 0)
+    video_item["failures"] = video_item_failures
+
+    # === [STOP_PIPELINE_CRASH] Лог начала обработки ===
+    video_file_id_short = (video_item.get("file_id") or "?")[:20]
+    log.info(f"[PIPE] start post_id={video_item.get('id')} file_id={video_file_id_short}...")
+    log.info(
+        f"[PIPE] DEQUEUE type={video_item.get('type')} id={video_item.get('id')} failures={video_item_failures}"
+    )
+
+    # === [STOP_PIPELINE_CRASH] Обёртка try/except для продолжения очереди ===
+    try:
+        # Подготавливаем видео
+        ready_path = await prepare_video_for_ready(application, video_item)
+    except Exception as pipe_err:
+        # Ошибка одного ролика НЕ останавливает очередь
+        log.error(f"[PIPE] EXCEPTION during prepare: {type(pipe_err).__name__}: {pipe_err}")
+        ready_path = None
+        video_item["last_prepare_error"] = type(pipe_err).__name__
+        video_item["last_prepare_error_detail"] = str(pipe_err)
+
+    if ready_path:
+        log.info(f"[CONVEYOR] Successfully prepared: {ready_path.name}")
+        # Удаляем из буфера
+        try:
+            await delete_from_buffer(application, video_item)
+        except Exception as e:
+            log.warning(f"[CONVEYOR] Failed to delete from buffer: {e}")
+    else:
+        failure_count = int(video_item.get("failures") or 0) + 1
+        video_item["failures"] = failure_count
+        failure_reason = video_item.get("last_prepare_error") or "unknown"
+        failure_detail = video_item.get("last_prepare_error_detail") or ""
+
+        # === [STOP_PIPELINE_CRASH] FileTooBig / непригодный исходник / дубль по кадрам - сразу в failed, без retry ===
+        if failure_reason in ("filetoobig_skip", "unusable_input", "duplicate_source"):
+            video_item["error"] = failure_detail or failure_reason
+            artifact = _record_failed_conveyor_item(video_item, failure_reason, failure_detail)
+            artifact_name = artifact.name if artifact else "n/a"
+            log.warning(f"[PIPE] SKIP_TO_FAILED ({failure_reason}) id={video_item.get('id')} artifact={artifact_name}")
+            # continue queue - не останавливаем
+        elif failure_count >= CONVEYOR_MAX_FAILURES:
+            error_detail = failure_detail or failure_reason
+            video_item["error"] = error_detail
+            artifact = _record_failed_conveyor_item(video_item, failure_reason, error_detail)
+            artifact_name = artifact.name if artifact else "n/a"
+            log.error(
+                f"[PIPE] DROP_TO_FAILED id={video_item.get('id')} failures={failure_count} artifact={artifact_name}"
+            )
+        else:
+            POST_QUEUE.append(video_item)
+            save_queue()
+            log.warning(
+                f"[CONVEYOR] Item re-queued for retry (failures={failure_count}, queue size={len(POST_QUEUE)})"
+            )
+
+
+def _take_raw_video_from_queue() -> dict | None:
+    """Берёт из очереди первое СЫРОЕ видео (не из ready_to_publish)."""
+    # [POST_QUEUE] Голова полосы сырых видео, без перебора очереди
+    item = POST_QUEUE.pop_first(type="video", from_ready=False)
+    if item is None:
+        return None
+    save_queue()
+    log.info(f"[CONVEYOR] Took RAW video from queue, queue size: {len(POST_QUEUE)}")
+    return item
+
+
 async def maintain_ready_posts_worker(application):
     """
-    СИСТЕМА КОНВЕЙЕР: Фоновый процесс поддержания 5 готовых постов.
+    СИСТЕМА КОНВЕЙЕР: Фоновый процесс поддержания TARGET_READY_POSTS готовых постов.
     - Проверяет количество готовых файлов в ready_to_publish
-    - Если меньше 5, берет видео из POST_QUEUE и подготавливает
-    - Рендерит строго по одному файлу за раз
+    - Если меньше цели, берет видео из POST_QUEUE и подготавливает
+    - Рендерит до RENDER_POOL.slots файлов параллельно (каждый в своём процессе)
     """
     global IS_PREPARING
     
-    log.info("[CONVEYOR] Maintain ready posts worker started")
+    log.info(f"[CONVEYOR] Maintain ready posts worker started (render slots={RENDER_POOL.slots})")
     
     while True:
         try:
-            # Считаем готовые видео (только .mp4 файлы)
-            ready_files = list(READY_TO_PUBLISH_DIR.glob("*.mp4"))
-            ready_count = len(ready_files)
+            # Считаем готовые видео по индексу склада (без glob)
+            ready_count = READY_INDEX.count()
             
-            # Если меньше целевого количества и есть видео в очереди
-            if ready_count < TARGET_READY_POSTS and POST_QUEUE and not IS_PREPARING:
-                IS_PREPARING = True
-                log.info(f"[CONVEYOR] Ready posts: {ready_count}/{TARGET_READY_POSTS}. Preparing new video...")
-                
-                # Ищем первое видео в очереди (только СЫРЫЕ, не готовые)
-                video_item = None
-                for idx, item in enumerate(POST_QUEUE):
-                    # Берём только сырые видео (не из ready_to_publish)
-                    if item.get("type") == "video" and not item.get("from_ready_folder", False):
-                        video_item = item
-                        # Удаляем из очереди
-                        POST_QUEUE.remove(item)
-                        save_queue()
-                        log.info(f"[CONVEYOR] Took RAW video from queue position {idx}, queue size: {len(POST_QUEUE)}")
-                        break
-                
-                if video_item:
-                    ensure_post_id(video_item, video_item.get("id"))
-                    video_item_failures = int(video_item.get("failures") or 0)
-                    video_item["failures"] = video_item_failures
-                    
-                    # === [STOP_PIPELINE_CRASH] Лог начала обработки ===
-                    video_file_id_short = (video_item.get("file_id") or "?")[:20]
-                    log.info(f"[PIPE] start post_id={video_item.get('id')} file_id={video_file_id_short}...")
-                    log.info(
-                        f"[PIPE] DEQUEUE type={video_item.get('type')} id={video_item.get('id')} failures={video_item_failures}"
-                    )
-                    
-                    # === [STOP_PIPELINE_CRASH] Обёртка try/except для продолжения очереди ===
-                    try:
-                        # Подготавливаем видео
-                        ready_path = await prepare_video_for_ready(application, video_item)
-                    except Exception as pipe_err:
-                        # Ошибка одного ролика НЕ останавливает очередь
-                        log.error(f"[PIPE] EXCEPTION during prepare: {type(pipe_err).__name__}: {pipe_err}")
-                        ready_path = None
-                        video_item["last_prepare_error"] = type(pipe_err).__name__
-                        video_item["last_prepare_error_detail"] = str(pipe_err)
-                    
-                    if ready_path:
-                        log.info(f"[CONVEYOR] Successfully prepared: {ready_path.name}")
-                        # Удаляем из буфера
-                        try:
-                            await delete_from_buffer(application, video_item)
-                        except Exception as e:
-                            log.warning(f"[CONVEYOR] Failed to delete from buffer: {e}")
-                    else:
-                        failure_count = int(video_item.get("failures") or 0) + 1
-                        video_item["failures"] = failure_count
-                        failure_reason = video_item.get("last_prepare_error") or "unknown"
-                        failure_detail = video_item.get("last_prepare_error_detail") or ""
-                        
-                        # === [STOP_PIPELINE_CRASH] FileTooBig skip - сразу в failed, без retry ===
-                        if failure_reason == "filetoobig_skip":
-                            video_item["error"] = failure_detail or failure_reason
-                            artifact = _record_failed_conveyor_item(video_item, failure_reason, failure_detail)
-                            artifact_name = artifact.name if artifact else "n/a"
-                            log.warning(f"[PIPE] SKIP_TO_FAILED (FileTooBig) id={video_item.get('id')} artifact={artifact_name}")
-                            # continue queue - не останавливаем
-                        elif failure_count >= CONVEYOR_MAX_FAILURES:
-                            error_detail = failure_detail or failure_reason
-                            video_item["error"] = error_detail
-                            artifact = _record_failed_conveyor_item(video_item, failure_reason, error_detail)
-                            artifact_name = artifact.name if artifact else "n/a"
-                            log.error(
-                                f"[PIPE] DROP_TO_FAILED id={video_item.get('id')} failures={failure_count} artifact={artifact_name}"
-                            )
-                        else:
-                            POST_QUEUE.append(video_item)
-                            save_queue()
-                            log.warning(
-                                f"[CONVEYOR] Item re-queued for retry (failures={failure_count}, queue size={len(POST_QUEUE)})"
-                            )
-                
-                IS_PREPARING = False
-                
-            elif ready_count >= TARGET_READY_POSTS:
+            # Если меньше целевого количества, есть свободный слот и видео в очереди
+            while (
+                ready_count + len(CONVEYOR_TASKS) < TARGET_READY_POSTS
+                and len(CONVEYOR_TASKS) < RENDER_POOL.slots
+                and POST_QUEUE
+            ):
+                video_item = _take_raw_video_from_queue()
+                if not video_item:
+                    break
+                log.info(
+                    f"[CONVEYOR] Ready posts: {ready_count}/{TARGET_READY_POSTS}, "
+                    f"in_flight={len(CONVEYOR_TASKS) + 1}/{RENDER_POOL.slots}. Preparing new video..."
+                )
+                task = asyncio.create_task(_conveyor_prepare_item(application, video_item))
+                CONVEYOR_TASKS.add(task)
+                task.add_done_callback(CONVEYOR_TASKS.discard)
+
+            IS_PREPARING = bool(CONVEYOR_TASKS)
+
+            if ready_count >= TARGET_READY_POSTS:
                 log.info(f"[CONVEYOR] Ready posts: {ready_count}/{TARGET_READY_POSTS}. Target reached.")
             
-            # Проверяем каждые 30 секунд
-            await asyncio.sleep(30)
+            # Проверяем каждые 30 секунд или сразу, как освободится слот рендера
+            if CONVEYOR_TASKS:
+                await asyncio.wait(set(CONVEYOR_TASKS), timeout=30, return_when=asyncio.FIRST_COMPLETED)
+            else:
+                await asyncio.sleep(30)
+            IS_PREPARING = bool(CONVEYOR_TASKS)
             
         except Exception as e:
             log.error(f"[CONVEYOR] maintain_ready_posts_worker error: {e}")
-            IS_PREPARING = False
+            IS_PREPARING = bool(CONVEYOR_TASKS)
             await asyncio.sleep(60)
 
 
 def post_hash(item: dict) -> str:
     base = item.get("type", "")
-    if item["type"] == "text":
+    # carousel_pending — текстовый пост без file_id: ключ по тексту, иначе у всех один хэш
+    if item["type"] in ("text", "carousel_pending"):
         base += item.get("text", "")
     else:
         base += item.get("file_id", "") + (item.get("caption") or "")
@@ -5396,11 +6187,14 @@ def _strip_cyrillic(text: str) -> str:
     return CYRILLIC_DETECTION_RE.sub("", text or "")
 
 
-def _force_latin_retry(text: str, context: str) -> str:
-    if not openai_client:
+async def _force_latin_retry(text: str, context: str) -> str:
+    # [OPENAI_SCHED] Через общий планировщик: без блокировки event loop, с лимитами и учётом токенов
+    if not OPENAI_SCHEDULER:
         return text
     try:
-        resp = openai_client.chat.completions.create(
+        resp = await OPENAI_SCHEDULER.chat(
+            tag="UZ_LATIN",
+            timeout=OPENAI_SHORT_TIMEOUT_SECONDS,
             model=os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
             max_tokens=600,
             messages=[
@@ -5421,7 +6215,7 @@ def _force_latin_retry(text: str, context: str) -> str:
         return text
 
 
-def _finalize_uzbek_output(text: str, logger, context: str) -> str:
+async def _finalize_uzbek_output(text: str, logger, context: str) -> str:
     normalized = _normalize_uz_latin(text or "")
     if not normalized:
         logger.info(f"[UZ_LATIN] ok=True len=0 context={context}")
@@ -5430,7 +6224,7 @@ def _finalize_uzbek_output(text: str, logger, context: str) -> str:
     has_cyrillic = _contains_cyrillic(normalized)
     if has_cyrillic:
         logger.warning(f"[UZ_LATIN] Cyrillic detected context={context}, retrying Latin-only conversion")
-        normalized = _force_latin_retry(normalized, context)
+        normalized = await _force_latin_retry(normalized, context)
         normalized = _normalize_uz_latin(normalized)
         has_cyrillic = _contains_cyrillic(normalized)
         if has_cyrillic:
@@ -5551,43 +6345,72 @@ def clean_text_before_translation(text: str) -> str:
     return '\n'.join(unique_lines).strip()
 
 
+# === [PROMPT_HARDENING_V1.1] STRICT LOCK MODE ===
+UZ_JIVOY_PROMPT = (
+    "Ты переводишь текст с русского на узбекский (латиница).\n"
+    "Режим: ТОЧНЫЙ ФАКТИЧЕСКИЙ ПЕРЕВОД (без фантазий).\n"
+    "\n"
+    "ЖЁСТКИЕ ПРАВИЛА:\n"
+    "- НЕЛЬЗЯ добавлять новые факты, объекты, числа или причины.\n"
+    "- НЕЛЬЗЯ убирать важные детали или сокращать смысл.\n"
+    "- НЕЛЬЗЯ менять субъект и объект предложения (кто что сделал и над чем).\n"
+    "- НЕЛЬЗЯ менять причинно-следственные связи.\n"
+    "- НЕЛЬЗЯ заменять точные термины более общими словами.\n"
+    "- Если формулировка уже точная — НЕ перефразируй её ради красоты.\n"
+    "- Если предложение короткое — оставь его коротким.\n"
+    "\n"
+    "СТИЛЬ UZ-ЖИВОЙ:\n"
+    "- Живая разговорная речь.\n"
+    "- Естественный порядок слов.\n"
+    "- Без канцелярита и книжности.\n"
+    "- Без интро-крючков и рекламы.\n"
+    "\n"
+    "ФОРМАТ ОТВЕТА:\n"
+    "- Верни только перевод.\n"
+    "- Без комментариев и пояснений.\n"
+    "- Только латиница.\n"
+    "- Апостроф использовать только обычный: ' (o', g').\n"
+    "- Не использовать умные кавычки или символ `.\n"
+)
+UZ_JIVOY_PROMPT_SHA1 = hashlib.sha1(UZ_JIVOY_PROMPT.encode("utf-8")).hexdigest()
+
+
+def _translation_cache_count(kind: str) -> None:
+    """Дневные счётчики кэша переводов (для send_daily_report)."""
+    if DAILY_STATS.get("date") != datetime.now().strftime("%Y-%m-%d"):
+        reset_stats()
+    counters = DAILY_STATS.setdefault("translation_cache", {"hits": 0, "misses": 0})
+    counters[kind] = int(counters.get(kind, 0)) + 1
+
+
 async def translate_text(text: str) -> str:
-    """Умный режим перевода с self-check"""
-    if not openai_client or not text:
+    """Умный режим перевода с self-check. Повторный текст берётся из TRANSLATE_CACHE."""
+    if not OPENAI_SCHEDULER or not text:
         return text
 
     # Очищаем от служебных хвостов перед переводом
     cleaned_text = clean_text_before_translation(text)
 
+    # [TRANSLATE_CACHE] Ключ: версия промпта + модель + очищенный текст
+    model = os.getenv("OPENAI_MODEL", "gpt-4o")
+    cache_key = translation_cache.make_key(cleaned_text or "", model, f"{TRANSLATE_CACHE_VERSION}:{UZ_JIVOY_PROMPT_SHA1}")
+    cached = TRANSLATE_CACHE.get(cache_key)
+    if cached is not None:
+        _translation_cache_count("hits")
+        log.info(f"[TRANSLATE_CACHE] HIT key={cache_key[:12]} len={len(cached)}")
+        return cached
+    _translation_cache_count("misses")
+
+    result = await _translate_text_openai(text, cleaned_text)
+    # При окончательной ошибке возвращается исходный text — такое не кэшируем
+    if result and result is not text:
+        TRANSLATE_CACHE.put(cache_key, result, model)
+    return result
+
+
+async def _translate_text_openai(text: str, cleaned_text: str) -> str:
+    """Перевод + self-check через OpenAI (без кэша)."""
     # RESTORE_UZ_JIVOY_TRANSLATION_PROMPT: Константа UZ-ЖИВОЙ стиля перевода
-    # === [PROMPT_HARDENING_V1.1] STRICT LOCK MODE ===
-    UZ_JIVOY_PROMPT = (
-        "Ты переводишь текст с русского на узбекский (латиница).\n"
-        "Режим: ТОЧНЫЙ ФАКТИЧЕСКИЙ ПЕРЕВОД (без фантазий).\n"
-        "\n"
-        "ЖЁСТКИЕ ПРАВИЛА:\n"
-        "- НЕЛЬЗЯ добавлять новые факты, объекты, числа или причины.\n"
-        "- НЕЛЬЗЯ убирать важные детали или сокращать смысл.\n"
-        "- НЕЛЬЗЯ менять субъект и объект предложения (кто что сделал и над чем).\n"
-        "- НЕЛЬЗЯ менять причинно-следственные связи.\n"
-        "- НЕЛЬЗЯ заменять точные термины более общими словами.\n"
-        "- Если формулировка уже точная — НЕ перефразируй её ради красоты.\n"
-        "- Если предложение короткое — оставь его коротким.\n"
-        "\n"
-        "СТИЛЬ UZ-ЖИВОЙ:\n"
-        "- Живая разговорная речь.\n"
-        "- Естественный порядок слов.\n"
-        "- Без канцелярита и книжности.\n"
-        "- Без интро-крючков и рекламы.\n"
-        "\n"
-        "ФОРМАТ ОТВЕТА:\n"
-        "- Верни только перевод.\n"
-        "- Без комментариев и пояснений.\n"
-        "- Только латиница.\n"
-        "- Апостроф использовать только обычный: ' (o', g').\n"
-        "- Не использовать умные кавычки или символ `.\n"
-    )
-    
     # РЕЖИМ МАКСИМАЛЬНО-СТРОГИЙ (опционально, для максимального приближения к оригиналу):
     # UZ_JIVOY_FACTS_STRICT = (
     #     "Ты — машинный переводчик на узбекский (латиница). РЕЖИМ: ТОЧНЫЙ ПЕРЕВОД.\n"
@@ -5608,7 +6431,8 @@ async def translate_text(text: str) -> str:
         try:
             # Первый проход: перевод
             TRANSLATION_LAST_COST = 0.0
-            resp1 = openai_client.chat.completions.create(
+            resp1 = await OPENAI_SCHEDULER.chat(
+                tag="TRANSLATE",
                 model=os.getenv("OPENAI_MODEL", "gpt-4o"),
                 max_tokens=800,
                 temperature=0.1,
@@ -5632,17 +6456,15 @@ async def translate_text(text: str) -> str:
             if translated and len(translated.split()) <= 4 and "—" not in translated and "..." not in translated:
                 log.warning(f"[UZJIVOY_STYLE_WARN] output too dry: {repr(translated)}")
             
-            # Логируем токены первого запроса
-            usage = resp1.usage
-            if usage:
-                log_tokens(usage.prompt_tokens, usage.completion_tokens, usage.total_tokens)
+            # Токены первого запроса уже учтены в log_tokens через OPENAI_SCHEDULER
             
             # Если пусто — повторяем
             if not translated:
                 raise RuntimeError("Empty translation")
 
             # Второй проход: self-check
-            resp2 = openai_client.chat.completions.create(
+            resp2 = await OPENAI_SCHEDULER.chat(
+                tag="TRANSLATE_CHECK",
                 model=os.getenv("OPENAI_MODEL", "gpt-4o"),
                 max_tokens=800,
                 temperature=0.0,
@@ -5674,10 +6496,7 @@ async def translate_text(text: str) -> str:
                 response_format={"type": "json_object"},
             )
             
-            # Логируем токены второго запроса
-            usage2 = resp2.usage
-            if usage2:
-                log_tokens(usage2.prompt_tokens, usage2.completion_tokens, usage2.total_tokens)
+            # Токены второго запроса учтены в log_tokens через OPENAI_SCHEDULER
             
             # Парсим JSON ответ
             try:
@@ -5699,14 +6518,14 @@ async def translate_text(text: str) -> str:
                 # Если любая оценка < 7 → переписать
                 if min_score < 7 or avg_score < 7:
                     log.warning(f"REWRITE: low score (min={min_score:.2f}, avg={avg_score:.2f}), using improved_text")
-                    return _finalize_uzbek_output(improved_text, log, context="[TRANSLATE]")
+                    return await _finalize_uzbek_output(improved_text, log, context="[TRANSLATE]")
                 else:
                     log.info(f"OK: translation approved (min={min_score:.2f}, avg={avg_score:.2f})")
-                    return _finalize_uzbek_output(improved_text, log, context="[TRANSLATE]")
+                    return await _finalize_uzbek_output(improved_text, log, context="[TRANSLATE]")
                     
             except (json.JSONDecodeError, KeyError) as e:
                 log.warning(f"Failed to parse self-check JSON: {e}, using original translation")
-                return _finalize_uzbek_output(translated, log, context="[TRANSLATE]")
+                return await _finalize_uzbek_output(translated, log, context="[TRANSLATE]")
         except Exception as e:
             last_error = e
             log.warning(f"Translate attempt {attempt}/{attempts} failed: {e}")
@@ -5969,30 +6788,26 @@ def get_next_post_from_queue():
     
     log.info(f"[MIXED QUEUE] Current block: {CURRENT_BLOCK_TYPE}, progress: {VOICEOVER_POSTS_COUNT if CURRENT_BLOCK_TYPE == 'voiceover' else NO_VOICEOVER_POSTS_COUNT}/4")
     
-    # Ищем пост нужного типа
-    for idx, item in enumerate(POST_QUEUE):
-        if item.get("voiceover", False) == target_voiceover:
-            # Нашли нужный тип
-            post = POST_QUEUE[idx]
-            del POST_QUEUE[idx]
-            
-            # Обновляем счётчики
-            if target_voiceover:
-                VOICEOVER_POSTS_COUNT += 1
-                log.info(f"[MIXED QUEUE] Selected voiceover post ({VOICEOVER_POSTS_COUNT}/4)")
-                if VOICEOVER_POSTS_COUNT >= 4:
-                    CURRENT_BLOCK_TYPE = "no_voiceover"
-                    VOICEOVER_POSTS_COUNT = 0
-                    log.info("[MIXED QUEUE] ✅ Voiceover block complete, switching to no_voiceover")
-            else:
-                NO_VOICEOVER_POSTS_COUNT += 1
-                log.info(f"[MIXED QUEUE] Selected no_voiceover post ({NO_VOICEOVER_POSTS_COUNT}/4)")
-                if NO_VOICEOVER_POSTS_COUNT >= 4:
-                    CURRENT_BLOCK_TYPE = "voiceover"
-                    NO_VOICEOVER_POSTS_COUNT = 0
-                    log.info("[MIXED QUEUE] ✅ No_voiceover block complete, switching to voiceover")
-            
-            return post
+    # Ищем пост нужного типа (голова полос с этим флагом voiceover)
+    post = POST_QUEUE.pop_first(voiceover=target_voiceover)
+    if post is not None:
+        # Обновляем счётчики
+        if target_voiceover:
+            VOICEOVER_POSTS_COUNT += 1
+            log.info(f"[MIXED QUEUE] Selected voiceover post ({VOICEOVER_POSTS_COUNT}/4)")
+            if VOICEOVER_POSTS_COUNT >= 4:
+                CURRENT_BLOCK_TYPE = "no_voiceover"
+                VOICEOVER_POSTS_COUNT = 0
+                log.info("[MIXED QUEUE] ✅ Voiceover block complete, switching to no_voiceover")
+        else:
+            NO_VOICEOVER_POSTS_COUNT += 1
+            log.info(f"[MIXED QUEUE] Selected no_voiceover post ({NO_VOICEOVER_POSTS_COUNT}/4)")
+            if NO_VOICEOVER_POSTS_COUNT >= 4:
+                CURRENT_BLOCK_TYPE = "voiceover"
+                NO_VOICEOVER_POSTS_COUNT = 0
+                log.info("[MIXED QUEUE] ✅ No_voiceover block complete, switching to voiceover")
+        
+        return post
     
     # Если нужного типа нет, берём что есть
     log.warning(f"[MIXED QUEUE] No {CURRENT_BLOCK_TYPE} posts available, taking any post")
@@ -6035,9 +6850,10 @@ SYSTEM_PROMPT_UZ = (
 )
 
 
-def _translate_sync(text: str) -> str:
-    assert openai_client is not None
-    resp = openai_client.chat.completions.create(
+async def _translate_uz(text: str) -> str:
+    assert OPENAI_SCHEDULER is not None
+    resp = await OPENAI_SCHEDULER.chat(
+        tag="TRANSLATE_UZ",
         model=OPENAI_MODEL,
         messages=[
             {"role": "system", "content": SYSTEM_PROMPT_UZ},
@@ -6046,7 +6862,7 @@ def _translate_sync(text: str) -> str:
     )
     out = (resp.choices[0].message.content or "").strip()
     final_out = out or text
-    return _finalize_uzbek_output(final_out, log, context="[TRANSLATE_SYNC]")
+    return await _finalize_uzbek_output(final_out, log, context="[TRANSLATE_UZ]")
 
 
 async def translate_and_adapt(text: str, logger) -> str:
@@ -6054,12 +6870,12 @@ async def translate_and_adapt(text: str, logger) -> str:
     if not text:
         return text
 
-    if not openai_client:
+    if not OPENAI_SCHEDULER:
         return text
 
     try:
-        # OpenAI SDK вызов синхронный — уводим в отдельный поток, чтобы не блокировать event loop PTB.
-        return await asyncio.to_thread(_translate_sync, text)
+        # [OPENAI_SCHED] Async-клиент под общим семафором и лимитами RPM/TPM
+        return await _translate_uz(text)
     except Exception as e:
         logger.warning("Translate failed, sending original text. Error=%s", e)
         return text
@@ -7130,6 +7946,7 @@ async def post_worker(application, item, upload_path, caption, caption_tg, capti
     if upload_path and not upload_path_is_url:
         guarded_path = Path(ensure_max_50mb(str(upload_path)))
         if guarded_path != upload_path:
+            _bump_encode_count(item, "post_worker")
             try:
                 os.replace(str(guarded_path), str(upload_path))
                 log.info(f"[MAX50] Replaced oversize file -> {upload_path.name}")
@@ -7137,6 +7954,11 @@ async def post_worker(application, item, upload_path, caption, caption_tg, capti
             except Exception as guard_err:
                 log.warning(f"[MAX50] Failed to overwrite original file: {guard_err}")
                 upload_path = guarded_path
+            # Файл перекодирован — заранее залитая версия уже не та
+            stale_url = item.pop("supabase_url", None)
+            if stale_url:
+                delete_supabase_file(stale_url)
+                log.info("[PREUPLOAD] dropped stale pre-uploaded URL after MAX50 re-encode")
         else:
             upload_path = guarded_path
         if local_path:
@@ -7163,7 +7985,7 @@ async def post_worker(application, item, upload_path, caption, caption_tg, capti
             public_url = None
             try:
                 content_type = "video/mp4"
-                public_url = upload_to_supabase(str(upload_path), content_type)
+                public_url = await upload_to_supabase_async(str(upload_path), content_type)
                 if public_url:
                     log.info(f"[SUPABASE] Upload OK: {public_url}")
                     item["supabase_url"] = public_url
@@ -7248,7 +8070,9 @@ async def post_worker(application, item, upload_path, caption, caption_tg, capti
     log.info(f"[CAPTION_SAFE] tg={len(caption_tg)} ig={len(caption_ig)} fb={len(caption_fb)}")
     ig_success = False
     ig_publish_attempts = 0
-    max_ig_attempts = 3
+    # [PLAN_B_VARIANTS] Первая попытка + по одному варианту на повтор
+    max_ig_attempts = 1 + PLAN_B_BUDGET["ig"]
+    plan_b_urls: list[str] = []  # URL вариантов в Supabase — удаляются после публикации
     tg_success = False
     fb_success = False
 
@@ -7309,7 +8133,7 @@ async def post_worker(application, item, upload_path, caption, caption_tg, capti
     async def instagram_publish_task():
         nonlocal ig_success, ig_publish_attempts
         now_before_check = datetime.now()
-        ready_count = len(list(READY_TO_PUBLISH_DIR.glob("*.mp4")))
+        ready_count = READY_INDEX.count()
         last_post_str = LAST_POST_TIME.strftime('%Y-%m-%d %H:%M:%S') if LAST_POST_TIME else "Never"
         log.info("[DIAGNOSTICS PRE-DECISION]")
         log.info(f"  FORCE_POST_NOW={FORCE_POST_NOW}")
@@ -7333,7 +8157,6 @@ async def post_worker(application, item, upload_path, caption, caption_tg, capti
             log.error("[IG_BLOCKED] Empty caption for Instagram — skip publish")
             return False
 
-        dark_palette = [(0, 0, 0), (10, 10, 20), (20, 20, 30), (12, 8, 24), (6, 12, 18)]
         while ig_publish_attempts < max_ig_attempts and not ig_success:
             ig_publish_attempts += 1
             try:
@@ -7367,37 +8190,20 @@ async def post_worker(application, item, upload_path, caption, caption_tg, capti
                         break
                     log.warning(f"[IG_ATTEMPT_{ig_publish_attempts}] Failed, preparing Plan B")
                 else:
-                    log.warning(f"[PLAN B] Instagram retry {ig_publish_attempts}/{max_ig_attempts} with unique params")
-                    speed_mult = 1.01 + (ig_publish_attempts - 1) * 0.01
-                    bg_color_new = dark_palette[(ig_publish_attempts - 1) % len(dark_palette)]
-                    brightness_adj = 0.01 * ig_publish_attempts
-                    log.info(f"[PLAN B] Reprocessing video: speed={speed_mult:.3f}, bg={bg_color_new}, brightness={brightness_adj:+.3f}")
-                    plan_b_description = item.get("description") or item.get("caption") or item.get("text") or ""
-                    processed_path_retry = process_video(
-                        local_path,
-                        caption,
-                        source_description=plan_b_description,
-                        speed_multiplier=speed_mult,
-                        bg_color_override=bg_color_new,
-                        brightness_adjust=brightness_adj,
-                        random_crop=True,
-                        post_data=item,
-                    )
-                    if not processed_path_retry or not Path(processed_path_retry).exists():
-                        log.error(f"[PLAN B] Video reprocessing failed on attempt {ig_publish_attempts}")
-                        continue
-                    content_type_retry = mimetypes.guess_type(str(processed_path_retry))[0] or "video/mp4"
-                    public_url_retry = upload_to_supabase(str(processed_path_retry), content_type_retry)
+                    variant_no = ig_publish_attempts - 2
+                    log.warning(f"[PLAN B] Instagram retry {ig_publish_attempts}/{max_ig_attempts} with variant {variant_no}")
+                    if not local_path:
+                        log.error("[PLAN B] No local ready file - variants unavailable")
+                        ig_publish_attempts = max_ig_attempts
+                        break
+                    # [PLAN_B_VARIANTS] Вариант обычно уже отрендерен заранее — остаются заливка и публикация
+                    public_url_retry = await plan_b_variant_url(local_path, variant_no, caption, item)
                     if not public_url_retry:
-                        log.error(f"[PLAN B] Supabase upload failed on attempt {ig_publish_attempts}")
-                        if Path(processed_path_retry).exists():
-                            await safe_unlink(processed_path_retry)
+                        log.error(f"[PLAN B] Variant {variant_no} unavailable on attempt {ig_publish_attempts}")
                         continue
-                    old_url = item.get("supabase_url")
-                    if old_url:
-                        delete_supabase_file(old_url)
-                    item["supabase_url"] = public_url_retry
+                    plan_b_urls.append(public_url_retry)
                     item_ig = dict(item)
+                    item_ig["supabase_url"] = public_url_retry
                     # === ШАГ 4: INSTAGRAM CAPTION С РАСШИРЕННЫМИ ХЭШТЕГАМИ (CAPTION_POLISH_CLEAN_TOPTEXT_HASHTAGS_V2) ===
                     # CAPTION_ZERO_AFTER_UNIFIED_FIX_WIRING: Очистка caption в Plan B (как и в основной попытке)
                     ig_caption_cleaned_planb = clean_caption(caption_instagram)
@@ -7409,13 +8215,9 @@ async def post_worker(application, item, upload_path, caption, caption_tg, capti
                         ig_success = True
                         append_history("IG", "Video", public_url_retry, item.get("translation_cost", 0.0))
                         log.info(f"[PLAN B SUCCESS] Video published on attempt {ig_publish_attempts}")
-                        if Path(processed_path_retry).exists():
-                            await safe_unlink(processed_path_retry)
                         break
                     else:
                         log.warning(f"[PLAN B] Attempt {ig_publish_attempts} failed")
-                        if Path(processed_path_retry).exists():
-                            await safe_unlink(processed_path_retry)
             except Exception as e:
                 log.error(f"[IG_ATTEMPT_{ig_publish_attempts}] Exception: {e}")
                 if FORCE_POST_NOW:
@@ -7429,43 +8231,67 @@ async def post_worker(application, item, upload_path, caption, caption_tg, capti
         return ig_success  # POSTNOW_SYNC_PUBLISH_FIX_V1: Track status
 
     async def facebook_publish_task():
+        # Возвращает FB_PUBLISHED / FB_SKIPPED / FB_FAILED
         nonlocal fb_success
         if ENABLE_FB != "1":
-            return False
+            return FB_SKIPPED
         if not item.get("supabase_url"):
             log.warning("[FB_SKIP] Missing Supabase URL")
-            return False
+            return FB_SKIPPED
         log.info(f"[PUBLISH][FB] start -> {Path(local_path).name if local_path else 'remote'}")
         # POSTNOW явный лог
         if FORCE_POST_NOW:
             log.info(f"[POSTNOW] → FB start")
-        try:
-            item_fb = dict(item)
-            # === ШАГ 4: FACEBOOK CAPTION С РАСШИРЕННЫМИ ХЭШТЕГАМИ (CAPTION_POLISH_CLEAN_TOPTEXT_HASHTAGS_V2) ===
-            # POSTNOW_SYNC_PUBLISH_FIX_V1: Очистка caption перед отправкой в Facebook с гарантией что не None
-            # CAPTION_ZERO_AFTER_UNIFIED_FIX_WIRING: Логирование ДО и ПОСЛЕ clean_caption
-            log.info(f"[FB_CAPTION_BEFORE_CLEAN] len={len(caption_fb)} text_start={caption_fb[:100]!r}")
-            fb_caption_safe = safe_text(caption_fb)  # Гарантирует строку
-            fb_caption_cleaned = clean_caption(fb_caption_safe)
-            log.info(f"[FB_CAPTION_AFTER_CLEAN] len={len(fb_caption_cleaned)} text_start={fb_caption_cleaned[:100]!r}")
-            # POSTNOW_SYNC_NOFAIL_TG_FB: Защита от None перед len()
-            fb_caption_cleaned = fb_caption_cleaned or ""
-            item_fb["caption"] = fb_caption_cleaned
-            log.info(f"[FB_CAPTION_SEND] len={len(fb_caption_cleaned)} has_footer={'Haqiqat' in fb_caption_cleaned} has_hash={'#haqiqat' in fb_caption_cleaned} repr={fb_caption_cleaned[:150]!r}")
-            await publish_to_facebook(item_fb, force=FORCE_POST_NOW)
-            fb_success = True
-            # POSTNOW явный лог успеха
-            if FORCE_POST_NOW:
-                log.info(f"[POSTNOW] → FB success")
-            append_history("FB", "Video", item.get("supabase_url", "-"), item.get("translation_cost", 0.0))
-        except Exception as e:
-            # POSTNOW явный лог ошибки
-            if FORCE_POST_NOW:
-                log.error(f"[POSTNOW] → FB error: {str(e)[:100]}")
-            log.error(f"Facebook publish error (video): {e}")
-            send_admin_error(f"Facebook publish error (video): {e}")
-            fb_success = False
-        return fb_success  # POSTNOW_SYNC_PUBLISH_FIX_V1: Track status
+        # [PLAN_B_VARIANTS] Повторы FB — на заранее отрендеренных вариантах (PLAN_B_VARIANTS_FB, по умолчанию 0)
+        max_fb_attempts = 1 + (PLAN_B_BUDGET["fb"] if local_path else 0)
+        fb_status = FB_FAILED
+        for fb_attempt in range(1, max_fb_attempts + 1):
+            try:
+                item_fb = dict(item)
+                if fb_attempt > 1:
+                    variant_no = fb_attempt - 2
+                    log.warning(f"[PLAN B] Facebook retry {fb_attempt}/{max_fb_attempts} with variant {variant_no}")
+                    fb_url_retry = await plan_b_variant_url(local_path, variant_no, caption, item)
+                    if not fb_url_retry:
+                        log.error(f"[PLAN B] Variant {variant_no} unavailable for Facebook")
+                        continue
+                    plan_b_urls.append(fb_url_retry)
+                    item_fb["supabase_url"] = fb_url_retry
+                # === ШАГ 4: FACEBOOK CAPTION С РАСШИРЕННЫМИ ХЭШТЕГАМИ (CAPTION_POLISH_CLEAN_TOPTEXT_HASHTAGS_V2) ===
+                # POSTNOW_SYNC_PUBLISH_FIX_V1: Очистка caption перед отправкой в Facebook с гарантией что не None
+                # CAPTION_ZERO_AFTER_UNIFIED_FIX_WIRING: Логирование ДО и ПОСЛЕ clean_caption
+                log.info(f"[FB_CAPTION_BEFORE_CLEAN] len={len(caption_fb)} text_start={caption_fb[:100]!r}")
+                fb_caption_safe = safe_text(caption_fb)  # Гарантирует строку
+                fb_caption_cleaned = clean_caption(fb_caption_safe)
+                log.info(f"[FB_CAPTION_AFTER_CLEAN] len={len(fb_caption_cleaned)} text_start={fb_caption_cleaned[:100]!r}")
+                # POSTNOW_SYNC_NOFAIL_TG_FB: Защита от None перед len()
+                fb_caption_cleaned = fb_caption_cleaned or ""
+                item_fb["caption"] = fb_caption_cleaned
+                log.info(f"[FB_CAPTION_SEND] len={len(fb_caption_cleaned)} has_footer={'Haqiqat' in fb_caption_cleaned} has_hash={'#haqiqat' in fb_caption_cleaned} repr={fb_caption_cleaned[:150]!r}")
+                fb_status = await publish_to_facebook(item_fb, force=FORCE_POST_NOW)
+                if fb_status == FB_SKIPPED:
+                    # Публиковать нечего/некуда — варианты Плана Б не помогут
+                    log.info("[FB_SKIP] publish_to_facebook skipped the post")
+                    break
+                if fb_status != FB_PUBLISHED:
+                    log.error(f"[PLAN B] Facebook publish failed (attempt {fb_attempt}/{max_fb_attempts})")
+                    fb_success = False
+                    continue
+                fb_success = True
+                # POSTNOW явный лог успеха
+                if FORCE_POST_NOW:
+                    log.info(f"[POSTNOW] → FB success")
+                append_history("FB", "Video", item_fb.get("supabase_url", "-"), item.get("translation_cost", 0.0))
+                break
+            except Exception as e:
+                # POSTNOW явный лог ошибки
+                if FORCE_POST_NOW:
+                    log.error(f"[POSTNOW] → FB error: {str(e)[:100]}")
+                log.error(f"Facebook publish error (video, attempt {fb_attempt}/{max_fb_attempts}): {e}")
+                send_admin_error(f"Facebook publish error (video): {e}")
+                fb_success = False
+                fb_status = FB_FAILED
+        return fb_status  # POSTNOW_SYNC_PUBLISH_FIX_V1: Track status
 
     publish_tasks = []
     if MAIN_CHANNEL_ID:
@@ -7483,6 +8309,7 @@ async def post_worker(application, item, upload_path, caption, caption_tg, capti
         tg_ok = False
         ig_ok = False
         fb_ok = False
+        fb_skipped = ENABLE_FB != "1"
         
         # Unpack results to individual platform status
         result_idx = 0
@@ -7498,7 +8325,8 @@ async def post_worker(application, item, upload_path, caption, caption_tg, capti
             result_idx += 1
         if ENABLE_FB == "1":
             fb_result = results[result_idx]
-            fb_ok = fb_result is True
+            fb_ok = fb_result == FB_PUBLISHED
+            fb_skipped = fb_result == FB_SKIPPED
             log.info(f"[SYNC_PUBLISH] FB result: {fb_result} (ok={fb_ok})")
         
         log.info(f"[SYNC_PUBLISH] Final status: TG={tg_ok} IG={ig_ok} FB={fb_ok}")
@@ -7516,9 +8344,11 @@ async def post_worker(application, item, upload_path, caption, caption_tg, capti
         tg_ok = False
         ig_ok = False
         fb_ok = False
+        fb_skipped = False
 
     # POSTNOW_SYNC_PUBLISH_FIX_V1: Only archive if ALL platforms succeed
-    all_platforms_ok = tg_ok and ig_ok and fb_ok
+    # (FB «пропущен» — не ошибка: не блокирует архив и очистку Supabase)
+    all_platforms_ok = tg_ok and ig_ok and (fb_ok or fb_skipped)
     log.info(f"[SYNC_PUBLISH] Archive gate: tg_ok={tg_ok} ig_ok={ig_ok} fb_ok={fb_ok} all_ok={all_platforms_ok}")
     
     # ОТЛОЖЕННОЕ УДАЛЕНИЕ: Только после успеха ALL платформ
@@ -7570,13 +8400,13 @@ async def post_worker(application, item, upload_path, caption, caption_tg, capti
         log.info(f"[CLEANUP] Supabase cleanup executed (all_ok={all_platforms_ok}, ig_attempts={ig_publish_attempts})")
     else:
         log.warning("[CLEANUP] Supabase cleanup skipped - not all platforms succeeded")
+    if plan_b_urls:
+        # [PLAN_B_VARIANTS] Залитые варианты одноразовые — удаляем всегда
+        await asyncio.to_thread(delete_supabase_files, plan_b_urls)
     increment_stat("video")
     append_history("TG", "Video", item.get("supabase_url", "-"), item.get("translation_cost", 0.0))
     if caption:
-        PUBLISHED_TEXTS.append(caption)
-        if len(PUBLISHED_TEXTS) > MAX_PUBLISHED_TEXTS:
-            PUBLISHED_TEXTS.pop(0)
-        save_published_texts()
+        remember_published_text(caption)
     log.info("published_ok (video)")
     publish_success = tg_ok or ig_ok or fb_ok  # POSTNOW_SYNC_PUBLISH_FIX_V1: Use platform status flags
     log.info(f"[PUBLISH] Final success status: {publish_success} (tg={tg_ok} ig={ig_ok} fb={fb_ok})")
@@ -7829,13 +8659,26 @@ async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                 seconds = int(time_diff.total_seconds() % 60)
                 time_remaining = f"{minutes:02d}:{seconds:02d}"
         
-        # Количество готовых видео на складе
-        ready_files = list(READY_TO_PUBLISH_DIR.glob("*.mp4"))
-        ready_count = len(ready_files)
+        # Количество готовых видео на складе (READY_INDEX)
+        ready_stats = READY_INDEX.stats()
+        ready_count = ready_stats["mp4"]
         
         # Количество видео в очереди
         queue_count = len(POST_QUEUE)
-        video_queue_count = sum(1 for item in POST_QUEUE if item.get("type") == "video")
+        video_queue_count = POST_QUEUE.count("video")
+        
+        # [RENDER_POOL] Сколько роликов рендерится прямо сейчас
+        render_stats = RENDER_POOL.stats()
+        upload_stats = SUPABASE_UPLOADER.stats()
+        openai_stats = OPENAI_SCHEDULER.stats() if OPENAI_SCHEDULER else None
+        try:
+            toptext_stats = TOPTEXT_CACHE.stats()
+        except Exception:
+            toptext_stats = None
+        try:
+            timing_lines = await asyncio.to_thread(stage_timing_lines, pytime.time() - 24 * 3600, 5)
+        except Exception:
+            timing_lines = []
         
         # Формируем красивое сообщение
         status_message = (
@@ -7844,9 +8687,67 @@ async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             f"● Интервал: {interval_minutes} мин.\n"
             f"● СЛЕДУЮЩИЙ ПОСТ ЧЕРЕЗ: {time_remaining}\n"
             f"● Готовых HD-видео (склад): {ready_count}/5\n"
+            f"● Склад: с JSON {ready_stats['with_meta']}, в Supabase {ready_stats['preuploaded']}, "
+            f"{ready_stats['total_mb']} MB, старейший {ready_stats['oldest_age_h']} ч\n"
             f"● Видео в очереди (база): {video_queue_count}\n"
             f"● Всего в очереди: {queue_count}\n"
+            f"● Рендер: {len(CONVEYOR_TASKS)}/{RENDER_POOL.slots} в работе "
+            f"(готово {render_stats['completed']}, ошибок {render_stats['failed']})\n"
+            f"● Supabase: {upload_stats['uploads_ok']} загр., {upload_stats['avg_mbps']} MB/s, "
+            f"повторов {upload_stats['retries']}, докачек {upload_stats['resumes']}\n"
         )
+        asset_stats = ASSET_REGISTRY.stats()
+        if asset_stats["backgrounds"]:
+            status_message += (
+                f"● Фоны: {asset_stats['decoded']}/{asset_stats['backgrounds']} в памяти, "
+                f"{asset_stats['memory_mb']}/{asset_stats['max_mb']} MB\n"
+            )
+        if toptext_stats:
+            status_message += (
+                f"● Кэш TOPTEXT: {toptext_stats['entries']} PNG, {toptext_stats['size_mb']} MB, "
+                f"попаданий {toptext_stats['hits']}/{toptext_stats['hits'] + toptext_stats['misses']}\n"
+            )
+        probe_stats = MEDIA_PROBE.stats()
+        if probe_stats["hits"] + probe_stats["disk_hits"] + probe_stats["misses"]:
+            status_message += (
+                f"● ffprobe кэш: {probe_stats['disk_entries']} файлов, "
+                f"попаданий {probe_stats['hits'] + probe_stats['disk_hits']}, вызовов ffprobe {probe_stats['misses']}\n"
+            )
+        hash_stats = FILE_HASHES.stats()
+        if hash_stats["hits"] + hash_stats["misses"]:
+            status_message += (
+                f"● Хэши исходников: попаданий {hash_stats['hits']}/{hash_stats['hits'] + hash_stats['misses']}, "
+                f"{hash_stats['avg_hash_ms']} мс на файл\n"
+            )
+        fp_stats = VIDEO_FP.stats()
+        if fp_stats["checks"]:
+            status_message += (
+                f"● Отпечатки видео: {fp_stats['videos']} исходников, проверок {fp_stats['checks']}, "
+                f"дублей {fp_stats['duplicates']}, {fp_stats['avg_fingerprint_s']}с на ролик\n"
+            )
+        dedup_stats = TEXT_DEDUP.stats()
+        if dedup_stats["queries"]:
+            embed_stats = EMBED_STORE.stats()
+            status_message += (
+                f"● Антидубль текста: {dedup_stats['entries']} в индексе, проверок {dedup_stats['queries']}, "
+                f"дублей без сети {dedup_stats['duplicates']}, {dedup_stats['avg_query_ms']} мс\n"
+                f"● Эмбеддинги ({embed_stats['store']}): {embed_stats['vectors']} векторов, "
+                f"{embed_stats['size_mb']} MB, поиск {embed_stats['avg_search_ms']} мс\n"
+            )
+        if max(PLAN_B_BUDGET.values()) > 0:
+            variant_stats = PLAN_B_VARIANTS.stats()
+            status_message += (
+                f"● План Б: {variant_stats['variants']} вариантов, {variant_stats['total_mb']} MB, "
+                f"рендерится {len(_PLAN_B_INFLIGHT)} (IG {PLAN_B_BUDGET['ig']}, FB {PLAN_B_BUDGET['fb']})\n"
+            )
+        if openai_stats:
+            status_message += (
+                f"● OpenAI: {openai_stats['in_flight']}/{openai_stats['max_concurrency']} в работе, "
+                f"вызовов {openai_stats['calls']}, ожидание {openai_stats['avg_wait_s']}с, "
+                f"ответ {openai_stats['avg_call_s']}с, таймаутов {openai_stats['timeouts']}\n"
+            )
+        if timing_lines:
+            status_message += "● Этапы (24ч, p95):\n" + "".join(f"   {line}\n" for line in timing_lines)
         
         await update.message.reply_text(
             status_message,
@@ -7864,6 +8765,16 @@ async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
 
 async def handle_channel_post(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    # [POST_QUEUE] Билет — до первого await: при concurrent_updates посты обрабатываются
+    # параллельно, но в POST_QUEUE встают в порядке прихода, а не завершения обработки
+    ticket = CHANNEL_POST_ORDER.take()
+    try:
+        await _handle_channel_post(update, context, ticket)
+    finally:
+        CHANNEL_POST_ORDER.release(ticket)
+
+
+async def _handle_channel_post(update: Update, context: ContextTypes.DEFAULT_TYPE, ticket: int) -> None:
     msg = update.channel_post
     if not msg:
         return
@@ -8181,6 +9092,8 @@ async def handle_channel_post(update: Update, context: ContextTypes.DEFAULT_TYPE
             # No local_path (TG too big case) - but can still publish to IG/FB via file_id
             log.info("[QUEUE] No local_path (TG file too big), but will queue for IG/FB via file_id")
     
+    if not await CHANNEL_POST_ORDER.wait_turn(ticket, CHANNEL_POST_ORDER_TIMEOUT):
+        log.warning(f"[QUEUE] earlier posts still processing after {CHANNEL_POST_ORDER_TIMEOUT:.0f}s, queueing message_id={message_id} now")
     log.info("Queue push type=%s size_before=%s", item["type"], len(POST_QUEUE))
     # ✅ Дополнительная диагностика для видео с local_path
     if item.get("type") == "video" and item.get("local_path"):
@@ -8189,15 +9102,18 @@ async def handle_channel_post(update: Update, context: ContextTypes.DEFAULT_TYPE
     # === ДЕДУПЛИКАЦИЯ: Убиваем дубликаты по file_id перед очередью ===
     current_file_id = item.get("file_id")
     if current_file_id and current_file_id != "instagram_source":
-        # Ищем в очереди если уже есть item с ТАКИМ же file_id
-        for idx, existing_item in enumerate(POST_QUEUE):
-            if existing_item.get("file_id") == current_file_id:
-                log.info(f"[DEDUP_QUEUE] Found duplicate file_id={current_file_id} at queue[{idx}]")
-                log.info(f"[DEDUP_QUEUE] Removing old item: id={existing_item.get('id')} caption={repr(existing_item.get('caption', '')[:50])}")
-                POST_QUEUE.pop(idx)
-                log.info(f"[DEDUP_QUEUE] Removed. New item will be added instead.")
-                break
-    
+        # Ищем в очереди если уже есть item с ТАКИМ же file_id (индекс POST_QUEUE)
+        existing_item = POST_QUEUE.pop_duplicate(file_id=current_file_id)
+        if existing_item is not None:
+            log.info(f"[DEDUP_QUEUE] Found duplicate file_id={current_file_id} in queue")
+            log.info(f"[DEDUP_QUEUE] Removed old item: id={existing_item.get('id')} caption={repr((existing_item.get('caption') or '')[:50])}")
+            log.info(f"[DEDUP_QUEUE] New item will be added instead.")
+    elif not current_file_id and dedup_key:
+        # Пост без file_id (carousel_pending): тот же текст уже ждёт в очереди
+        existing_item = POST_QUEUE.pop_duplicate(dedup_key=dedup_key)
+        if existing_item is not None:
+            log.info(f"[DEDUP_QUEUE] Replaced queued text with same dedup_key: id={existing_item.get('id')}")
+
     log.info(f"[PIPE] ENQUEUE type={item.get('type')} id={item.get('id')} file_id={item.get('file_id')}")
     
     # === ЛОГИРОВАНИЕ СВЯЗКИ: video ↔ post_data ===
@@ -8267,11 +9183,17 @@ def main() -> None:
         log.error(f"[LOCK] {e}")
         return
 
+    migrate_json_state()
     load_queue()
     load_seen()
     load_published_keys()
     load_stats()
     load_published_texts()
+    # [TEXT_DEDUP] Первый запуск: индекс наполняется сохранённым окном публикаций
+    try:
+        TEXT_DEDUP.add_many(PUBLISHED_TEXTS)
+    except Exception as e:
+        log.warning(f"[TEXT_DEDUP] backfill failed: {e}")
     load_last_post_time()
     
     # === [BOOTSTRAP] Загрузка данных с диска при старте ===
@@ -8286,7 +9208,7 @@ def main() -> None:
     global STARTUP_AT
     STARTUP_AT = pytime.time()
     log.info(f"[STARTUP] at={STARTUP_AT}")
-    video_count = sum(1 for it in POST_QUEUE if it.get("type") == "video")
+    video_count = POST_QUEUE.count("video")
     est_hours = (video_count + 59) // 60  # 1 per hour -> videos count hours
     log.info(f"INFO | [QUEUE] Found {video_count} posts for Instagram. Estimated completion time: {est_hours} hours.")
 
@@ -8315,12 +9237,10 @@ def main() -> None:
         
         # 🔄 STARTUP SYNC: фиксируем количество готовых файлов на диске
         try:
-            ready_files = list(READY_TO_PUBLISH_DIR.glob("*.mp4"))
-            json_files = list(READY_TO_PUBLISH_DIR.glob("*.json"))
-            n_mp4 = len(ready_files)
-            n_json = len(json_files)
+            n_mp4 = READY_INDEX.count() if READY_INDEX.scans else READY_INDEX.scan()
+            n_json = READY_INDEX.count(with_meta=True)
             log.info(f"[READY_SCAN] dir={READY_TO_PUBLISH_DIR} exists={READY_TO_PUBLISH_DIR.exists()} mp4={n_mp4} json={n_json}")
-            if ready_files:
+            if n_mp4:
                 log.info("[STARTUP] Use /postnow or wait for schedule to publish existing ready files.")
             else:
                 log.warning("[STARTUP] No ready files found on disk.")
@@ -8348,13 +9268,14 @@ def main() -> None:
         
         # AUTO-PURGE: Удаляем слишком тяжелые файлы из ready_to_publish
         try:
-            ready_files = list(READY_TO_PUBLISH_DIR.glob("*.mp4"))
             purged_count = 0
-            for ready_file in ready_files:
-                file_size_mb = ready_file.stat().st_size / (1024 * 1024)
+            for ready_entry in READY_INDEX.entries():
+                ready_file = ready_entry.mp4
+                file_size_mb = ready_entry.size / (1024 * 1024)
                 if file_size_mb > 95:
                     log.warning(f"[AUTO-PURGE] Deleting oversized file: {ready_file.name} ({file_size_mb:.2f} MB)")
                     ready_file.unlink()
+                    READY_INDEX.discard(ready_file)
                     # Удаляем метаданные тоже (READY_META_EXT_FIX: try both formats)
                     meta_file_a = ready_file.with_suffix('.json')
                     meta_file_b = ready_file.with_suffix('.mp4.json')
@@ -8415,14 +9336,49 @@ def main() -> None:
             
             asyncio.create_task(history_log_scheduler())
             log.info("[WORKER] history_log_scheduler started OK")
+
+            asyncio.create_task(supabase_cleanup_scheduler())
+            log.info("[WORKER] supabase_cleanup_scheduler started OK")
+
+            # [EMBED_STORE] Бэкфилл эмбеддингов сохранённого окна публикаций (только недостающие)
+            _spawn_embed_task(index_published_embeddings(list(PUBLISHED_TEXTS)))
+
+            ready_watch_mode = READY_INDEX.start_watch(READY_INDEX_RECONCILE_SECONDS)
+            log.info(f"[WORKER] ready index reconcile started OK (mode={ready_watch_mode})")
+
+            # [ASSETS] Декодируем фоны в фоне, чтобы не задерживать старт бота
+            asyncio.create_task(asyncio.to_thread(ASSET_REGISTRY.load))
+            log.info("[WORKER] asset registry preload started OK")
             
             asyncio.create_task(maintain_ready_posts_worker(app))  # CONVEYOR worker
             log.info("[WORKER] maintain_ready_posts_worker (CONVEYOR) started OK")
+
+            if PLAN_B_PRERENDER and max(PLAN_B_BUDGET.values()) > 0:
+                asyncio.create_task(plan_b_prerender_worker())
+                log.info("[WORKER] plan_b_prerender_worker started OK")
             
             log.info("[WORKER_START] all workers started successfully")
         
         log.info("[CONVEYOR] All workers started. Waiting for /postnow command or scheduled publish time.")
 
+    async def post_shutdown(app: Application) -> None:
+        # [RENDER_POOL] Снимаем незапущенные рендеры и гасим процессы-воркеры
+        try:
+            RENDER_POOL.shutdown(cancel_pending=True)
+        except Exception as e:
+            log.warning(f"[RENDER_POOL] shutdown error: {e}")
+        # [GRAPH_CLIENT] Закрываем пул соединений к Graph API
+        try:
+            await GRAPH_CLIENT.aclose()
+        except Exception as e:
+            log.warning(f"[GRAPH_CLIENT] close error: {e}")
+        # [OPENAI_SCHED] Закрываем HTTP-пул async-клиента OpenAI
+        if OPENAI_SCHEDULER:
+            try:
+                await OPENAI_SCHEDULER.client.close()
+            except Exception as e:
+                log.warning(f"[OPENAI_SCHED] close error: {e}")
+
     app = (
         Application.builder()
         .token(TELEGRAM_BOT_TOKEN)
@@ -8431,6 +9387,8 @@ def main() -> None:
         .pool_timeout(60)
         .write_timeout(60)
         .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .concurrent_updates(TG_CONCURRENT_UPDATES if TG_CONCURRENT_UPDATES > 1 else False)
         .build()
     )
     
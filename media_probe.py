@@ -0,0 +1,261 @@
+# media_probe.py
+# === [MEDIA_PROBE] Метаданные медиафайлов: один ffprobe на файл ===
+# Длительность и размеры ролика считались по нескольку раз: _ffprobe_duration_sec
+# в ensure_max_50mb (на каждой публикации и в PREUPLOAD), ffmpeg_render.probe_media
+# в ffmpeg-движке и на каждом перезапуске Плана Б, отдельный ffprobe для озвучки.
+# Здесь: один вызов ffprobe -of json на файл, разбор потоков (кодеки, fps, поворот,
+# битрейт), кэш в памяти + таблица media_probe в state.db рядом с media_state. Ключ — путь,
+# размер и mtime: файл перезаписали (MAX50, AUTO-COMPRESS) — ключ другой.
+
+import json
+import logging
+import sqlite3
+import subprocess
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from state_store import ProcessConnection
+
+log = logging.getLogger("auto_telegramm")
+
+# Поднять при изменении parse_ffprobe — старые записи перестанут совпадать
+PROBE_VERSION = "1"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS media_probe (
+    key        TEXT PRIMARY KEY,
+    path       TEXT NOT NULL,
+    data       TEXT NOT NULL,
+    created_at INTEGER NOT NULL,
+    last_used  INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_media_probe_last_used ON media_probe(last_used);
+"""
+
+
+class MediaProbeError(RuntimeError):
+    """ffprobe не смог прочитать файл."""
+
+
+def _rate(value: str | None) -> float:
+    """'30000/1001' -> 29.97; '0/0' и мусор -> 0.0."""
+    try:
+        num, _, den = (value or "").partition("/")
+        num, den = float(num), float(den or 1)
+        return round(num / den, 3) if den else 0.0
+    except ValueError:
+        return 0.0
+
+
+def _int(value) -> int:
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return 0
+
+
+def _float(value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _rotation(stream: dict) -> int:
+    # Старый ffmpeg: tags.rotate; новый: side_data_list[].rotation (displaymatrix, знак обратный)
+    rotate = (stream.get("tags") or {}).get("rotate")
+    if rotate is not None:
+        return _int(rotate) % 360
+    for side in stream.get("side_data_list") or []:
+        if "rotation" in side:
+            return (-_int(side["rotation"])) % 360
+    return 0
+
+
+def parse_ffprobe(data: dict) -> dict:
+    """
+    Разбор ffprobe -show_format -show_streams. width/height — как кадр будет показан
+    (ffmpeg автоповорачивает при декодировании), coded_* — как записан в потоке.
+    """
+    info = {
+        "has_video": False,
+        "has_audio": False,
+        "width": 0,
+        "height": 0,
+        "coded_width": 0,
+        "coded_height": 0,
+        "rotation": 0,
+        "fps": 0.0,
+        "video_codec": "",
+        "audio_codec": "",
+        "sample_rate": 44100,
+        "channels": 0,
+        "duration": 0.0,
+        "bit_rate": 0,
+        "video_bit_rate": 0,
+        "format": "",
+        "streams": [],
+    }
+    for st in data.get("streams") or []:
+        kind = st.get("codec_type")
+        info["streams"].append({"index": st.get("index"), "type": kind, "codec": st.get("codec_name") or ""})
+        if kind == "video" and not info["has_video"]:
+            # Обложка mp3/m4a приходит как video-поток с attached_pic — это не видео
+            if (st.get("disposition") or {}).get("attached_pic"):
+                continue
+            info["has_video"] = True
+            info["coded_width"] = _int(st.get("width"))
+            info["coded_height"] = _int(st.get("height"))
+            info["rotation"] = _rotation(st)
+            if info["rotation"] in (90, 270):
+                info["width"], info["height"] = info["coded_height"], info["coded_width"]
+            else:
+                info["width"], info["height"] = info["coded_width"], info["coded_height"]
+            info["fps"] = _rate(st.get("avg_frame_rate")) or _rate(st.get("r_frame_rate"))
+            info["video_codec"] = st.get("codec_name") or ""
+            info["video_bit_rate"] = _int(st.get("bit_rate"))
+            info["duration"] = max(info["duration"], _float(st.get("duration")))
+        elif kind == "audio" and not info["has_audio"]:
+            info["has_audio"] = True
+            info["audio_codec"] = st.get("codec_name") or ""
+            info["sample_rate"] = _int(st.get("sample_rate")) or 44100
+            info["channels"] = _int(st.get("channels"))
+    fmt = data.get("format") or {}
+    info["duration"] = _float(fmt.get("duration")) or info["duration"]
+    info["bit_rate"] = _int(fmt.get("bit_rate"))
+    info["format"] = fmt.get("format_name") or ""
+    return info
+
+
+def run_ffprobe(path: str | Path, timeout: float = 60) -> dict:
+    """Один вызов ffprobe, без кэша."""
+    cmd = ["ffprobe", "-v", "error", "-show_format", "-show_streams", "-of", "json", str(path)]
+    try:
+        out = subprocess.check_output(cmd, stderr=subprocess.STDOUT, timeout=timeout)
+        data = json.loads(out.decode("utf-8", "ignore") or "{}")
+    except Exception as e:
+        raise MediaProbeError(f"ffprobe failed for {path}: {e}") from e
+    return parse_ffprobe(data)
+
+
+def usable_video_problem(info: dict) -> str | None:
+    """Причина, по которой файл нельзя рендерить, или None."""
+    if not info.get("has_video"):
+        return "no video stream"
+    if not info.get("width") or not info.get("height"):
+        return "zero frame size"
+    if (info.get("duration") or 0.0) <= 0.0:
+        return "zero duration"
+    return None
+
+
+class MediaProbe:
+    """
+    Один экземпляр на процесс; SQLite общий для процессов RENDER_POOL
+    (соединение открывается заново в каждом процессе).
+    """
+
+    def __init__(self, db_path: str | Path, *, memory_entries: int = 512, max_entries: int = 20000):
+        self.db_path = Path(db_path)
+        self.memory_entries = memory_entries
+        self.max_entries = max_entries
+        self._memory: OrderedDict[str, dict] = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = ProcessConnection(self.db_path, _SCHEMA)
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(path: str | Path) -> str:
+        """Путь + размер + mtime; FileNotFoundError, если файла нет."""
+        p = Path(path)
+        st = p.stat()
+        return f"{PROBE_VERSION}|{p.resolve()}|{st.st_size}|{st.st_mtime_ns}"
+
+    def probe(self, path: str | Path) -> dict:
+        """Метаданные файла (копия). MediaProbeError — ffprobe не справился, FileNotFoundError — файла нет."""
+        key = self.make_key(path)
+        with self._lock:
+            cached = self._memory.get(key)
+            if cached is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return dict(cached)
+            try:
+                row = self._db().execute("SELECT data FROM media_probe WHERE key = ?", (key,)).fetchone()
+            except sqlite3.Error as e:
+                log.warning(f"[MEDIA_PROBE] cache read failed: {e}")
+                row = None
+            if row is not None:
+                info = json.loads(row[0])
+                self.disk_hits += 1
+                self._remember(key, info)
+                self._touch(key)
+                return dict(info)
+            self.misses += 1
+        t0 = time.perf_counter()
+        info = run_ffprobe(path)
+        log.info(
+            f"[MEDIA_PROBE] {Path(path).name}: {info['width']}x{info['height']} rot={info['rotation']} "
+            f"{info['duration']:.2f}s {info['fps']}fps {info['video_codec'] or '-'}/{info['audio_codec'] or '-'} "
+            f"({(time.perf_counter() - t0) * 1000:.0f}ms)"
+        )
+        with self._lock:
+            self._remember(key, info)
+            try:
+                now = int(time.time())
+                self._db().execute(
+                    "INSERT OR REPLACE INTO media_probe(key, path, data, created_at, last_used) VALUES(?, ?, ?, ?, ?)",
+                    (key, str(Path(path).resolve()), json.dumps(info, ensure_ascii=False), now, now),
+                )
+                self._trim_locked()
+            except sqlite3.Error as e:
+                log.warning(f"[MEDIA_PROBE] cache write failed: {e}")
+        return dict(info)
+
+    def duration(self, path: str | Path) -> float:
+        """Длительность в секундах, 0.0 при любой ошибке (как старый _ffprobe_duration_sec)."""
+        try:
+            return float(self.probe(path)["duration"] or 0.0)
+        except Exception:
+            return 0.0
+
+    def _remember(self, key: str, info: dict) -> None:
+        self._memory[key] = info
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _touch(self, key: str) -> None:
+        try:
+            self._db().execute("UPDATE media_probe SET last_used = ? WHERE key = ?", (int(time.time()), key))
+        except sqlite3.Error:
+            pass
+
+    def _trim_locked(self) -> None:
+        db = self._db()
+        count = db.execute("SELECT COUNT(*) FROM media_probe").fetchone()[0]
+        if count > self.max_entries:
+            db.execute(
+                "DELETE FROM media_probe WHERE key IN (SELECT key FROM media_probe ORDER BY last_used ASC LIMIT ?)",
+                (count - self.max_entries,),
+            )
+
+    def stats(self) -> dict:
+        with self._lock:
+            try:
+                entries = self._db().execute("SELECT COUNT(*) FROM media_probe").fetchone()[0]
+            except sqlite3.Error:
+                entries = None
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.disk_hits) / lookups, 3) if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "disk_entries": entries,
+            }
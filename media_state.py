@@ -0,0 +1,113 @@
+# media_state.py
+# === [MEDIA_STATE] Атомарные обновления состояния медиа (дедуп рендера по хешу) ===
+# Старый _media_state_lock_guard крутился на os.O_EXCL с pytime.sleep(0.05) прямо в
+# event loop и через 5с шёл дальше «without lock»; чтение было вне блокировки, а
+# запись — неатомарной. Здесь: advisory-блокировка ОС (fcntl.flock / msvcrt на Windows)
+# + read-modify-write одной записи в одной транзакции SQLite; async-обёртки уводят
+# ожидание блокировки в поток, чтобы не держать loop.
+
+import asyncio
+import logging
+import os
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+from state_store import StateStore
+
+log = logging.getLogger("auto_telegramm")
+
+UpdateFn = Callable[[Optional[dict]], Optional[dict]]
+
+
+@contextmanager
+def os_file_lock(lock_path: str | Path, timeout: float = 30.0):
+    """
+    Эксклюзивная advisory-блокировка файла. Ждёт до timeout секунд (потом TimeoutError) —
+    вызывать из потока, не из event loop. Снимается ОС автоматически, если процесс упал.
+    """
+    lock_path = Path(lock_path)
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    fd = os.open(str(lock_path), os.O_RDWR | os.O_CREAT, 0o644)
+    started = time.monotonic()
+    delay = 0.01
+    try:
+        # Неблокирующая попытка + повторы с ограничением: зависший держатель блокировки
+        # не должен вешать всех вызывающих навсегда
+        while True:
+            try:
+                if fcntl is not None:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                else:
+                    msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+                break
+            except OSError:
+                if time.monotonic() - started > timeout:
+                    log.warning(f"[MEDIA_STATE] lock busy > {timeout:g}s, giving up: {lock_path}")
+                    raise TimeoutError(f"media state lock busy > {timeout}s: {lock_path}")
+                time.sleep(delay)
+                delay = min(delay * 2, 0.25)
+        waited = time.monotonic() - started
+        if waited > 1.0:
+            log.info(f"[MEDIA_STATE] lock waited {waited:.2f}s")
+        yield
+    finally:
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            else:
+                os.lseek(fd, 0, os.SEEK_SET)
+                msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+        except OSError:
+            pass
+        os.close(fd)
+
+
+class MediaState:
+    """Состояние медиа поверх StateStore: get + атомарный update под блокировкой ОС."""
+
+    def __init__(self, store: StateStore, lock_path: str | Path):
+        self.store = store
+        self.lock_path = Path(lock_path)
+
+    def get(self, media_hash: str) -> dict:
+        if not media_hash:
+            return {}
+        return self.store.media_get(media_hash) or {}
+
+    def update(self, media_hash: str, fn: UpdateFn) -> Optional[dict]:
+        """
+        fn(entry | None) -> новая запись | None (удалить).
+        Чтение, решение и запись идут под одной блокировкой и в одной транзакции:
+        два конвейерных задания с одним хешем не смогут оба «захватить» ролик.
+        """
+        if not media_hash:
+            return None
+        with os_file_lock(self.lock_path):
+            return self.store.media_update(media_hash, fn)
+
+    def put(self, media_hash: str, entry: dict) -> None:
+        self.update(media_hash, lambda _current: entry)
+
+    def delete(self, media_hash: str) -> None:
+        self.update(media_hash, lambda _current: None)
+
+    # --- async: ожидание блокировки не держит event loop ---
+    async def aget(self, media_hash: str) -> dict:
+        return await asyncio.to_thread(self.get, media_hash)
+
+    async def aupdate(self, media_hash: str, fn: UpdateFn) -> Optional[dict]:
+        return await asyncio.to_thread(self.update, media_hash, fn)
+
+    async def aput(self, media_hash: str, entry: dict) -> None:
+        await asyncio.to_thread(self.put, media_hash, entry)
+
+    async def adelete(self, media_hash: str) -> None:
+        await asyncio.to_thread(self.delete, media_hash)
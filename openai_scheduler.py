@@ -0,0 +1,164 @@
+# openai_scheduler.py
+# === [OPENAI_SCHED] Асинхронный OpenAI с ограничением параллельности и rate limit ===
+# translate_text, check_similar_content и detect_category_openai вызывали синхронный
+# openai_client.chat.completions.create прямо из async-кода: каждый запрос на 2-10с
+# замораживал цикл Telegram, а пачка постов из буфера переводилась строго по одному.
+# Здесь: общий AsyncOpenAI, семафор на число одновременных запросов, два token bucket
+# (запросы/мин и токены/мин) и таймаут на каждый вызов. Usage уходит в колбэк (log_tokens).
+
+import asyncio
+import logging
+import time
+from typing import Callable, Optional
+
+log = logging.getLogger("auto_telegramm")
+
+UsageCallback = Callable[[int, int, int], object]  # (prompt, completion, total)
+
+
+class TokenBucket:
+    """
+    Ведро на rate единиц в секунду с запасом capacity.
+    Баланс может уйти в минус (settle после ответа) — следующие вызовы подождут долг.
+    """
+
+    def __init__(self, rate_per_sec: float, capacity: float):
+        self.rate = max(1e-6, float(rate_per_sec))
+        self.capacity = max(1.0, float(capacity))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, amount: float = 1.0) -> float:
+        """Ждёт, пока в ведре наберётся amount (не больше capacity). Возвращает время ожидания."""
+        amount = min(float(amount), self.capacity)
+        waited = 0.0
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return waited
+                delay = (amount - self._tokens) / self.rate
+                waited += delay
+                await asyncio.sleep(delay)
+
+    def settle(self, delta: float) -> None:
+        """Поправка после ответа: delta > 0 — потратили больше оценки, < 0 — вернуть."""
+        self._refill()
+        self._tokens = min(self.capacity, self._tokens - delta)
+
+
+def estimate_tokens(messages: list, max_tokens: Optional[int]) -> int:
+    """Грубая оценка до запроса: ~3 символа на токен + лимит ответа."""
+    chars = 0
+    for msg in messages or []:
+        content = msg.get("content") if isinstance(msg, dict) else None
+        if isinstance(content, str):
+            chars += len(content)
+    return chars // 3 + 16 + int(max_tokens or 256)
+
+
+class OpenAIScheduler:
+    """
+    Один экземпляр на процесс. chat() безопасно вызывать из любого числа задач:
+    лишние ждут семафор и ведра, а не блокируют event loop.
+    """
+
+    def __init__(
+        self,
+        client,
+        *,
+        max_concurrency: int = 4,
+        requests_per_minute: float = 60,
+        tokens_per_minute: float = 150_000,
+        timeout: float = 60.0,
+        on_usage: Optional[UsageCallback] = None,
+    ):
+        self.client = client
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.timeout = timeout
+        self.on_usage = on_usage
+        self._sem = asyncio.Semaphore(self.max_concurrency)
+        self._rpm = TokenBucket(requests_per_minute / 60.0, max(1.0, requests_per_minute / 6))
+        self._tpm = TokenBucket(tokens_per_minute / 60.0, max(1.0, tokens_per_minute / 6))
+        self.in_flight = 0
+        self.metrics = {
+            "calls": 0,
+            "errors": 0,
+            "timeouts": 0,
+            "wait_seconds": 0.0,
+            "call_seconds": 0.0,
+            "max_in_flight": 0,
+        }
+
+    async def chat(self, *, tag: str = "OPENAI", timeout: Optional[float] = None, **kwargs):
+        """
+        Обёртка над client.chat.completions.create(**kwargs).
+        Бросает исключения SDK / asyncio.TimeoutError как есть — обработка у вызывающего.
+        """
+        estimate = estimate_tokens(kwargs.get("messages"), kwargs.get("max_tokens"))
+        return await self._call(tag, timeout, estimate, lambda t: self.client.chat.completions.create(timeout=t, **kwargs))
+
+    async def embeddings(self, *, tag: str = "EMBED", timeout: Optional[float] = None, **kwargs):
+        """Обёртка над client.embeddings.create(**kwargs) — те же семафор, вёдра и таймауты."""
+        inputs = kwargs.get("input")
+        texts = [inputs] if isinstance(inputs, str) else list(inputs or [])
+        estimate = sum(len(t) for t in texts if isinstance(t, str)) // 3 + 16
+        return await self._call(tag, timeout, estimate, lambda t: self.client.embeddings.create(timeout=t, **kwargs))
+
+    async def _call(self, tag: str, timeout: Optional[float], estimate: int, make_request):
+        call_timeout = float(timeout or self.timeout)
+        queued = time.perf_counter()
+        await self._rpm.acquire(1)
+        await self._tpm.acquire(estimate)
+        async with self._sem:
+            waited = time.perf_counter() - queued
+            self.in_flight += 1
+            self.metrics["max_in_flight"] = max(self.metrics["max_in_flight"], self.in_flight)
+            started = time.perf_counter()
+            try:
+                # timeout SDK — на одну HTTP-попытку; wait_for — жёсткий потолок на весь вызов с повторами SDK
+                resp = await asyncio.wait_for(make_request(call_timeout), timeout=call_timeout * 2 + 5)
+            except asyncio.TimeoutError:
+                self.metrics["timeouts"] += 1
+                self.metrics["errors"] += 1
+                self._tpm.settle(-estimate)
+                log.warning(f"[OPENAI_SCHED] {tag} timeout after {call_timeout:.0f}s")
+                raise
+            except Exception:
+                self.metrics["errors"] += 1
+                self._tpm.settle(-estimate)
+                raise
+            finally:
+                self.in_flight -= 1
+        elapsed = time.perf_counter() - started
+        self.metrics["calls"] += 1
+        self.metrics["wait_seconds"] += waited
+        self.metrics["call_seconds"] += elapsed
+
+        usage = getattr(resp, "usage", None)
+        if usage:
+            self._tpm.settle(usage.total_tokens - estimate)
+            if self.on_usage:
+                try:
+                    # У embeddings нет completion_tokens
+                    self.on_usage(usage.prompt_tokens, getattr(usage, "completion_tokens", 0) or 0, usage.total_tokens)
+                except Exception as e:
+                    log.warning(f"[OPENAI_SCHED] usage callback failed: {e}")
+        log.info(f"[OPENAI_SCHED] {tag} ok wait={waited:.2f}s call={elapsed:.2f}s in_flight={self.in_flight}")
+        return resp
+
+    def stats(self) -> dict:
+        snap = dict(self.metrics)
+        calls = snap["calls"] or 1
+        snap["avg_wait_s"] = round(snap["wait_seconds"] / calls, 2)
+        snap["avg_call_s"] = round(snap["call_seconds"] / calls, 2)
+        snap["in_flight"] = self.in_flight
+        snap["max_concurrency"] = self.max_concurrency
+        return snap
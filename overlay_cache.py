@@ -0,0 +1,154 @@
+# overlay_cache.py
+# === [TOPTEXT_CACHE] Контентно-адресуемый кэш PNG-плашек TOPTEXT ===
+# make_top_text_png уже считал MD5 от текста и размеров, но затем удалял
+# tmp_media/toptext_<hash>.png и рисовал заново. Plan B в post_worker до трёх раз
+# перезапускает process_video с тем же текстом — и каждый раз платил за Pillow.
+# Здесь: ключ = шрифт (путь + размер + mtime файла) + текст + параметры раскладки,
+# PNG лежат в отдельной папке, индекс и счётчики — в SQLite (общий для процессов
+# RENDER_POOL), объём ограничен, вытеснение по давности использования (LRU).
+
+import hashlib
+import logging
+import os
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from state_store import ProcessConnection
+
+log = logging.getLogger("auto_telegramm")
+
+# Поднять, если меняется сам рисунок плашки (цвета, тень, отступы) при тех же параметрах
+OVERLAY_LAYOUT_VERSION = "1"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS overlays (
+    key        TEXT PRIMARY KEY,
+    file       TEXT NOT NULL,
+    size       INTEGER NOT NULL,
+    created_at INTEGER NOT NULL,
+    last_used  REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_overlays_last_used ON overlays(last_used);
+CREATE TABLE IF NOT EXISTS counters (
+    name  TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+
+def font_identity(font_path: str | Path) -> str:
+    """Путь + размер + mtime: заменили файл шрифта под тем же именем — другой ключ."""
+    path = Path(font_path)
+    try:
+        st = path.stat()
+        return f"{path.resolve()}|{st.st_size}|{st.st_mtime_ns}"
+    except OSError:
+        return str(path)
+
+
+def make_key(text: str, *, font_path: str | Path, **layout) -> str:
+    """layout — все параметры, влияющие на картинку (width, height, font_size, ...)."""
+    parts = [OVERLAY_LAYOUT_VERSION, font_identity(font_path), text]
+    parts.extend(f"{name}={layout[name]}" for name in sorted(layout))
+    return hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()
+
+
+class OverlayCache:
+    """
+    Один экземпляр на процесс; каталог и индекс общие для всех процессов.
+    Файл, которым пользовались недавно (min_evict_age_seconds), не удаляется:
+    его может читать параллельный рендер.
+    """
+
+    def __init__(self, cache_dir: str | Path, *, max_bytes: int = 64 * 1024 * 1024, min_evict_age_seconds: float = 600):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.min_evict_age_seconds = min_evict_age_seconds
+        # Соединение на процесс: воркеры RENDER_POOL открывают своё
+        self._db = ProcessConnection(self.cache_dir / "index.db", _SCHEMA)
+        self._lock = threading.Lock()
+
+    def _count(self, name: str, value: int = 1) -> None:
+        self._db().execute(
+            "INSERT INTO counters(name, value) VALUES(?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+            (name, value),
+        )
+
+    def get(self, key: str) -> Path | None:
+        with self._lock:
+            db = self._db()
+            row = db.execute("SELECT file FROM overlays WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                path = self.cache_dir / row[0]
+                if path.exists():
+                    db.execute("UPDATE overlays SET last_used = ? WHERE key = ?", (time.time(), key))
+                    self._count("hits")
+                    return path
+                # Файл удалили мимо индекса
+                db.execute("DELETE FROM overlays WHERE key = ?", (key,))
+            self._count("misses")
+            return None
+
+    def put(self, key: str, image) -> Path:
+        """Сохраняет PIL.Image под ключом (tmp + os.replace) и возвращает путь."""
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        name = f"toptext_{key[:20]}.png"
+        path = self.cache_dir / name
+        tmp = self.cache_dir / f".{name}.{uuid.uuid4().hex[:8]}.tmp"
+        image.save(tmp, format="PNG")
+        os.replace(tmp, path)
+        size = path.stat().st_size
+        now = time.time()
+        with self._lock:
+            self._db().execute(
+                "INSERT OR REPLACE INTO overlays(key, file, size, created_at, last_used) VALUES(?, ?, ?, ?, ?)",
+                (key, name, size, int(now), now),
+            )
+            self._count("stores")
+            self._evict_locked()
+        return path
+
+    def _evict_locked(self) -> int:
+        db = self._db()
+        total = db.execute("SELECT COALESCE(SUM(size), 0) FROM overlays").fetchone()[0]
+        if total <= self.max_bytes:
+            return 0
+        cutoff = time.time() - self.min_evict_age_seconds
+        removed = 0
+        for key, name, size in db.execute(
+            "SELECT key, file, size FROM overlays WHERE last_used < ? ORDER BY last_used ASC", (cutoff,)
+        ).fetchall():
+            if total <= self.max_bytes:
+                break
+            try:
+                (self.cache_dir / name).unlink(missing_ok=True)
+            except OSError as e:
+                log.warning(f"[TOPTEXT_CACHE] failed to evict {name}: {e}")
+                continue
+            db.execute("DELETE FROM overlays WHERE key = ?", (key,))
+            total -= size
+            removed += 1
+        if removed:
+            self._count("evictions", removed)
+            log.info(f"[TOPTEXT_CACHE] evicted {removed} overlays, size now {total / (1024 * 1024):.1f}MB")
+        return removed
+
+    def stats(self) -> dict:
+        with self._lock:
+            db = self._db()
+            counters = dict(db.execute("SELECT name, value FROM counters").fetchall())
+            entries, total = db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM overlays").fetchone()
+        hits = counters.get("hits", 0)
+        lookups = hits + counters.get("misses", 0)
+        return {
+            "hits": hits,
+            "misses": counters.get("misses", 0),
+            "stores": counters.get("stores", 0),
+            "evictions": counters.get("evictions", 0),
+            "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+            "entries": entries,
+            "size_mb": round(total / (1024 * 1024), 1),
+        }
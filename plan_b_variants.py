@@ -0,0 +1,106 @@
+# plan_b_variants.py
+# === [PLAN_B_VARIANTS] Запасные версии готовых роликов для Плана Б ===
+# Когда Instagram отклонял ролик, post_worker прямо в пути публикации заново гнал
+# process_video (speed/фон/яркость чуть другие), заливал результат в Supabase и
+# пробовал ещё раз — публикация стояла минутами на каждом повторе. Здесь: варианты
+# рендерятся заранее (фоновым воркером, пока конвейер простаивает) или лениво в
+# RENDER_POOL и лежат на складе рядом с основным роликом — в ready_to_publish/_variants,
+# вне glob("*.mp4") склада и inotify READY_INDEX. Повтор Плана Б — только заливка и публикация.
+
+import logging
+import os
+import threading
+from pathlib import Path
+
+log = logging.getLogger("auto_telegramm")
+
+VARIANTS_SUBDIR = "_variants"
+# Тот же набор тёмных фонов, что у прежнего Плана Б в post_worker
+PLAN_B_PALETTE = [(0, 0, 0), (10, 10, 20), (20, 20, 30), (12, 8, 24), (6, 12, 18)]
+
+
+def variant_params(n: int) -> dict:
+    """
+    Параметры process_video для варианта n (0, 1, ...). Совпадают с прежним Планом Б:
+    вариант 0 = бывшая попытка 2 (speed 1.02, яркость +0.02), вариант 1 = попытка 3.
+    """
+    return {
+        "speed_multiplier": round(1.02 + n * 0.01, 3),
+        "bg_color_override": PLAN_B_PALETTE[(n + 1) % len(PLAN_B_PALETTE)],
+        "brightness_adjust": round(0.01 * (n + 2), 3),
+        "random_crop": True,
+    }
+
+
+class VariantStore:
+    """Файлы вариантов: <ready>/_variants/<stem>__pb<n>.mp4."""
+
+    def __init__(self, ready_dir: str | Path):
+        self.dir = Path(ready_dir) / VARIANTS_SUBDIR
+        self._lock = threading.Lock()
+
+    def path(self, primary: str | Path, n: int) -> Path:
+        return self.dir / f"{Path(primary).stem}__pb{n}.mp4"
+
+    def get(self, primary: str | Path, n: int) -> Path | None:
+        p = self.path(primary, n)
+        try:
+            return p if p.stat().st_size > 0 else None
+        except FileNotFoundError:
+            return None
+
+    def missing(self, primary: str | Path, budget: int) -> list[int]:
+        """Номера вариантов из бюджета, которых ещё нет на диске."""
+        return [n for n in range(budget) if self.get(primary, n) is None]
+
+    def store(self, primary: str | Path, n: int, rendered: str | Path) -> Path:
+        """Атомарно переносит результат рендера на место варианта n."""
+        dest = self.path(primary, n)
+        with self._lock:
+            self.dir.mkdir(parents=True, exist_ok=True)
+            os.replace(str(rendered), str(dest))
+        return dest
+
+    def discard(self, primary: str | Path) -> int:
+        """Удаляет все варианты ролика (опубликован, в архиве или удалён со склада)."""
+        stem = Path(primary).stem
+        removed = 0
+        with self._lock:
+            for p in self.dir.glob("*__pb*.mp4"):
+                if p.name.rpartition("__pb")[0] != stem:
+                    continue
+                try:
+                    p.unlink()
+                    removed += 1
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    log.warning(f"[PLAN_B_VARIANTS] failed to delete {p.name}: {e}")
+        if removed:
+            log.info(f"[PLAN_B_VARIANTS] discarded {removed} variant(s) of {Path(primary).name}")
+        return removed
+
+    def sweep(self, live_stems: set[str]) -> int:
+        """Удаляет варианты, чьих основных роликов на складе больше нет."""
+        removed = 0
+        with self._lock:
+            for p in self.dir.glob("*__pb*.mp4"):
+                if p.name.rpartition("__pb")[0] in live_stems:
+                    continue
+                try:
+                    p.unlink()
+                    removed += 1
+                except OSError:
+                    pass
+        if removed:
+            log.info(f"[PLAN_B_VARIANTS] swept {removed} orphan variant(s)")
+        return removed
+
+    def stats(self) -> dict:
+        files = []
+        for p in self.dir.glob("*__pb*.mp4"):
+            try:
+                files.append(p.stat().st_size)
+            except FileNotFoundError:
+                pass
+        return {"variants": len(files), "total_mb": round(sum(files) / (1024 * 1024), 1)}
@@ -0,0 +1,238 @@
+# post_queue.py
+# === [POST_QUEUE] Очередь постов с индексами ===
+# POST_QUEUE был простым deque словарей: дедуп по file_id в handle_channel_post и
+# load_ready_files_to_queue — линейный поиск + pop(idx), конвейер искал первое сырое
+# видео перебором и удалял его remove(), публикатор перебирал очередь в поисках поста
+# с нужным флагом voiceover, /status считал видео проходом по всей очереди.
+# Здесь: общий FIFO-порядок (OrderedDict по порядковому номеру), отдельные FIFO-полосы
+# по (type, voiceover, from_ready_folder), словари file_id/dedup_key -> элементы и
+# счётчики по типам. Постановка, выборка, дедуп и счёт — O(1).
+# Полоса и ключи фиксируются при постановке: правка полей элемента, уже лежащего
+# в очереди, его полосу не меняет.
+# Очередь ведёт журнал изменений с последнего сохранения (drain_changes) — save_queue
+# пишет в STATE_DB только его, не сериализуя всю очередь.
+# ArrivalOrder — постановка в порядке прихода апдейтов при параллельной обработке.
+
+import asyncio
+import itertools
+from collections import Counter, OrderedDict
+from typing import Iterable, Iterator
+
+Lane = tuple[str | None, bool, bool]
+
+
+def lane_of(item: dict) -> Lane:
+    """(type, voiceover, from_ready_folder) — полоса, в которую попадает элемент."""
+    return (item.get("type"), bool(item.get("voiceover", False)), bool(item.get("from_ready_folder", False)))
+
+
+class PostQueue:
+    """
+    Совместима с тем, как main.py пользовался deque: append/popleft/remove/clear,
+    len(), bool() и итерация в порядке постановки (её читает STATE_DB.queue_sync).
+    """
+
+    def __init__(self, items: Iterable[dict] = ()):
+        self._seq = itertools.count()
+        self._items: OrderedDict[int, dict] = OrderedDict()
+        # seq -> (полоса, file_id, dedup_key) на момент постановки
+        self._slots: dict[int, tuple[Lane, str | None, str | None]] = {}
+        self._by_obj: dict[int, int] = {}
+        self._lanes: dict[Lane, OrderedDict[int, None]] = {}
+        self._by_file_id: dict[str, OrderedDict[int, None]] = {}
+        self._by_dedup_key: dict[str, OrderedDict[int, None]] = {}
+        self._type_counts: Counter = Counter()
+        # Журнал с последнего drain_changes(): id(item) -> item
+        self._added: dict[int, dict] = {}
+        self._removed: dict[int, dict] = {}
+        self._cleared = False
+        for item in items:
+            self.append(item)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __bool__(self) -> bool:
+        return bool(self._items)
+
+    def __iter__(self) -> Iterator[dict]:
+        return iter(self._items.values())
+
+    def __contains__(self, item: dict) -> bool:
+        return id(item) in self._by_obj
+
+    @staticmethod
+    def _index_add(index: dict, key, seq: int) -> None:
+        if key:
+            index.setdefault(key, OrderedDict())[seq] = None
+
+    @staticmethod
+    def _index_remove(index: dict, key, seq: int) -> None:
+        if not key:
+            return
+        bucket = index.get(key)
+        if bucket is not None:
+            bucket.pop(seq, None)
+            if not bucket:
+                del index[key]
+
+    def append(self, item: dict) -> None:
+        """В конец очереди. Тот же словарь, уже стоящий в очереди, переносится в конец."""
+        if id(item) in self._by_obj:
+            self._discard(self._by_obj[id(item)])
+        seq = next(self._seq)
+        lane = lane_of(item)
+        file_id = item.get("file_id")
+        dedup_key = item.get("dedup_key")
+        self._items[seq] = item
+        self._slots[seq] = (lane, file_id, dedup_key)
+        self._by_obj[id(item)] = seq
+        self._lanes.setdefault(lane, OrderedDict())[seq] = None
+        self._index_add(self._by_file_id, file_id, seq)
+        self._index_add(self._by_dedup_key, dedup_key, seq)
+        self._type_counts[lane[0]] += 1
+        self._added[id(item)] = item
+
+    def _discard(self, seq: int) -> dict:
+        item = self._items.pop(seq)
+        lane, file_id, dedup_key = self._slots.pop(seq)
+        del self._by_obj[id(item)]
+        self._index_remove(self._lanes, lane, seq)
+        self._index_remove(self._by_file_id, file_id, seq)
+        self._index_remove(self._by_dedup_key, dedup_key, seq)
+        self._type_counts[lane[0]] -= 1
+        if not self._type_counts[lane[0]]:
+            del self._type_counts[lane[0]]
+        # Поставлен и убран между сохранениями — в хранилище его не было
+        if self._added.pop(id(item), None) is None:
+            self._removed[id(item)] = item
+        return item
+
+    def popleft(self) -> dict:
+        if not self._items:
+            raise IndexError("pop from an empty PostQueue")
+        return self._discard(next(iter(self._items)))
+
+    def remove(self, item: dict) -> None:
+        seq = self._by_obj.get(id(item))
+        if seq is None:
+            raise ValueError("item not in PostQueue")
+        self._discard(seq)
+
+    def clear(self) -> None:
+        self._items.clear()
+        self._slots.clear()
+        self._by_obj.clear()
+        self._lanes.clear()
+        self._by_file_id.clear()
+        self._by_dedup_key.clear()
+        self._type_counts.clear()
+        self._added.clear()
+        self._removed.clear()
+        self._cleared = True
+
+    def drain_changes(self) -> tuple[list[dict], list[dict], bool]:
+        """
+        (поставленные в конец — по порядку, убранные, была ли очистка) с прошлого вызова.
+        Элемент, убранный и поставленный снова, есть в обоих списках.
+        """
+        added = sorted(self._added.values(), key=lambda item: self._by_obj[id(item)])
+        removed = list(self._removed.values())
+        cleared = self._cleared
+        self._added.clear()
+        self._removed.clear()
+        self._cleared = False
+        return added, removed, cleared
+
+    def find(self, *, file_id: str | None = None, dedup_key: str | None = None) -> dict | None:
+        """Самый ранний элемент с этим file_id (или dedup_key)."""
+        index, key = (self._by_file_id, file_id) if file_id else (self._by_dedup_key, dedup_key)
+        bucket = index.get(key) if key else None
+        return self._items[next(iter(bucket))] if bucket else None
+
+    def pop_duplicate(self, *, file_id: str | None = None, dedup_key: str | None = None) -> dict | None:
+        """Убирает из очереди самый ранний элемент с этим file_id (или dedup_key)."""
+        item = self.find(file_id=file_id, dedup_key=dedup_key)
+        if item is not None:
+            self.remove(item)
+        return item
+
+    def pop_first(self, *, type: str | None = None, voiceover: bool | None = None, from_ready: bool | None = None) -> dict | None:
+        """
+        Самый ранний элемент среди полос, подходящих под фильтр (None — любое значение).
+        Полос единицы, поэтому сравниваются только их головы.
+        """
+        best = None
+        for (lane_type, lane_voiceover, lane_ready), seqs in self._lanes.items():
+            if type is not None and lane_type != type:
+                continue
+            if voiceover is not None and lane_voiceover != voiceover:
+                continue
+            if from_ready is not None and lane_ready != from_ready:
+                continue
+            head = next(iter(seqs))
+            if best is None or head < best:
+                best = head
+        return self._discard(best) if best is not None else None
+
+    def count(self, type: str | None = None) -> int:
+        """Число элементов данного типа (без аргумента — всего)."""
+        return len(self._items) if type is None else self._type_counts.get(type, 0)
+
+    def stats(self) -> dict:
+        return {
+            "total": len(self._items),
+            "by_type": dict(self._type_counts),
+            "lanes": {f"{t}/{'vo' if v else 'novo'}/{'ready' if r else 'raw'}": len(s) for (t, v, r), s in self._lanes.items()},
+        }
+
+
+class ArrivalOrder:
+    """
+    Порядок постановки в очередь = порядок прихода апдейтов. При concurrent_updates
+    handle_channel_post обрабатывает посты параллельно (перевод, скачивание), и короткий
+    пост закончил бы раньше длинного. Билет берётся при приходе апдейта, до первого await;
+    ставить в POST_QUEUE можно, когда все предыдущие билеты отпущены.
+    """
+
+    def __init__(self):
+        self._next_ticket = 0
+        self._serving = 0
+        self._released: set[int] = set()
+        self._changed: asyncio.Event | None = None
+
+    def take(self) -> int:
+        ticket = self._next_ticket
+        self._next_ticket += 1
+        return ticket
+
+    async def wait_turn(self, ticket: int, timeout: float) -> bool:
+        """Ждёт, пока все более ранние билеты отпущены. False — не дождались за timeout."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while self._serving < ticket:
+            if self._changed is None:
+                self._changed = asyncio.Event()
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return False
+            try:
+                await asyncio.wait_for(self._changed.wait(), remaining)
+            except asyncio.TimeoutError:
+                return False
+        return True
+
+    def release(self, ticket: int) -> None:
+        """Билет отработан (пост поставлен в очередь или отброшен) — в finally обработчика."""
+        self._released.add(ticket)
+        advanced = False
+        while self._serving in self._released:
+            self._released.discard(self._serving)
+            self._serving += 1
+            advanced = True
+        if advanced and self._changed is not None:
+            self._changed.set()
+            self._changed = None
+
+    def pending(self) -> int:
+        return self._next_ticket - self._serving
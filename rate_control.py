@@ -0,0 +1,118 @@
+# rate_control.py
+# === [RATE_CONTROL] Бюджет битрейта до кодирования ===
+# process_video писал CRF 18 (+ -b:v 6000k, который x264 при заданном CRF игнорирует),
+# размер файла заранее не знал никто: AUTO-COMPRESS потом пережимал CRF 22 и CRF 24,
+# а ensure_max_50mb в post_worker — ещё до двух раз. Итого до пяти кодирований ролика.
+# Здесь по итоговой длительности таймлайна считается бюджет видео-битрейта под лимит
+# платформы, и первое же кодирование в него укладывается:
+# - бюджет с запасом — прежнее качество CRF 18, но с потолком -maxrate/-bufsize;
+# - бюджет тесный — двухпроходный ABR точно в бюджет (MoviePy: однопроходный ABR с VBV).
+
+import logging
+from dataclasses import dataclass, field
+
+log = logging.getLogger("auto_telegramm")
+
+DEFAULT_AUDIO_BPS = 128_000
+# Доля лимита, которую разрешаем занять видео+аудио (mp4-контейнер, VBV-погрешность)
+DEFAULT_SAFETY = 0.90
+# Ниже этого бюджета CRF с жёстким потолком даёт блоки на динамичных сценах — лучше two-pass
+DEFAULT_TWO_PASS_BELOW_BPS = 3_000_000
+MIN_VIDEO_BPS = 300_000
+
+
+@dataclass
+class EncodePlan:
+    mode: str                  # "crf_capped" | "two_pass" | "abr_capped"
+    duration: float
+    max_bytes: int
+    video_kbps: int            # бюджет видео (maxrate для crf_capped, -b:v для two_pass/abr_capped)
+    audio_kbps: int
+    crf: int = 18
+    preset: str = "slow"
+    notes: list[str] = field(default_factory=list)
+
+    @property
+    def bufsize_kbps(self) -> int:
+        # Окно VBV в 1 секунду: размер не выходит за бюджет больше чем на секунду потока
+        return self.video_kbps
+
+    @property
+    def expected_max_mb(self) -> float:
+        total_kbps = self.video_kbps + self.audio_kbps
+        return round((total_kbps * 1000 / 8 * self.duration + self.bufsize_kbps * 1000 / 8) / (1024 * 1024), 1)
+
+    def rate_args(self) -> list[str]:
+        """Управление битрейтом для одного прохода (crf_capped / abr_capped), без кодека и preset."""
+        if self.mode == "crf_capped":
+            return [
+                "-crf", str(self.crf),
+                "-maxrate", f"{self.video_kbps}k", "-bufsize", f"{self.bufsize_kbps}k",
+                "-pix_fmt", "yuv420p",
+            ]
+        return [
+            "-b:v", f"{self.video_kbps}k",
+            "-maxrate", f"{self.video_kbps}k", "-bufsize", f"{self.bufsize_kbps * 2}k",
+            "-pix_fmt", "yuv420p",
+        ]
+
+    def video_args(self) -> list[str]:
+        """Аргументы видео + аудио-битрейт для одного прохода ffmpeg."""
+        return ["-c:v", "libx264", "-preset", self.preset, *self.rate_args(), "-b:a", f"{self.audio_kbps}k"]
+
+    def pass_args(self, pass_no: int, passlogfile: str) -> list[str]:
+        """Аргументы для прохода 1/2 двухпроходного кодирования."""
+        return [
+            "-c:v", "libx264", "-preset", self.preset, "-b:v", f"{self.video_kbps}k",
+            "-maxrate", f"{int(self.video_kbps * 1.5)}k", "-bufsize", f"{self.video_kbps * 2}k",
+            "-pix_fmt", "yuv420p", "-pass", str(pass_no), "-passlogfile", passlogfile,
+            "-b:a", f"{self.audio_kbps}k",
+        ]
+
+    def summary(self) -> dict:
+        return {
+            "mode": self.mode,
+            "duration": round(self.duration, 2),
+            "video_kbps": self.video_kbps,
+            "audio_kbps": self.audio_kbps,
+            "crf": self.crf if self.mode == "crf_capped" else None,
+            "limit_mb": round(self.max_bytes / (1024 * 1024), 1),
+            "expected_max_mb": self.expected_max_mb,
+        }
+
+
+def plan_encode(
+    duration: float,
+    max_bytes: int,
+    *,
+    audio_bps: int = DEFAULT_AUDIO_BPS,
+    crf: int = 18,
+    preset: str = "slow",
+    safety: float = DEFAULT_SAFETY,
+    two_pass_below_bps: int = DEFAULT_TWO_PASS_BELOW_BPS,
+    allow_two_pass: bool = True,
+) -> EncodePlan:
+    """
+    duration — итоговая длительность таймлайна (после ускорения, озвучки, паддинга).
+    allow_two_pass=False — для движков, которые не умеют два прохода (MoviePy): тогда ABR с VBV.
+    """
+    duration = max(0.5, float(duration or 0.0))
+    budget_total_bps = max_bytes * 8 * safety / duration
+    video_bps = max(MIN_VIDEO_BPS, budget_total_bps - audio_bps)
+    # bufsize = 1 секунда потока тоже входит в лимит
+    video_bps = max(MIN_VIDEO_BPS, video_bps * duration / (duration + 1.0))
+    plan = EncodePlan(
+        mode="crf_capped",
+        duration=duration,
+        max_bytes=max_bytes,
+        video_kbps=int(video_bps / 1000),
+        audio_kbps=int(audio_bps / 1000),
+        crf=crf,
+        preset=preset,
+    )
+    if video_bps < two_pass_below_bps:
+        plan.mode = "two_pass" if allow_two_pass else "abr_capped"
+        plan.notes.append(f"budget {plan.video_kbps}k < {two_pass_below_bps // 1000}k")
+    if video_bps <= MIN_VIDEO_BPS:
+        plan.notes.append("budget at floor — file may exceed limit")
+    return plan
@@ -0,0 +1,258 @@
+# ready_index.py
+# === [READY_INDEX] Индекс склада ready_to_publish в памяти ===
+# _pick_ready_fifo/_pick_ready_latest, конвейер и /status на каждом тике делали
+# glob("*.mp4") (иногда дважды), stat() каждого файла и проверку .json рядом.
+# Здесь склад сканируется один раз при старте, дальше конвейер и публикатор
+# сообщают об изменениях сами; выбор следующего ролика — вершина кучи по mtime.
+# Сверка с диском: inotify (если установлен inotify_simple) или редкий пересчёт.
+
+import heapq
+import itertools
+import json
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+
+log = logging.getLogger("auto_telegramm")
+
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
+
+
+@dataclass
+class ReadyEntry:
+    mp4: Path
+    meta_path: Path | None
+    size: int
+    mtime: float
+    meta: dict = field(default_factory=dict)
+
+    @property
+    def has_meta(self) -> bool:
+        return self.meta_path is not None
+
+
+def meta_path_for(mp4: Path) -> Path | None:
+    """Sidecar для mp4: <stem>.json или <name>.mp4.json (READY_META_EXT_FIX)."""
+    for candidate in (mp4.with_suffix(".json"), mp4.with_suffix(".mp4.json")):
+        if candidate.exists():
+            return candidate
+    return None
+
+
+def mp4_for_meta(meta_path: Path) -> Path:
+    name = meta_path.name
+    if name.endswith(".mp4.json"):
+        return meta_path.with_name(name[: -len(".json")])
+    return meta_path.with_suffix(".mp4")
+
+
+class ReadyIndex:
+    """
+    Две кучи (старые первыми / новые первыми) с ленивым удалением:
+    запись в куче валидна, только если её версия совпадает с версией в _entries.
+    """
+
+    def __init__(self, ready_dir: Path):
+        self.ready_dir = Path(ready_dir)
+        self._entries: dict[str, ReadyEntry] = {}
+        self._versions: dict[str, int] = {}
+        self._oldest: list[tuple[float, int, str, int]] = []
+        self._newest: list[tuple[float, int, str, int]] = []
+        self._seq = itertools.count()
+        self._lock = threading.RLock()
+        self.last_scan_at = 0.0
+        self.scans = 0
+        self._watch_thread: threading.Thread | None = None
+
+    # --- наполнение ---
+    def scan(self) -> int:
+        """Полная пересборка индекса по диску (старт и сверка). Возвращает число mp4."""
+        # glob и слияние под одной блокировкой: discard() публикатора между ними
+        # иначе вернул бы в индекс уже удалённый ролик
+        with self._lock:
+            entries: dict[str, ReadyEntry] = {}
+            for mp4 in self.ready_dir.glob("*.mp4"):
+                entry = self._build_entry(mp4)
+                if entry:
+                    entries[mp4.name] = entry
+            self._entries = {}
+            self._versions = {}
+            self._oldest = []
+            self._newest = []
+            for entry in entries.values():
+                self._put_locked(entry)
+            self.last_scan_at = time.time()
+            self.scans += 1
+        log.info(f"[READY_INDEX] scan dir={self.ready_dir} mp4={len(entries)} with_json={self.count(with_meta=True)}")
+        return len(entries)
+
+    def _build_entry(self, mp4: Path) -> ReadyEntry | None:
+        try:
+            st = mp4.stat()
+        except OSError:
+            return None
+        meta_path = meta_path_for(mp4)
+        meta: dict = {}
+        if meta_path:
+            try:
+                meta = json.loads(meta_path.read_text(encoding="utf-8"))
+            except Exception as exc:
+                log.warning(f"[READY_INDEX] failed to read meta {meta_path.name}: {exc}")
+        return ReadyEntry(mp4=mp4, meta_path=meta_path, size=st.st_size, mtime=st.st_mtime, meta=meta)
+
+    def _put_locked(self, entry: ReadyEntry) -> None:
+        key = entry.mp4.name
+        version = self._versions.get(key, 0) + 1
+        self._versions[key] = version
+        self._entries[key] = entry
+        seq = next(self._seq)
+        heapq.heappush(self._oldest, (entry.mtime, seq, key, version))
+        heapq.heappush(self._newest, (-entry.mtime, seq, key, version))
+        # Кучи с ленивым удалением растут — изредка ужимаем до живых записей
+        if len(self._oldest) > 4 * max(16, len(self._entries)):
+            self._compact_locked()
+
+    def _compact_locked(self) -> None:
+        self._oldest = [e for e in self._oldest if self._is_live(e)]
+        self._newest = [e for e in self._newest if self._is_live(e)]
+        heapq.heapify(self._oldest)
+        heapq.heapify(self._newest)
+
+    def _is_live(self, heap_item) -> bool:
+        _, _, key, version = heap_item
+        return key in self._entries and self._versions.get(key) == version
+
+    def add(self, mp4: str | Path) -> ReadyEntry | None:
+        """Конвейер: новый готовый ролик (или обновлённый sidecar)."""
+        entry = self._build_entry(Path(mp4))
+        if entry is None:
+            self.discard(mp4)
+            return None
+        with self._lock:
+            self._put_locked(entry)
+        return entry
+
+    def refresh_meta(self, meta_path: str | Path) -> None:
+        """Sidecar переписан (pre-upload, TTL) — перечитываем только его."""
+        mp4 = mp4_for_meta(Path(meta_path))
+        with self._lock:
+            known = mp4.name in self._entries
+        if known:
+            self.add(mp4)
+
+    def discard(self, mp4: str | Path) -> None:
+        """Публикатор/очистка: ролик ушёл со склада."""
+        key = Path(mp4).name
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self._versions[key] = self._versions.get(key, 0) + 1
+
+    # --- выбор ---
+    def _peek_locked(self, heap: list, require_meta: bool) -> ReadyEntry | None:
+        skipped = []
+        found = None
+        while heap:
+            item = heap[0]
+            if not self._is_live(item):
+                heapq.heappop(heap)
+                continue
+            entry = self._entries[item[2]]
+            if not entry.mp4.exists():
+                # Файл удалили мимо индекса — выкидываем
+                log.warning(f"[READY_INDEX] stale entry dropped: {entry.mp4.name}")
+                heapq.heappop(heap)
+                self.discard(entry.mp4)
+                continue
+            if require_meta and not entry.has_meta:
+                skipped.append(heapq.heappop(heap))
+                continue
+            found = entry
+            break
+        for item in skipped:
+            heapq.heappush(heap, item)
+        return found
+
+    def oldest(self, require_meta: bool = True) -> ReadyEntry | None:
+        with self._lock:
+            return self._peek_locked(self._oldest, require_meta)
+
+    def newest(self, require_meta: bool = True) -> ReadyEntry | None:
+        with self._lock:
+            return self._peek_locked(self._newest, require_meta)
+
+    # --- статистика ---
+    def count(self, with_meta: bool = False) -> int:
+        with self._lock:
+            if not with_meta:
+                return len(self._entries)
+            return sum(1 for e in self._entries.values() if e.has_meta)
+
+    def entries(self) -> list[ReadyEntry]:
+        with self._lock:
+            return list(self._entries.values())
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = list(self._entries.values())
+        return {
+            "mp4": len(entries),
+            "with_meta": sum(1 for e in entries if e.has_meta),
+            "preuploaded": sum(1 for e in entries if e.meta.get("supabase_url")),
+            "total_mb": round(sum(e.size for e in entries) / (1024 * 1024), 1),
+            "oldest_age_h": round((time.time() - min(e.mtime for e in entries)) / 3600, 1) if entries else 0.0,
+        }
+
+    # --- сверка с диском ---
+    def start_watch(self, interval: float = 300.0) -> str:
+        """
+        inotify (Linux + inotify_simple): пересчёт при любом изменении каталога.
+        Иначе — фоновый пересчёт раз в interval секунд. Возвращает режим.
+        """
+        if self._watch_thread and self._watch_thread.is_alive():
+            return "running"
+        mode = "inotify" if inotify_simple is not None else "poll"
+        target = self._watch_inotify if mode == "inotify" else self._watch_poll
+        self._watch_thread = threading.Thread(target=target, args=(interval,), name="ready-index-watch", daemon=True)
+        self._watch_thread.start()
+        log.info(f"[READY_INDEX] reconcile mode={mode}")
+        return mode
+
+    def _watch_poll(self, interval: float) -> None:
+        while True:
+            time.sleep(max(30.0, interval))
+            try:
+                self.scan()
+            except Exception as exc:
+                log.warning(f"[READY_INDEX] reconcile failed: {exc}")
+
+    def _watch_inotify(self, interval: float) -> None:
+        flags = inotify_simple.flags
+        ino = inotify_simple.INotify()
+        ino.add_watch(
+            str(self.ready_dir),
+            flags.CLOSE_WRITE | flags.MOVED_TO | flags.MOVED_FROM | flags.DELETE | flags.CREATE,
+        )
+        while True:
+            events = ino.read(timeout=int(interval * 1000), read_delay=500)
+            try:
+                if events:
+                    for ev in events:
+                        path = self.ready_dir / ev.name
+                        if ev.name.endswith(".mp4"):
+                            if ev.mask & (flags.DELETE | flags.MOVED_FROM):
+                                self.discard(path)
+                            else:
+                                self.add(path)
+                        elif ev.name.endswith(".json"):
+                            mp4 = mp4_for_meta(path)
+                            if mp4.exists():
+                                self.add(mp4)
+                else:
+                    self.scan()
+            except Exception as exc:
+                log.warning(f"[READY_INDEX] inotify reconcile failed: {exc}")
@@ -0,0 +1,156 @@
+# render_pool.py
+# === [RENDER_POOL] Пул процессов для рендера видео ===
+# process_video (MoviePy + write_videofile preset=slow) занимает минуты CPU.
+# Раньше он вызывался прямо в event loop и замораживал бота целиком:
+# handle_channel_post, /status, /postnow, scheduled_ready_worker.
+# Теперь рендер уходит в ProcessPoolExecutor, а конвейер только ждёт результат.
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import uuid
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+log = logging.getLogger("auto_telegramm")
+
+
+def default_render_workers() -> int:
+    """RENDER_WORKERS из ENV; по умолчанию половина ядер (минимум 1)."""
+    raw = os.getenv("RENDER_WORKERS", "").strip()
+    if raw:
+        try:
+            return max(0, int(raw))
+        except ValueError:
+            log.warning(f"[RENDER_POOL] bad RENDER_WORKERS={raw!r}, using default")
+    return max(1, (os.cpu_count() or 2) // 2)
+
+
+class RenderPool:
+    """
+    Обёртка над ProcessPoolExecutor:
+    - submit() ставит задачу и возвращает job_id
+    - wait(job_id) ждёт результат или пробрасывает исключение из воркера
+    - cancel(job_id) снимает задачу, если она ещё не начала выполняться
+    - workers=0 -> рендер в одном фоновом потоке, без процессов
+    """
+
+    def __init__(self, workers: int | None = None, max_tasks_per_child: int | None = None):
+        self.workers = default_render_workers() if workers is None else max(0, int(workers))
+        self.max_tasks_per_child = max_tasks_per_child
+        self._executor: Executor | None = None
+        self._jobs: dict[str, Future] = {}
+        self._labels: dict[str, str] = {}
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+
+    @property
+    def slots(self) -> int:
+        """Сколько рендеров конвейер может держать одновременно."""
+        return max(1, self.workers)
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.workers == 0:
+                # Режим без процессов: рендер в одном фоновом потоке, loop всё равно свободен
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="render")
+                log.info("[RENDER_POOL] started in thread mode (RENDER_WORKERS=0)")
+                return self._executor
+            # spawn: одинаково на Windows и Linux, не форкаем event loop и потоки бота
+            ctx = multiprocessing.get_context("spawn")
+            kwargs = {"max_workers": self.workers, "mp_context": ctx}
+            if self.max_tasks_per_child:
+                # MoviePy/ffmpeg течёт памятью — периодически пересоздаём воркер
+                kwargs["max_tasks_per_child"] = self.max_tasks_per_child
+            self._executor = ProcessPoolExecutor(**kwargs)
+            log.info(f"[RENDER_POOL] started workers={self.workers} max_tasks_per_child={self.max_tasks_per_child}")
+        return self._executor
+
+    def submit(self, fn, *args, label: str = "", **kwargs) -> str:
+        """Ставит fn(*args, **kwargs) в пул. fn и аргументы должны быть picklable."""
+        job_id = uuid.uuid4().hex[:12]
+        try:
+            self._jobs[job_id] = self._get_executor().submit(fn, *args, **kwargs)
+        except BrokenProcessPool:
+            # Воркер умер (OOM/краш ffmpeg) — пул непригоден, поднимаем новый
+            log.error("[RENDER_POOL] pool broken, restarting executor")
+            self._executor = None
+            self._jobs[job_id] = self._get_executor().submit(fn, *args, **kwargs)
+        self._labels[job_id] = label
+        self.submitted += 1
+        log.info(f"[RENDER_POOL] submit job={job_id} label={label} active={self.active_count()}")
+        return job_id
+
+    async def wait(self, job_id: str):
+        """Ждёт завершения задачи, не блокируя event loop. Возвращает результат или бросает исключение."""
+        fut = self._jobs.get(job_id)
+        if fut is None:
+            raise KeyError(f"unknown render job {job_id}")
+        try:
+            result = await asyncio.wrap_future(fut)
+            self.completed += 1
+            log.info(f"[RENDER_POOL] done job={job_id} label={self._labels.get(job_id, '')}")
+            return result
+        except asyncio.CancelledError:
+            # Корутина конвейера отменена — снимаем задачу из пула, если ещё не стартовала.
+            # Сюда же приходит отмена через cancel(): считаем снятые задачи только здесь
+            fut.cancel()
+            if fut.cancelled():
+                self.cancelled += 1
+            raise
+        except BrokenProcessPool:
+            self.failed += 1
+            self._executor = None
+            log.error(f"[RENDER_POOL] job={job_id} lost: worker process died")
+            raise
+        except Exception as e:
+            self.failed += 1
+            log.error(f"[RENDER_POOL] job={job_id} failed: {type(e).__name__}: {e}")
+            raise
+        finally:
+            self._jobs.pop(job_id, None)
+            self._labels.pop(job_id, None)
+
+    async def run(self, fn, *args, label: str = "", **kwargs):
+        """submit + wait одним вызовом."""
+        return await self.wait(self.submit(fn, *args, label=label, **kwargs))
+
+    def cancel(self, job_id: str) -> bool:
+        """
+        Отменяет задачу. Уже запущенный рендер ProcessPoolExecutor прервать не может —
+        в этом случае возвращается False и результат просто будет проигнорирован.
+        """
+        fut = self._jobs.get(job_id)
+        if fut is None:
+            return False
+        ok = fut.cancel()
+        if ok:
+            log.info(f"[RENDER_POOL] cancelled job={job_id}")
+        else:
+            log.info(f"[RENDER_POOL] cancel refused job={job_id} (already running)")
+        return ok
+
+    def active_count(self) -> int:
+        return sum(1 for f in self._jobs.values() if not f.done())
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "active": self.active_count(),
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "cancelled": self.cancelled,
+        }
+
+    def shutdown(self, cancel_pending: bool = True) -> None:
+        for job_id in list(self._jobs):
+            if cancel_pending:
+                self._jobs[job_id].cancel()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=cancel_pending)
+            self._executor = None
+            log.info("[RENDER_POOL] shutdown")
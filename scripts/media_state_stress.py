@@ -0,0 +1,87 @@
+import argparse
+import multiprocessing as mp
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+# Запуск из корня проекта: python scripts/media_state_stress.py
+# Несколько процессов и потоков параллельно увеличивают счётчики в media_state.
+# MediaState.update (flock + транзакция) не должен терять ни одного инкремента;
+# для сравнения --naive повторяет старую схему get -> put без общей блокировки.
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from media_state import MediaState  # noqa: E402
+from state_store import StateStore  # noqa: E402
+
+
+def _bump(current):
+    entry = dict(current or {})
+    entry["status"] = "in_flight"
+    entry["attempts"] = int(entry.get("attempts") or 0) + 1
+    return entry
+
+
+def worker(db_path, lock_path, hashes, increments, threads, naive):
+    store = StateStore(db_path)
+    state = MediaState(store, lock_path)
+
+    def run():
+        for i in range(increments):
+            media_hash = hashes[i % len(hashes)]
+            if naive:
+                entry = state.get(media_hash)
+                time.sleep(0)  # окно гонки между чтением и записью
+                store.media_put(media_hash, _bump(entry))
+            else:
+                state.update(media_hash, _bump)
+
+    pool = [threading.Thread(target=run) for _ in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    store.close()
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Stress test: concurrent media_state updates must not lose writes")
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--increments", type=int, default=200, help="На каждый поток")
+    parser.add_argument("--hashes", type=int, default=3)
+    parser.add_argument("--naive", action="store_true", help="Старая схема get/put без блокировки")
+    args = parser.parse_args()
+
+    tmp = Path(tempfile.mkdtemp(prefix="media_state_stress_"))
+    db_path = tmp / "state.db"
+    lock_path = tmp / "media_state.lock"
+    StateStore(db_path).close()  # схема создаётся один раз до старта воркеров
+    hashes = [f"hash_{i}" for i in range(args.hashes)]
+
+    started = time.perf_counter()
+    ctx = mp.get_context("spawn")
+    procs = [
+        ctx.Process(target=worker, args=(db_path, lock_path, hashes, args.increments, args.threads, args.naive))
+        for _ in range(args.processes)
+    ]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+    elapsed = time.perf_counter() - started
+
+    store = StateStore(db_path)
+    total = sum(int((store.media_get(h) or {}).get("attempts") or 0) for h in hashes)
+    expected = args.processes * args.threads * args.increments
+    lost = expected - total
+    mode = "naive get/put" if args.naive else "MediaState.update"
+    print(f"{mode}: expected={expected} got={total} lost={lost} time={elapsed:.2f}s "
+          f"({expected / elapsed:.0f} updates/s)")
+    sys.exit(0 if lost == 0 or args.naive else 1)
+
+
+if __name__ == "__main__":
+    main_cli()
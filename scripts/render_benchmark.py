@@ -0,0 +1,99 @@
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import time
+from pathlib import Path
+
+# Запуск из корня проекта: python scripts/render_benchmark.py clip1.mp4 clip2.mp4
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+os.chdir(ROOT)
+# main.py требует токен при импорте — для бенчмарка бот не запускается
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "benchmark")
+
+import main  # noqa: E402
+import ffmpeg_render  # noqa: E402
+
+DEFAULT_CAPTION = "Olimlar okeanning eng chuqur joyida yangi turdagi baliqlarni topishdi"
+
+
+def render_once(engine, src, caption, out_dir, seed, plan_b):
+    main.RENDER_ENGINE = engine
+    random.seed(seed)  # одинаковые случайные параметры для обоих движков
+    post_data = {"id": f"bench_{src.stem}", "final_translated_text": caption}
+    kwargs = {"random_crop": True}
+    if plan_b:
+        kwargs.update({"speed_multiplier": 1.02, "brightness_adjust": 0.02})
+    t0 = time.perf_counter()
+    cpu0 = time.process_time()
+    out = main.process_video(src, caption, source_description=caption, post_data=post_data, **kwargs)
+    wall = time.perf_counter() - t0
+    cpu = time.process_time() - cpu0
+    if not out or not Path(out).exists():
+        return {"engine": engine, "input": src.name, "ok": False, "wall_s": round(wall, 2)}
+    dst = out_dir / f"{engine}_{src.stem}{'_planb' if plan_b else ''}.mp4"
+    shutil.move(str(out), dst)
+    probe = ffmpeg_render.probe_media(dst)
+    out_dur = probe["duration"] or 0.0
+    return {
+        "engine": engine,
+        "input": src.name,
+        "plan_b": plan_b,
+        "ok": True,
+        "wall_s": round(wall, 2),
+        # CPU только текущего процесса: ffmpeg-движок считает в дочернем процессе
+        "cpu_s": round(cpu, 2),
+        "out_duration_s": round(out_dur, 2),
+        "sec_per_out_sec": round(wall / out_dur, 3) if out_dur else None,
+        "size_mb": round(dst.stat().st_size / (1024 * 1024), 2),
+        "out_size": f"{probe['width']}x{probe['height']}",
+        "output": str(dst),
+    }
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Side-by-side benchmark: MoviePy vs ffmpeg render engine")
+    parser.add_argument("inputs", nargs="+", help="Входные видео")
+    parser.add_argument("--engines", default="moviepy,ffmpeg")
+    parser.add_argument("--caption", default=DEFAULT_CAPTION)
+    parser.add_argument("--plan-b", action="store_true", help="Параметры Плана Б (speed/brightness)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out-dir", default="tmp_media/bench")
+    parser.add_argument("--json", dest="json_path", default="", help="Куда сохранить результаты")
+    args = parser.parse_args()
+
+    out_dir = Path(args.out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    engines = [e.strip() for e in args.engines.split(",") if e.strip()]
+
+    results = []
+    for inp in args.inputs:
+        src = Path(inp)
+        if not src.exists():
+            print(f"skip missing input: {src}", file=sys.stderr)
+            continue
+        for engine in engines:
+            # Рендерим копию: имя proc_<stem>.mp4 не пересекается между движками
+            work = out_dir / f"src_{engine}_{src.name}"
+            shutil.copy2(src, work)
+            res = render_once(engine, work, args.caption, out_dir, args.seed, args.plan_b)
+            res["input"] = src.name
+            results.append(res)
+            work.unlink(missing_ok=True)
+            print(json.dumps(res, ensure_ascii=False))
+
+    print()
+    print(f"{'input':30} {'engine':8} {'wall,s':>8} {'s/out-s':>8} {'MB':>7}")
+    for r in results:
+        print(f"{r['input'][:30]:30} {r['engine']:8} {r['wall_s']:>8} {str(r.get('sec_per_out_sec')):>8} {str(r.get('size_mb')):>7}")
+
+    if args.json_path:
+        Path(args.json_path).write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"saved: {args.json_path}")
+
+
+if __name__ == "__main__":
+    main_cli()
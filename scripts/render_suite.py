@@ -0,0 +1,334 @@
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from multiprocessing import get_context
+from pathlib import Path
+
+# Запуск из корня проекта: python scripts/render_suite.py --compare latest
+# Синтетические клипы (ffmpeg testsrc2 + sine) всех раскладок прогоняются через process_video;
+# каждый рендер — в свежем процессе, чтобы пик памяти относился к одной конфигурации.
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+os.chdir(ROOT)
+
+from stage_timing import StageLog, peak_children_rss_mb, peak_rss_mb  # noqa: E402
+
+DEFAULT_CAPTION = "Olimlar okeanning eng chuqur joyida yangi turdagi baliqlarni topishdi"
+
+# layout_kind в process_video определяется по соотношению сторон
+KINDS = {
+    "landscape": (1920, 1080),
+    "square": (1080, 1080),
+    "vertical": (1080, 1920),
+}
+# 2.5s — без нарезки; 4.5s — один сегмент SMART SLICER; 7.5s — 1 стык; 12s — 2 стыка
+DEFAULT_DURATIONS = "2.5,4.5,7.5,12"
+CONFIGS = {
+    "base": {},
+    "random_crop": {"random_crop": True},
+    "plan_b": {"random_crop": True, "speed_multiplier": 1.02, "brightness_adjust": 0.02},
+    # Озвучка длиннее ролика: ветка [SYNC] (замедление видео под голос)
+    "voiceover": {"voiceover": 1.3},
+}
+DEFAULT_CONFIGS = "base,random_crop,plan_b,voiceover"
+
+
+def _run(cmd: list[str]) -> str:
+    return subprocess.run(cmd, check=True, capture_output=True, text=True).stdout.strip()
+
+
+def make_clip(path: Path, width: int, height: int, duration: float) -> Path:
+    """testsrc2 (движущаяся картинка, честная нагрузка на x264) + синус 440 Гц."""
+    if path.exists():
+        return path
+    path.parent.mkdir(parents=True, exist_ok=True)
+    _run([
+        "ffmpeg", "-y", "-hide_banner", "-loglevel", "error",
+        "-f", "lavfi", "-i", f"testsrc2=size={width}x{height}:rate=30:duration={duration}",
+        "-f", "lavfi", "-i", f"sine=frequency=440:sample_rate=44100:duration={duration}",
+        "-c:v", "libx264", "-preset", "veryfast", "-crf", "20", "-pix_fmt", "yuv420p",
+        "-c:a", "aac", "-b:a", "128k", "-shortest", str(path),
+    ])
+    return path
+
+
+def make_voiceover(path: Path, duration: float) -> Path:
+    if path.exists():
+        return path
+    path.parent.mkdir(parents=True, exist_ok=True)
+    _run([
+        "ffmpeg", "-y", "-hide_banner", "-loglevel", "error",
+        "-f", "lavfi", "-i", f"sine=frequency=220:sample_rate=44100:duration={duration}",
+        "-c:a", "libmp3lame", "-b:a", "128k", str(path),
+    ])
+    return path
+
+
+def render_case(case: dict) -> dict:
+    """Выполняется в дочернем процессе (spawn, один рендер на процесс)."""
+    os.environ.setdefault("TELEGRAM_BOT_TOKEN", "benchmark")
+    # Этапы рендера пишутся в файл прогона, а не в рабочий reports/stage_timings.jsonl
+    os.environ["STAGE_TIMINGS_PATH"] = case["stages_path"]
+    import main  # noqa: E402
+    import ffmpeg_render  # noqa: E402
+
+    main.RENDER_ENGINE = case["engine"]
+    random.seed(case["seed"])
+    work = Path(case["work"])
+    shutil.copy2(case["src"], work)
+    kwargs = dict(case["kwargs"])
+    if case.get("voiceover_src"):
+        # process_video удаляет файл озвучки после наложения — даём копию
+        vo_copy = work.with_suffix(".vo.mp3")
+        shutil.copy2(case["voiceover_src"], vo_copy)
+        kwargs["voiceover_path"] = str(vo_copy)
+    post_data = {"id": case["post_id"], "post_id": case["post_id"], "final_translated_text": case["caption"]}
+
+    t0 = time.perf_counter()
+    cpu0 = time.process_time()
+    out = main.process_video(work, case["caption"], source_description=case["caption"], post_data=post_data, **kwargs)
+    wall = time.perf_counter() - t0
+    cpu = time.process_time() - cpu0
+    work.unlink(missing_ok=True)
+
+    result = {
+        "wall_s": round(wall, 3),
+        "cpu_s": round(cpu, 3),
+        "peak_rss_mb": peak_rss_mb(),
+        # ffmpeg-движок и writer MoviePy кодируют в дочерних ffmpeg
+        "peak_ffmpeg_rss_mb": peak_children_rss_mb(),
+        "ok": bool(out and Path(out).exists()),
+        "encode_plan": post_data.get("encode_plan"),
+        "encode_count": post_data.get("encode_count"),
+    }
+    if result["ok"]:
+        out = Path(out)
+        probe = ffmpeg_render.probe_media(out)
+        result["out_duration_s"] = round(probe["duration"], 3)
+        result["size_mb"] = round(out.stat().st_size / (1024 * 1024), 2)
+        result["out_size"] = f"{probe['width']}x{probe['height']}"
+        if case.get("keep_dir"):
+            shutil.move(str(out), Path(case["keep_dir"]) / f"{case['key'].replace('|', '_')}.mp4")
+        else:
+            out.unlink(missing_ok=True)
+    return result
+
+
+def git_info() -> dict:
+    try:
+        sha = _run(["git", "rev-parse", "--short", "HEAD"])
+        dirty = bool(_run(["git", "status", "--porcelain", "--untracked-files=no"]))
+    except Exception:
+        sha, dirty = "nogit", False
+    return {"commit": sha, "dirty": dirty}
+
+
+def environment() -> dict:
+    try:
+        ffmpeg_version = _run(["ffmpeg", "-version"]).splitlines()[0]
+    except Exception:
+        ffmpeg_version = "unknown"
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "ffmpeg": ffmpeg_version,
+    }
+
+
+def summarize_stages(stages_path: Path, post_id: str) -> dict:
+    """Этапы одного рендера из [TIMING] (stage -> секунды)."""
+    stages = {}
+    for rec in StageLog(stages_path).records():
+        if rec.get("post_id") == post_id and rec.get("stage") != "total":
+            stages[f"{rec['scope']}:{rec['stage']}"] = round(stages.get(f"{rec['scope']}:{rec['stage']}", 0.0) + rec["wall_s"], 3)
+    return stages
+
+
+def aggregate(key: str, case: dict, runs: list[dict], stages: dict) -> dict:
+    ok_runs = [r for r in runs if r["ok"]]
+    row = {
+        "key": key,
+        "engine": case["engine"],
+        "kind": case["kind"],
+        "duration": case["duration"],
+        "config": case["config"],
+        "runs": len(runs),
+        "ok": len(ok_runs) == len(runs),
+    }
+    if not ok_runs:
+        return row
+    walls = [r["wall_s"] for r in ok_runs]
+    out_dur = ok_runs[0]["out_duration_s"] or 0.0
+    wall = statistics.median(walls)
+    row.update({
+        "wall_s": round(wall, 3),
+        "wall_s_all": walls,
+        "out_duration_s": out_dur,
+        "sec_per_out_sec": round(wall / out_dur, 3) if out_dur else None,
+        "cpu_s": round(statistics.median(r["cpu_s"] for r in ok_runs), 3),
+        "peak_rss_mb": max((r["peak_rss_mb"] or 0.0) for r in ok_runs) or None,
+        "peak_ffmpeg_rss_mb": max((r["peak_ffmpeg_rss_mb"] or 0.0) for r in ok_runs) or None,
+        "size_mb": ok_runs[0]["size_mb"],
+        "out_size": ok_runs[0]["out_size"],
+        "encode_plan": ok_runs[0].get("encode_plan"),
+        "encode_count": ok_runs[0].get("encode_count"),
+        "stages": stages,
+    })
+    return row
+
+
+def resolve_baseline(spec: str, results_dir: Path, current: Path | None) -> Path | None:
+    if spec != "latest":
+        return Path(spec)
+    candidates = sorted(p for p in results_dir.glob("render_*.json") if p != current)
+    return candidates[-1] if candidates else None
+
+
+def compare(rows: list[dict], baseline_path: Path, tolerance: float) -> list[str]:
+    """Сравнение по ключу конфигурации; возвращает список регрессий."""
+    baseline = json.loads(baseline_path.read_text(encoding="utf-8"))
+    base_rows = {r["key"]: r for r in baseline.get("results", [])}
+    print(f"\ncompare with {baseline_path.name} (commit {baseline.get('git', {}).get('commit')}):")
+    print(f"{'config':42} {'s/out-s':>16} {'peak MB':>16} {'size MB':>16}")
+    regressions = []
+    for row in rows:
+        old = base_rows.get(row["key"])
+        if not old or not row.get("sec_per_out_sec") or not old.get("sec_per_out_sec"):
+            continue
+        cells = []
+        for metric in ("sec_per_out_sec", "peak_rss_mb", "size_mb"):
+            a, b = old.get(metric), row.get(metric)
+            if not a or not b:
+                cells.append(f"{'-':>16}")
+                continue
+            delta = (b - a) / a
+            cells.append(f"{a:>6}->{b:<6}{delta:+.0%}".rjust(16))
+            if metric != "size_mb" and delta > tolerance:
+                regressions.append(f"{row['key']} {metric} {a} -> {b} ({delta:+.0%})")
+        print(f"{row['key'][:42]:42} {' '.join(cells)}")
+    return regressions
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Offline render benchmark on synthetic clips (all layout kinds and options)")
+    parser.add_argument("--engines", default="moviepy,ffmpeg")
+    parser.add_argument("--kinds", default=",".join(KINDS), help=f"Из: {', '.join(KINDS)}")
+    parser.add_argument("--durations", default=DEFAULT_DURATIONS, help="Секунды исходника через запятую")
+    parser.add_argument("--configs", default=DEFAULT_CONFIGS, help=f"Из: {', '.join(CONFIGS)}")
+    parser.add_argument("--repeat", type=int, default=1, help="Повторов на конфигурацию (в отчёт идёт медиана)")
+    parser.add_argument("--caption", default=DEFAULT_CAPTION)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--work-dir", default="tmp_media/bench/suite", help="Синтетические клипы (кэшируются)")
+    parser.add_argument("--results-dir", default="reports/bench", help="Куда сохранять результаты прогонов")
+    parser.add_argument("--keep-outputs", action="store_true", help="Сохранить готовые mp4 в work-dir/out")
+    parser.add_argument("--compare", default="", help="JSON прошлого прогона или 'latest'")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Порог регрессии s/out-s и памяти (0.10 = +10%%)")
+    args = parser.parse_args()
+
+    if not shutil.which("ffmpeg"):
+        parser.error("ffmpeg not found in PATH")
+    engines = [e.strip() for e in args.engines.split(",") if e.strip()]
+    kinds = [k.strip() for k in args.kinds.split(",") if k.strip()]
+    configs = [c.strip() for c in args.configs.split(",") if c.strip()]
+    durations = [float(d) for d in args.durations.split(",") if d.strip()]
+    unknown = [k for k in kinds if k not in KINDS] + [c for c in configs if c not in CONFIGS]
+    if unknown:
+        parser.error(f"unknown kinds/configs: {unknown}")
+
+    work_dir = Path(args.work_dir)
+    results_dir = Path(args.results_dir)
+    results_dir.mkdir(parents=True, exist_ok=True)
+    keep_dir = work_dir / "out"
+    if args.keep_outputs:
+        keep_dir.mkdir(parents=True, exist_ok=True)
+    started = datetime.now()
+    git = git_info()
+    stages_path = work_dir / f"stages_{started:%Y%m%d_%H%M%S}.jsonl"
+
+    cases = []
+    for kind in kinds:
+        width, height = KINDS[kind]
+        for duration in durations:
+            src = make_clip(work_dir / "clips" / f"{kind}_{width}x{height}_{duration:g}s.mp4", width, height, duration)
+            for config in configs:
+                kwargs = dict(CONFIGS[config])
+                vo_src = None
+                if "voiceover" in kwargs:
+                    vo_len = round(duration * kwargs.pop("voiceover"), 2)
+                    vo_src = make_voiceover(work_dir / "clips" / f"voiceover_{vo_len:g}s.mp3", vo_len)
+                for engine in engines:
+                    key = f"{engine}|{kind}|{duration:g}s|{config}"
+                    cases.append((key, {
+                        "key": key,
+                        "engine": engine,
+                        "kind": kind,
+                        "duration": duration,
+                        "config": config,
+                        "src": str(src),
+                        "voiceover_src": str(vo_src) if vo_src else None,
+                        "kwargs": kwargs,
+                        "caption": args.caption,
+                        "seed": args.seed,
+                        "stages_path": str(stages_path),
+                        "keep_dir": str(keep_dir) if args.keep_outputs else None,
+                    }))
+
+    rows = []
+    ctx = get_context("spawn")
+    print(f"{len(cases)} configurations x {args.repeat} run(s), commit {git['commit']}{' (dirty)' if git['dirty'] else ''}")
+    for key, case in cases:
+        runs = []
+        for attempt in range(args.repeat):
+            post_id = f"suite_{len(rows)}_{attempt}"
+            case_run = {**case, "post_id": post_id, "work": str(work_dir / f"src_{post_id}.mp4")}
+            # Свежий процесс на рендер: пик RSS и кэши не переходят между конфигурациями
+            with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+                try:
+                    runs.append(pool.submit(render_case, case_run).result())
+                except Exception as e:
+                    runs.append({"ok": False, "error": str(e)})
+        stages = summarize_stages(stages_path, f"suite_{len(rows)}_0")
+        row = aggregate(key, case, runs, stages)
+        rows.append(row)
+        print(
+            f"{key:42} s/out-s={row.get('sec_per_out_sec')} peak={row.get('peak_rss_mb')}MB "
+            f"ffmpeg={row.get('peak_ffmpeg_rss_mb')}MB size={row.get('size_mb')}MB{'' if row['ok'] else ' FAILED'}"
+        )
+
+    payload = {
+        "started_at": started.isoformat(timespec="seconds"),
+        "git": git,
+        "environment": environment(),
+        "params": {k: v for k, v in vars(args).items() if k not in ("compare",)},
+        "results": rows,
+    }
+    out_path = results_dir / f"render_{started:%Y%m%d_%H%M%S}_{git['commit']}.json"
+    out_path.write_text(json.dumps(payload, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"\nsaved: {out_path}")
+
+    if args.compare:
+        baseline = resolve_baseline(args.compare, results_dir, out_path)
+        if baseline is None or not baseline.exists():
+            print(f"no baseline to compare with ({args.compare})")
+            return
+        regressions = compare(rows, baseline, args.tolerance)
+        if regressions:
+            print(f"\nREGRESSIONS (> {args.tolerance:.0%}):")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print("\nno regressions")
+
+
+if __name__ == "__main__":
+    main_cli()
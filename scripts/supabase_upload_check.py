@@ -0,0 +1,152 @@
+import argparse
+import hashlib
+import os
+import sys
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+# Запуск из корня проекта: python scripts/supabase_upload_check.py
+# Поднимает локальный TUS-стенд вместо Supabase Storage, рвёт соединение
+# посреди загрузки и проверяет, что SupabaseUploader докачал файл байт в байт.
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from supabase_upload import SupabaseUploader  # noqa: E402
+
+
+class StandInState:
+    def __init__(self, drop_after: int):
+        self.uploads: dict[str, dict] = {}
+        self.objects: dict[str, bytes] = {}
+        self.drop_after = drop_after  # сколько байт принять перед обрывом (один раз)
+        self.dropped = 0
+        self.lock = threading.Lock()
+
+
+def make_handler(state: StandInState):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _reply(self, code: int, headers: dict | None = None, body: bytes = b""):
+            self.send_response(code)
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            if body:
+                self.wfile.write(body)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            if self.path.endswith("/upload/resumable"):
+                upload_id = uuid.uuid4().hex
+                with state.lock:
+                    state.uploads[upload_id] = {
+                        "length": int(self.headers["Upload-Length"]),
+                        "data": bytearray(),
+                        "metadata": self.headers.get("Upload-Metadata", ""),
+                    }
+                self._reply(201, {"Location": f"/storage/v1/upload/resumable/{upload_id}", "Tus-Resumable": "1.0.0"})
+                return
+            if "/object/" in self.path:
+                body = self.rfile.read(length)
+                key = self.path.split("/object/", 1)[1]
+                with state.lock:
+                    state.objects[key] = body
+                self._reply(200, {"Content-Type": "application/json"}, b'{"Key":"ok"}')
+                return
+            self._reply(404)
+
+        def _upload(self):
+            upload_id = self.path.rsplit("/", 1)[-1]
+            return upload_id, state.uploads.get(upload_id)
+
+        def do_HEAD(self):
+            _, up = self._upload()
+            if up is None:
+                self._reply(404)
+                return
+            self._reply(200, {"Upload-Offset": str(len(up["data"])), "Upload-Length": str(up["length"]), "Tus-Resumable": "1.0.0"})
+
+        def do_PATCH(self):
+            _, up = self._upload()
+            if up is None:
+                self._reply(404)
+                return
+            offset = int(self.headers["Upload-Offset"])
+            length = int(self.headers.get("Content-Length") or 0)
+            if offset != len(up["data"]):
+                self.rfile.read(length)
+                self._reply(409)
+                return
+            with state.lock:
+                should_drop = state.dropped == 0 and offset + length > state.drop_after
+            if should_drop:
+                # Принимаем часть чанка и рвём соединение без ответа
+                part = max(0, state.drop_after - offset)
+                up["data"].extend(self.rfile.read(part))
+                with state.lock:
+                    state.dropped += 1
+                self.close_connection = True
+                self.connection.shutdown(2)
+                return
+            up["data"].extend(self.rfile.read(length))
+            if len(up["data"]) >= up["length"]:
+                with state.lock:
+                    state.objects[f"tus/{_}"] = bytes(up["data"])
+            self._reply(204, {"Upload-Offset": str(len(up["data"])), "Tus-Resumable": "1.0.0"})
+
+    return Handler
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Local TUS stand-in: resume-after-interrupt check for SupabaseUploader")
+    parser.add_argument("--size-mb", type=float, default=15.0)
+    parser.add_argument("--drop-at-mb", type=float, default=8.5, help="Где оборвать соединение")
+    args = parser.parse_args()
+
+    total = int(args.size_mb * 1024 * 1024)
+    payload = os.urandom(total)
+    src = ROOT / "tmp_media" / "tus_check.bin"
+    src.parent.mkdir(parents=True, exist_ok=True)
+    src.write_bytes(payload)
+
+    state = StandInState(drop_after=int(args.drop_at_mb * 1024 * 1024))
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(state))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    endpoint = f"http://127.0.0.1:{server.server_address[1]}/storage/v1/"
+
+    ok = True
+    try:
+        uploader = SupabaseUploader(endpoint, "standin-key", "videos", timeout=30, max_retries=3)
+        progress = []
+        uploader.upload(src, "check.bin", "application/octet-stream", on_progress=lambda s, t: progress.append(s), force_tus=True)
+        stored = next((v for k, v in state.objects.items() if k.startswith("tus/")), b"")
+        same = hashlib.sha256(stored).hexdigest() == hashlib.sha256(payload).hexdigest()
+        stats = uploader.stats()
+        print(f"tus: dropped={state.dropped} resumes={stats['resumes']} retries={stats['retries']} identical={same} progress_calls={len(progress)}")
+        ok &= same and state.dropped == 1 and stats["resumes"] >= 1
+
+        # Обычная (не TUS) потоковая загрузка через тот же пул
+        small = src.with_name("tus_check_small.bin")
+        small.write_bytes(payload[: 2 * 1024 * 1024])
+        uploader.upload(small, "small.bin", "application/octet-stream")
+        same_small = state.objects.get("videos/small.bin") == payload[: 2 * 1024 * 1024]
+        print(f"simple: identical={same_small} avg_mbps={uploader.stats()['avg_mbps']}")
+        ok &= same_small
+        small.unlink(missing_ok=True)
+    finally:
+        server.shutdown()
+        src.unlink(missing_ok=True)
+
+    print("OK" if ok else "FAIL")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main_cli()
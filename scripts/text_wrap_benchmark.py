@@ -0,0 +1,128 @@
+import argparse
+import json
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+# Запуск из корня проекта: python scripts/text_wrap_benchmark.py --font fonts/Montserrat-VariableFont_wght.ttf
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from PIL import Image, ImageDraw  # noqa: E402
+
+import text_layout  # noqa: E402
+
+UZ_WORDS = (
+    "olimlar okeanning eng chuqur joyida yangi turdagi baliqlarni topishdi bu odat sizni har kuni "
+    "biroz boyroq qiladi yaponiyada poyezdlar bir soniya ham kechikmaydi mana nima uchun "
+    "muvaffaqiyatsizliklaringizdan qo'rqmang ular sizni kuchliroq qiladi dunyodagi eng kichik "
+    "mamlakatlarimizdagilarning hayoti qanday o'tadi nega mushuklar har doim oyoqlari bilan yerga "
+    "tushadi miyangizni 10 daqiqada dam oldirishning ilmiy usuli"
+).split()
+
+
+def legacy_wrap_lines_to_width(draw, text, font, max_width):
+    """Старый wrap_lines_to_width: textbbox всей растущей строки на каждое слово."""
+    words = text.split()
+    lines = []
+    line = ""
+    for word in words:
+        candidate = (line + " " + word).strip()
+        if not candidate:
+            continue
+        bbox = draw.textbbox((0, 0), candidate, font=font)
+        if bbox[2] - bbox[0] <= max_width:
+            line = candidate
+        else:
+            if line:
+                lines.append(line)
+            line = word
+    if line:
+        lines.append(line)
+    return lines
+
+
+def new_wrap_lines_to_width(draw, text, font, max_width):
+    words = text.split()
+    return [" ".join(words[a:b]) for a, b in text_layout.greedy_wrap(draw, words, font, max_width)]
+
+
+def slide_layout(wrap, draw, chunk, font_path, max_w, max_h, precheck=False):
+    """Подбор размера как в create_carousel_images: 72 -> 50 шагом 2."""
+    font_size = 72
+    while font_size >= 50:
+        font = text_layout.get_font(font_path, font_size)
+        lines = wrap(draw, chunk, font, max_w)
+        if precheck and len(lines) > 18:
+            font_size -= 2
+            continue
+        bbox = draw.multiline_textbbox((0, 0), "\n".join(lines), font=font, align="center")
+        if bbox[2] - bbox[0] <= max_w and bbox[3] - bbox[1] <= max_h and len(lines) <= 18:
+            return font_size, lines
+        font_size -= 2
+    return 50, lines
+
+
+def make_chunks(count, chars, seed):
+    rng = random.Random(seed)
+    chunks = []
+    for _ in range(count):
+        words = []
+        while len(" ".join(words)) < chars:
+            words.append(rng.choice(UZ_WORDS))
+        chunks.append(" ".join(words))
+    return chunks
+
+
+def timed(wrap, draw, chunks, font_path, max_w, max_h, precheck=False):
+    times_ms = []
+    results = []
+    for chunk in chunks:
+        t0 = time.perf_counter()
+        results.append(slide_layout(wrap, draw, chunk, font_path, max_w, max_h, precheck))
+        times_ms.append((time.perf_counter() - t0) * 1000)
+    return times_ms, results
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Benchmark: carousel slide layout, old O(words^2) wrap vs text_layout.greedy_wrap")
+    parser.add_argument("--font", type=Path, default=None, help="TTF/OTF (по умолчанию первый из fonts/)")
+    parser.add_argument("--slides", type=int, default=30)
+    parser.add_argument("--chars", type=int, default=700, help="Длина текста слайда (split_text_for_carousel)")
+    parser.add_argument("--width", type=int, default=1080)
+    parser.add_argument("--height", type=int, default=1350)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    if args.font is None:
+        fonts = sorted((ROOT / "fonts").rglob("*.ttf")) + sorted((ROOT / "fonts").rglob("*.otf"))
+        if not fonts:
+            parser.error("no fonts found in fonts/, pass --font")
+        args.font = fonts[0]
+
+    img = Image.new("RGBA", (args.width, args.height))
+    draw = ImageDraw.Draw(img)
+    max_w, max_h = int(args.width * 0.55), int(args.height * 0.8)
+    chunks = make_chunks(args.slides, args.chars, args.seed)
+    # Прогрев кэша шрифтов для обоих вариантов одинаково
+    slide_layout(legacy_wrap_lines_to_width, draw, chunks[0], args.font, max_w, max_h)
+
+    before, old_res = timed(legacy_wrap_lines_to_width, draw, chunks, args.font, max_w, max_h)
+    after, new_res = timed(new_wrap_lines_to_width, draw, chunks, args.font, max_w, max_h, precheck=True)
+    same = sum(1 for a, b in zip(old_res, new_res) if a == b)
+    result = {
+        "font": str(args.font),
+        "slides": len(chunks),
+        "before_ms_per_slide": round(statistics.mean(before), 2),
+        "after_ms_per_slide": round(statistics.mean(after), 2),
+        "speedup": round(statistics.mean(before) / statistics.mean(after), 1),
+        "identical_layouts": f"{same}/{len(chunks)}",
+        "size_diff": [(a[0], b[0]) for a, b in zip(old_res, new_res) if a[0] != b[0]][:10],
+    }
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,117 @@
+import argparse
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+
+# Запуск из корня проекта: python scripts/toptext_font_benchmark.py --font fonts/Montserrat-VariableFont_wght.ttf
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from PIL import Image, ImageDraw, ImageFont  # noqa: E402
+
+import text_layout  # noqa: E402
+
+# Типичные TOPTEXT на узбекском: короткие, длинные и с длинными агглютинативными словами
+UZ_CAPTIONS = [
+    "Olimlar okeanning eng chuqur joyida yangi turdagi baliqlarni topishdi",
+    "Bu odat sizni har kuni biroz boyroq qiladi",
+    "Yaponiyada poyezdlar bir soniya ham kechikmaydi — mana nima uchun",
+    "Muvaffaqiyatsizliklaringizdan qo'rqmang, ular sizni kuchliroq qiladi",
+    "Dunyodagi eng kichik mamlakatlarimizdagilarning hayoti qanday o'tadi",
+    "Xalqaroavtomobilsozlikkorxonalarining yangi zavodi Toshkentda ochildi",
+    "Nega mushuklar har doim oyoqlari bilan yerga tushadi?",
+    "Miyangizni 10 daqiqada dam oldirishning ilmiy usuli",
+]
+
+
+def legacy_fit(draw, words, font_path, font_size, font_min, max_w, max_lines):
+    """Старый цикл make_top_text_png: truetype на каждом шаге, шаг 4px."""
+    font = ImageFont.truetype(str(font_path), font_size)
+    lines = text_layout.wrap_to_lines(draw, words, font, max_w, max_lines=max_lines)
+    wraps = 1
+    while font_size > font_min:
+        if not any(text_layout.measure_text(draw, ln, font) > max_w for ln in lines):
+            break
+        font_size -= 4
+        font = ImageFont.truetype(str(font_path), font_size)
+        lines = text_layout.wrap_to_lines(draw, words, font, max_w, max_lines=max_lines)
+        wraps += 1
+    return font_size, lines, wraps
+
+
+def cached_fit(draw, words, font_path, font_size, font_min, max_w, max_lines):
+    """Новый путь: кэш шрифтов + бинарный поиск размера."""
+    def _layout(size):
+        fnt = text_layout.get_font(font_path, size)
+        wrapped = text_layout.wrap_to_lines(draw, words, fnt, max_w, max_lines=max_lines)
+        return not any(text_layout.measure_text(draw, ln, fnt) > max_w for ln in wrapped), wrapped
+
+    size, lines, probes = text_layout.fit_font_size(_layout, font_min, font_size)
+    return size, lines, probes
+
+
+def run(fit, captions, args):
+    img = Image.new("RGBA", (args.width, args.height), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(img)
+    max_w = int(args.width * 0.92)
+    times_ms = []
+    wraps = []
+    sizes = []
+    for _ in range(args.repeat):
+        for caption in captions:
+            words = caption.split()
+            t0 = time.perf_counter()
+            size, _, n = fit(draw, words, args.font, args.font_size, args.font_min, max_w, args.max_lines)
+            times_ms.append((time.perf_counter() - t0) * 1000)
+            wraps.append(n)
+            sizes.append(size)
+    times_ms.sort()
+    return {
+        "renders": len(times_ms),
+        "mean_ms": round(statistics.mean(times_ms), 3),
+        "p50_ms": round(times_ms[len(times_ms) // 2], 3),
+        "p95_ms": round(times_ms[int(len(times_ms) * 0.95) - 1], 3),
+        "avg_wraps": round(statistics.mean(wraps), 2),
+        "sizes": sorted(set(sizes)),
+    }
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Micro-benchmark: TOPTEXT font sizing before/after font cache + binary search")
+    parser.add_argument("--font", type=Path, default=None, help="TTF/OTF (по умолчанию первый из fonts/)")
+    parser.add_argument("--width", type=int, default=1080)
+    parser.add_argument("--height", type=int, default=240)
+    parser.add_argument("--font-size", type=int, default=120, help="Стартовый размер (как vert_font_size)")
+    parser.add_argument("--font-min", type=int, default=22)
+    parser.add_argument("--max-lines", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    if args.font is None:
+        fonts = sorted((ROOT / "fonts").rglob("*.ttf")) + sorted((ROOT / "fonts").rglob("*.otf"))
+        if not fonts:
+            parser.error("no fonts found in fonts/, pass --font")
+        args.font = fonts[0]
+
+    # Прогрев: ленивые импорты Pillow/FreeType не должны попасть в замер "до"
+    run(legacy_fit, UZ_CAPTIONS[:1], argparse.Namespace(**{**vars(args), "repeat": 1}))
+    text_layout._load_font.cache_clear()
+
+    before = run(legacy_fit, UZ_CAPTIONS, args)
+    after = run(cached_fit, UZ_CAPTIONS, args)
+    result = {
+        "font": str(args.font),
+        "font_size": args.font_size,
+        "font_min": args.font_min,
+        "before": before,
+        "after": after,
+        "speedup_mean": round(before["mean_ms"] / after["mean_ms"], 1) if after["mean_ms"] else None,
+        "font_cache": text_layout.font_cache_stats(),
+    }
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main_cli()
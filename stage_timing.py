@@ -0,0 +1,222 @@
+# stage_timing.py
+# === [TIMING] Замеры этапов рендера и конвейера ===
+# process_video — десяток шагов (кроп, ресайз, speedx, slicer, маска, TOPTEXT, аудио,
+# паддинг, write_videofile, AUTO-COMPRESS), и ни один не замерялся: куда уходят минуты,
+# было не понять. Здесь: StageTimer отмечает этапы "кругами" (lap) — без переотступа
+# огромных функций — или контекстом span(); на каждый этап пишется строка JSONL
+# (стена, CPU процесса, RSS и пик RSS, post_id). Файл общий для процессов RENDER_POOL
+# (append построчно), агрегаты p50/p95 считаются чтением хвоста файла.
+#
+# Важно для MoviePy: crop/resize/speedx ленивые — они только строят граф клипа,
+# кадры реально считаются внутри write_videofile, поэтому основное время там.
+
+import json
+import logging
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+log = logging.getLogger("auto_telegramm")
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def current_rss_mb() -> float | None:
+    if psutil is not None:
+        try:
+            return round(psutil.Process().memory_info().rss / (1024 * 1024), 1)
+        except Exception:
+            pass
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return round(int(f.read().split()[1]) * _PAGE_SIZE / (1024 * 1024), 1)
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def peak_rss_mb() -> float | None:
+    """Пик RSS процесса за всё время жизни (high-water mark)."""
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux — КБ, macOS — байты
+        divisor = 1024 * 1024 if os.uname().sysname == "Darwin" else 1024
+        return round(peak / divisor, 1)
+    if psutil is not None:
+        try:
+            peak = getattr(psutil.Process().memory_info(), "peak_wset", None)  # Windows
+            return round(peak / (1024 * 1024), 1) if peak else None
+        except Exception:
+            return None
+    return None
+
+
+def peak_children_rss_mb() -> float | None:
+    """Пик RSS среди завершённых дочерних процессов (ffmpeg). Только POSIX."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    divisor = 1024 * 1024 if os.uname().sysname == "Darwin" else 1024
+    return round(peak / divisor, 1) if peak else None
+
+
+def percentile(sorted_values: list[float], q: float) -> float:
+    """Nearest-rank перцентиль по уже отсортированному списку."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, min(len(sorted_values), math.ceil(q * len(sorted_values))))
+    return sorted_values[rank - 1]
+
+
+class StageLog:
+    """JSONL-приёмник замеров с ротацией в <file>.1 по размеру."""
+
+    def __init__(self, path: str | Path, *, max_bytes: int = 20 * 1024 * 1024, enabled: bool = True):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self._lock = threading.Lock()
+
+    def write(self, record: dict) -> None:
+        if not self.enabled:
+            return
+        line = json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n"
+        try:
+            with self._lock:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                try:
+                    if self.path.stat().st_size > self.max_bytes:
+                        os.replace(self.path, self.path.with_name(self.path.name + ".1"))
+                except FileNotFoundError:
+                    pass
+                # Одна запись = один write в режиме append: строки процессов не перемешиваются
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(line)
+        except OSError as e:
+            log.warning(f"[TIMING] failed to write {self.path.name}: {e}")
+
+    def records(self, *, since: float | None = None):
+        for path in (self.path.with_name(self.path.name + ".1"), self.path):
+            try:
+                f = open(path, encoding="utf-8")
+            except FileNotFoundError:
+                continue
+            with f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        continue  # строка, недописанная упавшим процессом
+                    if since is None or rec.get("ts", 0) >= since:
+                        yield rec
+
+    def summarize(self, *, since: float | None = None, scope: str | None = None) -> dict:
+        """{"scope:stage": {count, p50_s, p95_s, cpu_p50_s, max_peak_rss_mb}} — по убыванию p95."""
+        walls: dict[str, list[float]] = {}
+        cpus: dict[str, list[float]] = {}
+        peaks: dict[str, float] = {}
+        for rec in self.records(since=since):
+            if scope is not None and rec.get("scope") != scope:
+                continue
+            key = f"{rec.get('scope')}:{rec.get('stage')}"
+            walls.setdefault(key, []).append(float(rec.get("wall_s") or 0.0))
+            cpus.setdefault(key, []).append(float(rec.get("cpu_s") or 0.0))
+            if rec.get("peak_rss_mb") is not None:
+                peaks[key] = max(peaks.get(key, 0.0), float(rec["peak_rss_mb"]))
+        summary = {}
+        for key, values in walls.items():
+            values.sort()
+            cpu_values = sorted(cpus[key])
+            summary[key] = {
+                "count": len(values),
+                "p50_s": round(percentile(values, 0.50), 3),
+                "p95_s": round(percentile(values, 0.95), 3),
+                "cpu_p50_s": round(percentile(cpu_values, 0.50), 3),
+                "max_peak_rss_mb": peaks.get(key),
+            }
+        return dict(sorted(summary.items(), key=lambda kv: kv[1]["p95_s"], reverse=True))
+
+
+class StageTimer:
+    """
+    timer = StageTimer(STAGE_LOG, "process_video", post_id)
+    ... шаг ...; timer.lap("crop")      # время с предыдущей отметки
+    with timer.span("download"): ...    # время блока
+    timer.finish()                      # итоговая строка stage="total"
+    CPU — time.process_time() процесса: в главном процессе включает соседние потоки.
+    """
+
+    def __init__(self, sink: StageLog | None, scope: str, post_id: str | None = None, **extra):
+        self.sink = sink
+        self.scope = scope
+        self.post_id = str(post_id) if post_id else None
+        self.extra = extra
+        self.stages: dict[str, float] = {}
+        self._started_wall = self._mark_wall = time.perf_counter()
+        self._started_cpu = self._mark_cpu = time.process_time()
+
+    def _emit(self, stage: str, wall: float, cpu: float, **fields) -> None:
+        self.stages[stage] = round(self.stages.get(stage, 0.0) + wall, 3)
+        if self.sink is None:
+            return
+        record = {
+            "ts": round(time.time(), 3),
+            "scope": self.scope,
+            "stage": stage,
+            "post_id": self.post_id,
+            "wall_s": round(wall, 4),
+            "cpu_s": round(cpu, 4),
+            "rss_mb": current_rss_mb(),
+            "peak_rss_mb": peak_rss_mb(),
+            "pid": os.getpid(),
+        }
+        record.update(self.extra)
+        record.update(fields)
+        self.sink.write(record)
+
+    def lap(self, stage: str, **fields) -> float:
+        now_wall, now_cpu = time.perf_counter(), time.process_time()
+        wall = now_wall - self._mark_wall
+        self._emit(stage, wall, now_cpu - self._mark_cpu, **fields)
+        self._mark_wall, self._mark_cpu = now_wall, now_cpu
+        return wall
+
+    def skip(self) -> None:
+        """Сбросить отметку, не записывая этап (неинтересный промежуток)."""
+        self._mark_wall, self._mark_cpu = time.perf_counter(), time.process_time()
+
+    @contextmanager
+    def span(self, stage: str, **fields):
+        wall0, cpu0 = time.perf_counter(), time.process_time()
+        ok = True
+        try:
+            yield self
+        except BaseException:
+            ok = False
+            raise
+        finally:
+            now_wall, now_cpu = time.perf_counter(), time.process_time()
+            self._emit(stage, now_wall - wall0, now_cpu - cpu0, ok=ok, **fields)
+            self._mark_wall, self._mark_cpu = now_wall, now_cpu
+
+    def finish(self, *, ok: bool = True, **fields) -> float:
+        total = time.perf_counter() - self._started_wall
+        self._emit("total", total, time.process_time() - self._started_cpu, ok=ok, **fields)
+        slow = sorted(((v, k) for k, v in self.stages.items() if k != "total"), reverse=True)[:4]
+        log.info(
+            f"[TIMING] {self.scope} post_id={self.post_id or '-'} total={total:.1f}s "
+            + " ".join(f"{k}={v:.1f}s" for v, k in slow)
+        )
+        return total
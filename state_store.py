@@ -0,0 +1,546 @@
+# state_store.py
+# === [STATE_DB] Единое SQLite-хранилище состояния бота (WAL) ===
+# Раньше состояние жило в семи JSON-файлах и каждый из них целиком переписывался
+# при любом изменении: save_queue() после каждого enqueue, save_published_keys()
+# с сортировкой всего множества, _save_media_state() с indent=2. С ростом истории
+# стоимость записи росла линейно. Здесь — индексированные таблицы и точечные
+# UPSERT/DELETE по строкам; старые JSON-файлы переносятся один раз при первом старте.
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Iterable
+
+log = logging.getLogger("auto_telegramm")
+
+SCHEMA_VERSION = 1
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS queue_items (
+    qid        TEXT PRIMARY KEY,
+    position   REAL NOT NULL,
+    data       TEXT NOT NULL,
+    updated_at INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_queue_position ON queue_items(position);
+
+CREATE TABLE IF NOT EXISTS dedup_keys (
+    kind       TEXT NOT NULL,
+    key        TEXT NOT NULL,
+    created_at INTEGER NOT NULL,
+    PRIMARY KEY (kind, key)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS published_texts (
+    id         INTEGER PRIMARY KEY AUTOINCREMENT,
+    text       TEXT NOT NULL,
+    created_at INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS media_state (
+    media_hash TEXT PRIMARY KEY,
+    status     TEXT NOT NULL DEFAULT '',
+    data       TEXT NOT NULL,
+    updated_at INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_media_state_status ON media_state(status);
+
+CREATE TABLE IF NOT EXISTS kv (
+    key        TEXT PRIMARY KEY,
+    value      TEXT NOT NULL,
+    updated_at INTEGER NOT NULL
+);
+"""
+
+# Виды ключей в dedup_keys
+DEDUP_SEEN_HASH = "seen_hash"
+DEDUP_SEEN_FILE_ID = "seen_file_id"
+DEDUP_PUBLISHED = "published"
+
+# Служебное поле в элементе очереди: стабильный ключ строки queue_items
+QUEUE_ID_FIELD = "_qid"
+
+
+def _dumps(value) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+def connect(db_path: str | Path, schema: str = "") -> sqlite3.Connection:
+    """Соединение с настройками, общими для всех SQLite бота: autocommit, WAL, busy_timeout."""
+    db_path = Path(db_path)
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(db_path), check_same_thread=False, isolation_level=None, timeout=10)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=10000")
+    if schema:
+        conn.executescript(schema)
+    return conn
+
+
+class ProcessConnection:
+    """
+    Ленивое соединение на процесс для кэшей, которыми пользуются и воркеры RENDER_POOL:
+    соединение родителя после fork не переиспользуется — в новом процессе открывается своё.
+    Вызов возвращает соединение: self._db = ProcessConnection(path, _SCHEMA); self._db().execute(...).
+    """
+
+    def __init__(self, db_path: str | Path, schema: str):
+        self.db_path = Path(db_path)
+        self.schema = schema
+        self._conn: sqlite3.Connection | None = None
+        self._pid = None
+
+    def __call__(self) -> sqlite3.Connection:
+        if self._conn is None or self._pid != os.getpid():
+            self._conn, self._pid = connect(self.db_path, self.schema), os.getpid()
+        return self._conn
+
+
+class StateStore:
+    """
+    Одно соединение на процесс, autocommit + явные транзакции там, где пишем пачкой.
+    Вызовы короткие (миллисекунды), поэтому их можно делать прямо из event loop,
+    как раньше делались записи JSON.
+    """
+
+    def __init__(self, db_path: str | Path):
+        self.db_path = Path(db_path)
+        self._lock = threading.RLock()
+        self._conn = connect(self.db_path, _SCHEMA)
+        # qid -> (position, data_json) того, что сейчас лежит в queue_items
+        self._queue_cache: dict[str, tuple[float, str]] | None = None
+        # Позиция последнего элемента: queue_apply дописывает новые элементы после неё
+        self._queue_tail: float | None = None
+
+    # --- служебное ---
+    def _tx(self):
+        return _Transaction(self._conn, self._lock)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    # --- kv (last_post_time, daily_stats, флаги) ---
+    def kv_get(self, key: str, default=None):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM kv WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return default
+        try:
+            return json.loads(row[0])
+        except ValueError:
+            return default
+
+    def kv_set(self, key: str, value) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO kv(key, value, updated_at) VALUES(?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at",
+                (key, _dumps(value), int(time.time())),
+            )
+
+    # --- dedup-ключи ---
+    def dedup_load(self, kind: str) -> set[str]:
+        with self._lock:
+            rows = self._conn.execute("SELECT key FROM dedup_keys WHERE kind = ?", (kind,)).fetchall()
+        return {r[0] for r in rows}
+
+    def dedup_contains(self, kind: str, key: str) -> bool:
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM dedup_keys WHERE kind = ? AND key = ?", (kind, key)).fetchone()
+        return row is not None
+
+    def dedup_add(self, kind: str, key: str) -> bool:
+        """True, если ключ новый."""
+        with self._lock:
+            cur = self._conn.execute(
+                "INSERT OR IGNORE INTO dedup_keys(kind, key, created_at) VALUES(?, ?, ?)",
+                (kind, str(key), int(time.time())),
+            )
+        return cur.rowcount > 0
+
+    def dedup_add_many(self, kind: str, keys: Iterable[str]) -> int:
+        now = int(time.time())
+        rows = [(kind, str(k), now) for k in keys if k]
+        if not rows:
+            return 0
+        with self._tx() as conn:
+            before = conn.total_changes
+            conn.executemany("INSERT OR IGNORE INTO dedup_keys(kind, key, created_at) VALUES(?, ?, ?)", rows)
+            return conn.total_changes - before
+
+    # --- опубликованные тексты (скользящее окно последних N) ---
+    def texts_load(self, limit: int) -> list[str]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT text FROM published_texts ORDER BY id DESC LIMIT ?", (int(limit),)
+            ).fetchall()
+        return [r[0] for r in reversed(rows)]
+
+    def text_append(self, text: str, keep: int) -> None:
+        with self._tx() as conn:
+            cur = conn.execute("INSERT INTO published_texts(text, created_at) VALUES(?, ?)", (text, int(time.time())))
+            conn.execute("DELETE FROM published_texts WHERE id <= ?", (cur.lastrowid - int(keep),))
+
+    def texts_replace(self, texts: list[str]) -> None:
+        now = int(time.time())
+        with self._tx() as conn:
+            conn.execute("DELETE FROM published_texts")
+            conn.executemany("INSERT INTO published_texts(text, created_at) VALUES(?, ?)", [(t, now) for t in texts])
+
+    # --- состояние медиа (дедуп рендера по хешу исходника) ---
+    def media_get(self, media_hash: str) -> dict | None:
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM media_state WHERE media_hash = ?", (media_hash,)).fetchone()
+        if row is None:
+            return None
+        try:
+            return json.loads(row[0])
+        except ValueError:
+            return None
+
+    def media_put(self, media_hash: str, entry: dict) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO media_state(media_hash, status, data, updated_at) VALUES(?, ?, ?, ?) "
+                "ON CONFLICT(media_hash) DO UPDATE SET status = excluded.status, data = excluded.data, "
+                "updated_at = excluded.updated_at",
+                (media_hash, str(entry.get("status") or ""), _dumps(entry), int(time.time())),
+            )
+
+    def media_delete(self, media_hash: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM media_state WHERE media_hash = ?", (media_hash,))
+
+    def media_update(self, media_hash: str, fn) -> dict | None:
+        """
+        Read-modify-write одной записи в одной транзакции (BEGIN IMMEDIATE):
+        fn(entry | None) -> новая запись или None (удалить). Возвращает результат fn.
+        """
+        with self._tx() as conn:
+            row = conn.execute("SELECT data FROM media_state WHERE media_hash = ?", (media_hash,)).fetchone()
+            current = None
+            if row is not None:
+                try:
+                    current = json.loads(row[0])
+                except ValueError:
+                    current = None
+            result = fn(current)
+            if result is None:
+                conn.execute("DELETE FROM media_state WHERE media_hash = ?", (media_hash,))
+            else:
+                conn.execute(
+                    "INSERT INTO media_state(media_hash, status, data, updated_at) VALUES(?, ?, ?, ?) "
+                    "ON CONFLICT(media_hash) DO UPDATE SET status = excluded.status, data = excluded.data, "
+                    "updated_at = excluded.updated_at",
+                    (media_hash, str(result.get("status") or ""), _dumps(result), int(time.time())),
+                )
+            return result
+
+    def media_all(self) -> dict[str, dict]:
+        with self._lock:
+            rows = self._conn.execute("SELECT media_hash, data FROM media_state").fetchall()
+        out = {}
+        for media_hash, data in rows:
+            try:
+                out[media_hash] = json.loads(data)
+            except ValueError:
+                continue
+        return out
+
+    def media_count_by_status(self) -> dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM media_state GROUP BY status").fetchall()
+        return {status or "": count for status, count in rows}
+
+    # --- очередь постов ---
+    def queue_load(self) -> list[dict]:
+        with self._lock:
+            rows = self._conn.execute("SELECT qid, position, data FROM queue_items ORDER BY position").fetchall()
+        items = []
+        cache: dict[str, tuple[float, str]] = {}
+        for qid, position, data in rows:
+            try:
+                item = json.loads(data)
+            except ValueError:
+                continue
+            item[QUEUE_ID_FIELD] = qid
+            items.append(item)
+            cache[qid] = (position, data)
+        self._queue_cache = cache
+        self._queue_tail = rows[-1][1] if rows else None
+        return items
+
+    def queue_sync(self, items: Iterable[dict]) -> tuple[int, int]:
+        """
+        Полная сверка queue_items с текущим содержимым очереди: каждый элемент
+        сериализуется и сравнивается с кэшем, пишутся только отличия. O(n) по CPU —
+        для старта и восстановления после сбоя; обычные сохранения идут через queue_apply.
+        Возвращает (upserts, deletes).
+        """
+        with self._lock:
+            if self._queue_cache is None:
+                self.queue_load()
+            cache = self._queue_cache
+            items = list(items)
+            seen: set[str] = set()
+            upserts: list[tuple[str, float, str, int]] = []
+            new_cache: dict[str, tuple[float, str]] = {}
+            now = int(time.time())
+            prev_pos: float | None = None
+
+            # Позиции храним дробными: вставка между соседями не сдвигает остальных
+            cached_positions = []
+            for item in items:
+                qid = item.get(QUEUE_ID_FIELD)
+                if not qid or qid in seen:
+                    # Новый элемент (или копия уже учтённого словаря) — свой ключ
+                    qid = item[QUEUE_ID_FIELD] = uuid.uuid4().hex
+                seen.add(qid)
+                cached_positions.append((qid, cache.get(qid)))
+
+            for idx, (qid, cached) in enumerate(cached_positions):
+                item = items[idx]
+                data = _dumps({k: v for k, v in item.items() if k != QUEUE_ID_FIELD})
+                position = cached[0] if cached else None
+                if position is None or (prev_pos is not None and position <= prev_pos):
+                    next_pos = None
+                    for _, later in cached_positions[idx + 1:]:
+                        if later is not None:
+                            next_pos = later[0]
+                            break
+                    if prev_pos is None:
+                        position = (next_pos - 1.0) if next_pos is not None else 0.0
+                    elif next_pos is not None and next_pos > prev_pos:
+                        position = (prev_pos + next_pos) / 2.0
+                    else:
+                        position = prev_pos + 1.0
+                if cached is None or cached[0] != position or cached[1] != data:
+                    upserts.append((qid, position, data, now))
+                new_cache[qid] = (position, data)
+                prev_pos = position
+
+            deletes = [(qid,) for qid in cache if qid not in new_cache]
+            if upserts or deletes:
+                with self._tx() as conn:
+                    if deletes:
+                        conn.executemany("DELETE FROM queue_items WHERE qid = ?", deletes)
+                    if upserts:
+                        conn.executemany(
+                            "INSERT INTO queue_items(qid, position, data, updated_at) VALUES(?, ?, ?, ?) "
+                            "ON CONFLICT(qid) DO UPDATE SET position = excluded.position, "
+                            "data = excluded.data, updated_at = excluded.updated_at",
+                            upserts,
+                        )
+            self._queue_cache = new_cache
+            self._queue_tail = prev_pos
+            return len(upserts), len(deletes)
+
+    def queue_apply(self, added: list[dict], removed: list[dict], *, cleared: bool = False) -> tuple[int, int]:
+        """
+        Применяет журнал изменений очереди (PostQueue.drain_changes): cleared — очередь
+        очищалась, removed — ушедшие элементы, added — поставленные в конец, по порядку.
+        Сериализуются и пишутся только они — O(изменений), а не O(длины очереди).
+        Возвращает (upserts, deletes).
+        """
+        with self._lock:
+            if self._queue_cache is None:
+                self.queue_load()
+            cache = self._queue_cache
+            if cleared:
+                deletes = [(qid,) for qid in cache]
+                cache.clear()
+                self._queue_tail = None
+            else:
+                deletes = []
+            removed_qids = set()
+            for item in removed:
+                qid = item.get(QUEUE_ID_FIELD)
+                if qid and cache.pop(qid, None) is not None:
+                    deletes.append((qid,))
+                    removed_qids.add(qid)
+            upserts: list[tuple[str, float, str, int]] = []
+            now = int(time.time())
+            tail = self._queue_tail
+            batch: set[str] = set()
+            for item in added:
+                qid = item.get(QUEUE_ID_FIELD)
+                if not qid or qid in cache or qid in batch:
+                    # Новый элемент (или копия словаря, ещё стоящего в очереди) — свой ключ
+                    qid = item[QUEUE_ID_FIELD] = uuid.uuid4().hex
+                batch.add(qid)
+                tail = 0.0 if tail is None else tail + 1.0
+                data = _dumps({k: v for k, v in item.items() if k != QUEUE_ID_FIELD})
+                upserts.append((qid, tail, data, now))
+                cache[qid] = (tail, data)
+            # Элемент убран и поставлен снова — строка одна, обновляется upsert'ом
+            deletes = [d for d in deletes if d[0] not in batch]
+            if upserts or deletes:
+                with self._tx() as conn:
+                    if deletes:
+                        conn.executemany("DELETE FROM queue_items WHERE qid = ?", deletes)
+                    if upserts:
+                        conn.executemany(
+                            "INSERT INTO queue_items(qid, position, data, updated_at) VALUES(?, ?, ?, ?) "
+                            "ON CONFLICT(qid) DO UPDATE SET position = excluded.position, "
+                            "data = excluded.data, updated_at = excluded.updated_at",
+                            upserts,
+                        )
+            self._queue_tail = tail
+            return len(upserts), len(deletes)
+
+    # --- одноразовая миграция из JSON ---
+    def migrate_from_json(self, files: dict[str, Path]) -> dict[str, int]:
+        """
+        files: {"queue", "seen", "published_keys", "published_texts",
+                "media_state", "last_post_time", "daily_stats"} -> путь к JSON.
+        Выполняется один раз (флаг в kv). Перенесённые файлы переименовываются
+        в *.migrated, чтобы их не перечитывать и при этом не потерять.
+        """
+        if self.kv_get("json_migrated"):
+            return {}
+        counts: dict[str, int] = {}
+
+        def _read(name: str):
+            path = files.get(name)
+            if not path or not Path(path).exists():
+                return None
+            try:
+                return json.loads(Path(path).read_text(encoding="utf-8"))
+            except Exception as e:
+                log.warning(f"[STATE_DB] migrate: cannot read {path}: {e}")
+                return None
+
+        data = _read("queue")
+        if isinstance(data, list):
+            self.queue_sync([it for it in data if isinstance(it, dict)])
+            counts["queue"] = len(data)
+
+        data = _read("seen")
+        if isinstance(data, dict):
+            counts["seen_hash"] = self.dedup_add_many(DEDUP_SEEN_HASH, data.get("hashes", []))
+            counts["seen_file_id"] = self.dedup_add_many(DEDUP_SEEN_FILE_ID, data.get("file_ids", []))
+        elif isinstance(data, list):
+            counts["seen_hash"] = self.dedup_add_many(DEDUP_SEEN_HASH, data)
+
+        data = _read("published_keys")
+        if isinstance(data, dict):
+            data = data.get("keys") or data.get("hashes") or data.get("values") or []
+        if isinstance(data, list):
+            counts["published"] = self.dedup_add_many(DEDUP_PUBLISHED, data)
+
+        data = _read("published_texts")
+        if isinstance(data, list):
+            self.texts_replace([str(t) for t in data if t])
+            counts["published_texts"] = len(data)
+
+        data = _read("media_state")
+        if isinstance(data, dict):
+            with self._tx() as conn:
+                now = int(time.time())
+                conn.executemany(
+                    "INSERT OR REPLACE INTO media_state(media_hash, status, data, updated_at) VALUES(?, ?, ?, ?)",
+                    [
+                        (h, str(e.get("status") or ""), _dumps(e), now)
+                        for h, e in data.items() if isinstance(e, dict)
+                    ],
+                )
+            counts["media_state"] = len(data)
+
+        data = _read("last_post_time")
+        if isinstance(data, dict) and data.get("last_post_time"):
+            self.kv_set("last_post_time", data["last_post_time"])
+            counts["last_post_time"] = 1
+
+        data = _read("daily_stats")
+        if isinstance(data, dict):
+            self.kv_set("daily_stats", data)
+            counts["daily_stats"] = 1
+
+        self.kv_set("json_migrated", {"at": int(time.time()), "schema": SCHEMA_VERSION, "counts": counts})
+        for path in files.values():
+            path = Path(path)
+            if path.exists():
+                try:
+                    path.rename(path.with_name(path.name + ".migrated"))
+                except OSError as e:
+                    log.warning(f"[STATE_DB] migrate: cannot rename {path}: {e}")
+        log.info(f"[STATE_DB] migrated JSON state -> {self.db_path}: {counts}")
+        return counts
+
+    def migrate_sqlite(self, legacy_path: str | Path, tables: Iterable[str]) -> dict[str, int]:
+        """
+        Переносит таблицы отдельного SQLite-файла (кэши раньше жили каждый в своём
+        state/*.db) в эту базу и переименовывает файл в *.migrated. Таблицы, которых
+        здесь ещё нет, создаются по DDL из старого файла (вместе с индексами); строки,
+        уже существующие здесь, не перезаписываются. Нет файла — ничего не делает.
+        """
+        legacy_path = Path(legacy_path)
+        if not legacy_path.exists() or legacy_path.resolve() == self.db_path.resolve():
+            return {}
+        counts: dict[str, int] = {}
+        with self._lock:
+            try:
+                self._conn.execute("ATTACH DATABASE ? AS legacy", (str(legacy_path),))
+            except sqlite3.Error as e:
+                log.warning(f"[STATE_DB] migrate: cannot open {legacy_path}: {e}")
+                return {}
+            try:
+                with self._tx() as conn:
+                    for table in tables:
+                        exists = conn.execute(
+                            "SELECT 1 FROM legacy.sqlite_master WHERE type = 'table' AND name = ?", (table,)
+                        ).fetchone()
+                        if exists is None:
+                            continue
+                        here = conn.execute(
+                            "SELECT 1 FROM main.sqlite_master WHERE type = 'table' AND name = ?", (table,)
+                        ).fetchone()
+                        if here is None:
+                            ddl = conn.execute(
+                                "SELECT sql FROM legacy.sqlite_master WHERE tbl_name = ? AND sql IS NOT NULL "
+                                "ORDER BY type = 'index'",
+                                (table,),
+                            ).fetchall()
+                            for (sql,) in ddl:
+                                conn.execute(sql)
+                        before = conn.total_changes
+                        conn.execute(f"INSERT OR IGNORE INTO main.{table} SELECT * FROM legacy.{table}")
+                        counts[table] = conn.total_changes - before
+            except sqlite3.Error as e:
+                log.warning(f"[STATE_DB] migrate: cannot copy {legacy_path}: {e}")
+                return {}
+            finally:
+                self._conn.execute("DETACH DATABASE legacy")
+        for path in (legacy_path, *(legacy_path.with_name(legacy_path.name + s) for s in ("-wal", "-shm"))):
+            if path.exists():
+                try:
+                    path.rename(path.with_name(path.name + ".migrated"))
+                except OSError as e:
+                    log.warning(f"[STATE_DB] migrate: cannot rename {path}: {e}")
+        log.info(f"[STATE_DB] migrated {legacy_path} -> {self.db_path}: {counts}")
+        return counts
+
+
+class _Transaction:
+    def __init__(self, conn: sqlite3.Connection, lock: threading.RLock):
+        self._conn = conn
+        self._lock = lock
+
+    def __enter__(self) -> sqlite3.Connection:
+        self._lock.acquire()
+        self._conn.execute("BEGIN IMMEDIATE")
+        return self._conn
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self._conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        finally:
+            self._lock.release()
+        return False
@@ -0,0 +1,271 @@
+# supabase_upload.py
+# === [SUPABASE_UPLOAD] Потоковая и докачиваемая загрузка в Supabase Storage ===
+# Раньше upload_to_supabase на каждый ролик открывал новый requests.post без
+# переиспользования соединения; обрыв сети на 40 МБ файле = загрузка с нуля.
+# Здесь: общий requests.Session с пулом, чтение с диска кусками с колбэком прогресса,
+# для больших файлов — resumable-протокол Supabase (TUS 1.0.0) с докачкой с места обрыва.
+
+import base64
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Optional
+from urllib.parse import urljoin
+
+import requests
+from requests.adapters import HTTPAdapter
+
+log = logging.getLogger("auto_telegramm")
+
+# Supabase принимает TUS-чанки строго по 6 МБ (кроме последнего)
+TUS_CHUNK_SIZE = 6 * 1024 * 1024
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+ProgressCallback = Callable[[int, int], None]  # (sent_bytes, total_bytes)
+
+
+class SupabaseUploadError(Exception):
+    """Загрузка не удалась после всех попыток."""
+
+
+def _b64(value: str) -> str:
+    return base64.b64encode(value.encode("utf-8")).decode("ascii")
+
+
+class _ChunkReader:
+    """Файл-подобный поток для requests: читает кусками и сообщает прогресс."""
+
+    def __init__(self, fh, total: int, on_progress: Optional[ProgressCallback], chunk_size: int = STREAM_CHUNK_SIZE):
+        self._fh = fh
+        self._total = total
+        self._sent = 0
+        self._on_progress = on_progress
+        self._chunk_size = chunk_size
+
+    def __len__(self) -> int:
+        return self._total
+
+    def __iter__(self):
+        while True:
+            chunk = self._fh.read(self._chunk_size)
+            if not chunk:
+                break
+            self._sent += len(chunk)
+            if self._on_progress:
+                self._on_progress(self._sent, self._total)
+            yield chunk
+
+
+class SupabaseUploader:
+    """
+    Один экземпляр на процесс. Потокобезопасен (requests.Session + счётчики под lock),
+    поэтому его можно звать из asyncio.to_thread параллельно.
+    """
+
+    def __init__(
+        self,
+        storage_endpoint: str,
+        service_key: str,
+        bucket: str,
+        *,
+        timeout: float = 120,
+        tus_threshold_bytes: int = 20 * 1024 * 1024,
+        max_retries: int = 4,
+        pool_size: int = 8,
+    ):
+        # storage_endpoint вида https://xxx.supabase.co/storage/v1/
+        self.storage_endpoint = storage_endpoint.rstrip("/") + "/" if storage_endpoint else ""
+        self.service_key = service_key
+        self.bucket = bucket
+        self.timeout = timeout
+        self.tus_threshold_bytes = tus_threshold_bytes
+        self.max_retries = max_retries
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._lock = threading.Lock()
+        self.metrics = {
+            "uploads_ok": 0,
+            "uploads_failed": 0,
+            "bytes_uploaded": 0,
+            "seconds_uploading": 0.0,
+            "retries": 0,
+            "resumes": 0,
+            "last_mbps": 0.0,
+        }
+
+    # --- helpers ---
+    def _auth_headers(self) -> dict:
+        return {
+            "Authorization": f"Bearer {self.service_key}",
+            "apikey": self.service_key,
+        }
+
+    def _bump(self, key: str, value=1) -> None:
+        with self._lock:
+            self.metrics[key] += value
+
+    def stats(self) -> dict:
+        with self._lock:
+            snap = dict(self.metrics)
+        secs = snap["seconds_uploading"]
+        snap["avg_mbps"] = round(snap["bytes_uploaded"] / (1024 * 1024) / secs, 2) if secs > 0 else 0.0
+        return snap
+
+    def _backoff(self, attempt: int) -> None:
+        time.sleep(min(30.0, 1.5 * (2 ** (attempt - 1))))
+
+    # --- public API ---
+    def upload(
+        self,
+        local_path: str | Path,
+        object_name: str,
+        content_type: str = "application/octet-stream",
+        on_progress: Optional[ProgressCallback] = None,
+        force_tus: bool = False,
+    ) -> str:
+        """Загружает файл в bucket под object_name. Возвращает object_name или бросает SupabaseUploadError."""
+        path = Path(local_path)
+        total = path.stat().st_size
+        started = time.perf_counter()
+        try:
+            if force_tus or total >= self.tus_threshold_bytes:
+                self._upload_tus(path, object_name, content_type, total, on_progress)
+                mode = "tus"
+            else:
+                self._upload_simple(path, object_name, content_type, total, on_progress)
+                mode = "simple"
+        except Exception:
+            self._bump("uploads_failed")
+            raise
+        elapsed = max(1e-6, time.perf_counter() - started)
+        mbps = total / (1024 * 1024) / elapsed
+        with self._lock:
+            self.metrics["uploads_ok"] += 1
+            self.metrics["bytes_uploaded"] += total
+            self.metrics["seconds_uploading"] += elapsed
+            self.metrics["last_mbps"] = round(mbps, 2)
+        log.info(f"[SUPABASE_UPLOAD] ok mode={mode} key={object_name} size={total / (1024 * 1024):.2f}MB time={elapsed:.1f}s speed={mbps:.2f}MB/s")
+        return object_name
+
+    def _upload_simple(self, path: Path, object_name: str, content_type: str, total: int, on_progress) -> None:
+        url = f"{self.storage_endpoint}object/{self.bucket}/{object_name}"
+        headers = {
+            **self._auth_headers(),
+            "Content-Type": content_type or "application/octet-stream",
+            "Content-Length": str(total),
+            "x-upsert": "false",
+        }
+        last_err: Exception | None = None
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                with path.open("rb") as fh:
+                    resp = self.session.post(
+                        url,
+                        data=_ChunkReader(fh, total, on_progress),
+                        headers=headers,
+                        timeout=self.timeout,
+                    )
+                if resp.status_code < 400:
+                    return
+                # 409 на повторе: объект уже целиком записан предыдущей попыткой
+                if resp.status_code == 409 and attempt > 1:
+                    return
+                last_err = SupabaseUploadError(f"HTTP {resp.status_code}: {(resp.text or '')[:300]}")
+                if resp.status_code < 500 and resp.status_code != 429:
+                    break
+            except requests.RequestException as e:
+                last_err = e
+            if attempt < self.max_retries:
+                self._bump("retries")
+                log.warning(f"[SUPABASE_UPLOAD] simple retry {attempt}/{self.max_retries} key={object_name} err={last_err}")
+                self._backoff(attempt)
+        raise SupabaseUploadError(f"simple upload failed: {last_err}")
+
+    def _tus_create(self, object_name: str, content_type: str, total: int) -> str:
+        headers = {
+            **self._auth_headers(),
+            "Tus-Resumable": "1.0.0",
+            "Upload-Length": str(total),
+            "Upload-Metadata": ",".join([
+                f"bucketName {_b64(self.bucket)}",
+                f"objectName {_b64(object_name)}",
+                f"contentType {_b64(content_type or 'application/octet-stream')}",
+                f"cacheControl {_b64('3600')}",
+            ]),
+            "x-upsert": "false",
+        }
+        resp = self.session.post(f"{self.storage_endpoint}upload/resumable", headers=headers, timeout=self.timeout)
+        if resp.status_code not in (200, 201):
+            raise SupabaseUploadError(f"TUS create HTTP {resp.status_code}: {(resp.text or '')[:300]}")
+        location = resp.headers.get("Location") or resp.headers.get("location")
+        if not location:
+            raise SupabaseUploadError("TUS create: no Location header")
+        if location.startswith("/"):
+            # относительный Location — достраиваем от хоста storage endpoint
+            location = urljoin(self.storage_endpoint, location)
+        return location
+
+    def _tus_offset(self, upload_url: str) -> int:
+        resp = self.session.head(
+            upload_url,
+            headers={**self._auth_headers(), "Tus-Resumable": "1.0.0"},
+            timeout=self.timeout,
+        )
+        if resp.status_code >= 400:
+            raise SupabaseUploadError(f"TUS HEAD HTTP {resp.status_code}")
+        return int(resp.headers.get("Upload-Offset") or 0)
+
+    def _upload_tus(self, path: Path, object_name: str, content_type: str, total: int, on_progress) -> None:
+        upload_url = self._tus_create(object_name, content_type, total)
+        offset = 0
+        failures = 0
+        with path.open("rb") as fh:
+            while offset < total:
+                fh.seek(offset)
+                chunk = fh.read(TUS_CHUNK_SIZE)
+                try:
+                    resp = self.session.patch(
+                        upload_url,
+                        data=chunk,
+                        headers={
+                            **self._auth_headers(),
+                            "Tus-Resumable": "1.0.0",
+                            "Upload-Offset": str(offset),
+                            "Content-Type": "application/offset+octet-stream",
+                        },
+                        timeout=self.timeout,
+                    )
+                    if resp.status_code not in (200, 204):
+                        raise SupabaseUploadError(f"TUS PATCH HTTP {resp.status_code}: {(resp.text or '')[:200]}")
+                    offset = int(resp.headers.get("Upload-Offset") or (offset + len(chunk)))
+                    failures = 0
+                    if on_progress:
+                        on_progress(offset, total)
+                except (requests.RequestException, SupabaseUploadError) as e:
+                    failures += 1
+                    if failures > self.max_retries:
+                        raise SupabaseUploadError(f"TUS upload failed at offset={offset}: {e}") from e
+                    self._bump("retries")
+                    log.warning(f"[SUPABASE_UPLOAD] tus interrupted at {offset}/{total} ({failures}/{self.max_retries}): {e}")
+                    self._backoff(failures)
+                    # Докачка: спрашиваем сервер, сколько байт он уже принял
+                    try:
+                        server_offset = self._tus_offset(upload_url)
+                        if server_offset != offset:
+                            log.info(f"[SUPABASE_UPLOAD] tus resume offset {offset} -> {server_offset}")
+                        offset = server_offset
+                        self._bump("resumes")
+                    except Exception as head_err:
+                        log.warning(f"[SUPABASE_UPLOAD] tus HEAD failed: {head_err}")
+
+
+def default_tus_threshold() -> int:
+    """SUPABASE_TUS_THRESHOLD_MB из ENV (по умолчанию 20 МБ)."""
+    try:
+        return int(float(os.getenv("SUPABASE_TUS_THRESHOLD_MB", "20")) * 1024 * 1024)
+    except ValueError:
+        return 20 * 1024 * 1024
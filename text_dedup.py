@@ -0,0 +1,258 @@
+# text_dedup.py
+# === [TEXT_DEDUP] Локальный индекс почти-дубликатов текста (MinHash + LSH) ===
+# check_similar_content на каждый пост отправлял в chat completion новый текст и
+# последние 10 из 50 сохранённых PUBLISHED_TEXTS: секунды и токены на пост, а всё,
+# что старше — не проверялось вовсе. Здесь: нормализованный текст режется на
+# символьные k-граммы (шинглы), по ним считается MinHash-подпись (num_perm значений),
+# подпись делится на полосы (LSH banding) — кандидаты ищутся по совпадению хотя бы
+# одной полосы, без перебора всей истории. Оценка Jaccard = доля совпавших значений.
+# Подписи хранятся в SQLite (state/), история публикаций не ограничена окном в 50.
+
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from state_store import ProcessConnection
+
+log = logging.getLogger("auto_telegramm")
+
+# Поднять при изменении шинглов/хэширования/нормализации — старые подписи
+# пересчитываются из сохранённого текста при загрузке (_rebuild_stale_locked)
+SIGNATURE_VERSION = "2"
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS text_minhash (
+    id         INTEGER PRIMARY KEY AUTOINCREMENT,
+    text_hash  TEXT NOT NULL UNIQUE,
+    version    TEXT NOT NULL,
+    signature  BLOB NOT NULL,
+    text       TEXT NOT NULL,
+    created_at INTEGER NOT NULL
+);
+"""
+
+
+def shingles(normalized: str, k: int = 5) -> set[str]:
+    """Символьные k-граммы; текст короче k — один шингл целиком."""
+    if not normalized:
+        return set()
+    if len(normalized) <= k:
+        return {normalized}
+    return {normalized[i : i + k] for i in range(len(normalized) - k + 1)}
+
+
+def _shingle_hashes(items: set[str]) -> np.ndarray:
+    # Стабильный между запусками 32-битный хэш (hash() в Python рандомизирован)
+    return np.fromiter(
+        (int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=4).digest(), "little") for s in items),
+        dtype=np.uint64,
+        count=len(items),
+    )
+
+
+class MinHasher:
+    """h_i(x) = (a_i * x + b_i) mod (2^61 - 1), младшие 32 бита; a, b — из фиксированного seed."""
+
+    def __init__(self, num_perm: int = 128, seed: int = 1):
+        rng = np.random.RandomState(seed)
+        self.num_perm = num_perm
+        self.a = rng.randint(1, 1 << 32, size=num_perm, dtype=np.uint64)
+        self.b = rng.randint(0, 1 << 32, size=num_perm, dtype=np.uint64)
+
+    def signature(self, items: set[str]) -> np.ndarray | None:
+        if not items:
+            return None
+        x = _shingle_hashes(items)
+        # a < 2^32 и x < 2^32: произведение помещается в uint64 без переполнения
+        values = (np.outer(self.a, x) + self.b[:, None]) % _MERSENNE_PRIME
+        return (values.min(axis=1) & _MAX_HASH).astype(np.uint32)
+
+
+def estimate_jaccard(sig_a: np.ndarray, sig_b: np.ndarray) -> float:
+    return float(np.count_nonzero(sig_a == sig_b)) / len(sig_a)
+
+
+class NearDuplicateIndex:
+    """
+    Индекс опубликованных текстов. bands * rows = num_perm; порог срабатывания LSH
+    ~ (1/bands)^(1/rows): при 32x4 пары с Jaccard от ~0.4 почти всегда попадают в кандидаты.
+    normalize — функция нормализации текста (в main.py — на основе norm_cmp).
+    """
+
+    def __init__(
+        self,
+        db_path,
+        *,
+        normalize=None,
+        num_perm: int = 128,
+        bands: int = 32,
+        shingle_size: int = 5,
+    ):
+        if num_perm % bands:
+            raise ValueError(f"num_perm={num_perm} must be divisible by bands={bands}")
+        self.db_path = db_path
+        self.normalize = normalize or (lambda s: " ".join((s or "").lower().split()))
+        self.hasher = MinHasher(num_perm)
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        self._signatures: dict[int, np.ndarray] = {}
+        self._buckets: list[dict[bytes, list[int]]] = [{} for _ in range(bands)]
+        self._text_hashes: set[str] = set()
+        self._lock = threading.RLock()
+        self._db = ProcessConnection(self.db_path, _SCHEMA)
+        self._loaded = False
+        self.queries = 0
+        self.duplicates = 0
+        self.query_seconds = 0.0
+
+    def _band_keys(self, sig: np.ndarray) -> list[bytes]:
+        return [sig[i * self.rows : (i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+    def _put_locked(self, row_id: int, sig: np.ndarray) -> None:
+        self._signatures[row_id] = sig
+        for band, key in zip(self._buckets, self._band_keys(sig)):
+            band.setdefault(key, []).append(row_id)
+
+    def _ensure_loaded(self) -> None:
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            t0 = time.perf_counter()
+            self._rebuild_stale_locked()
+            try:
+                rows = self._db().execute(
+                    "SELECT id, text_hash, signature FROM text_minhash WHERE version = ?", (SIGNATURE_VERSION,)
+                ).fetchall()
+            except sqlite3.Error as e:
+                log.warning(f"[TEXT_DEDUP] load failed: {e}")
+                rows = []
+            for row_id, text_hash, blob in rows:
+                sig = np.frombuffer(blob, dtype=np.uint32)
+                if len(sig) == self.hasher.num_perm:
+                    self._put_locked(row_id, sig)
+                    self._text_hashes.add(text_hash)
+            self._loaded = True
+            log.info(f"[TEXT_DEDUP] loaded {len(self._signatures)} signatures in {(time.perf_counter() - t0) * 1000:.0f}ms")
+
+    def _rebuild_stale_locked(self) -> None:
+        """Подписи старых версий — пересчёт из колонки text (история не теряется)."""
+        try:
+            db = self._db()
+            stale = db.execute(
+                "SELECT id, text FROM text_minhash WHERE version != ?", (SIGNATURE_VERSION,)
+            ).fetchall()
+            if not stale:
+                return
+            db.execute("BEGIN")
+            rebuilt = dropped = 0
+            for row_id, text in stale:
+                normalized = self.normalize(text or "")
+                sig = self.hasher.signature(shingles(normalized, self.shingle_size))
+                text_hash = self.text_hash(normalized)
+                taken = db.execute(
+                    "SELECT 1 FROM text_minhash WHERE text_hash = ? AND id != ?", (text_hash, row_id)
+                ).fetchone()
+                if sig is None or taken:
+                    db.execute("DELETE FROM text_minhash WHERE id = ?", (row_id,))
+                    dropped += 1
+                    continue
+                db.execute(
+                    "UPDATE text_minhash SET text_hash = ?, version = ?, signature = ? WHERE id = ?",
+                    (text_hash, SIGNATURE_VERSION, sig.tobytes(), row_id),
+                )
+                rebuilt += 1
+            db.execute("COMMIT")
+            log.info(f"[TEXT_DEDUP] rebuilt {rebuilt} signature(s) to version {SIGNATURE_VERSION}, dropped {dropped}")
+        except sqlite3.Error as e:
+            log.warning(f"[TEXT_DEDUP] signature rebuild failed: {e}")
+            try:
+                self._db().execute("ROLLBACK")
+            except sqlite3.Error:
+                pass
+
+    def signature(self, text: str) -> np.ndarray | None:
+        return self.hasher.signature(shingles(self.normalize(text or ""), self.shingle_size))
+
+    @staticmethod
+    def text_hash(normalized: str) -> str:
+        return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+    def add(self, text: str) -> bool:
+        """Добавляет опубликованный текст. False — пустой после нормализации или уже в индексе."""
+        self._ensure_loaded()
+        normalized = self.normalize(text or "")
+        sig = self.hasher.signature(shingles(normalized, self.shingle_size))
+        if sig is None:
+            return False
+        text_hash = self.text_hash(normalized)
+        with self._lock:
+            if text_hash in self._text_hashes:
+                return False
+            try:
+                cur = self._db().execute(
+                    "INSERT OR IGNORE INTO text_minhash(text_hash, version, signature, text, created_at) VALUES(?, ?, ?, ?, ?)",
+                    (text_hash, SIGNATURE_VERSION, sig.tobytes(), text, int(time.time())),
+                )
+            except sqlite3.Error as e:
+                log.warning(f"[TEXT_DEDUP] add failed: {e}")
+                return False
+            self._text_hashes.add(text_hash)
+            if cur.rowcount:
+                self._put_locked(cur.lastrowid, sig)
+            return True
+
+    def add_many(self, texts) -> int:
+        return sum(1 for t in texts if self.add(t))
+
+    def query(self, text: str, threshold: float = 0.0, limit: int = 5) -> list[tuple[float, int]]:
+        """[(оценка Jaccard, id)] кандидатов LSH с оценкой >= threshold, по убыванию."""
+        self._ensure_loaded()
+        t0 = time.perf_counter()
+        sig = self.signature(text)
+        matches: list[tuple[float, int]] = []
+        if sig is not None:
+            with self._lock:
+                candidates = set()
+                for band, key in zip(self._buckets, self._band_keys(sig)):
+                    candidates.update(band.get(key, ()))
+                for row_id in candidates:
+                    score = estimate_jaccard(sig, self._signatures[row_id])
+                    if score >= threshold:
+                        matches.append((round(score, 3), row_id))
+        matches.sort(reverse=True)
+        with self._lock:
+            self.queries += 1
+            self.query_seconds += time.perf_counter() - t0
+        return matches[:limit]
+
+    def texts(self, ids: list[int]) -> list[str]:
+        if not ids:
+            return []
+        placeholders = ",".join("?" * len(ids))
+        with self._lock:
+            rows = self._db().execute(f"SELECT id, text FROM text_minhash WHERE id IN ({placeholders})", ids).fetchall()
+        by_id = dict(rows)
+        return [by_id[i] for i in ids if i in by_id]
+
+    def record(self, *, duplicate: bool = False) -> None:
+        """Учёт исхода проверки для stats(): дубликат найден по индексу, без сети."""
+        with self._lock:
+            self.duplicates += int(duplicate)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._signatures),
+                "queries": self.queries,
+                "duplicates": self.duplicates,
+                "avg_query_ms": round(self.query_seconds / self.queries * 1000, 3) if self.queries else 0.0,
+            }
@@ -0,0 +1,165 @@
+# text_layout.py
+# === [TEXT_LAYOUT] Шрифты и подбор размера для Pillow-рендеров ===
+# make_top_text_png на каждом шаге уменьшения (4px) заново открывал TTF через
+# ImageFont.truetype и полностью переносил текст: от font_size до font_min это
+# десятки открытий файла и переносов на один ролик.
+# Здесь: кэш шрифтов на процесс по (path, size) с LRU-вытеснением и бинарный поиск
+# наибольшего подходящего размера — O(log n) переносов вместо O(n).
+# Перенос строк: ширина каждого слова и пробела меряется один раз на шрифт,
+# строки набираются жадно по накопленной ширине (O(слов)), а textbbox вызывается
+# не больше одного раза на строку — только если она у самой границы (кернинг, выносы глифов).
+
+import logging
+import os
+import weakref
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Callable
+
+from PIL import ImageFont
+
+log = logging.getLogger("auto_telegramm")
+
+FONT_CACHE_SIZE = int(os.getenv("FONT_CACHE_SIZE", "64"))
+
+
+@lru_cache(maxsize=FONT_CACHE_SIZE)
+def _load_font(path: str, size: int) -> ImageFont.FreeTypeFont:
+    return ImageFont.truetype(path, size)
+
+
+def get_font(path: str | Path, size: int) -> ImageFont.FreeTypeFont:
+    """FreeTypeFont из кэша процесса. Объект общий — не менять у него атрибуты."""
+    return _load_font(str(path), int(size))
+
+
+def font_cache_stats() -> dict:
+    info = _load_font.cache_info()
+    lookups = info.hits + info.misses
+    return {
+        "hits": info.hits,
+        "misses": info.misses,
+        "entries": info.currsize,
+        "max_entries": info.maxsize,
+        "hit_rate": round(info.hits / lookups, 3) if lookups else 0.0,
+    }
+
+
+def fit_font_size(layout: Callable[[int], tuple[bool, Any]], min_size: int, max_size: int, first_step: int = 4) -> tuple[int, Any, int]:
+    """
+    Наибольший размер из [min_size, max_size], при котором layout(size) -> (fits, result) влезает.
+    Предполагается монотонность: меньше шрифт — уже строки. Сначала пробуем max_size
+    (обычный случай — текст влезает сразу), затем экспоненциальный поиск вниз
+    (шаг 4, 8, 16...) и бинарный поиск внутри найденной вилки: O(log n) переносов,
+    а при небольшом уменьшении — 2-3 пробы, как у старого цикла.
+    Если не влезает даже min_size — возвращаем его раскладку (как и старый цикл).
+    Возвращает (size, result, probes).
+    """
+    max_size = int(max_size)
+    min_size = min(int(min_size), max_size)
+    fits, result = layout(max_size)
+    probes = 1
+    if fits or min_size == max_size:
+        return max_size, result, probes
+
+    # Инвариант: hi не влезает; lo влезает (best) или lo == min_size и ещё не проверен
+    hi = max_size
+    step = max(1, int(first_step))
+    lo, best = min_size, None
+    while hi - step > min_size:
+        fits, probe_result = layout(hi - step)
+        probes += 1
+        if fits:
+            lo, best = hi - step, probe_result
+            break
+        hi -= step
+        step *= 2
+
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        fits, mid_result = layout(mid)
+        probes += 1
+        if fits:
+            lo, best = mid, mid_result
+        else:
+            hi = mid
+    if best is None:
+        _, best = layout(min_size)
+        probes += 1
+    return lo, best, probes
+
+
+def measure_text(draw, text, font):
+    """Измеряет ширину текста в пиксельных единицах."""
+    if not text:
+        return 0
+    bbox = draw.textbbox((0, 0), text, font=font)
+    if not bbox:
+        return 0
+    return int(max(0, bbox[2] - bbox[0]))
+
+
+# font -> {слово: advance}. Слабые ссылки: вытесненный из get_font шрифт уносит и свою таблицу
+_ADVANCES: "weakref.WeakKeyDictionary[ImageFont.FreeTypeFont, dict[str, float]]" = weakref.WeakKeyDictionary()
+_ADVANCES_PER_FONT = 4096
+VERIFY_MARGIN_EM = 0.25
+
+
+def word_advance(font, word: str) -> float:
+    """Ширина слова (advance) из таблицы шрифта; меряется один раз."""
+    try:
+        table = _ADVANCES.get(font)
+        if table is None:
+            table = _ADVANCES[font] = {}
+    except TypeError:
+        # шрифт без поддержки weakref (например, ImageFont.load_default в старом Pillow)
+        return font.getlength(word)
+    width = table.get(word)
+    if width is None:
+        if len(table) >= _ADVANCES_PER_FONT:
+            table.clear()
+        width = table[word] = font.getlength(word)
+    return width
+
+
+def greedy_wrap(draw, pieces: list[str], font, max_w) -> list[tuple[int, int]]:
+    """
+    Общий движок переноса: pieces склеиваются через пробел.
+    Возвращает строки как полуинтервалы индексов [start, end).
+    Кусок шире max_w встаёт на строку один (как и в старых переносах).
+    """
+    n = len(pieces)
+    if n == 0:
+        return []
+    space = word_advance(font, " ")
+    # Запас на расхождение суммы advance и реального bbox строки
+    margin = VERIFY_MARGIN_EM * getattr(font, "size", 0)
+    widths = [word_advance(font, p) for p in pieces]
+    lines: list[tuple[int, int]] = []
+    i = 0
+    while i < n:
+        j = i + 1
+        width = widths[i]
+        while j < n and width + space + widths[j] <= max_w:
+            width += space + widths[j]
+            j += 1
+        # Проверка настоящей шириной (кернинг, выносы курсива) — только для строк у самой границы;
+        # лишние куски уходят на следующую строку
+        if width > max_w - margin:
+            while j - i > 1 and measure_text(draw, " ".join(pieces[i:j]), font) > max_w:
+                j -= 1
+        lines.append((i, j))
+        i = j
+    return lines
+
+
+def wrap_to_lines(draw, words, font, max_w, max_lines=2):
+    """Переносит текст на max_lines строк без изменения шрифта, ориентируясь на пиксельную ширину."""
+    words = [w for w in words if w]
+    spans = greedy_wrap(draw, words, font, max_w)
+    lines = [" ".join(words[a:b]) for a, b in spans[:max_lines]]
+    # Если слов больше, чем влезло — добавляем многоточие к последней строке
+    if len(spans) > max_lines and lines:
+        if not lines[-1].endswith("…"):
+            lines[-1] = (lines[-1] + " …").strip()
+    return lines
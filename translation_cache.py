@@ -0,0 +1,151 @@
+# translation_cache.py
+# === [TRANSLATE_CACHE] Кэш переводов по хешу очищенного исходного текста ===
+# translate_text делает два запроса к OpenAI (перевод + JSON self-check) на каждый пост.
+# Репосты, отредактированные сообщения буфера и повторы после /restart платили заново.
+# Ключ: sha256(версия промпта + модель + clean_text_before_translation(text)).
+# Два уровня: LRU-словарь в памяти (микросекунды) и SQLite на диске (переживает рестарт).
+# Вытеснение: LRU по числу записей + TTL по времени создания.
+
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+log = logging.getLogger("auto_telegramm")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS translations (
+    key        TEXT PRIMARY KEY,
+    result     TEXT NOT NULL,
+    model      TEXT NOT NULL,
+    created_at INTEGER NOT NULL,
+    last_used  INTEGER NOT NULL,
+    hits       INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_translations_last_used ON translations(last_used);
+"""
+
+
+def make_key(cleaned_text: str, model: str, prompt_version: str) -> str:
+    h = hashlib.sha256()
+    h.update(prompt_version.encode("utf-8"))
+    h.update(b"\0")
+    h.update(model.encode("utf-8"))
+    h.update(b"\0")
+    h.update(cleaned_text.strip().encode("utf-8"))
+    return h.hexdigest()
+
+
+class TranslationCache:
+    def __init__(
+        self,
+        db_path: str | Path,
+        *,
+        memory_entries: int = 2000,
+        disk_entries: int = 50000,
+        ttl_seconds: float = 30 * 24 * 3600,
+    ):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.memory_entries = memory_entries
+        self.disk_entries = disk_entries
+        self.ttl_seconds = ttl_seconds
+        self._mem: OrderedDict[str, tuple[str, float]] = OrderedDict()  # key -> (result, created_at)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False, isolation_level=None, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+        self.stores = 0
+
+    def _expired(self, created_at: float, now: float) -> bool:
+        return self.ttl_seconds > 0 and now - created_at > self.ttl_seconds
+
+    def _remember(self, key: str, result: str, created_at: float) -> None:
+        self._mem[key] = (result, created_at)
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.memory_entries:
+            self._mem.popitem(last=False)
+
+    def get(self, key: str) -> str | None:
+        now = time.time()
+        with self._lock:
+            cached = self._mem.get(key)
+            if cached is not None:
+                result, created_at = cached
+                if not self._expired(created_at, now):
+                    self._mem.move_to_end(key)
+                    self.hits_memory += 1
+                    return result
+                self._mem.pop(key, None)
+
+            row = self._conn.execute(
+                "SELECT result, created_at FROM translations WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None:
+                result, created_at = row
+                if not self._expired(created_at, now):
+                    self._conn.execute(
+                        "UPDATE translations SET last_used = ?, hits = hits + 1 WHERE key = ?",
+                        (int(now), key),
+                    )
+                    self._remember(key, result, created_at)
+                    self.hits_disk += 1
+                    return result
+                self._conn.execute("DELETE FROM translations WHERE key = ?", (key,))
+            self.misses += 1
+            return None
+
+    def put(self, key: str, result: str, model: str) -> None:
+        if not result:
+            return
+        now = time.time()
+        with self._lock:
+            self._remember(key, result, now)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO translations(key, result, model, created_at, last_used, hits) "
+                "VALUES(?, ?, ?, ?, ?, 0)",
+                (key, result, model, int(now), int(now)),
+            )
+            self.stores += 1
+            # Подрезаем диск пачкой, не на каждую запись
+            if self.stores % 100 == 0:
+                self.prune()
+
+    def prune(self) -> int:
+        """Удаляет просроченные записи и самые давно не использованные сверх disk_entries."""
+        now = int(time.time())
+        with self._lock:
+            before = self._conn.total_changes
+            if self.ttl_seconds > 0:
+                self._conn.execute("DELETE FROM translations WHERE created_at < ?", (now - int(self.ttl_seconds),))
+            self._conn.execute(
+                "DELETE FROM translations WHERE key IN ("
+                "SELECT key FROM translations ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.disk_entries,),
+            )
+            removed = self._conn.total_changes - before
+        if removed:
+            log.info(f"[TRANSLATE_CACHE] pruned {removed} entries")
+        return removed
+
+    def stats(self) -> dict:
+        with self._lock:
+            disk_rows = self._conn.execute("SELECT COUNT(*) FROM translations").fetchone()[0]
+        hits = self.hits_memory + self.hits_disk
+        lookups = hits + self.misses
+        return {
+            "hits": hits,
+            "hits_memory": self.hits_memory,
+            "hits_disk": self.hits_disk,
+            "misses": self.misses,
+            "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+            "memory_entries": len(self._mem),
+            "disk_entries": disk_rows,
+        }
@@ -0,0 +1,289 @@
+# video_fingerprint.py
+# === [VIDEO_FP] Перцептивные отпечатки исходников: ловим перекодированные дубли ===
+# _hash_file_fast берёт SHA-256 первых 10 МБ + размер: тот же ролик, пережатый,
+# обрезанный или перезалитый другим каналом, получает новый хэш — и снова уходит
+# на многоминутный рендер и в публикацию. Здесь: ffmpeg декодирует исходник
+# сразу в 32x32 серого с шагом в секунду (дёшево), на каждый кадр — pHash
+# (DCT 8x8 низких частот против медианы, 64 бита). Кадровые хэши лежат в индексе
+# multi-index hashing (поиск по расстоянию Хэмминга); ролик — дубль, если достаточная
+# доля его кадров находит близкий кадр одного и того же ранее отрендеренного исходника.
+
+import logging
+import sqlite3
+import subprocess
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+from state_store import ProcessConnection
+
+log = logging.getLogger("auto_telegramm")
+
+FRAME_SIZE = 32
+HASH_SIZE = 8
+# Кадр почти одного цвета (чёрная заставка, fade) даёт хэш, совпадающий у разных роликов
+MIN_FRAME_STD = 4.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS video_fp (
+    id         INTEGER PRIMARY KEY AUTOINCREMENT,
+    media_hash TEXT NOT NULL UNIQUE,
+    label      TEXT NOT NULL DEFAULT '',
+    hashes     BLOB NOT NULL,
+    created_at INTEGER NOT NULL
+);
+"""
+
+
+def _dct_matrix(n: int) -> np.ndarray:
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    m = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+    m[0, :] = np.sqrt(1.0 / n)
+    return m
+
+
+_DCT = _dct_matrix(FRAME_SIZE)
+_BIT_WEIGHTS = (1 << np.arange(HASH_SIZE * HASH_SIZE - 1, -1, -1, dtype=np.uint64)).astype(np.uint64)
+
+
+def phash_frames(frames: np.ndarray) -> np.ndarray:
+    """(n, 32, 32) яркость -> (n,) uint64 pHash; однотонные кадры отбрасываются."""
+    if len(frames) == 0:
+        return np.zeros(0, dtype=np.uint64)
+    frames = frames.astype(np.float32)
+    frames = frames[frames.reshape(len(frames), -1).std(axis=1) >= MIN_FRAME_STD]
+    if len(frames) == 0:
+        return np.zeros(0, dtype=np.uint64)
+    low = (_DCT @ frames @ _DCT.T)[:, :HASH_SIZE, :HASH_SIZE].reshape(len(frames), -1)
+    bits = low > np.median(low, axis=1, keepdims=True)
+    return (bits.astype(np.uint64) * _BIT_WEIGHTS).sum(axis=1, dtype=np.uint64)
+
+
+def sample_frames(path: str | Path, *, interval: float = 1.0, max_frames: int = 60, timeout: float = 120) -> np.ndarray:
+    """Кадры каждые interval секунд, сразу 32x32 gray — ffmpeg не отдаёт полноразмерные кадры в Python."""
+    cmd = [
+        "ffmpeg", "-v", "error", "-nostdin", "-threads", "2",
+        "-i", str(path), "-an", "-sn",
+        "-vf", f"fps=1/{interval},scale={FRAME_SIZE}:{FRAME_SIZE}:flags=area,format=gray",
+        "-frames:v", str(max_frames), "-f", "rawvideo", "-",
+    ]
+    out = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=timeout)
+    if out.returncode != 0:
+        raise RuntimeError(f"ffmpeg frame sampling failed: {out.stderr.decode('utf-8', 'ignore')[-300:]}")
+    frame_bytes = FRAME_SIZE * FRAME_SIZE
+    count = len(out.stdout) // frame_bytes
+    return np.frombuffer(out.stdout[: count * frame_bytes], dtype=np.uint8).reshape(count, FRAME_SIZE, FRAME_SIZE)
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+class MultiIndexHash:
+    """
+    Multi-index hashing: 64 бита режутся на chunks частей по 16 бит, у каждой — своя таблица.
+    Если полное расстояние <= radius, хотя бы одна часть отличается не больше чем на
+    radius // chunks бит (принцип Дирихле) — кандидаты ищутся перебором таких вариантов
+    части, а затем проверяются по полному расстоянию.
+    """
+
+    def __init__(self, chunks: int = 4):
+        self.chunks = chunks
+        self.bits = 64 // chunks
+        self._mask = (1 << self.bits) - 1
+        self._tables: list[dict[int, list[int]]] = [{} for _ in range(chunks)]
+        self._values: list[int] = []
+        self._payloads: list[object] = []
+        self._flips: dict[int, list[int]] = {}
+
+    @property
+    def size(self) -> int:
+        return len(self._values)
+
+    def _parts(self, value: int) -> list[int]:
+        return [(value >> (i * self.bits)) & self._mask for i in range(self.chunks)]
+
+    def _flip_masks(self, max_bits: int) -> list[int]:
+        masks = self._flips.get(max_bits)
+        if masks is None:
+            masks = [0]
+            for _ in range(max_bits):
+                masks = sorted({m | (1 << b) for m in masks for b in range(self.bits)} | set(masks))
+            self._flips[max_bits] = masks
+        return masks
+
+    def add(self, value: int, payload) -> None:
+        idx = len(self._values)
+        self._values.append(value)
+        self._payloads.append(payload)
+        for table, part in zip(self._tables, self._parts(value)):
+            table.setdefault(part, []).append(idx)
+
+    def search(self, value: int, radius: int) -> list[tuple[int, object]]:
+        """[(расстояние, payload)] всех значений в пределах radius."""
+        masks = self._flip_masks(radius // self.chunks)
+        candidates: set[int] = set()
+        for table, part in zip(self._tables, self._parts(value)):
+            for m in masks:
+                hit = table.get(part ^ m)
+                if hit:
+                    candidates.update(hit)
+        found = []
+        for idx in candidates:
+            d = hamming(value, self._values[idx])
+            if d <= radius:
+                found.append((d, self._payloads[idx]))
+        return found
+
+
+class VideoFingerprintIndex:
+    """
+    radius — допустимое расстояние Хэмминга между кадрами (из 64 бит);
+    min_match — доля кадров нового ролика, совпавших с одним исходником, чтобы считать дублем.
+    """
+
+    def __init__(
+        self,
+        db_path: str | Path,
+        *,
+        radius: int = 10,
+        min_match: float = 0.5,
+        min_frames: int = 3,
+        interval: float = 1.0,
+        max_frames: int = 60,
+    ):
+        self.db_path = Path(db_path)
+        self.radius = radius
+        self.min_match = min_match
+        self.min_frames = min_frames
+        self.interval = interval
+        self.max_frames = max_frames
+        self._frames = MultiIndexHash()
+        self._videos: dict[int, tuple[str, str, int]] = {}  # id -> (media_hash, label, frames)
+        self._by_media_hash: dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._db = ProcessConnection(self.db_path, _SCHEMA)
+        self._loaded = False
+        self.checks = 0
+        self.duplicates = 0
+        self.fingerprint_seconds = 0.0
+
+    def _put_locked(self, video_id: int, media_hash: str, label: str, hashes: np.ndarray) -> None:
+        self._videos[video_id] = (media_hash, label, len(hashes))
+        self._by_media_hash[media_hash] = video_id
+        for frame_no, h in enumerate(hashes.tolist()):
+            self._frames.add(int(h), (video_id, frame_no))
+
+    def _ensure_loaded(self) -> None:
+        with self._lock:
+            if self._loaded:
+                return
+            t0 = time.perf_counter()
+            try:
+                rows = self._db().execute("SELECT id, media_hash, label, hashes FROM video_fp").fetchall()
+            except sqlite3.Error as e:
+                log.warning(f"[VIDEO_FP] load failed: {e}")
+                rows = []
+            for video_id, media_hash, label, blob in rows:
+                self._put_locked(video_id, media_hash, label, np.frombuffer(blob, dtype=np.uint64))
+            self._loaded = True
+            log.info(
+                f"[VIDEO_FP] loaded {len(self._videos)} videos / {self._frames.size} frame hashes "
+                f"in {(time.perf_counter() - t0) * 1000:.0f}ms"
+            )
+
+    def fingerprint(self, path: str | Path) -> np.ndarray:
+        """pHash кадров файла (uint64). Исключения ffmpeg — как есть."""
+        t0 = time.perf_counter()
+        hashes = phash_frames(sample_frames(path, interval=self.interval, max_frames=self.max_frames))
+        elapsed = time.perf_counter() - t0
+        with self._lock:
+            self.fingerprint_seconds += elapsed
+        log.info(f"[VIDEO_FP] {Path(path).name}: {len(hashes)} frame hashes in {elapsed:.2f}s")
+        return hashes
+
+    def find_duplicate(self, hashes: np.ndarray, *, exclude_media_hash: str | None = None) -> dict | None:
+        """Лучший ранее сохранённый исходник, с которым совпала доля кадров >= min_match, или None."""
+        self._ensure_loaded()
+        with self._lock:
+            self.checks += 1
+            if len(hashes) < self.min_frames:
+                return None
+            exclude_id = self._by_media_hash.get(exclude_media_hash) if exclude_media_hash else None
+            matched_frames: dict[int, int] = {}
+            distances: dict[int, list[int]] = {}
+            for h in hashes.tolist():
+                best: dict[int, int] = {}
+                for d, (video_id, _) in self._frames.search(int(h), self.radius):
+                    if video_id != exclude_id and d < best.get(video_id, 65):
+                        best[video_id] = d
+                for video_id, d in best.items():
+                    matched_frames[video_id] = matched_frames.get(video_id, 0) + 1
+                    distances.setdefault(video_id, []).append(d)
+            if not matched_frames:
+                return None
+            video_id, count = max(matched_frames.items(), key=lambda kv: kv[1])
+            ratio = count / len(hashes)
+            if ratio < self.min_match:
+                return None
+            self.duplicates += 1
+            media_hash, label, frames = self._videos[video_id]
+            return {
+                "media_hash": media_hash,
+                "label": label,
+                "match_ratio": round(ratio, 3),
+                "mean_distance": round(float(np.mean(distances[video_id])), 1),
+                "frames": frames,
+            }
+
+    def add(self, media_hash: str, hashes: np.ndarray, label: str = "") -> bool:
+        """Запоминает исходник. False — мало содержательных кадров или уже есть."""
+        if len(hashes) < self.min_frames or not media_hash:
+            return False
+        self._ensure_loaded()
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        with self._lock:
+            if media_hash in self._by_media_hash:
+                return False
+            try:
+                cur = self._db().execute(
+                    "INSERT OR IGNORE INTO video_fp(media_hash, label, hashes, created_at) VALUES(?, ?, ?, ?)",
+                    (media_hash, label, hashes.tobytes(), int(time.time())),
+                )
+            except sqlite3.Error as e:
+                log.warning(f"[VIDEO_FP] add failed: {e}")
+                return False
+            if not cur.rowcount:
+                return False
+            self._put_locked(cur.lastrowid, media_hash, label, hashes)
+            return True
+
+    def rename_media_hash(self, old: str, new: str) -> bool:
+        """Перенос отпечатка на новый ключ MEDIA_STATE (миграция ключей, см. file_identity)."""
+        self._ensure_loaded()
+        with self._lock:
+            video_id = self._by_media_hash.get(old)
+            if video_id is None or new in self._by_media_hash:
+                return False
+            try:
+                self._db().execute("UPDATE video_fp SET media_hash = ? WHERE id = ?", (new, video_id))
+            except sqlite3.Error as e:
+                log.warning(f"[VIDEO_FP] rename failed: {e}")
+                return False
+            _, label, frames = self._videos[video_id]
+            self._videos[video_id] = (new, label, frames)
+            self._by_media_hash[new] = self._by_media_hash.pop(old)
+            return True
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "videos": len(self._videos),
+                "frame_hashes": self._frames.size,
+                "checks": self.checks,
+                "duplicates": self.duplicates,
+                "avg_fingerprint_s": round(self.fingerprint_seconds / self.checks, 2) if self.checks else 0.0,
+            }